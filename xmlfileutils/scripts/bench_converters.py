@@ -0,0 +1,462 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import time
+import getopt
+import shutil
+import marshal
+import traceback
+import tempfile
+from wikifile import File
+from wikinamespaces import Namespaces
+from gendumps import LoggingGenerator, ContentGenerator
+from pageslogging2sql import LoggingXml, TitlesDict
+from wikicontent2sql import Stubber, Titles, StepProfiler
+from benchresults import BenchResults
+import extract_tablecreate
+
+
+class LoggingBench(object):
+    """Time the line by line and the block-buffered logging parsers of
+    pageslogging2sql against each other on the same logging file, both
+    for parsing alone and for the full conversion to sql, and check that
+    the two produce identical output."""
+
+    def __init__(self, logging_file, titles_file, workdir, runs=1, verbose=False):
+        """Constructor. Arguments:
+        logging_file  -- path to the pages-logging xml file
+        titles_file   -- path to the matching titles file (pageid nsnum pagetitle)
+        workdir       -- directory for the sql output files
+        runs          -- number of times to run each test; the best time is kept
+        verbose       -- display progress messages"""
+
+        self.logging_file = logging_file
+        self.titles_file = titles_file
+        self.workdir = workdir
+        self.runs = runs
+        self.verbose = verbose
+        namespaces = Namespaces("en", "wikipedia", dump_path=logging_file, offline=True)
+        namespaces.load()
+        self.ns_dict_by_string = namespaces.get_ns_dict_by_string()
+        self.titles_dict = TitlesDict(self.ns_dict_by_string).get_titles_dict(titles_file)
+
+    def get_converter(self, line_parser, name):
+        return LoggingXml(self.ns_dict_by_string, self.titles_dict, self.logging_file,
+                          os.path.join(self.workdir, "logging-%s.sql" % name),
+                          os.path.join(self.workdir, "user-%s.sql" % name), line_parser)
+
+    def parse_only(self, line_parser):
+        """Run one parser over the file without writing anything,
+        returning the number of items read"""
+
+        converter = self.get_converter(line_parser, "parse")
+        fd = File.open_input(self.logging_file)
+        if line_parser:
+            converter.skip_header(fd)
+            items = converter.get_log_items_by_lines(fd)
+        else:
+            items = converter.get_log_items(fd)
+        count = 0
+        for item in items:
+            count = count + 1
+        fd.close()
+        return count
+
+    def convert(self, line_parser):
+        """Run the full conversion with one parser, returning the number
+        of items converted"""
+
+        name = "line" if line_parser else "block"
+        self.get_converter(line_parser, name).write_sql()
+        fd = open(os.path.join(self.workdir, "logging-%s.sql" % name))
+        count = sum(1 for line in fd if line.startswith("INSERT INTO logging"))
+        fd.close()
+        return count
+
+    def time_it(self, method, line_parser):
+        """Return (items, best elapsed seconds) for the given method"""
+
+        best = None
+        for i in range(self.runs):
+            start = time.time()
+            count = method(line_parser)
+            elapsed = time.time() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        return (count, best)
+
+    def same_output(self):
+        """Return True if the two parsers wrote identical sql"""
+
+        for table in ["logging", "user"]:
+            paths = [os.path.join(self.workdir, "%s-%s.sql" % (table, name))
+                     for name in ["line", "block"]]
+            fds = [open(path, "rb") for path in paths]
+            contents = [fd.read() for fd in fds]
+            for fd in fds:
+                fd.close()
+            if contents[0] != contents[1]:
+                return False
+        return True
+
+    def run(self):
+        """Run all the timings and write a report to stdout"""
+
+        size = os.path.getsize(self.logging_file)
+        sys.stdout.write("logging file %s, %d bytes\n" % (self.logging_file, size))
+        sys.stdout.write("%-10s %-8s %10s %10s %12s %10s\n"
+                         % ("test", "parser", "items", "seconds", "items/sec", "MB/sec"))
+        results = {}
+        for (test, method) in [("parse", self.parse_only), ("convert", self.convert)]:
+            for line_parser in [True, False]:
+                parser = "line" if line_parser else "block"
+                if self.verbose:
+                    sys.stderr.write("running %s with %s parser\n" % (test, parser))
+                (count, elapsed) = self.time_it(method, line_parser)
+                results[(test, parser)] = elapsed
+                sys.stdout.write("%-10s %-8s %10d %10.2f %12.0f %10.1f\n"
+                                 % (test, parser, count, elapsed, count / elapsed,
+                                    size / elapsed / 1024 / 1024))
+        for test in ["parse", "convert"]:
+            sys.stdout.write("%s speedup: %.2fx\n"
+                             % (test, results[(test, "line")] / results[(test, "block")]))
+        if self.same_output():
+            sys.stdout.write("outputs identical\n")
+            return True
+        sys.stdout.write("OUTPUTS DIFFER\n")
+        return False
+
+
+class ConverterBench(object):
+    """Time the file processing done by wikicontent2sql, pageslogging2sql
+    and extract_tablecreate on synthetic dump files, recording items per
+    second and peak memory for each in a BenchResults object"""
+
+    def __init__(self, workdir, page_count=100000, log_count=200000, text_size=2000,
+                 revisions=1, runs=1, verbose=False):
+        """Constructor. Arguments:
+        workdir     -- directory for the generated and output files
+        page_count  -- number of pages to generate
+        log_count   -- number of log items to generate
+        text_size   -- median bytes of page text
+        revisions   -- number of revisions per page
+        runs        -- number of times to run each benchmark; the best time is kept
+        verbose     -- display progress messages"""
+
+        self.workdir = workdir
+        self.page_count = page_count
+        self.log_count = log_count
+        self.text_size = text_size
+        self.revisions = revisions
+        self.runs = runs
+        self.verbose = verbose
+        self.shards = 4
+        self.ns_dict = None
+        self.ns_dict_by_string = None
+
+    def get_path(self, name):
+        return os.path.join(self.workdir, name)
+
+    def get_shard_paths(self):
+        return [self.get_path("content-%d.xml" % (shard + 1)) for shard in range(self.shards)]
+
+    def generate(self):
+        """Write the input files for the benchmarks"""
+
+        if self.verbose:
+            sys.stderr.write("generating %d pages and %d log items\n"
+                             % (self.page_count, self.log_count))
+        logging = LoggingGenerator(self.log_count, 1, self.page_count)
+        logging.write_logging(self.get_path("logging.xml"))
+        logging.write_titles(self.get_path("titles.txt"))
+        content = ContentGenerator(self.page_count, 1, self.text_size, self.revisions)
+        content.write_content([self.get_path("content.xml")])
+        content.write_content(self.get_shard_paths())
+        content.write_titles_list(self.get_path("titles-list.txt"))
+        for table in ["page", "revision"]:
+            content.write_sql_table(self.get_path("enwiki-%s.sql.gz" % table), table)
+        namespaces = Namespaces("en", "wikipedia", dump_path=self.get_path("content.xml"),
+                                offline=True)
+        namespaces.load()
+        self.ns_dict = namespaces.get_ns_dict()
+        self.ns_dict_by_string = namespaces.get_ns_dict_by_string()
+
+    def run_stubber(self):
+        Stubber(self.workdir, False).write_stub_and_page_ids(
+            self.get_path("content.xml"), self.get_path("stubs-out.xml"),
+            self.get_path("pageids-out.txt"))
+        return self.page_count
+
+    def run_combine(self):
+        File.combine_xml(self.get_shard_paths(), self.get_path("combined.xml"))
+        return self.page_count
+
+    def run_combine_sorted(self):
+        # out of order, so that the pages really have to be sorted
+        File.combine_xml(list(reversed(self.get_shard_paths())), self.get_path("combined.xml"),
+                         sort_by_id=True, tmpdir=self.workdir)
+        return self.page_count
+
+    def run_titles_related(self):
+        titles = Titles(self.ns_dict, self.ns_dict_by_string)
+        titles.add_related_titles_from_file(self.get_path("titles-list.txt"), ["1", "5", "7", "15"],
+                                            ["0", "4", "6", "14"])
+        return self.page_count
+
+    def run_titles_ns(self):
+        titles = Titles(self.ns_dict, self.ns_dict_by_string)
+        titles.add_titles_from_file(self.get_path("titles-list.txt"), "10")
+        return self.page_count
+
+    def run_titles_dict(self):
+        TitlesDict(self.ns_dict_by_string).get_titles_dict(self.get_path("titles.txt"))
+        return self.page_count
+
+    def run_logging(self):
+        LoggingXml(self.ns_dict_by_string,
+                   TitlesDict(self.ns_dict_by_string).get_titles_dict(self.get_path("titles.txt")),
+                   self.get_path("logging.xml"), self.get_path("logging-out.sql"),
+                   self.get_path("user-out.sql")).write_sql()
+        return self.log_count
+
+    def run_create_table(self):
+        # each file is only read up to the end of its CREATE TABLE
+        # statement, so do it often enough to be measurable
+        count = 0
+        for i in range(200):
+            for table in ["page", "revision"]:
+                sqlfile = self.get_path("enwiki-%s.sql.gz" % table)
+                extract_tablecreate.write_create_table(
+                    sqlfile, extract_tablecreate.get_create_table(sqlfile))
+                count = count + 1
+        return count
+
+    def run(self, results):
+        """Generate the input files and run all the benchmarks, adding the
+        results to a BenchResults object"""
+
+        self.generate()
+        benchmarks = [("stubs", "pages", self.run_stubber),
+                      ("combine_xml", "pages", self.run_combine),
+                      ("combine_xml_sorted", "pages", self.run_combine_sorted),
+                      ("titles_related", "titles", self.run_titles_related),
+                      ("titles_ns", "titles", self.run_titles_ns),
+                      ("titles_dict", "titles", self.run_titles_dict),
+                      ("logging_sql", "items", self.run_logging),
+                      ("create_table", "tables", self.run_create_table)]
+        for (name, unit, method) in benchmarks:
+            if self.verbose:
+                sys.stderr.write("running %s\n" % name)
+            best = None
+            for i in range(self.runs):
+                (count, elapsed, peak_kb) = self.run_forked(name, method)
+                if best is None or elapsed < best[1]:
+                    best = (count, elapsed, peak_kb)
+            results.add(name, best[0], best[1], unit, best[2])
+
+    def run_forked(self, name, method):
+        """Run one benchmark in a child process, so that memory left allocated
+        by one benchmark doesn't count towards the peak of the next.
+        Returns (items, elapsed seconds, peak resident kilobytes)"""
+
+        (read_fd, write_fd) = os.pipe()
+        pid = os.fork()
+        if not pid:
+            os.close(read_fd)
+            status = 0
+            try:
+                profiler = StepProfiler(enabled=True)
+                profiler.start(name)
+                count = method()
+                profiler.end()
+                step = profiler.steps[-1]
+                os.write(write_fd, marshal.dumps((count, step['wall'], step['peak_rss'])))
+            except Exception:
+                traceback.print_exc()
+                status = 1
+            os._exit(status)
+        os.close(write_fd)
+        data = []
+        while True:
+            chunk = os.read(read_fd, 4096)
+            if not chunk:
+                break
+            data.append(chunk)
+        os.close(read_fd)
+        (pid, status) = os.waitpid(pid, 0)
+        if status:
+            raise RuntimeError("benchmark %s failed" % name)
+        return marshal.loads("".join(data))
+
+
+def usage(message=None):
+    """Show usage and help information. Arguments:
+    message   -- message to be shown (e.g. error message) before the help"""
+
+    if message:
+        sys.stderr.write(message)
+        sys.stderr.write("\n")
+    usage_message = """Usage: python bench_converters.py [--suite logging|converters]
+           [--loggingfile filename --titlesfile filename]
+           [--count number] [--pages number] [--textsize bytes] [--revisions number]
+           [--runs number] [--workdir dirname]
+           [--save path] [--baseline path] [--tolerance fraction] [--verbose]
+
+With the logging suite, the default, this script measures the throughput
+in log items per second of the pageslogging2sql parsers, the old line by
+line one and the block-buffered one, on the same logging file, and checks
+that their output is identical.
+
+With the converters suite, it generates synthetic content, title, logging
+and sql table files and measures the throughput and peak memory use of
+writing stubs and page ids, combining content files (plain and sorted by
+page id), reading title lists and title dicts, converting logging xml to
+sql and extracting CREATE TABLE statements. Results can be saved and later
+runs compared with them; a rate that has dropped or a peak memory use that
+has grown by more than the tolerance is reported as a regression, and the
+script exits with an error.
+
+Options:
+
+--suite        logging or converters, default logging
+
+--loggingfile  path to a pages-logging xml file; if not given, a synthetic one
+               is generated
+--titlesfile   path to the file of page ids, namespaces and titles for the
+               logging file, as for pageslogging2sql --sqlfile; required with
+               --loggingfile
+--count        number of log items to generate, default 200000
+--pages        converters suite: number of pages to generate, default 100000
+--textsize     converters suite: median bytes of page text, default 2000
+--revisions    converters suite: number of revisions per page, default 1
+--runs         number of runs of each test, the best time is reported;
+               default 1
+--workdir      directory for generated and output files; if not given a
+               temporary directory is used and removed afterwards
+--save         converters suite: write the results as json to this file, to be
+               given as --baseline to later runs
+--baseline     converters suite: compare the results with those saved in this file
+--tolerance    fraction by which a rate may drop or memory use grow before it
+               counts as a regression, default 0.2
+--verbose      display progress messages
+"""
+    sys.stderr.write(usage_message)
+    sys.exit(1)
+
+
+def do_main():
+    logging_file = None
+    titles_file = None
+    count = 200000
+    runs = 1
+    workdir = None
+    verbose = False
+    suite = "logging"
+    page_count = 100000
+    text_size = 2000
+    revisions = 1
+    save_path = None
+    baseline_path = None
+    tolerance = 0.2
+
+    try:
+        (options, remainder) = getopt.gnu_getopt(
+            sys.argv[1:], "", ["suite=", "loggingfile=", "titlesfile=", "count=", "pages=",
+                               "textsize=", "revisions=", "runs=", "workdir=", "save=",
+                               "baseline=", "tolerance=", "verbose", "help"])
+    except getopt.GetoptError as e:
+        usage(e.msg)
+
+    for (opt, val) in options:
+        if opt == "--loggingfile":
+            logging_file = val
+        elif opt == "--titlesfile":
+            titles_file = val
+        elif opt in ["--count", "--runs", "--pages", "--textsize", "--revisions"]:
+            if not val.isdigit():
+                usage("%s requires a number" % opt)
+            if opt == "--count":
+                count = int(val)
+            elif opt == "--pages":
+                page_count = int(val)
+            elif opt == "--textsize":
+                text_size = int(val)
+            elif opt == "--revisions":
+                revisions = int(val)
+            else:
+                runs = int(val)
+        elif opt == "--suite":
+            if val not in ["logging", "converters"]:
+                usage("suite must be one of logging, converters")
+            suite = val
+        elif opt == "--save":
+            save_path = val
+        elif opt == "--baseline":
+            baseline_path = val
+        elif opt == "--tolerance":
+            try:
+                tolerance = float(val)
+            except ValueError:
+                usage("tolerance requires a fraction")
+        elif opt == "--workdir":
+            workdir = val
+        elif opt == "--verbose":
+            verbose = True
+        elif opt == "--help":
+            usage()
+        else:
+            usage("Unknown option specified: %s" % opt)
+
+    if len(remainder) > 0:
+        usage("Unknown option specified: <%s>" % remainder[0])
+    if bool(logging_file) != bool(titles_file):
+        usage("The options loggingfile and titlesfile must be given together")
+    if suite == "converters" and logging_file:
+        usage("The converters suite generates its own files, loggingfile can't be given")
+
+    remove_workdir = False
+    if not workdir:
+        workdir = tempfile.mkdtemp(prefix="bench-")
+        remove_workdir = True
+    elif not os.path.isdir(workdir):
+        os.makedirs(workdir)
+
+    if suite == "converters":
+        results = BenchResults("converters")
+        try:
+            ConverterBench(workdir, page_count, count, text_size, revisions, runs,
+                           verbose).run(results)
+        finally:
+            if remove_workdir:
+                shutil.rmtree(workdir)
+        baseline = BenchResults.load(baseline_path) if baseline_path else None
+        results.write_report(sys.stdout, baseline)
+        if save_path:
+            results.save(save_path)
+        if baseline:
+            regressions = results.compare(baseline, tolerance)
+            for message in regressions:
+                sys.stdout.write("REGRESSION %s\n" % message)
+            if regressions:
+                sys.exit(1)
+        return
+
+    try:
+        if not logging_file:
+            logging_file = os.path.join(workdir, "logging.xml")
+            titles_file = os.path.join(workdir, "titles.txt")
+            if verbose:
+                sys.stderr.write("generating %d log items\n" % count)
+            generator = LoggingGenerator(count)
+            generator.write_logging(logging_file)
+            generator.write_titles(titles_file)
+        ok = LoggingBench(logging_file, titles_file, workdir, runs, verbose).run()
+    finally:
+        if remove_workdir:
+            shutil.rmtree(workdir)
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    do_main()
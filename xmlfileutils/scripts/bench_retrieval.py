@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import time
+import getopt
+import shutil
+import urllib
+import tempfile
+import subprocess
+from wikifile import File
+from fakewiki import Corpus
+from benchresults import BenchResults
+from requestmetrics import RequestMetrics
+from wikiretriever import WikiConnection, Content, CatTitles, CatTreeTitles, EmbeddedTitles
+from wikiretriever import NamespaceTitles
+from wikiretriever import Users, RCTitles, UserContribsTitles, LogEventsTitles
+
+
+class RetrievalBench(object):
+    """Time each kind of title listing that wikiretriever.py does, and
+    content retrieval for the titles of one namespace, against a wiki
+    (normally a fakewiki.py server), reporting titles or pages per second
+    and the requests and bytes it took to get them."""
+
+    def __init__(self, wikiname, workdir, params, batch_size=500, content_pages=1000,
+                 runs=1, username=None, password=None, verbose=False, max_bytes=None,
+                 target_seconds=None):
+        """Constructor. Arguments:
+        wikiname       -- host name (and port) of the wiki
+        workdir        -- directory for the output files
+        params         -- dict of the category, template, namespace, user and log action
+                          to list entries for, keyed by those names
+        batch_size     -- number of entries or pages to ask for in each request
+        content_pages  -- number of pages to retrieve content for
+        runs           -- number of times to run each benchmark; the best time is kept
+        username       -- user to log in as, or None
+        password       -- password for the user
+        verbose        -- display progress messages
+        max_bytes      -- byte budget for each content request, see Content
+        target_seconds -- seconds each content request should take, see Content"""
+
+        self.wikiname = wikiname
+        self.workdir = workdir
+        self.params = params
+        self.batch_size = batch_size
+        self.content_pages = content_pages
+        self.runs = runs
+        self.username = username
+        self.password = password
+        self.verbose = verbose
+        self.max_bytes = max_bytes
+        self.target_seconds = target_seconds
+        self.retries = 20
+
+    def get_retriever(self, name, wiki_conn, outfile):
+        """Return the wikiretriever object for the named benchmark"""
+
+        args = (self.workdir, outfile, False, False, self.batch_size, self.retries, False)
+        dates = ("now", "now-3650d")
+        if name == "category":
+            # the category is given without its namespace prefix
+            category = self.params["category"].split(":", 1)[-1]
+            return CatTitles(wiki_conn, urllib.pathname2url(category), None, *args)
+        elif name == "categorytree":
+            category = Corpus.bench_tree_category.split(":", 1)[-1]
+            return CatTreeTitles(wiki_conn, urllib.pathname2url(category), None, *args)
+        elif name == "embeddedin":
+            return EmbeddedTitles(wiki_conn, urllib.pathname2url(self.params["template"]), None, *args)
+        elif name == "namespace":
+            return NamespaceTitles(wiki_conn, self.params["namespace"], None, *args)
+        elif name == "users":
+            return Users(wiki_conn, None, *args)
+        elif name == "rc":
+            return RCTitles(wiki_conn, None, "user,comment,sizes", *(dates + args))
+        elif name == "usercontribs":
+            return UserContribsTitles(wiki_conn, urllib.pathname2url(self.params["user"]), None,
+                                      *(dates + args))
+        elif name == "log":
+            return LogEventsTitles(wiki_conn, self.params["logaction"], None, *(dates + args))
+        elif name == "content":
+            return Content(wiki_conn, os.path.join(self.workdir, "content-titles.txt"),
+                           self.workdir, outfile, self.batch_size, self.retries, False,
+                           self.max_bytes, self.target_seconds)
+        raise ValueError("no such benchmark %s" % name)
+
+    def count_output(self, name, path):
+        """Return the number of entries, or pages for content, in an output file"""
+
+        input_fd = File.open_input(path)
+        if name == "content":
+            count = sum(1 for line in input_fd if line.strip() == "<page>")
+        else:
+            count = sum(1 for line in input_fd if line.strip())
+        input_fd.close()
+        return count
+
+    def write_content_titles(self):
+        """Write the titles for the content benchmark, taken from the
+        output of the namespace benchmark"""
+
+        input_fd = File.open_input(os.path.join(self.workdir, "namespace.gz"))
+        output_fd = open(os.path.join(self.workdir, "content-titles.txt"), "w")
+        for (count, line) in enumerate(input_fd):
+            if count >= self.content_pages:
+                break
+            output_fd.write(line)
+        output_fd.close()
+        input_fd.close()
+
+    def run_one(self, name):
+        """Run one benchmark, returning (entries, best elapsed seconds,
+        requests made, response bytes) for the best run"""
+
+        best = None
+        for i in range(self.runs):
+            metrics = RequestMetrics(self.wikiname)
+            wiki_conn = WikiConnection(self.wikiname, self.username, self.password, False,
+                                       metrics, use_http=True)
+            wiki_conn.login()
+            outfile = "%s.gz" % name
+            retriever = self.get_retriever(name, wiki_conn, outfile)
+            start = time.time()
+            try:
+                retriever.get_all_entries()
+            finally:
+                wiki_conn.close()
+            elapsed = time.time() - start
+            if best is None or elapsed < best[1]:
+                stats = metrics.stats.values()
+                best = (self.count_output(name, os.path.join(self.workdir, outfile)), elapsed,
+                        sum([s.requests for s in stats]), sum([s.bytes for s in stats]))
+        return best
+
+    def run(self, results):
+        """Run all the benchmarks, adding the results to a BenchResults object"""
+
+        for name in ["category", "categorytree", "embeddedin", "namespace", "users", "rc",
+                     "usercontribs", "log", "content"]:
+            if name == "content":
+                self.write_content_titles()
+            if self.verbose:
+                sys.stderr.write("running %s\n" % name)
+            (count, elapsed, requests, size) = self.run_one(name)
+            results.add(name, count, elapsed, "pages" if name == "content" else "titles",
+                        extra={"requests": requests, "bytes": size})
+
+
+def start_fakewiki(options, verbose):
+    """Start fakewiki.py with the given list of options and return
+    (process, port it is listening on)"""
+
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fakewiki.py")
+    command = [sys.executable, script, "--port", "0"] + options
+    if verbose:
+        sys.stderr.write("starting %s\n" % " ".join(command))
+    process = subprocess.Popen(command, stdout=subprocess.PIPE)
+    port = process.stdout.readline().strip()
+    if not port.isdigit():
+        process.wait()
+        raise RuntimeError("fakewiki.py failed to start")
+    return (process, int(port))
+
+
+def usage(message=None):
+    """Show usage and help information. Arguments:
+    message   -- message to be shown (e.g. error message) before the help"""
+
+    if message:
+        sys.stderr.write(message)
+        sys.stderr.write("\n")
+    usage_message = """Usage: python bench_retrieval.py [--wiki host:port]
+           [--pages number] [--textsize bytes] [--corpus path]
+           [--latency milliseconds] [--bandwidth kilobytes] [--lagrate fraction]
+           [--batchsize number] [--batchbytes bytes] [--targetseconds seconds]
+           [--contentpages number] [--auth username:password]
+           [--category name] [--template name] [--namespace number] [--user name]
+           [--logaction type/action] [--runs number] [--workdir dirname]
+           [--save path] [--baseline path] [--tolerance fraction] [--verbose]
+
+This script measures the titles per second retrieved by wikiretriever.py
+for each kind of title listing (category, categorytree, embeddedin, namespace,
+users, rc, usercontribs, log) and the pages per second of content retrieval, against
+a fakewiki.py server which it starts, or against a wiki already running.
+
+Options:
+
+--wiki          host:port of a running fakewiki.py (or other wiki serving plain http);
+                if not given, fakewiki.py is started with the options below
+--pages         number of pages for fakewiki.py to make up, default 10000
+--textsize      median bytes of made up page text, default 2000
+--corpus        XML content file for fakewiki.py to serve instead
+--latency       milliseconds for fakewiki.py to wait before each response, default 0
+--bandwidth     kilobytes per second for fakewiki.py to send at, default no limit
+--lagrate       fraction of fakewiki.py responses to be maxlag errors, default 0
+--batchsize     number of titles or pages to request at once, default 500
+--batchbytes    pack content requests by page length to about this many bytes each
+--targetseconds with batchbytes, adjust the bytes per content request so that
+                each takes about this long
+--contentpages  number of pages of content to retrieve, default 1000
+--auth          username:password to log in with, allowing batches up to 5000
+--category      category to list, default '%s'
+--template      template to list pages embedding, default '%s'
+--namespace     namespace to list, default 0
+--user          user to list contributions of, default 'User 1'
+--logaction     log type and action to list, default upload/upload
+--runs          number of runs of each benchmark, the best time is reported;
+                default 1
+--workdir       directory for output files; if not given a temporary
+                directory is used and removed afterwards
+--save          write the results as json to this file, to be given as
+                --baseline to later runs
+--baseline      compare the results with those saved in this file, exiting
+                with an error if any rate has dropped by more than the tolerance
+--tolerance     fraction by which a rate may drop before it counts as a
+                regression, default 0.2
+--verbose       display progress messages
+""" % (Corpus.bench_category, Corpus.bench_template)
+    sys.stderr.write(usage_message)
+    sys.exit(1)
+
+
+def do_main():
+    wikiname = None
+    fakewiki_options = []
+    params = {"category": Corpus.bench_category, "template": Corpus.bench_template,
+              "namespace": "0", "user": "User 1", "logaction": "upload/upload"}
+    batch_size = 500
+    content_pages = 1000
+    max_bytes = None
+    target_seconds = None
+    username = None
+    password = None
+    runs = 1
+    workdir = None
+    save_path = None
+    baseline_path = None
+    tolerance = 0.2
+    verbose = False
+
+    try:
+        (options, remainder) = getopt.gnu_getopt(
+            sys.argv[1:], "", ["wiki=", "pages=", "textsize=", "corpus=", "latency=",
+                               "bandwidth=", "lagrate=", "batchsize=", "batchbytes=",
+                               "targetseconds=", "contentpages=",
+                               "auth=", "category=", "template=", "namespace=", "user=",
+                               "logaction=", "runs=", "workdir=", "save=", "baseline=",
+                               "tolerance=", "verbose", "help"])
+    except getopt.GetoptError as e:
+        usage(e.msg)
+
+    for (opt, val) in options:
+        if opt == "--wiki":
+            wikiname = val
+        elif opt in ["--pages", "--textsize", "--latency", "--bandwidth"]:
+            if not val.isdigit():
+                usage("%s requires a number" % opt)
+            fakewiki_options.extend([opt, val])
+        elif opt in ["--corpus", "--lagrate"]:
+            fakewiki_options.extend([opt, val])
+        elif opt in ["--batchsize", "--batchbytes", "--contentpages", "--runs"]:
+            if not val.isdigit():
+                usage("%s requires a number" % opt)
+            if opt == "--batchsize":
+                batch_size = int(val)
+            elif opt == "--batchbytes":
+                max_bytes = int(val)
+            elif opt == "--contentpages":
+                content_pages = int(val)
+            else:
+                runs = int(val)
+        elif opt == "--auth":
+            if ':' not in val:
+                usage("auth requires username:password")
+            (username, password) = val.split(':', 1)
+        elif opt[2:] in params:
+            params[opt[2:]] = val
+        elif opt == "--workdir":
+            workdir = val
+        elif opt == "--save":
+            save_path = val
+        elif opt == "--baseline":
+            baseline_path = val
+        elif opt == "--targetseconds":
+            try:
+                target_seconds = float(val)
+            except ValueError:
+                usage("targetseconds requires a number")
+        elif opt == "--tolerance":
+            try:
+                tolerance = float(val)
+            except ValueError:
+                usage("tolerance requires a fraction")
+        elif opt == "--verbose":
+            verbose = True
+        elif opt == "--help":
+            usage()
+        else:
+            usage("Unknown option specified: %s" % opt)
+
+    if len(remainder) > 0:
+        usage("Unknown option specified: <%s>" % remainder[0])
+    if wikiname and fakewiki_options:
+        usage("fakewiki options can't be given with --wiki")
+
+    remove_workdir = False
+    if not workdir:
+        workdir = tempfile.mkdtemp(prefix="bench-")
+        remove_workdir = True
+    elif not os.path.isdir(workdir):
+        os.makedirs(workdir)
+
+    process = None
+    results = BenchResults("retrieval")
+    try:
+        if not wikiname:
+            (process, port) = start_fakewiki(fakewiki_options, verbose)
+            wikiname = "127.0.0.1:%d" % port
+        RetrievalBench(wikiname, workdir, params, batch_size, content_pages, runs,
+                       username, password, verbose, max_bytes, target_seconds).run(results)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        if remove_workdir:
+            shutil.rmtree(workdir)
+
+    baseline = BenchResults.load(baseline_path) if baseline_path else None
+    results.write_report(sys.stdout, baseline)
+    if save_path:
+        results.save(save_path)
+    if baseline:
+        regressions = results.compare(baseline, tolerance)
+        for message in regressions:
+            sys.stdout.write("REGRESSION %s\n" % message)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    do_main()
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import json
+import time
+import socket
+
+
+class BenchResults(object):
+    """Results of one run of a benchmark suite: for each benchmark the
+    number of items done, the seconds taken and optionally the peak memory
+    used, saved as json so that a later run can be compared against them
+    and slowdowns or growth in memory use flagged."""
+
+    def __init__(self, suite):
+        """Constructor. Arguments:
+        suite   -- name of the benchmark suite, e.g. retrieval"""
+
+        self.suite = suite
+        self.info = {"suite": suite, "host": socket.gethostname(),
+                     "python": sys.version.split()[0],
+                     "date": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}
+        self.names = []  # in the order run
+        self.results = {}
+
+    def add(self, name, count, seconds, unit="items", peak_kb=None, extra=None):
+        """Record the result of one benchmark. Arguments:
+        name     -- name of the benchmark
+        count    -- number of items done
+        seconds  -- seconds taken
+        unit     -- what the items are called, e.g. titles
+        peak_kb  -- peak resident memory in kilobytes while the benchmark ran, if known
+        extra    -- dict of anything else worth keeping, e.g. number of requests"""
+
+        result = {"count": count, "seconds": seconds, "unit": unit,
+                  "rate": count / seconds if seconds > 0 else 0.0}
+        if peak_kb is not None:
+            result["peak_kb"] = peak_kb
+        if extra:
+            result.update(extra)
+        if name not in self.results:
+            self.names.append(name)
+        self.results[name] = result
+
+    def save(self, path):
+        contents = {"info": self.info, "names": self.names, "results": self.results}
+        output_fd = open(path + ".tmp", "w")
+        json.dump(contents, output_fd, indent=2, sort_keys=True)
+        output_fd.write("\n")
+        output_fd.close()
+        os.rename(path + ".tmp", path)
+
+    @staticmethod
+    def load(path):
+        input_fd = open(path)
+        contents = json.load(input_fd)
+        input_fd.close()
+        results = BenchResults(contents["info"]["suite"])
+        results.info = contents["info"]
+        results.names = contents["names"]
+        results.results = contents["results"]
+        return results
+
+    def compare(self, baseline, tolerance=0.2):
+        """Return a list of messages about benchmarks that have got slower
+        or use more memory than in the baseline by more than the tolerance.
+        Arguments:
+        baseline   -- BenchResults from an earlier run
+        tolerance  -- fraction by which a rate may drop or memory use grow
+                      before it is flagged"""
+
+        regressions = []
+        for name in self.names:
+            if name not in baseline.results:
+                continue
+            old = baseline.results[name]
+            new = self.results[name]
+            if old["rate"] and new["rate"] < old["rate"] * (1 - tolerance):
+                regressions.append("%s: %.1f %s/s, was %.1f (%.0f%% slower)" % (
+                    name, new["rate"], new["unit"], old["rate"],
+                    100.0 * (old["rate"] - new["rate"]) / old["rate"]))
+            if old.get("peak_kb") and new.get("peak_kb", 0) > old["peak_kb"] * (1 + tolerance):
+                regressions.append("%s: peak memory %d KB, was %d (%.0f%% more)" % (
+                    name, new["peak_kb"], old["peak_kb"],
+                    100.0 * (new["peak_kb"] - old["peak_kb"]) / old["peak_kb"]))
+        return regressions
+
+    def write_report(self, output_fd, baseline=None):
+        """Write a table of the results, with the change in rate from
+        the baseline for each benchmark if a baseline is given"""
+
+        output_fd.write("%-24s %10s %10s %12s %10s %8s\n" % (
+            "benchmark", "items", "seconds", "items/sec", "peak MB", "change"))
+        for name in self.names:
+            result = self.results[name]
+            peak = "%.1f" % (result["peak_kb"] / 1024.0) if "peak_kb" in result else "-"
+            change = "-"
+            if baseline is not None and baseline.results.get(name, {}).get("rate"):
+                old_rate = baseline.results[name]["rate"]
+                change = "%+.0f%%" % (100.0 * (result["rate"] - old_rate) / old_rate)
+            output_fd.write("%-24s %10d %10.2f %12.1f %10s %8s\n" % (
+                name, result["count"], result["seconds"], result["rate"], peak, change))
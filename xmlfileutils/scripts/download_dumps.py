@@ -0,0 +1,407 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+import sys
+import time
+import getopt
+import hashlib
+import socket
+import httplib
+import urlparse
+import threading
+import Queue
+
+
+class DownloadErr(Exception):
+    pass
+
+
+class DumpDownloader(object):
+    """Download files of one run of a wiki's dumps, several at once,
+    checking each against the checksums file published with the run.
+    Files are written with a .part suffix and renamed once their
+    checksum is good; a .part file left over from an interrupted run
+    is resumed with a range request rather than fetched again, and
+    files already present with a good checksum are not fetched at all.
+    The checksum is computed as the data is written, so files are
+    read back from disk only when resuming or checking existing files."""
+
+    checksum_types = ["sha1", "md5"]
+
+    def __init__(self, base_url, wiki, date, output_dir, checksum_type="sha1", jobs=4,
+                 retries=3, verbose=False, timeout=60):
+        """Constructor. Arguments:
+        base_url       -- url of the top of the dumps tree, e.g. https://dumps.wikimedia.org;
+                          files are retrieved from base_url/wiki/date/
+        wiki           -- name of the wiki as it appears in dump file names, e.g. elwikivoyage
+        date           -- date of the dump run, e.g. 20170401
+        output_dir     -- directory into which to write the files
+        checksum_type  -- 'sha1' or 'md5', which checksums file to verify against
+        jobs           -- number of files to download at the same time
+        retries        -- number of times to retry a file after an error
+        verbose        -- display progress messages
+        timeout        -- seconds to wait for the server on connecting or reading
+                          before giving up on the request, so that a stalled
+                          download is retried (and resumed) rather than hanging"""
+
+        if checksum_type not in DumpDownloader.checksum_types:
+            raise DownloadErr("unknown checksum type %s, expected one of %s\n"
+                              % (checksum_type, ", ".join(DumpDownloader.checksum_types)))
+        self.base_url = base_url.rstrip("/")
+        self.wiki = wiki
+        self.date = date
+        self.output_dir = output_dir
+        self.checksum_type = checksum_type
+        self.jobs = jobs
+        self.retries = retries
+        self.verbose = verbose
+        self.timeout = timeout
+        self.user_agent = "download_dumps.py/0.1"
+        self.block_size = 1024 * 1024
+        self.max_redirects = 5
+        self.checksums = None
+        self.results = {}  # filename -> (status, bytes fetched, seconds, error)
+        self.lock = threading.Lock()
+
+    def get_url(self, filename):
+        return "%s/%s/%s/%s" % (self.base_url, self.wiki, self.date, filename)
+
+    def get_response(self, url, offset=0):
+        """Request the url, from the given byte offset onwards if it is not 0,
+        following redirects, and return (connection, response); the caller
+        must close the connection. Raises an exception on error."""
+
+        for i in range(self.max_redirects + 1):
+            parsed = urlparse.urlparse(url)
+            if parsed.scheme == "https":
+                http_conn = httplib.HTTPSConnection(parsed.netloc, timeout=self.timeout)
+            elif parsed.scheme == "http":
+                http_conn = httplib.HTTPConnection(parsed.netloc, timeout=self.timeout)
+            else:
+                raise DownloadErr("unsupported url %s\n" % url)
+            path = parsed.path or "/"
+            if parsed.query:
+                path = path + "?" + parsed.query
+            http_conn.putrequest("GET", path, skip_accept_encoding=True)
+            http_conn.putheader("User-Agent", self.user_agent)
+            if offset:
+                http_conn.putheader("Range", "bytes=%d-" % offset)
+            http_conn.endheaders()
+            http_result = http_conn.getresponse()
+            if http_result.status in [301, 302, 303, 307, 308]:
+                location = http_result.getheader("Location")
+                http_conn.close()
+                if not location:
+                    raise DownloadErr("redirect without location for %s\n" % url)
+                url = urlparse.urljoin(url, location)
+                continue
+            return (http_conn, http_result)
+        raise DownloadErr("too many redirects for %s\n" % url)
+
+    def get_checksums(self):
+        """Retrieve the checksums file for the dump run and return a dict
+        of file name -> checksum. Raises an exception on error."""
+
+        filename = "%s-%s-%ssums.txt" % (self.wiki, self.date, self.checksum_type)
+        url = self.get_url(filename)
+        (http_conn, http_result) = self.get_response(url)
+        contents = http_result.read()
+        http_conn.close()
+        if http_result.status != 200:
+            raise DownloadErr("status %s, reason %s retrieving %s\n"
+                              % (http_result.status, http_result.reason, url))
+        checksums = {}
+        for line in contents.splitlines():
+            fields = line.split()
+            if len(fields) == 2:
+                # 'checksum  filename', as written by sha1sum and md5sum
+                checksums[fields[1].lstrip("*")] = fields[0].lower()
+        return checksums
+
+    def new_hash(self):
+        return hashlib.new(self.checksum_type)
+
+    def hash_file(self, path, file_hash=None):
+        """Add the contents of the file to the hash (a new one if not given) and return it"""
+
+        if file_hash is None:
+            file_hash = self.new_hash()
+        in_fd = open(path, "rb")
+        while True:
+            data = in_fd.read(self.block_size)
+            if not data:
+                break
+            file_hash.update(data)
+        in_fd.close()
+        return file_hash
+
+    def fetch(self, filename, part_path):
+        """Fetch the file into part_path, resuming from the end of part_path
+        if it exists, and return (hash of the whole file, bytes fetched).
+        Raises an exception on error, leaving what was fetched in part_path."""
+
+        offset = 0
+        file_hash = self.new_hash()
+        if os.path.exists(part_path):
+            offset = os.path.getsize(part_path)
+            if offset:
+                self.hash_file(part_path, file_hash)
+        url = self.get_url(filename)
+        (http_conn, http_result) = self.get_response(url, offset)
+        try:
+            if offset and http_result.status == 416:
+                # nothing past what we have: the part file is complete, or bad
+                return (file_hash, 0)
+            if offset and http_result.status == 200:
+                # server doesn't do ranges, start over
+                if self.verbose:
+                    sys.stderr.write("%s: no range support, fetching from the start\n" % filename)
+                offset = 0
+                file_hash = self.new_hash()
+            elif http_result.status not in [200, 206]:
+                raise DownloadErr("status %s, reason %s retrieving %s\n"
+                                  % (http_result.status, http_result.reason, url))
+            elif http_result.status == 206:
+                result = re.match(r"bytes (\d+)-", http_result.getheader("Content-Range", ""))
+                if not result or int(result.group(1)) != offset:
+                    raise DownloadErr("bad Content-Range from %s\n" % url)
+            if self.verbose and offset:
+                sys.stderr.write("%s: resuming at byte %d\n" % (filename, offset))
+            out_fd = open(part_path, "ab" if offset else "wb")
+            fetched = 0
+            try:
+                while True:
+                    data = http_result.read(self.block_size)
+                    if not data:
+                        break
+                    out_fd.write(data)
+                    file_hash.update(data)
+                    fetched = fetched + len(data)
+            finally:
+                out_fd.close()
+            expected = http_result.getheader("Content-Length")
+            if expected is not None and fetched != int(expected):
+                raise DownloadErr("short read from %s, %d of %s bytes\n" % (url, fetched, expected))
+        finally:
+            http_conn.close()
+        return (file_hash, fetched)
+
+    def download_file(self, filename):
+        """Download one file unless it is already present with the right
+        checksum, and return (status, bytes fetched); status is one of
+        'present', 'downloaded', 'resumed'. Raises an exception on error."""
+
+        if filename not in self.checksums:
+            raise DownloadErr("%s is not in the %s checksums file for %s %s\n"
+                              % (filename, self.checksum_type, self.wiki, self.date))
+        expected = self.checksums[filename]
+        path = os.path.join(self.output_dir, filename)
+        part_path = path + ".part"
+        if os.path.exists(path):
+            if self.hash_file(path).hexdigest() == expected:
+                return ("present", 0)
+            if self.verbose:
+                sys.stderr.write("%s: existing file has bad checksum, fetching again\n" % filename)
+            os.unlink(path)
+
+        status = "resumed" if os.path.exists(part_path) else "downloaded"
+        fetched = 0
+        attempt = 0
+        while True:
+            before = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+            try:
+                (file_hash, count) = self.fetch(filename, part_path)
+                fetched = fetched + count
+                if file_hash.hexdigest() == expected:
+                    os.rename(part_path, path)
+                    return (status, fetched)
+                # corrupt somewhere; resuming won't help
+                os.unlink(part_path)
+                error = "%s: bad checksum\n" % filename
+            except (DownloadErr, httplib.HTTPException, IOError, OSError, socket.error) as e:
+                # keep the part file so the next attempt resumes
+                if os.path.exists(part_path):
+                    fetched = fetched + max(os.path.getsize(part_path) - before, 0)
+                error = "%s: %s" % (filename, str(e) or e.__class__.__name__)
+            attempt = attempt + 1
+            if attempt > self.retries:
+                raise DownloadErr(error.rstrip("\n") + ", giving up\n")
+            if self.verbose:
+                sys.stderr.write(error.rstrip("\n") + ", retrying\n")
+            time.sleep(min(2 ** attempt, 30))
+
+    def worker(self, queue):
+        """Download files from the queue until it is empty"""
+
+        while True:
+            try:
+                filename = queue.get_nowait()
+            except Queue.Empty:
+                return
+            if self.verbose:
+                sys.stderr.write("%s: starting\n" % filename)
+            start = time.time()
+            try:
+                (status, fetched) = self.download_file(filename)
+                error = None
+            except (DownloadErr, httplib.HTTPException, IOError, OSError, socket.error) as e:
+                (status, fetched, error) = ("failed", 0, str(e) or e.__class__.__name__)
+                sys.stderr.write(error)
+            with self.lock:
+                self.results[filename] = (status, fetched, time.time() - start, error)
+            if self.verbose:
+                sys.stderr.write("%s: %s\n" % (filename, status))
+
+    def download(self, filenames):
+        """Download all the files; returns True if every file is present with a good
+        checksum at the end. Raises exception if the checksums can't be retrieved."""
+
+        if not os.path.isdir(self.output_dir):
+            os.makedirs(self.output_dir)
+        self.checksums = self.get_checksums()
+        queue = Queue.Queue()
+        for filename in filenames:
+            queue.put(filename)
+        threads = [threading.Thread(target=self.worker, args=(queue,))
+                   for i in range(min(self.jobs, len(filenames)))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            # with a timeout so that an interrupt is noticed
+            while thread.is_alive():
+                thread.join(1)
+        return not [f for f in filenames if self.results.get(f, ("failed",))[0] == "failed"]
+
+    def write_report(self, out_fd):
+        """Write the status, bytes fetched and rate for each file"""
+
+        for filename in sorted(self.results):
+            (status, fetched, seconds, error) = self.results[filename]
+            out_fd.write("%-50s %-10s %14d %9.1f %9.2f MB/sec\n"
+                         % (filename, status, fetched, seconds,
+                            fetched / (seconds or 0.000001) / 1024 / 1024))
+
+
+def get_table_files(wiki, date, tables):
+    """Return the dump file names of the sql table dumps for the tables"""
+
+    return ["%s-%s-%s.sql.gz" % (wiki, date, table) for table in tables]
+
+
+def usage(message=None):
+    """Show usage and help information. Arguments:
+    message   -- message to be shown (e.g. error message) before the help"""
+
+    if message:
+        sys.stderr.write(message)
+        sys.stderr.write("\n")
+    usage_message = """Usage: python download_dumps.py --wiki dbname --date YYYYMMDD
+           [--tables 'table1 table2 ...'] [--files 'file1 file2 ...']
+           [--output dirname] [--baseurl url] [--checksums sha1|md5]
+           [--jobs number] [--retries number] [--timeout seconds] [--verbose] [--help]
+
+This script downloads files from a run of a wiki's dumps, several at
+a time, and checks each against the checksums file of the run. Files
+already in the output directory with the right checksum are skipped,
+and partly downloaded files left by an interrupted run are resumed.
+At the end the status of each file is written to stdout.
+
+Options:
+
+--wiki       name of the wiki as it appears in the dump file names, e.g. elwikivoyage
+--date       date of the dump run, e.g. 20170401
+--tables     space-separated list of tables whose sql dumps should be retrieved,
+             e.g. 'pagelinks categorylinks'
+--files      space-separated list of other files of the run to retrieve,
+             e.g. 'elwikivoyage-20170401-stub-meta-history.xml.gz'
+--output     directory into which to write the files, default: '.'
+--baseurl    url of the top of the dumps tree, default: https://dumps.wikimedia.org
+             files are retrieved from <baseurl>/<wiki>/<date>/
+--checksums  checksums file to verify against, sha1 or md5, default: sha1
+--jobs       number of files to download at the same time, default: 4
+--retries    number of times to retry a file after an error, default: 3
+--timeout    seconds to wait for the server to answer or send more data before
+             giving up on a request, which is then retried, default: 60
+--verbose    display progress messages
+--help       show this usage message
+"""
+    sys.stderr.write(usage_message)
+    sys.exit(1)
+
+
+def do_main():
+    wiki = None
+    date = None
+    tables = []
+    files = []
+    output_dir = "."
+    base_url = "https://dumps.wikimedia.org"
+    checksum_type = "sha1"
+    jobs = 4
+    retries = 3
+    timeout = 60
+    verbose = False
+
+    try:
+        (options, remainder) = getopt.gnu_getopt(
+            sys.argv[1:], "", ["wiki=", "date=", "tables=", "files=", "output=", "baseurl=",
+                               "checksums=", "jobs=", "retries=", "timeout=", "verbose",
+                               "help"])
+    except getopt.GetoptError as e:
+        usage(e.msg)
+
+    for (opt, val) in options:
+        if opt == "--wiki":
+            wiki = val
+        elif opt == "--date":
+            date = val
+        elif opt == "--tables":
+            tables = val.split()
+        elif opt == "--files":
+            files = val.split()
+        elif opt == "--output":
+            output_dir = val
+        elif opt == "--baseurl":
+            base_url = val
+        elif opt == "--checksums":
+            if val not in DumpDownloader.checksum_types:
+                usage("checksums must be one of %s" % ", ".join(DumpDownloader.checksum_types))
+            checksum_type = val
+        elif opt in ["--jobs", "--retries", "--timeout"]:
+            if not val.isdigit():
+                usage("%s requires a number" % opt)
+            if opt == "--jobs":
+                jobs = max(int(val), 1)
+            elif opt == "--timeout":
+                timeout = max(int(val), 1)
+            else:
+                retries = int(val)
+        elif opt == "--verbose":
+            verbose = True
+        elif opt == "--help":
+            usage()
+        else:
+            usage("Unknown option specified: %s" % opt)
+
+    if len(remainder) > 0:
+        usage("Unknown option specified: <%s>" % remainder[0])
+    if not wiki or not date:
+        usage("Missing mandatory option <%s>" % ("wiki" if not wiki else "date"))
+    if not tables and not files:
+        usage("At least one of tables or files must be given")
+
+    downloader = DumpDownloader(base_url, wiki, date, output_dir, checksum_type, jobs,
+                                retries, verbose, timeout)
+    try:
+        ok = downloader.download(get_table_files(wiki, date, tables) + files)
+    except (DownloadErr, httplib.HTTPException, IOError, socket.error) as e:
+        sys.stderr.write("failed to retrieve checksums: %s" % (str(e) or e.__class__.__name__))
+        sys.exit(1)
+    downloader.write_report(sys.stdout)
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    do_main()
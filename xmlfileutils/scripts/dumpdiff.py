@@ -0,0 +1,392 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import getopt
+from wikifile import File
+from sqlwriter import RowWriter
+from progress import Progress
+from pagerows import PageRows, PageRowsErr
+from wikicontent2sql import Filter, WikiContentErr
+
+
+class DumpDiffErr(Exception):
+    pass
+
+
+class Deleter(object):
+    """Write DELETE statements to an open file, gathering the values
+    given for each table and column into statements of up to batch_size
+    values each, so that neither memory nor statement count grows with
+    the number of rows deleted."""
+
+    def __init__(self, fd, batch_size=1000):
+        """Constructor. Arguments:
+        fd          -- file descriptor open for writing
+        batch_size  -- maximum number of values in one statement"""
+
+        self.fd = fd
+        self.batch_size = batch_size
+        self.values = {}
+
+    def delete(self, table, column, value):
+        """Add a row to be deleted.
+        Arguments:
+        table   -- name of the table
+        column  -- column to match, e.g. rev_id
+        value   -- value of the column for the row, as an int or sql literal"""
+
+        key = (table, column)
+        if key not in self.values:
+            self.values[key] = []
+        self.values[key].append(str(value))
+        if len(self.values[key]) >= self.batch_size:
+            self.flush(key)
+
+    def flush(self, key):
+        if self.values[key]:
+            self.fd.write("DELETE FROM %s WHERE %s IN (%s);\n" % (key[0], key[1],
+                                                                  ",".join(self.values[key])))
+            self.values[key] = []
+
+    def close(self):
+        """Write out what is left; the file descriptor is left open for the caller"""
+
+        for key in sorted(self.values.keys()):
+            self.flush(key)
+
+
+class DumpDiff(object):
+    """Compare two content or stub dumps of a wiki, old and new, both in
+    page id order, and write only the rows that differ: page, revision and
+    text rows to be written over the ones in a database loaded from the old
+    dump, DELETE statements for those that are gone, and the ids of the
+    pages whose link table rows must be taken from the new dump.
+
+    The dumps are read side by side in one pass, a page from each at a
+    time, so memory use does not grow with their size. A page is the same
+    in both if it has the same title, namespace and redirect target and
+    the same revisions with the same sha1s.
+
+    Files written to the output directory, to be applied in this order:
+      deletes.sql    -- DELETE statements for pages, revisions and text gone
+                        from the new dump or superseded, and for the link
+                        table rows of the pages deleted or changed
+      page.sql, revision.sql, text.sql
+                     -- REPLACE statements for the rows inserted or changed;
+                        there are no text rows for stub dumps
+      pageids        -- ids of the pages inserted or changed, as column:value
+                        lines for sqlfilter, to filter the new link tables with"""
+
+    # link tables with one row or more per page, and the column with the page id
+    link_tables = {"categorylinks": "cl_from", "externallinks": "el_from",
+                   "imagelinks": "il_from", "iwlinks": "iwl_from", "langlinks": "ll_from",
+                   "page_props": "pp_page", "page_restrictions": "pr_page",
+                   "pagelinks": "pl_from", "redirect": "rd_from", "templatelinks": "tl_from"}
+
+    def __init__(self, output_dir, compress=True, links=True, verbose=False, text_ids=False):
+        """Constructor. Arguments:
+        output_dir  -- directory in which to write the files
+        compress    -- gzip the files
+        links       -- write DELETE statements for the link table rows of pages
+                       deleted or changed
+        verbose     -- display progress messages on stderr
+        text_ids    -- the database was loaded with mwxml2sql -i, taking text ids
+                       from the dump rather than using the revision ids"""
+
+        self.output_dir = output_dir
+        if not os.path.isdir(self.output_dir):
+            os.makedirs(self.output_dir)
+        self.suffix = ".gz" if compress else ""
+        self.links = links
+        self.verbose = verbose
+        self.page_rows = PageRows(text_ids)
+        self.counts = dict([(name, 0) for name in ["pages inserted", "pages changed",
+                                                   "pages deleted", "pages unchanged",
+                                                   "revisions inserted", "revisions changed",
+                                                   "revisions deleted"]])
+
+        self.fds = {}
+        self.writers = {}
+        for table in ["page", "revision", "text"]:
+            self.fds[table] = File.open_output(self.get_path(table + ".sql"))
+            self.writers[table] = RowWriter(self.fds[table], table,
+                                            self.page_rows.get_columns(table), "extended",
+                                            replace=True)
+        self.fds["deletes"] = File.open_output(self.get_path("deletes.sql"))
+        self.deleter = Deleter(self.fds["deletes"])
+        self.fds["pageids"] = File.open_output(self.get_path("pageids"))
+
+    def get_path(self, filename):
+        return os.path.join(self.output_dir, filename + self.suffix)
+
+    def read_pages(self, path, progress=None):
+        """Read the pages of a dump, yielding (page id, page element);
+        raises an exception if they are not in page id order
+        Arguments:
+        path      -- path to the content or stub file
+        progress  -- Progress to tell about the file, or None"""
+
+        in_fd = File.open_input(path)
+        if progress:
+            progress.set_input(in_fd, path)
+        previous = None
+        for (page_id, page_xml) in File.read_pages(in_fd):
+            if previous is not None and page_id <= previous:
+                raise DumpDiffErr("pages in %s are not in page id order: %d comes after %d"
+                                  % (path, page_id, previous))
+            previous = page_id
+            yield (page_id, self.page_rows.parse(page_xml))
+        in_fd.close()
+
+    def get_page_key(self, page):
+        """Return what the page row depends on besides the revisions"""
+
+        redirect = page.find("redirect")
+        return (self.page_rows.get_field(page, "ns", "0"), self.page_rows.get_field(page, "title"),
+                None if redirect is None else redirect.get("title", ""))
+
+    def write_revision(self, page_id, revision):
+        self.writers["revision"].write_row(self.page_rows.get_revision_row(page_id, revision))
+        text_row = self.page_rows.get_text_row(revision)
+        if text_row is not None:
+            self.writers["text"].write_row(text_row)
+
+    def write_page(self, page_id, page):
+        """Write the page row and note the page for its link table rows"""
+
+        self.writers["page"].write_row(self.page_rows.get_page_row(page, page.findall("revision")[-1]))
+        self.fds["pageids"].write("1:%d\n" % page_id)
+
+    def delete_links(self, page_id):
+        if self.links:
+            for table in sorted(DumpDiff.link_tables.keys()):
+                self.deleter.delete(table, DumpDiff.link_tables[table], page_id)
+
+    def insert_page(self, page_id, page):
+        for revision in page.findall("revision"):
+            self.write_revision(page_id, revision)
+            self.counts["revisions inserted"] = self.counts["revisions inserted"] + 1
+        self.write_page(page_id, page)
+        self.counts["pages inserted"] = self.counts["pages inserted"] + 1
+
+    def delete_page(self, page_id, page):
+        self.deleter.delete("page", "page_id", page_id)
+        for revision in page.findall("revision"):
+            self.deleter.delete("revision", "rev_id", self.page_rows.get_field(revision, "id"))
+            self.deleter.delete("text", "old_id", self.page_rows.get_text_id(revision))
+            self.counts["revisions deleted"] = self.counts["revisions deleted"] + 1
+        self.delete_links(page_id)
+        self.counts["pages deleted"] = self.counts["pages deleted"] + 1
+
+    def update_page(self, page_id, old_page, new_page):
+        """Write the rows that differ between the old and new versions of a page"""
+
+        get_field = self.page_rows.get_field
+        old_revisions = dict([(get_field(revision, "id"), revision)
+                              for revision in old_page.findall("revision")])
+        new_revisions = new_page.findall("revision")
+        # stubs may have several revisions sharing one text
+        text_ids = set([self.page_rows.get_text_id(revision) for revision in new_revisions])
+
+        changed = False
+        for revision in new_revisions:
+            old_revision = old_revisions.pop(get_field(revision, "id"), None)
+            if old_revision is None:
+                self.counts["revisions inserted"] = self.counts["revisions inserted"] + 1
+            elif get_field(old_revision, "sha1") != get_field(revision, "sha1"):
+                self.counts["revisions changed"] = self.counts["revisions changed"] + 1
+                old_text_id = self.page_rows.get_text_id(old_revision)
+                if old_text_id not in text_ids:
+                    self.deleter.delete("text", "old_id", old_text_id)
+            else:
+                continue
+            self.write_revision(page_id, revision)
+            changed = True
+        for (rev_id, revision) in old_revisions.items():
+            self.deleter.delete("revision", "rev_id", rev_id)
+            if self.page_rows.get_text_id(revision) not in text_ids:
+                self.deleter.delete("text", "old_id", self.page_rows.get_text_id(revision))
+            self.counts["revisions deleted"] = self.counts["revisions deleted"] + 1
+            changed = True
+
+        if changed or self.get_page_key(old_page) != self.get_page_key(new_page):
+            self.write_page(page_id, new_page)
+            self.delete_links(page_id)
+            self.counts["pages changed"] = self.counts["pages changed"] + 1
+        else:
+            self.counts["pages unchanged"] = self.counts["pages unchanged"] + 1
+
+    def diff(self, old_path, new_path):
+        """Read both dumps and write the rows that differ
+        Arguments:
+        old_path  -- path to the content or stub file the database was loaded from
+        new_path  -- path to the newer file of the same kind"""
+
+        progress = Progress("comparing dumps", "pages", [new_path], enabled=self.verbose)
+        old_pages = self.read_pages(old_path)
+        new_pages = self.read_pages(new_path, progress)
+        old = next(old_pages, None)
+        new = next(new_pages, None)
+        while old is not None or new is not None:
+            if new is None or (old is not None and old[0] < new[0]):
+                self.delete_page(*old)
+                old = next(old_pages, None)
+                continue
+            if old is None or new[0] < old[0]:
+                self.insert_page(*new)
+            else:
+                self.update_page(new[0], old[1], new[1])
+                old = next(old_pages, None)
+            new = next(new_pages, None)
+            progress.update()
+        progress.finish()
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+        self.deleter.close()
+        for fd in self.fds.values():
+            fd.close()
+
+    def write_report(self, output_fd):
+        for name in ["pages inserted", "pages changed", "pages deleted", "pages unchanged",
+                     "revisions inserted", "revisions changed", "revisions deleted"]:
+            output_fd.write("%s: %d\n" % (name, self.counts[name]))
+
+
+def usage(message=None):
+    """Show usage and help information. Arguments:
+    message   -- message to be shown (e.g. error message) before the help"""
+
+    if message:
+        sys.stderr.write(message)
+        sys.stderr.write("\n")
+    usage_message = """Usage: python dumpdiff.py --old path --new path --outputdir dirname
+           [--sqlfiles pathformat] [--sqlfilter path] [--jobs number]
+           [--textids] [--nocompress] [--verbose] [--help]
+
+This script compares two content or stub dumps of a wiki, an older one
+from which a database was loaded and a newer one, and writes only the
+rows that changed between them, so that the database can be brought up
+to date without loading the new dump from scratch. Pages must be in page
+id order in both files, as they are in the dumps.
+
+The dumps are read side by side in one pass, so memory use stays the same
+however large they are. A page has changed if its title, namespace or
+redirect target differ, or if any revision was added or removed or has a
+different sha1.
+
+Written to the output directory, to be applied in this order:
+  deletes.sql.gz    DELETE statements for the rows of pages, revisions and
+                    text no longer in the dump, and for the link table rows
+                    of pages deleted or changed
+  page.sql.gz, revision.sql.gz, text.sql.gz
+                    REPLACE statements for the rows of pages and revisions
+                    new or changed; no text rows are written from stubs
+  the link table sql files named by sqlfiles, filtered down to the rows
+                    for the pages new or changed
+  pageids.gz        the ids of the pages new or changed, for sqlfilter
+
+Link table rows are taken only for pages whose own rows changed; a link
+that changed because of an edit to a template elsewhere is not picked up.
+
+Options:
+
+--old         path to the content or stub file the database was loaded from
+--new         path to the newer content or stub file
+--outputdir   directory to write the sql files to
+--sqlfiles    path including file format string, to sql files of the link
+              tables from the same dump run as the newer file, e.g.
+              dump/enwiki-20130304-{t}.sql.gz; '{t}' is replaced by each
+              table name. If not given, link tables are left alone.
+--sqlfilter   path to sqlfilter program, default: ./sqlfilter
+--jobs        number of sqlfilter commands to run at once, default 4
+--textids     the database was loaded with mwxml2sql -i, so its text ids are
+              those in the dump; by default they are the revision ids, as
+              mwxml2sql writes them without -i
+--nocompress  write uncompressed sql files
+--verbose     display progress messages on stderr
+--help        show this help message
+"""
+    sys.stderr.write(usage_message)
+    sys.exit(1)
+
+
+def do_main():
+    old_path = None
+    new_path = None
+    output_dir = None
+    sql_files = None
+    sql_filter = os.path.join(os.getcwd(), "sqlfilter")
+    jobs = 4
+    compress = True
+    verbose = False
+    text_ids = False
+
+    try:
+        (options, remainder) = getopt.gnu_getopt(
+            sys.argv[1:], "", ["old=", "new=", "outputdir=", "sqlfiles=", "sqlfilter=",
+                               "jobs=", "textids", "nocompress", "verbose", "help"])
+    except getopt.GetoptError as e:
+        usage(e.msg)
+
+    for (opt, val) in options:
+        if opt == "--old":
+            old_path = val
+        elif opt == "--new":
+            new_path = val
+        elif opt == "--outputdir":
+            output_dir = val
+        elif opt == "--sqlfiles":
+            sql_files = val
+        elif opt == "--sqlfilter":
+            sql_filter = val
+        elif opt == "--jobs":
+            if not val.isdigit() or not int(val):
+                usage("jobs requires a positive number")
+            jobs = int(val)
+        elif opt == "--textids":
+            text_ids = True
+        elif opt == "--nocompress":
+            compress = False
+        elif opt == "--verbose":
+            verbose = True
+        elif opt == "--help":
+            usage()
+        else:
+            usage("Unknown option specified: %s" % opt)
+
+    if len(remainder) > 0:
+        usage("Unknown option specified: <%s>" % remainder[0])
+    if not old_path or not new_path or not output_dir:
+        usage("Missing mandatory option: old, new and outputdir must be given")
+    if sql_files and "{t}" not in sql_files:
+        usage("sqlfiles must contain '{t}', to be replaced by the table name")
+
+    dump_diff = DumpDiff(output_dir, compress, sql_files is not None, verbose, text_ids)
+    try:
+        dump_diff.diff(old_path, new_path)
+    except (DumpDiffErr, PageRowsErr) as e:
+        sys.stderr.write("%s\n" % e)
+        sys.exit(1)
+    finally:
+        dump_diff.close()
+
+    if sql_files:
+        if verbose:
+            sys.stderr.write("Filtering link tables against changed page ids\n")
+        tables = sorted(DumpDiff.link_tables.keys())
+        files = [(sql_files.format(t=table), os.path.basename(sql_files.format(t=table)))
+                 for table in tables]
+        try:
+            Filter(sql_filter, output_dir, verbose).filter_all(
+                files, dump_diff.get_path("pageids"), jobs)
+        except WikiContentErr as e:
+            sys.stderr.write("%s" % e)
+            sys.exit(1)
+
+    dump_diff.write_report(sys.stdout)
+
+
+if __name__ == "__main__":
+    do_main()
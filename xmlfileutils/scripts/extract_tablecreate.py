@@ -1,10 +1,16 @@
 """
 grab CREATE TABLE statement from e.g. a mysql dump
-and write it to a separate file
+and write it to a separate file, optionally with a
+schema catalog of the table and scripts to create it
+with only its primary key and to add the other indexes
+once the data is loaded
 """
+import os
+import re
 import getopt
 import sys
 import gzip
+import json
 
 
 def usage(message=None):
@@ -15,7 +21,7 @@ def usage(message=None):
     if message is not None:
         sys.stderr.write(message + "\n")
     usage_message = """extract_tablecreate.py --sqlfile path
-               [--help]
+               [--catalog path] [--split] [--help]
 
 Tis script will read the sql contained in the specified sql file until
 it finds a CREATE TABLE statement.  It will write that statement to
@@ -30,20 +36,33 @@ Options:
 --sqlfile (-s):  path to possibly gzipped sql file with the
                  CREATE TABLE statement and perhaps a bunch of
                  INSERTS and such afterwards
+--catalog (-c):  path to a json schema catalog; the table's columns,
+                 primary key, secondary keys and table options are
+                 added to it, replacing any earlier entry for the table,
+                 and the file is created if it does not exist
+--split   (-S):  also write a CREATE TABLE statement with the primary
+                 key as the only index, to a file with 'create-pk'
+                 tacked on at the end instead of 'create', and an
+                 ALTER TABLE statement adding all the other indexes,
+                 to a file with 'indexes' tacked on at the end.
+                 Loading data into the table created with only its
+                 primary key and then adding the indexes builds each
+                 index once, in sorted order, instead of updating every
+                 index for every row loaded
 --help    (-h):  show this help message
 """
     sys.stderr.write(usage_message)
     sys.exit(1)
 
 
-def get_output_file(sqlfile):
+def get_output_file(sqlfile, suffix="create"):
     """
     generate suitable output filename
     """
     newfile = sqlfile
     if newfile.endswith(".gz"):
         newfile = newfile[:-3]
-    return newfile + ".create"
+    return newfile + "." + suffix
 
 
 def get_fhandle(path, mode="r"):
@@ -57,44 +76,171 @@ def get_fhandle(path, mode="r"):
         return open(path, mode)
 
 
-def write_create_table(sqlfile):
+def get_create_table(sqlfile):
     """
     read the first part of the sql file,
-    fine the create table statement,
-    write it out to a file of a similar name but with
-    no compression file extension (as the file will
-    be written out uncompressed), and the string
-    'create' tacked on at the end.
+    find the create table statement and
+    return its lines, or None if there is none
     """
-    out_fhandle = get_fhandle(get_output_file(sqlfile), "w+")
     in_fhandle = get_fhandle(sqlfile, "r")
-    writing = False
+    lines = None
     for line in in_fhandle:
         if line.startswith("CREATE"):
-            writing = True
-            out_fhandle.write(line)
-        elif line.startswith(")") and writing:
-            writing = False
-            out_fhandle.write(line)
-            out_fhandle.close()
-            return
-        elif writing:
-            out_fhandle.write(line)
+            lines = [line]
+        elif line.startswith(")") and lines is not None:
+            lines.append(line)
+            break
+        elif lines is not None:
+            lines.append(line)
+    in_fhandle.close()
+    return lines
+
+
+def write_create_table(sqlfile, lines):
+    """
+    write the create table statement out to a file of
+    a similar name but with no compression file extension
+    (as the file will be written out uncompressed), and
+    the string 'create' tacked on at the end.
+    """
+    out_fhandle = get_fhandle(get_output_file(sqlfile), "w+")
+    out_fhandle.write("".join(lines))
+    out_fhandle.close()
+
+
+def get_column_names(columns):
+    """
+    given the column list of a key definition, e.g.
+    `tl_namespace`,`tl_title`(10), return the column names
+    without quotes or prefix lengths
+    """
+    return [re.sub(r"\(\d+\)$", "", name.strip()).strip("`")
+            for name in columns.split(",")]
+
+
+def parse_create_table(lines):
+    """
+    parse the lines of a create table statement as written
+    by mysqldump, one column or key per line, into a dict:
+    table:         the table name
+    columns:       list of {name, definition}
+    primary_key:   list of column names, empty if there is no primary key
+    keys:          list of secondary keys and constraints, each
+                   {name, type, columns, definition}, type being
+                   e.g. 'KEY', 'UNIQUE KEY', 'FULLTEXT KEY'
+    table_options: the closing line, e.g. ') ENGINE=InnoDB ...'
+    """
+    result = re.match(r"^CREATE TABLE\s+(?:IF NOT EXISTS\s+)?`?([^`\s(]+)`?", lines[0])
+    if not result:
+        return None
+    catalog = {'table': result.group(1), 'columns': [], 'primary_key': [], 'keys': [],
+               'table_options': lines[-1].strip().rstrip(";")}
+    key_pattern = re.compile(r"^((?:UNIQUE |FULLTEXT |SPATIAL )?(?:KEY|INDEX))\s+`([^`]+)`\s*"
+                             r"\((.*)\)")
+    for line in lines[1:-1]:
+        definition = line.strip().rstrip(",")
+        if not definition:
+            continue
+        if definition.startswith("`"):
+            name = definition[1:definition.index("`", 1)]
+            catalog['columns'].append({'name': name, 'definition': definition})
+        elif definition.startswith("PRIMARY KEY"):
+            columns = definition[definition.index("(") + 1:definition.rindex(")")]
+            catalog['primary_key'] = get_column_names(columns)
+            catalog['primary_key_definition'] = definition
+        else:
+            result = key_pattern.match(definition)
+            if result:
+                catalog['keys'].append({'name': result.group(2), 'type': result.group(1),
+                                        'columns': get_column_names(result.group(3)),
+                                        'definition': definition})
+            else:
+                # CONSTRAINT and anything else we don't know
+                catalog['keys'].append({'name': None, 'type': definition.split()[0],
+                                        'columns': [], 'definition': definition})
+    return catalog
+
+
+def get_create_table_pk_only(catalog):
+    """
+    return a create table statement for the table in the
+    catalog entry with its primary key as the only index
+    """
+    definitions = [column['definition'] for column in catalog['columns']]
+    if catalog['primary_key']:
+        definitions.append(catalog['primary_key_definition'])
+    return ("CREATE TABLE `%s` (\n  " % catalog['table'] + ",\n  ".join(definitions) +
+            "\n" + catalog['table_options'] + ";\n")
+
+
+def get_add_indexes(catalog):
+    """
+    return an alter table statement adding all the secondary
+    keys of the table in the catalog entry, or None if it has none;
+    they are added in one statement so that the table is only
+    read through once
+    """
+    if not catalog['keys']:
+        return None
+    return ("ALTER TABLE `%s`\n  " % catalog['table'] +
+            ",\n  ".join(["ADD " + key['definition'] for key in catalog['keys']]) + ";\n")
+
+
+def write_split_create_table(sqlfile, catalog):
+    """
+    write the create table statement with only the primary key
+    to the file with 'create-pk' tacked on at the end, and the
+    statement adding the remaining indexes to the file with
+    'indexes' tacked on at the end; if there are no secondary
+    indexes the latter file is empty
+    """
+    out_fhandle = get_fhandle(get_output_file(sqlfile, "create-pk"), "w+")
+    out_fhandle.write(get_create_table_pk_only(catalog))
+    out_fhandle.close()
+    out_fhandle = get_fhandle(get_output_file(sqlfile, "indexes"), "w+")
+    add_indexes = get_add_indexes(catalog)
+    if add_indexes:
+        out_fhandle.write(add_indexes)
+    out_fhandle.close()
+
+
+def update_catalog(catalog_path, catalog):
+    """
+    add the catalog entry for a table to the json catalog file,
+    replacing any previous entry for the table
+    """
+    tables = {}
+    if os.path.exists(catalog_path):
+        in_fhandle = open(catalog_path, "r")
+        tables = json.load(in_fhandle)
+        in_fhandle.close()
+    tables[catalog['table']] = catalog
+    out_fhandle = open(catalog_path + ".tmp", "w+")
+    json.dump(tables, out_fhandle, indent=2, sort_keys=True)
+    out_fhandle.write("\n")
+    out_fhandle.close()
+    os.rename(catalog_path + ".tmp", catalog_path)
 
 
 def do_main():
     'main entry point, does all the work'
     sqlfile = None
+    catalog_path = None
+    split = False
 
     try:
         (options, remainder) = getopt.gnu_getopt(
-            sys.argv[1:], "s:h", ["sqlfile=", "help"])
+            sys.argv[1:], "s:c:Sh", ["sqlfile=", "catalog=", "split", "help"])
     except getopt.GetoptError as err:
         usage("Unknown option specified: " + str(err))
 
     for (opt, val) in options:
         if opt in ["-s", "--sqlfile"]:
             sqlfile = val
+        elif opt in ["-c", "--catalog"]:
+            catalog_path = val
+        elif opt in ["-S", "--split"]:
+            split = True
         elif opt in ["-h", "--help"]:
             usage("Help for this script")
         else:
@@ -106,7 +252,21 @@ def do_main():
         print "Mandatory 'sqlfile' argument not specified"
         sys.exit(1)
 
-    write_create_table(sqlfile)
+    lines = get_create_table(sqlfile)
+    write_create_table(sqlfile, lines or [])
+    if catalog_path is None and not split:
+        return
+    if lines is None:
+        sys.stderr.write("No CREATE TABLE statement found in %s\n" % sqlfile)
+        sys.exit(1)
+    catalog = parse_create_table(lines)
+    if catalog is None:
+        sys.stderr.write("Failed to parse CREATE TABLE statement in %s\n" % sqlfile)
+        sys.exit(1)
+    if catalog_path is not None:
+        update_catalog(catalog_path, catalog)
+    if split:
+        write_split_create_table(sqlfile, catalog)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+import os
+import heapq
+import marshal
+import tempfile
+
+
+class ExternalSort(object):
+    """Sort a stream of records which may be too large to fit in memory.
+    Records are accumulated in memory until there are max_in_memory of
+    them, or until their sizes as given to add() reach max_bytes; that
+    run is then sorted and written to a temporary file. When all records
+    have been added, the runs are merged.
+    Records must be tuples (or other marshallable values) whose natural
+    ordering is the order wanted, so put the sort key first."""
+
+    def __init__(self, max_in_memory=1000000, tmpdir=None, max_bytes=None):
+        """Constructor. Arguments:
+        max_in_memory -- number of records to sort in memory before writing
+                         a sorted run out to disk
+        tmpdir        -- directory for the temporary run files
+        max_bytes     -- total size of records to sort in memory before writing
+                         a sorted run out to disk, for records of very
+                         different sizes; None for no limit"""
+
+        self.max_in_memory = max_in_memory
+        self.tmpdir = tmpdir
+        self.max_bytes = max_bytes
+        self.records = []
+        self.run_paths = []
+        self.count = 0
+        self.bytes_in_memory = 0
+
+    def add(self, record, size=0):
+        """Add one record to be sorted
+        Arguments:
+        record  -- the record
+        size    -- its size in bytes, if there is a limit on bytes in memory"""
+
+        self.records.append(record)
+        self.count = self.count + 1
+        self.bytes_in_memory = self.bytes_in_memory + size
+        if (len(self.records) >= self.max_in_memory or
+                (self.max_bytes and self.bytes_in_memory >= self.max_bytes)):
+            self.write_run()
+
+    def write_run(self):
+        """Sort the records in memory and write them to a new run file"""
+
+        self.records.sort()
+        (fd, path) = tempfile.mkstemp(prefix="sortrun-", dir=self.tmpdir)
+        out_fd = os.fdopen(fd, "wb")
+        for record in self.records:
+            marshal.dump(record, out_fd)
+        out_fd.close()
+        self.run_paths.append(path)
+        self.records = []
+        self.bytes_in_memory = 0
+
+    def read_run(self, path):
+        """Generator returning the records from a run file in order"""
+
+        in_fd = open(path, "rb")
+        while True:
+            try:
+                yield marshal.load(in_fd)
+            except EOFError:
+                break
+        in_fd.close()
+
+    def sorted(self):
+        """Generator returning all records added, in sorted order.
+        If nothing was written to disk this is just an in-memory sort."""
+
+        if not self.run_paths:
+            self.records.sort()
+            for record in self.records:
+                yield record
+            return
+        if self.records:
+            self.write_run()
+        for record in heapq.merge(*[self.read_run(path) for path in self.run_paths]):
+            yield record
+
+    def cleanup(self):
+        """Remove any temporary run files and release memory"""
+
+        for path in self.run_paths:
+            if os.path.exists(path):
+                os.unlink(path)
+        self.run_paths = []
+        self.records = []
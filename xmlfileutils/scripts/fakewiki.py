@@ -0,0 +1,1089 @@
+# -*- coding: utf-8 -*-
+import re
+import sys
+import time
+import json
+import calendar
+import random
+import bisect
+import getopt
+import hashlib
+import urlparse
+import threading
+import BaseHTTPServer
+import SocketServer
+from xml.sax.saxutils import escape
+from xml.etree import ElementTree as ElementTree
+from wikifile import File
+
+
+class FakeWikiErr(Exception):
+    pass
+
+
+def format_timestamp(secs, api=True):
+    """Return a timestamp as the api shows it (2013-02-01T14:01:59Z),
+    or as continuation parameters give it (20130201140159)"""
+
+    if api:
+        return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(secs))
+    return time.strftime("%Y%m%d%H%M%S", time.gmtime(secs))
+
+
+def parse_timestamp(text):
+    """Return seconds since the epoch for a timestamp in either form"""
+
+    digits = re.sub("[^0-9]", "", text)
+    if len(digits) != 14:
+        raise FakeWikiErr("bad timestamp %s" % text)
+    return calendar.timegm(time.strptime(digits, "%Y%m%d%H%M%S"))
+
+
+class Page(object):
+    """One page with its latest revision. Synthetic pages have no text;
+    it is made up from the revision id when it is asked for, so that large
+    corpora fit in memory. A page may also have a made-up history, only
+    the number of earlier revisions being kept; see get_revision."""
+
+    __slots__ = ["id", "ns", "title", "rev_id", "timestamp", "user", "user_id", "comment",
+                 "categories", "templates", "size", "text", "history"]
+
+    # ids of made-up earlier revisions start here, above those of the latest ones
+    history_rev_base = 1000000000
+
+    def get_revision(self, index):
+        """Return (revision id, timestamp, user, user id, comment, text) of
+        revision number index of the page, counting from 0 for the oldest;
+        number history is the latest. Earlier revisions are ten minutes apart,
+        two at a time sharing the same second, as happens on busy pages."""
+
+        if index == self.history:
+            return (self.rev_id, self.timestamp, self.user, self.user_id, self.comment,
+                    self.get_text())
+        rev_id = Page.history_rev_base + self.id * 100000 + index
+        return (rev_id, self.get_revision_timestamp(index), self.user, self.user_id,
+                "old revision %d" % index, self.get_text(rev_id))
+
+    def get_revision_timestamp(self, index):
+        return self.timestamp - (self.history - index + 1) // 2 * 600
+
+    def get_text(self, rev_id=None):
+        if rev_id is None:
+            if self.text is not None:
+                return self.text
+            rev_id = self.rev_id
+        rand = random.Random(rev_id)
+        words = []
+        length = 0
+        while length < self.size:
+            word = rand.choice(Corpus.words)
+            if rand.random() < 0.05:
+                word = "[[%s]]" % word.capitalize()
+            words.append(word)
+            length = length + len(word) + 1
+        lines = []
+        for i in range(0, len(words), 12):
+            lines.append(" ".join(words[i:i + 12]))
+        text = "\n".join(["{{%s}}" % t.split(":", 1)[1] for t in self.templates] + lines +
+                         ["[[%s]]" % c for c in self.categories])
+        return text
+
+
+class Corpus(object):
+    """Pages, users and log events served by FakeWiki, either made up
+    (see generate) or read from an XML content file (see load)"""
+
+    namespaces = {0: "", 1: "Talk", 2: "User", 3: "User talk", 4: "Project", 5: "Project talk",
+                  6: "File", 7: "File talk", 8: "MediaWiki", 9: "MediaWiki talk",
+                  10: "Template", 11: "Template talk", 12: "Help", 13: "Help talk",
+                  14: "Category", 15: "Category talk", 828: "Module", 829: "Module talk"}
+    words = ["the", "of", "and", "in", "to", "was", "is", "for", "on", "as", "with", "by",
+             "he", "at", "from", "his", "an", "were", "are", "which", "this", "also", "be",
+             "river", "village", "album", "species", "moth", "station", "church", "season",
+             "district", "population", "family", "school", "football", "century", "war"]
+    # in every synthetic corpus, for benchmarks to ask for
+    bench_category = "Category:Bench pages"
+    bench_tree_category = "Category:Bench tree"
+    bench_template = "Template:WikiProject Bench"
+    log_actions = ["upload/upload", "move/move", "delete/delete", "newusers/create",
+                   "protect/protect", "block/block"]
+
+    def __init__(self):
+        self.pages = []
+        self.users = []  # (id, name, editcount, registration)
+        self.log_events = []  # (id, type, action, timestamp, user, user id, ns, title, page id, comment)
+        self.by_title = {}
+        self.by_id = {}
+        self.lists = {}
+        self.next_rev_id = 1
+
+    @staticmethod
+    def get_prefix(ns):
+        if ns:
+            return Corpus.namespaces.get(ns, "Namespace%d" % ns) + ":"
+        return ""
+
+    @staticmethod
+    def generate(page_count=10000, user_count=500, log_count=10000, text_size=2000, seed=1):
+        """Make up a corpus; the same arguments always give the same corpus.
+        Arguments:
+        page_count  -- number of pages
+        user_count  -- number of users, the first few of whom make most edits
+        log_count   -- number of log events
+        text_size   -- median bytes of page text; sizes are lognormally distributed
+        seed        -- seed for the random choices"""
+
+        rand = random.Random(seed)
+        corpus = Corpus()
+        now = int(time.time())
+        start = now - 30 * 86400
+        for user_id in range(1, user_count + 1):
+            corpus.users.append([user_id, "User %d" % user_id, 0, start - rand.randint(0, 86400 * 3650)])
+
+        ns_weights = [(0, 60), (1, 15), (10, 8), (14, 4), (8, 3), (828, 2), (2, 3), (6, 5)]
+        ns_choices = []
+        for (ns, weight) in ns_weights:
+            ns_choices.extend([ns] * weight)
+        templates = ["Template:Infobox %d" % i for i in range(20)]
+        for page_id in range(1, page_count + 1):
+            page = Page()
+            page.id = page_id
+            page.history = 0
+            page.ns = rand.choice(ns_choices)
+            if page_id % 50 == 0:
+                # titles the escaping and unescaping code has to get right
+                name = "Q&A \"%d\" l'été <%d>" % (page_id, page_id)
+            else:
+                name = "%s %d" % (rand.choice(Corpus.words).capitalize(), page_id)
+            page.title = Corpus.get_prefix(page.ns) + name
+            page.rev_id = page_id * 7
+            page.timestamp = start + rand.randint(0, now - start)
+            user = corpus.users[int(user_count * rand.random() ** 3)]
+            user[2] = user[2] + 1
+            page.user = user[1]
+            page.user_id = user[0]
+            page.comment = rand.choice(["", "copyedit", "/* History */ expanded", "rv vandalism",
+                                        "added references & links"])
+            page.categories = []
+            page.templates = []
+            if page.ns == 0:
+                page.categories = [Corpus.bench_category] + [
+                    "Category:Topic %d" % rand.randint(0, 99) for i in range(rand.randint(0, 2))]
+                page.templates = [rand.choice(templates)] if rand.random() < 0.3 else []
+            elif page.ns == 1 and rand.random() < 0.6:
+                page.templates = [Corpus.bench_template]
+            page.size = min(int(rand.lognormvariate(0, 1) * text_size), 500 * text_size)
+            page.text = None
+            corpus.pages.append(page)
+
+        # category pages go in a tree of categories under bench_tree_category,
+        # with a few loops; the choices are made apart so the rest is as before
+        tree_rand = random.Random(seed + 1)
+        category_pages = [p for p in corpus.pages if p.ns == 14]
+        for (i, page) in enumerate(category_pages):
+            if i and tree_rand.random() < 0.9:
+                page.categories = [tree_rand.choice(category_pages[:i]).title]
+            else:
+                page.categories = [Corpus.bench_tree_category]
+            if tree_rand.random() < 0.05:
+                page.categories.append(tree_rand.choice(category_pages).title)
+        for page in corpus.pages:
+            if page.ns == 0 and category_pages and tree_rand.random() < 0.5:
+                page.categories.append(tree_rand.choice(category_pages).title)
+
+        for log_id in range(1, log_count + 1):
+            (log_type, action) = rand.choice(Corpus.log_actions).split("/")
+            page = rand.choice(corpus.pages)
+            user = corpus.users[int(user_count * rand.random() ** 3)]
+            corpus.log_events.append((log_id, log_type, action, start + rand.randint(0, now - start),
+                                      user[1], user[0], page.ns, page.title, page.id, ""))
+        corpus.index()
+        return corpus
+
+    @staticmethod
+    def get_tag(elt):
+        return elt.tag.rsplit("}", 1)[-1]
+
+    @staticmethod
+    def load(path):
+        """Read a corpus from an XML content file such as a pages-articles
+        dump or the output of wikiretriever.py content retrieval; users
+        come from the revision contributors and there are no log events"""
+
+        corpus = Corpus()
+        users = {}
+        category_pattern = re.compile(r"\[\[\s*[Cc]ategory\s*:\s*([^\]|]+)")
+        template_pattern = re.compile(r"\{\{\s*([^{}|#:]+)\s*[|}]")
+        in_fd = File.open_input(path)
+        for (event, elt) in ElementTree.iterparse(in_fd):
+            if Corpus.get_tag(elt) != "page":
+                continue
+            fields = {}
+            for child in elt.iter():
+                tag = Corpus.get_tag(child)
+                if tag not in fields:
+                    fields[tag] = child.text or ""
+            page = Page()
+            page.id = int(fields["id"])
+            page.history = 0
+            page.ns = int(fields.get("ns", "0"))
+            page.title = fields["title"].encode("utf8")
+            page.text = fields.get("text", "").encode("utf8")
+            page.size = len(page.text)
+            page.timestamp = parse_timestamp(fields.get("timestamp", "20010101000000"))
+            page.user = fields.get("username", fields.get("ip", "127.0.0.1")).encode("utf8")
+            page.user_id = 0
+            page.comment = fields.get("comment", "").encode("utf8")
+            page.categories = ["Category:" + c.strip().replace("_", " ")
+                               for c in category_pattern.findall(page.text)]
+            page.templates = ["Template:" + t.strip().replace("_", " ")
+                              for t in template_pattern.findall(page.text)]
+            # the revision id is the first id inside the revision element
+            revision = [c for c in elt if Corpus.get_tag(c) == "revision"]
+            page.rev_id = page.id
+            if revision:
+                for child in revision[0]:
+                    if Corpus.get_tag(child) == "id":
+                        page.rev_id = int(child.text)
+                    elif Corpus.get_tag(child) == "contributor":
+                        for part in child:
+                            if Corpus.get_tag(part) == "id":
+                                page.user_id = int(part.text)
+            if page.user_id:
+                if page.user not in users:
+                    users[page.user] = [page.user_id, page.user, 0, page.timestamp]
+                users[page.user][2] = users[page.user][2] + 1
+            corpus.pages.append(page)
+            elt.clear()
+        in_fd.close()
+        corpus.users = sorted(users.values())
+        corpus.index()
+        return corpus
+
+    def index(self):
+        """Build the lists the api serves, each in the order the api returns it"""
+
+        self.pages.sort(key=lambda p: p.id)
+        self.by_title = dict([(page.title, page) for page in self.pages])
+        self.by_id = dict([(page.id, page) for page in self.pages])
+        # titles and ids in ascending order, dated lists newest first
+        by_title = lambda p: (p.title, p.id)
+        newest = lambda p: (-p.timestamp, -p.rev_id)
+        self.next_rev_id = max([self.next_rev_id] + [page.rev_id + 1 for page in self.pages])
+        lists = {}
+        for page in self.pages:
+            lists.setdefault(("allpages", str(page.ns)), []).append(page)
+            for category in page.categories:
+                lists.setdefault(("categorymembers", category), []).append(page)
+            for template in page.templates:
+                lists.setdefault(("embeddedin", template), []).append(page)
+            lists.setdefault(("usercontribs", page.user), []).append(page)
+        # built aside and put in place at once, as pages may be edited while serving
+        listings = {}
+        for ((name, param), items) in lists.items():
+            if name == "embeddedin":
+                listings[(name, param)] = Listing(items, lambda p: (p.id,))
+            elif name == "usercontribs":
+                listings[(name, param)] = Listing(items, newest)
+            else:
+                listings[(name, param)] = Listing(items, by_title)
+        listings[("recentchanges", None)] = Listing(self.pages, newest)
+        for ns in set([page.ns for page in self.pages]):
+            listings[("recentchanges", str(ns))] = Listing(
+                [page for page in self.pages if page.ns == ns], newest)
+        listings[("allusers", None)] = Listing(self.users, lambda u: (u[1], u[0]))
+        events = {}
+        for event in self.log_events:
+            events.setdefault("%s/%s" % (event[1], event[2]), []).append(event)
+            events.setdefault(event[1], []).append(event)
+        for (action, items) in events.items():
+            listings[("logevents", action)] = Listing(items, lambda e: (-e[3], -e[0]))
+        self.lists = listings
+
+    def edit(self, page, now, comment="churn"):
+        """Give a page a new revision, without updating the lists; see index
+        Arguments:
+        page     -- Page to edit
+        now      -- timestamp of the edit
+        comment  -- edit summary"""
+
+        page.rev_id = self.next_rev_id
+        self.next_rev_id = self.next_rev_id + 1
+        page.timestamp = now
+        page.comment = comment
+        if page.text is not None:
+            page.text = page.text + "\nEdited in revision %d." % page.rev_id
+            page.size = len(page.text)
+
+    def churn(self, fraction, seed=1, now=None):
+        """Give a fraction of the pages a new revision, as edits since the
+        corpus was made would, so that retrievals of the same pages before
+        and after can be compared; the same arguments always edit the same
+        pages in the same way.
+        Arguments:
+        fraction  -- fraction of pages to edit
+        seed      -- seed for choosing the pages
+        now       -- timestamp of the edits, default the current time"""
+
+        rand = random.Random(seed)
+        now = now or int(time.time())
+        edited = 0
+        for page in self.pages:
+            if rand.random() >= fraction:
+                continue
+            self.edit(page, now)
+            edited = edited + 1
+        self.index()
+        return edited
+
+    def add_history(self, median, seed=1):
+        """Give each page a made-up history of earlier revisions, about median
+        of them, with one page in a hundred having a hundred times as many
+        Arguments:
+        median  -- median number of earlier revisions
+        seed    -- seed for choosing the numbers"""
+
+        rand = random.Random(seed)
+        for page in self.pages:
+            count = int(rand.lognormvariate(0, 1) * median)
+            if rand.random() < 0.01:
+                count = count * 100
+            page.history = min(count, 99999)
+
+    def get_list(self, name, param):
+        return self.lists.get((name, param), Listing([], lambda x: x))
+
+
+class Editor(threading.Thread):
+    """Edit pages of a Corpus at random while it is being served, as the
+    users of a live wiki would, so that recent changes keep coming in"""
+
+    daemon = True
+
+    def __init__(self, corpus, rate, seed=1):
+        """Constructor. Arguments:
+        corpus  -- Corpus to edit
+        rate    -- edits per second; each edit reindexes the corpus, so this
+                   should be kept to a few per second for large corpora
+        seed    -- seed for choosing the pages to edit"""
+
+        threading.Thread.__init__(self)
+        self.corpus = corpus
+        self.rate = rate
+        self.rand = random.Random(seed)
+        self.edits = 0
+
+    def run(self):
+        while True:
+            time.sleep(self.rand.expovariate(self.rate))
+            if not self.corpus.pages:
+                continue
+            self.corpus.edit(self.rand.choice(self.corpus.pages), int(time.time()), "live edit")
+            self.corpus.index()
+            self.edits = self.edits + 1
+
+
+class Listing(object):
+    """The items of one api list in the order the api returns them,
+    with the key of each, so that a continuation can start anywhere"""
+
+    def __init__(self, items, key):
+        self.items = sorted(items, key=key)
+        self.keys = [key(item) for item in self.items]
+
+    def get_batch(self, start_key, limit, stop=None):
+        """Return (items, key of the item after them or None), for at most
+        limit items starting at the first with a key not less than start_key.
+        stop is a function which returns True for the first item past the
+        end of a date range, if any"""
+
+        index = bisect.bisect_left(self.keys, start_key) if start_key is not None else 0
+        batch = self.items[index:index + limit]
+        if stop is not None:
+            for i in range(len(batch)):
+                if stop(batch[i]):
+                    return (batch[:i], None)
+        if index + limit < len(self.items):
+            following = self.items[index + limit]
+            if stop is None or not stop(following):
+                return (batch, self.keys[index + limit])
+        return (batch, None)
+
+
+class FakeWikiApi(object):
+    """Answer api.php and Special:Export requests from a Corpus the way
+    MediaWiki does, with continuations, limits, login and maxlag.
+    This has nothing to do with http; see FakeWikiHandler for that."""
+
+    # list module -> (parameter prefix, tag of each item)
+    modules = {"categorymembers": ("cm", "cm"), "embeddedin": ("ei", "ei"),
+               "allpages": ("ap", "p"), "allusers": ("au", "u"),
+               "recentchanges": ("rc", "rc"), "usercontribs": ("uc", "item"),
+               "logevents": ("le", "item")}
+
+    def __init__(self, corpus, lag_rate=0, unavailable_rate=0, seed=1, broken_rate=0):
+        """Constructor. Arguments:
+        corpus            -- Corpus to serve
+        lag_rate          -- fraction of requests answered with a maxlag error
+        unavailable_rate  -- fraction of requests answered with a plain 503
+        seed              -- seed for choosing which requests fail
+        broken_rate       -- fraction of pages whose export always breaks off
+                             partway, leaving the XML without its footer"""
+
+        self.corpus = corpus
+        self.lag_rate = lag_rate
+        self.unavailable_rate = unavailable_rate
+        self.rand = random.Random(seed)
+        self.broken = set([page.id for page in corpus.pages if self.rand.random() < broken_rate])
+        # the most revisions Special:Export gives for one page, as $wgExportMaxHistory
+        self.max_history = 1000
+        self.lock = threading.Lock()
+        self.sessions = {}  # session id -> user name, None until logged in
+        self.tokens = {}  # session id -> login token
+
+    def get_failure(self):
+        """Return 'lag', 'unavailable' or None for the next request"""
+
+        self.lock.acquire()
+        try:
+            value = self.rand.random()
+        finally:
+            self.lock.release()
+        if value < self.lag_rate:
+            return "lag"
+        if value < self.lag_rate + self.unavailable_rate:
+            return "unavailable"
+        return None
+
+    def get_rights(self, session):
+        """Return the user rights of the user logged in to the session; users
+        whose names end in 'bot' get those of bots, apihighlimits among them"""
+
+        username = self.sessions.get(session) if session else None
+        rights = ["read", "createaccount"] if username is None else ["read", "edit", "writeapi"]
+        if username is not None and username.lower().endswith("bot"):
+            rights.extend(["bot", "apihighlimits"])
+        return rights
+
+    def get_session(self, cookies):
+        for cookie in cookies.split(";"):
+            (name, sep, value) = cookie.strip().partition("=")
+            if name == "fakewiki_session" and value in self.sessions:
+                return value
+        return None
+
+    def attrs(self, pairs):
+        return " ".join(['%s="%s"' % (name, escape(str(value), {'"': "&quot;"}))
+                         for (name, value) in pairs])
+
+    def api_error(self, code, info):
+        return '<?xml version="1.0"?><api><error code="%s" info="%s" /></api>' % (
+            code, escape(info, {'"': "&quot;"}))
+
+    def handle(self, path, params, cookies):
+        """Answer a request. Returns (http status, headers, body).
+        Arguments:
+        path     -- the path part of the url
+        params   -- dict of parameter name -> value from the query string and post body
+        cookies  -- the Cookie header, or an empty string"""
+
+        failure = self.get_failure()
+        if failure == "unavailable":
+            return (503, [("Retry-After", "5")], "Service Temporarily Unavailable\n")
+        if path.endswith("/api.php"):
+            if failure == "lag":
+                return (200, [("Retry-After", "5"), ("X-Database-Lag", "7")],
+                        self.api_error("maxlag", "Waiting for db1001: 7 seconds lagged"))
+            action = params.get("action", "")
+            if action == "login":
+                return (200, [], self.login(params))
+            if action == "query":
+                return self.query(params, self.get_session(cookies))
+            return (200, [], self.api_error("unknown_action", "Unrecognized value for action"))
+        if path.endswith("/index.php") and params.get("title", "").replace("_", ":") in [
+                "Special:Export", "Special::Export"]:
+            if failure == "lag":
+                return (503, [("Retry-After", "5")],
+                        "Waiting for db1001: 7 seconds lagged\n")
+            return (200, [], self.export(params))
+        return (404, [], "no such page\n")
+
+    def login(self, params):
+        """Log in in the two steps of the old action=login: the first
+        request gets a token, the second sends it back"""
+
+        username = params.get("lgname", "")
+        if not username or not params.get("lgpassword"):
+            return '<?xml version="1.0"?><api><login result="NeedToken" /></api>'
+        if "lgtoken" not in params:
+            session = hashlib.md5("%s%f" % (username, time.time())).hexdigest()
+            token = hashlib.md5(session).hexdigest()
+            self.lock.acquire()
+            self.sessions[session] = None
+            self.tokens[session] = token
+            self.lock.release()
+            return ('<?xml version="1.0"?><api><login %s /></api>' % self.attrs(
+                [("result", "NeedToken"), ("token", token), ("cookieprefix", "fakewiki"),
+                 ("sessionid", session)]))
+        for (session, token) in self.tokens.items():
+            if token == params["lgtoken"]:
+                break
+        else:
+            return '<?xml version="1.0"?><api><login result="WrongToken" /></api>'
+        self.sessions[session] = username
+        users = [u for u in self.corpus.users if u[1] == username]
+        user_id = users[0][0] if users else 1
+        return ('<?xml version="1.0"?><api><login %s /></api>' % self.attrs(
+            [("result", "Success"), ("lguserid", user_id), ("lgusername", username),
+             ("lgtoken", token), ("cookieprefix", "fakewiki"), ("sessionid", session)]))
+
+    def query(self, params, session):
+        if params.get("meta") == "siteinfo":
+            return (200, [("Content-Type", "application/json")], self.siteinfo())
+        if params.get("meta") == "userinfo":
+            return (200, [], self.userinfo(params, session))
+        if params.get("prop") == "info":
+            return (200, [], self.info(params, session))
+        if "export" in params:
+            return (200, [], self.export_by_id(params, session))
+        name = params.get("list")
+        if name not in FakeWikiApi.modules:
+            return (200, [], self.api_error("unknown_list", "Unrecognized value for list"))
+        (prefix, tag) = FakeWikiApi.modules[name]
+        max_limit = 5000 if "apihighlimits" in self.get_rights(session) else 500
+        limit = params.get(prefix + "limit", "10")
+        limit = max_limit if limit == "max" else min(int(limit), max_limit)
+        props = [p for p in params.get(prefix + "prop", "").split("|") if p]
+        try:
+            (items, next_key, continue_param) = getattr(self, "list_" + name)(params, prefix, limit)
+        except (KeyError, ValueError, FakeWikiErr) as e:
+            return (200, [], self.api_error("badparams", str(e)))
+        output = ['<?xml version="1.0"?><api batchcomplete="">']
+        if next_key is not None:
+            output.append('<continue %s />' % self.attrs([("continue", "-||"),
+                                                          (continue_param, next_key)]))
+        output.append("<query><%s>" % name)
+        for item in items:
+            output.append("<%s %s />" % (tag, self.attrs(self.get_attrs(name, item, props))))
+        output.append("</%s></query></api>" % name)
+        return (200, [], "".join(output))
+
+    def info(self, params, session):
+        """Answer prop=info for titles or pageids the way MediaWiki does, with
+        the titles it had to normalize listed first and missing pages marked"""
+
+        max_values = 500 if "apihighlimits" in self.get_rights(session) else 50
+        if "pageids" in params:
+            values = params["pageids"].split("|")
+        else:
+            values = params.get("titles", "").split("|")
+        if len(values) > max_values:
+            return self.api_error("toomanyvalues", "Too many values supplied, the limit is %d"
+                                  % max_values)
+        normalized = []
+        pages = []
+        for value in values:
+            if "pageids" in params:
+                page = self.corpus.by_id.get(int(value)) if value.isdigit() else None
+                if page is None:
+                    pages.append([("pageid", value), ("missing", "")])
+                    continue
+            else:
+                title = value.replace("_", " ").strip()
+                title = title[:1].upper() + title[1:]
+                if title != value:
+                    normalized.append('<n %s />' % self.attrs([("from", value), ("to", title)]))
+                page = self.corpus.by_title.get(title)
+                if page is None:
+                    pages.append([("ns", 0), ("title", title), ("missing", "")])
+                    continue
+            pages.append([("pageid", page.id), ("ns", page.ns), ("title", page.title),
+                          ("contentmodel", "wikitext"), ("pagelanguage", "en"),
+                          ("touched", format_timestamp(page.timestamp)),
+                          ("lastrevid", page.rev_id), ("length", len(page.get_text()))])
+        output = ['<?xml version="1.0"?><api batchcomplete=""><query>']
+        if normalized:
+            output.append("<normalized>%s</normalized>" % "".join(normalized))
+        output.append("<pages>")
+        output.extend(["<page %s />" % self.attrs(attrs) for attrs in pages])
+        output.append("</pages></query></api>")
+        return "".join(output)
+
+    def get_attrs(self, name, item, props):
+        """Return the attributes of one item of a list, given the props asked for"""
+
+        if name == "allusers":
+            attrs = [("userid", item[0]), ("name", item[1])]
+            if "editcount" in props:
+                attrs.append(("editcount", item[2]))
+            if "registration" in props:
+                attrs.append(("registration", format_timestamp(item[3])))
+            return attrs
+        # lists that take a property list give ids only when asked or by default
+        ids = not props or "ids" in props
+        if name == "logevents":
+            attrs = [("logid", item[0]), ("ns", item[6]), ("title", item[7]),
+                     ("type", item[1]), ("action", item[2])]
+            if ids:
+                attrs.append(("logpage", item[8]))
+            if "user" in props:
+                attrs.append(("user", item[4]))
+            if "userid" in props:
+                attrs.append(("userid", item[5]))
+            if "timestamp" in props:
+                attrs.append(("timestamp", format_timestamp(item[3])))
+            if "comment" in props:
+                attrs.append(("comment", item[9]))
+            return attrs
+        attrs = [("ns", item.ns), ("title", item.title)]
+        if ids or name in ["embeddedin", "allpages"]:
+            attrs.insert(0, ("pageid", item.id))
+        if name == "usercontribs":
+            attrs = [("userid", item.user_id), ("user", item.user)] + attrs
+        if ids and name in ["recentchanges", "usercontribs"]:
+            attrs.append(("revid", item.rev_id))
+        for prop in props:
+            if prop == "timestamp":
+                attrs.append(("timestamp", format_timestamp(item.timestamp)))
+            elif prop == "user":
+                attrs.append(("user", item.user))
+            elif prop == "userid":
+                attrs.append(("userid", item.user_id))
+            elif prop == "comment":
+                attrs.append(("comment", item.comment))
+            elif prop in ["size", "sizes"]:
+                attrs.extend([("oldlen", item.size), ("newlen", item.size), ("size", item.size)])
+            elif prop == "sortkey":
+                attrs.append(("sortkey", item.title.upper()))
+        return attrs
+
+    def get_title_key(self, token):
+        (title, page_id) = token.rsplit("|", 1)
+        return (title, int(page_id))
+
+    def get_date_range(self, params, prefix, token):
+        """Return (key to start from, function returning True past the end of the
+        range) for a newest first list, from the start and end dates and any
+        continuation, which is 'timestamp|id'"""
+
+        start_key = None
+        if params.get(prefix + "start"):
+            start_key = (-parse_timestamp(params[prefix + "start"]), -sys.maxint)
+        if token:
+            (timestamp, item_id) = token.split("|")
+            start_key = max(start_key, (-parse_timestamp(timestamp), -int(item_id)))
+        stop = None
+        if params.get(prefix + "end"):
+            end = parse_timestamp(params[prefix + "end"])
+            if prefix == "le":
+                stop = lambda item: item[3] < end
+            else:
+                stop = lambda item: item.timestamp < end
+        return (start_key, stop)
+
+    def dated_token(self, key):
+        return None if key is None else "%s|%d" % (format_timestamp(-key[0], False), -key[1])
+
+    def list_categorymembers(self, params, prefix, limit):
+        token = params.get("cmcontinue")
+        # the real token is 'page|hex sortkey|id'
+        start_key = self.get_title_key(token.split("|", 1)[1]) if token else None
+        (items, key) = self.corpus.get_list("categorymembers", params["cmtitle"]).get_batch(
+            start_key, limit)
+        return (items, None if key is None else "page|%s|%d" % key, "cmcontinue")
+
+    def list_embeddedin(self, params, prefix, limit):
+        # the real token is 'namespace|id' of the next page
+        token = params.get("eicontinue")
+        start_key = (int(token.split("|")[-1]),) if token else None
+        (items, key) = self.corpus.get_list("embeddedin", params["eititle"]).get_batch(start_key, limit)
+        if key is None:
+            return (items, None, "eicontinue")
+        return (items, "%d|%d" % (self.corpus.by_id[key[0]].ns, key[0]), "eicontinue")
+
+    def list_allpages(self, params, prefix, limit):
+        # the real token is the title of the next page, without namespace prefix
+        ns = params.get("apnamespace", "0")
+        token = params.get("apcontinue")
+        start_key = (Corpus.get_prefix(int(ns)) + token.replace("_", " "),) if token else None
+        (items, key) = self.corpus.get_list("allpages", ns).get_batch(start_key, limit)
+        return (items, None if key is None else key[0][len(Corpus.get_prefix(int(ns))):], "apcontinue")
+
+    def list_allusers(self, params, prefix, limit):
+        token = params.get("aufrom") or params.get("aucontinue")
+        start_key = (token.replace("_", " "),) if token else None
+        (items, key) = self.corpus.get_list("allusers", None).get_batch(start_key, limit)
+        return (items, None if key is None else key[0], "aufrom")
+
+    def list_recentchanges(self, params, prefix, limit):
+        (start_key, stop) = self.get_date_range(params, prefix, params.get("rccontinue"))
+        (items, key) = self.corpus.get_list("recentchanges", params.get("rcnamespace")).get_batch(
+            start_key, limit, stop)
+        return (items, self.dated_token(key), "rccontinue")
+
+    def list_usercontribs(self, params, prefix, limit):
+        (start_key, stop) = self.get_date_range(params, prefix, params.get("uccontinue"))
+        listing = self.corpus.get_list("usercontribs", params["ucuser"].replace("_", " "))
+        (items, key) = listing.get_batch(start_key, limit, stop)
+        return (items, self.dated_token(key), "uccontinue")
+
+    def list_logevents(self, params, prefix, limit):
+        (start_key, stop) = self.get_date_range(params, prefix, params.get("lecontinue"))
+        action = params.get("leaction") or params.get("letype")
+        (items, key) = self.corpus.get_list("logevents", action).get_batch(start_key, limit, stop)
+        return (items, self.dated_token(key), "lecontinue")
+
+    def siteinfo(self):
+        namespaces = {}
+        for (key, name) in Corpus.namespaces.items():
+            namespaces[str(key)] = {"id": key, "case": "first-letter", "*": name}
+            if name:
+                namespaces[str(key)]["canonical"] = name
+        return json.dumps({"batchcomplete": "", "query": {"namespaces": namespaces,
+                                                          "namespacealiases": []}})
+
+    def userinfo(self, params, session):
+        """Answer meta=userinfo, with the user's rights if uiprop asks for them"""
+
+        username = self.sessions.get(session) if session else None
+        if username is None:
+            attrs = [("id", 0), ("name", "127.0.0.1"), ("anon", "")]
+        else:
+            users = [u for u in self.corpus.users if u[1] == username]
+            attrs = [("id", users[0][0] if users else 1), ("name", username)]
+        output = ['<?xml version="1.0"?><api batchcomplete=""><query>',
+                  "<userinfo %s>" % self.attrs(attrs)]
+        if "rights" in params.get("uiprop", "").split("|"):
+            output.append("<rights>%s</rights>" % "".join(
+                ["<r>%s</r>" % right for right in self.get_rights(session)]))
+        output.append("</userinfo></query></api>")
+        return "".join(output)
+
+    def get_siteinfo_xml(self):
+        lines = ["  <siteinfo>", "    <sitename>Fakewiki</sitename>",
+                 "    <dbname>fakewiki</dbname>",
+                 "    <base>http://fakewiki.localhost/wiki/Main_Page</base>",
+                 "    <generator>MediaWiki 1.29.0</generator>",
+                 "    <case>first-letter</case>", "    <namespaces>"]
+        for key in sorted(Corpus.namespaces):
+            name = Corpus.namespaces[key]
+            if name:
+                lines.append('      <namespace key="%d" case="first-letter">%s</namespace>'
+                             % (key, name))
+            else:
+                lines.append('      <namespace key="%d" case="first-letter" />' % key)
+        lines.extend(["    </namespaces>", "  </siteinfo>"])
+        return "\n".join(lines) + "\n"
+
+    def get_revision_xml(self, revision):
+        (rev_id, timestamp, user, user_id, comment, text) = revision
+        comment = ("      <comment>%s</comment>\n" % escape(comment)) if comment else ""
+        if user_id:
+            contributor = ("      <contributor>\n        <username>%s</username>\n"
+                           "        <id>%d</id>\n      </contributor>\n"
+                           % (escape(user), user_id))
+        else:
+            contributor = ("      <contributor>\n        <ip>%s</ip>\n      </contributor>\n"
+                           % escape(user))
+        return ("    <revision>\n      <id>%d</id>\n      <timestamp>%s</timestamp>\n%s%s"
+                "      <model>wikitext</model>\n      <format>text/x-wiki</format>\n"
+                '      <text xml:space="preserve" bytes="%d">%s</text>\n'
+                "      <sha1>%s</sha1>\n    </revision>\n" % (
+                    rev_id, format_timestamp(timestamp), contributor, comment, len(text),
+                    escape(text), hashlib.sha1(text).hexdigest()))
+
+    def get_page_xml(self, page, history=None):
+        """Return the export XML for a page with its latest revision, or with
+        history, those of its revisions that Special:Export would give
+        Arguments:
+        page     -- Page
+        history  -- (offset timestamp or None, most revisions) for revisions
+                    after the offset in order of time, or None for the latest only"""
+
+        if history is None:
+            indexes = [page.history]
+        else:
+            (offset, limit) = history
+            indexes = range(page.history + 1)
+            if offset is not None:
+                indexes = [index for index in indexes
+                           if page.get_revision_timestamp(index) > offset]
+            indexes = indexes[:limit]
+        return ("  <page>\n    <title>%s</title>\n    <ns>%d</ns>\n    <id>%d</id>\n"
+                % (escape(page.title), page.ns, page.id) +
+                "".join([self.get_revision_xml(page.get_revision(index)) for index in indexes]) +
+                "  </page>\n")
+
+    def export(self, params):
+        """Return the XML for the pages listed in the pages parameter, one
+        title per line; titles that don't exist are skipped, as by Special:Export.
+        Unless curonly is given, each page comes with up to limit revisions
+        (no more than max_history) after the offset timestamp, if any, oldest
+        first; as in MediaWiki, the limit and offset apply to each page."""
+
+        titles = [title.strip().replace("_", " ") for title in params.get("pages", "").split("\n")]
+        history = None
+        if "curonly" not in params:
+            limit = int(params.get("limit") or self.max_history)
+            offset = parse_timestamp(params["offset"]) if params.get("offset") else None
+            history = (offset, max(1, min(limit, self.max_history)))
+        return self.get_export_xml([self.corpus.by_title.get(title) for title in titles], history)
+
+    def export_by_id(self, params, session):
+        """Answer action=query&export&exportnowrap for the pages in the pageids
+        parameter; ids that don't exist are skipped, as by MediaWiki"""
+
+        if "exportnowrap" not in params:
+            return self.api_error("badparams", "fakewiki only does export with exportnowrap")
+        if "pageids" not in params:
+            return self.api_error("badparams", "fakewiki only does export by pageids")
+        values = params["pageids"].split("|")
+        max_values = 500 if "apihighlimits" in self.get_rights(session) else 50
+        if len(values) > max_values:
+            return self.api_error("toomanyvalues", "Too many values supplied, the limit is %d"
+                                  % max_values)
+        return self.get_export_xml([self.corpus.by_id.get(int(value)) if value.isdigit() else None
+                                    for value in values])
+
+    def get_export_xml(self, pages, history=None):
+        """Return the export XML for a list of pages, skipping those that are
+        None or repeated. If a broken page is among them, the XML stops short
+        just before it.
+        Arguments:
+        pages    -- list of Page or None
+        history  -- which revisions to give, see get_page_xml"""
+
+        output = ['<mediawiki xmlns="http://www.mediawiki.org/xml/export-0.10/" '
+                  'version="0.10" xml:lang="en">\n', self.get_siteinfo_xml()]
+        seen = set()
+        for page in pages:
+            if page is None or page.id in seen:
+                continue
+            if page.id in self.broken:
+                return "".join(output)
+            seen.add(page.id)
+            output.append(self.get_page_xml(page, history))
+        output.append("</mediawiki>\n")
+        return "".join(output)
+
+
+class FakeWikiHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serve FakeWikiApi over http, with keepalive, adding the latency
+    and bandwidth limit set for the server"""
+
+    protocol_version = "HTTP/1.1"
+    # buffer the status line and headers, flushing once per response; written
+    # unbuffered, each goes out in its own packet and on a kept alive connection
+    # the client's delayed acks hold up every request by tens of milliseconds
+    wbufsize = -1
+
+    def do_GET(self):
+        self.respond("")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", "0"))
+        self.respond(self.rfile.read(length) if length else "")
+
+    def respond(self, body):
+        (path, sep, query) = self.path.partition("?")
+        params = dict([(k, v[-1]) for (k, v) in urlparse.parse_qs(query, True).items()])
+        params.update(dict([(k, v[-1]) for (k, v) in urlparse.parse_qs(body, True).items()]))
+        cookies = self.headers.get("Cookie", "")
+        (status, headers, contents) = self.server.api.handle(path, params, cookies)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.send_response(status)
+        content_type = "text/xml; charset=utf-8"
+        for (name, value) in headers:
+            if name == "Content-Type":
+                content_type = value
+            else:
+                self.send_header(name, value)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(contents)))
+        self.end_headers()
+        if not self.server.bandwidth:
+            self.wfile.write(contents)
+            return
+        chunk = 65536
+        for offset in range(0, len(contents), chunk):
+            piece = contents[offset:offset + chunk]
+            self.wfile.write(piece)
+            self.wfile.flush()
+            time.sleep(float(len(piece)) / self.server.bandwidth)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class FakeWiki(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """A stand-in for a MediaWiki wiki, serving api.php list queries and
+    Special:Export from a Corpus, for testing and benchmarking retrieval"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, api, host="127.0.0.1", port=0, latency=0, bandwidth=0, verbose=False):
+        """Constructor. Arguments:
+        api        -- FakeWikiApi to answer requests
+        host       -- address to listen on
+        port       -- port to listen on, or 0 for any free one (see get_port)
+        latency    -- seconds to wait before answering each request
+        bandwidth  -- bytes per second to send responses at per connection, or 0 for no limit
+        verbose    -- log each request on stderr"""
+
+        BaseHTTPServer.HTTPServer.__init__(self, (host, port), FakeWikiHandler)
+        self.api = api
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.verbose = verbose
+
+    def get_port(self):
+        return self.server_address[1]
+
+
+def usage(message=None):
+    """Show usage and help information. Arguments:
+    message   -- message to be shown (e.g. error message) before the help"""
+
+    if message:
+        sys.stderr.write(message)
+        sys.stderr.write("\n")
+    usage_message = """Usage: python fakewiki.py [--port number] [--host address]
+         [--pages number] [--users number] [--logevents number]
+         [--textsize bytes] [--seed number] [--history number] [--corpus path]
+         [--latency milliseconds] [--bandwidth kilobytes] [--lagrate fraction]
+         [--unavailablerate fraction] [--brokenrate fraction] [--churn fraction]
+         [--editrate number] [--verbose]
+
+Serve a stand-in for a MediaWiki wiki over http, for testing and benchmarking
+wikiretriever.py and the scripts built on it without going near a real wiki.
+The api.php list queries categorymembers, embeddedin, allpages, allusers,
+recentchanges, usercontribs and logevents are answered with continuations
+as MediaWiki gives them, as are prop=info, meta=userinfo, action=login,
+Special:Export and export by page id via the api. Any user name and
+password will log in; users whose names end in 'bot' get the higher api
+limits of bots.
+The port is written to stdout once the server is listening.
+
+Options:
+
+--port             port to listen on, default: any free port
+--host             address to listen on, default: 127.0.0.1
+--pages            number of pages to make up, default: 10000
+--users            number of users to make up, default: 500
+--logevents        number of log events to make up, default: 10000
+--textsize         median bytes of made up page text, default: 2000
+--seed             seed for making up the corpus, default: 1
+                   every made up corpus has the category '%s',
+                   the category tree '%s' over all the category pages,
+                   the template '%s' on many talk pages
+                   and users named 'User 1' and so on, User 1 the most active
+--history          median number of earlier revisions to make up for each page, which
+                   Special:Export gives unless asked for the latest only, with offset
+                   and limit as in MediaWiki; one page in a hundred has a hundred
+                   times as many, default: 0
+--corpus           XML content file (e.g. pages-articles, or content retrieved
+                   by wikiretriever.py) to serve instead of a made up corpus
+--latency          milliseconds to wait before answering each request, default: 0
+--bandwidth        kilobytes per second to send each response at, default: no limit
+--lagrate          fraction of requests to answer with a maxlag error, default: 0
+--unavailablerate  fraction of requests to answer with a plain 503, default: 0
+--brokenrate       fraction of pages whose export always breaks off before the page,
+                   leaving the XML without its </mediawiki> footer, default: 0
+--churn            fraction of pages to give a new revision at startup, as if edited
+                   since the corpus was made; with the same seed, the pages left
+                   alone are the same as in a run without churn, default: 0
+--editrate         edits per second to make to random pages while serving, so that
+                   recent changes keep coming in as on a live wiki, default: 0
+--verbose          log each request to stderr
+
+Example:
+   python fakewiki.py --pages 100000 --latency 50 --lagrate 0.01 &
+   python wikiretriever.py --http -w 127.0.0.1:<port> -q namespace -p 0 -o titles
+""" % (Corpus.bench_category, Corpus.bench_tree_category, Corpus.bench_template)
+    sys.stderr.write(usage_message)
+    sys.exit(1)
+
+
+def do_main():
+    host = "127.0.0.1"
+    port = 0
+    sizes = {"pages": 10000, "users": 500, "logevents": 10000, "textsize": 2000, "seed": 1,
+             "history": 0}
+    corpus_path = None
+    latency = 0
+    bandwidth = 0
+    rates = {"lagrate": 0, "unavailablerate": 0, "brokenrate": 0, "churn": 0, "editrate": 0}
+    verbose = False
+
+    try:
+        (options, remainder) = getopt.gnu_getopt(
+            sys.argv[1:], "", ["port=", "host=", "pages=", "users=", "logevents=", "textsize=",
+                               "seed=", "history=", "corpus=", "latency=", "bandwidth=",
+                               "lagrate=", "unavailablerate=", "brokenrate=", "churn=", "editrate=",
+                               "verbose", "help"])
+    except getopt.GetoptError as e:
+        usage(e.msg)
+
+    for (opt, val) in options:
+        if opt == "--host":
+            host = val
+        elif opt in ["--port", "--latency", "--bandwidth"] or opt[2:] in sizes:
+            if not val.isdigit():
+                usage("%s requires a number" % opt)
+            if opt == "--port":
+                port = int(val)
+            elif opt == "--latency":
+                latency = int(val) / 1000.0
+            elif opt == "--bandwidth":
+                bandwidth = int(val) * 1024
+            else:
+                sizes[opt[2:]] = int(val)
+        elif opt[2:] in rates:
+            try:
+                rates[opt[2:]] = float(val)
+            except ValueError:
+                usage("%s requires a fraction" % opt)
+        elif opt == "--corpus":
+            corpus_path = val
+        elif opt == "--verbose":
+            verbose = True
+        elif opt == "--help":
+            usage("Options help:\n")
+        else:
+            usage("Unknown option specified: %s" % opt)
+
+    if len(remainder) > 0:
+        usage("Unknown option specified: <%s>" % remainder[0])
+
+    if corpus_path:
+        corpus = Corpus.load(corpus_path)
+    else:
+        corpus = Corpus.generate(sizes["pages"], sizes["users"], sizes["logevents"],
+                                 sizes["textsize"], sizes["seed"])
+    if sizes["history"]:
+        corpus.add_history(sizes["history"], sizes["seed"])
+    if rates["churn"]:
+        edited = corpus.churn(rates["churn"], sizes["seed"])
+        if verbose:
+            sys.stderr.write("edited %d pages\n" % edited)
+    if verbose:
+        sys.stderr.write("serving %d pages, %d users, %d log events\n"
+                         % (len(corpus.pages), len(corpus.users), len(corpus.log_events)))
+    api = FakeWikiApi(corpus, rates["lagrate"], rates["unavailablerate"], sizes["seed"],
+                      rates["brokenrate"])
+    server = FakeWiki(api, host, port, latency, bandwidth, verbose)
+    if rates["editrate"]:
+        Editor(corpus, rates["editrate"], sizes["seed"]).start()
+    sys.stdout.write("%d\n" % server.get_port())
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    do_main()
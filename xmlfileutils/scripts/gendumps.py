@@ -0,0 +1,598 @@
+# -*- coding: utf-8 -*-
+import sys
+import math
+import getopt
+import random
+import hashlib
+from wikifile import File
+
+
+class LoggingGenerator(object):
+    """Write a synthetic pages-logging XML file, with a mix of log items
+    like those found in real logging dumps: deleted contributors and
+    comments, missing comments, comments and params over several lines,
+    titles with and without namespace prefixes and non-ascii text.
+    Optionally write the matching titles file (pageid nsnum pagetitle)
+    as read by pageslogging2sql --sqlfile."""
+
+    namespaces = [("0", ""), ("1", "Talk"), ("2", "User"), ("4", "Project"),
+                  ("10", "Template"), ("14", "Category")]
+    log_types = [("delete", "delete"), ("move", "move"), ("block", "block"),
+                 ("protect", "protect"), ("upload", "upload"), ("newusers", "create")]
+    words = ["page", "Main", "talk", "Βικιλεξικό", "entry", "list", "history", "Élan",
+             "&amp;", "&quot;quoted&quot;", "O&#039;Brien", "article", "draft", "wiki"]
+
+    def __init__(self, count, seed=1, page_count=None):
+        """Constructor. Arguments:
+        count       -- number of log items to write
+        seed        -- seed for the random number generator, so that
+                       runs with the same arguments produce the same file
+        page_count  -- number of distinct page titles to use in the log
+                       items, default count / 4"""
+
+        self.count = count
+        self.random = random.Random(seed)
+        self.page_count = page_count or max(count // 4, 1)
+
+    def get_title(self, pagenum):
+        """Return (nsnum, ns name, title without prefix) for a page number;
+        the same number always gives the same page"""
+
+        (nsnum, nsname) = LoggingGenerator.namespaces[pagenum % len(LoggingGenerator.namespaces)]
+        words = LoggingGenerator.words
+        title = "%s %s %d" % (words[pagenum % len(words)], words[(pagenum // 7) % len(words)], pagenum)
+        return (nsnum, nsname, title[0].upper() + title[1:])
+
+    def get_text(self, min_words, max_words, newline_chance=0.0):
+        """Return random text made of words from the word list"""
+
+        count = self.random.randint(min_words, max_words)
+        text = []
+        for i in range(count):
+            text.append(self.random.choice(LoggingGenerator.words))
+            if newline_chance and self.random.random() < newline_chance:
+                text.append("\n")
+        return " ".join(text)
+
+    def write_header(self, out_fd):
+        out_fd.write('<mediawiki xmlns="http://www.mediawiki.org/xml/export-0.10/" '
+                     'version="0.10" xml:lang="en">\n')
+        out_fd.write("  <siteinfo>\n    <sitename>Wikipedia</sitename>\n    <namespaces>\n")
+        for (nsnum, nsname) in LoggingGenerator.namespaces:
+            if nsname:
+                out_fd.write('      <namespace key="%s" case="first-letter">%s</namespace>\n'
+                             % (nsnum, nsname))
+            else:
+                out_fd.write('      <namespace key="%s" case="first-letter" />\n' % nsnum)
+        out_fd.write("    </namespaces>\n  </siteinfo>\n")
+
+    def write_log_item(self, out_fd, logid):
+        rand = self.random.random
+        lines = ["  <logitem>\n", "    <id>%d</id>\n" % logid,
+                 "    <timestamp>20%02d-%02d-%02dT%02d:%02d:%02dZ</timestamp>\n" % (
+                     5 + logid % 10, 1 + logid % 12, 1 + logid % 28,
+                     logid % 24, logid % 60, (logid * 7) % 60)]
+        if rand() < 0.02:
+            lines.append('    <contributor deleted="deleted" />\n')
+        else:
+            userid = self.random.randint(2, 5000)
+            word = LoggingGenerator.words[userid % len(LoggingGenerator.words)]
+            lines.append("    <contributor>\n      <username>User %s %d</username>\n"
+                         "      <id>%d</id>\n    </contributor>\n" % (word, userid, userid))
+        chance = rand()
+        if chance < 0.02:
+            lines.append('    <comment deleted="deleted" />\n')
+        elif chance < 0.10:
+            pass  # no comment at all
+        elif chance < 0.15:
+            lines.append("    <comment>content was: '%s'</comment>\n" % self.get_text(20, 200, 0.1))
+        else:
+            lines.append("    <comment>%s</comment>\n" % self.get_text(1, 12))
+        (log_type, log_action) = self.random.choice(LoggingGenerator.log_types)
+        lines.append("    <type>%s</type>\n    <action>%s</action>\n" % (log_type, log_action))
+        if rand() < 0.01:
+            lines.append('    <text deleted="deleted" />\n')
+        else:
+            (nsnum, nsname, title) = self.get_title(self.random.randint(0, self.page_count - 1))
+            if nsname:
+                title = nsname + ":" + title
+            lines.append("    <logtitle>%s</logtitle>\n" % title)
+        chance = rand()
+        if chance < 0.05:
+            pass  # no params element
+        elif chance < 0.25:
+            (nsnum, nsname, title) = self.get_title(self.random.randint(0, self.page_count - 1))
+            lines.append('    <params xml:space="preserve">%s\n%s</params>\n'
+                         % (title, self.get_text(0, 3)))
+        else:
+            lines.append('    <params xml:space="preserve" />\n')
+        lines.append("  </logitem>\n")
+        out_fd.write("".join(lines))
+
+    def write_logging(self, output_path):
+        """Write the logging XML file
+        Arguments:
+        output_path  -- path to the possibly compressed output file"""
+
+        out_fd = File.open_output(output_path)
+        self.write_header(out_fd)
+        for logid in range(1, self.count + 1):
+            self.write_log_item(out_fd, logid)
+        out_fd.write("</mediawiki>\n")
+        out_fd.close()
+
+    def write_titles(self, output_path):
+        """Write pageid nsnum pagetitle for every page used in log items,
+        with sql-escaped titles in single quotes and underscores for spaces
+        Arguments:
+        output_path  -- path to the possibly compressed output file"""
+
+        out_fd = File.open_output(output_path)
+        for pagenum in range(self.page_count):
+            (nsnum, nsname, title) = self.get_title(pagenum)
+            title = title.replace("&quot;", '"').replace("&#039;", "'").replace("&amp;", "&")
+            title = title.replace("\\", "\\\\").replace("'", "\\'").replace('"', '\\"')
+            out_fd.write("%d %s '%s'\n" % (pagenum + 1, nsnum, title.replace(" ", "_")))
+        out_fd.close()
+
+
+class ContentGenerator(object):
+    """Write synthetic MediaWiki page content XML like that from Special:Export,
+    the matching stub XML, lists of titles as written by wikiretriever.py and
+    page and revision tables as written by mysqldump, all for the same pages.
+    The pages are those named by a LoggingGenerator with the same page count
+    and seed, so these files go together with its logging and titles files.
+    Revision text sizes are lognormally distributed around a median, with a
+    long tail of large revisions; text runs over many lines and has escaped
+    characters in it, and some revisions have deleted contributors or
+    comments, or no comment at all."""
+
+    namespaces = [("-2", "Media"), ("-1", "Special"), ("0", ""), ("1", "Talk"),
+                  ("2", "User"), ("3", "User talk"), ("4", "Project"), ("5", "Project talk"),
+                  ("6", "File"), ("7", "File talk"), ("8", "MediaWiki"), ("9", "MediaWiki talk"),
+                  ("10", "Template"), ("11", "Template talk"), ("12", "Help"),
+                  ("13", "Help talk"), ("14", "Category"), ("15", "Category talk"),
+                  ("828", "Module"), ("829", "Module talk")]
+    markup = ["[[Link]]", "'''bold'''", "{{cite web|url=http://example.org/?a=1&amp;b=2}}",
+              "== Section ==\n", "* item\n", "&lt;ref&gt;note&lt;/ref&gt;", "[[Category:Pages]]"]
+
+    def __init__(self, page_count, seed=1, text_size=2000, revisions=1):
+        """Constructor. Arguments:
+        page_count  -- number of pages to write
+        seed        -- seed for the random number generator, so that
+                       runs with the same arguments produce the same files
+        text_size   -- median bytes of revision text
+        revisions   -- number of revisions for each page; Special:Export of
+                       current content gives one"""
+
+        self.page_count = page_count
+        self.seed = seed
+        self.text_size = text_size
+        self.revisions = revisions
+        self.titles = LoggingGenerator(0, seed, page_count)
+        rand = random.Random(seed)
+        words = LoggingGenerator.words + ContentGenerator.markup
+        pool = []
+        length = 0
+        while length < 1024 * 1024:
+            word = rand.choice(words)
+            if rand.random() < 0.08:
+                word = word + "\n"
+            pool.append(word)
+            length = length + len(word) + 1
+        # revision texts are slices of this
+        self.pool = " ".join(pool)
+
+    def unescape(self, text):
+        return text.replace("&lt;", "<").replace("&gt;", ">").replace("&quot;", '"').replace(
+            "&#039;", "'").replace("&amp;", "&")
+
+    def sql_escape(self, text):
+        return text.replace("\\", "\\\\").replace("'", "\\'").replace('"', '\\"').replace("\n", "\\n")
+
+    def get_page(self, pagenum):
+        """Return a dict of everything about a page, the same every time
+        for the same page number"""
+
+        rand = random.Random(self.seed * 1000003 + pagenum)
+        (nsnum, nsname, title) = self.titles.get_title(pagenum)
+        page = {"id": pagenum + 1, "ns": nsnum, "name": title, "revisions": [],
+                "title": (nsname + ":" + title) if nsname else title}
+        parent = 0
+        for revnum in range(self.revisions):
+            rev_id = (pagenum + 1) * self.revisions + revnum
+            size = min(int(rand.lognormvariate(math.log(self.text_size), 1.2)), 2 * 1024 * 1024)
+            chance = rand.random()
+            if chance < 0.01:
+                user = None  # deleted
+            elif chance < 0.20:
+                user = (0, "10.%d.%d.%d" % (rand.randint(0, 255), rand.randint(0, 255),
+                                            rand.randint(1, 254)))
+            else:
+                userid = int(5000 * rand.random() ** 3) + 1
+                word = LoggingGenerator.words[userid % len(LoggingGenerator.words)]
+                user = (userid, "User %s %d" % (word, userid))
+            chance = rand.random()
+            if chance < 0.01:
+                comment = None  # deleted
+            elif chance < 0.15:
+                comment = ""
+            else:
+                comment = " ".join([rand.choice(LoggingGenerator.words)
+                                    for i in range(rand.randint(1, 12))])
+            page["revisions"].append({
+                "id": rev_id, "parent": parent, "user": user, "comment": comment,
+                "minor": rand.random() < 0.3, "size": size,
+                "offset": rand.randint(0, len(self.pool) - 1),
+                "timestamp": "20%02d%02d%02d%02d%02d%02d" % (
+                    5 + revnum * 10 // self.revisions, 1 + pagenum % 12, 1 + pagenum % 28,
+                    rand.randint(0, 23), rand.randint(0, 59), rand.randint(0, 59))})
+            parent = rev_id
+        return page
+
+    def get_text(self, revision):
+        """Return (xml escaped text, its length in bytes unescaped, sha1 in base 36)"""
+
+        start = self.pool.find(" ", revision["offset"]) + 1
+        text = self.pool[start:start + revision["size"]]
+        while len(text) < revision["size"]:
+            text = text + " " + self.pool[:revision["size"] - len(text)]
+        # don't cut an entity in half
+        end = text.rfind(" ")
+        if end > 0:
+            text = text[:end]
+        raw = self.unescape(text)
+        digest = int(hashlib.sha1(raw).hexdigest(), 16)
+        sha1 = ""
+        while digest:
+            (digest, digit) = divmod(digest, 36)
+            sha1 = "0123456789abcdefghijklmnopqrstuvwxyz"[digit] + sha1
+        return (text, len(raw), sha1.rjust(31, "0"))
+
+    def format_timestamp(self, timestamp):
+        return "%s-%s-%sT%s:%s:%sZ" % (timestamp[0:4], timestamp[4:6], timestamp[6:8],
+                                       timestamp[8:10], timestamp[10:12], timestamp[12:14])
+
+    def write_header(self, out_fd):
+        out_fd.write('<mediawiki xmlns="http://www.mediawiki.org/xml/export-0.10/" '
+                     'version="0.10" xml:lang="en">\n')
+        out_fd.write("  <siteinfo>\n    <sitename>Wikipedia</sitename>\n"
+                     "    <dbname>enwiki</dbname>\n"
+                     "    <generator>MediaWiki 1.29.0</generator>\n"
+                     "    <case>first-letter</case>\n    <namespaces>\n")
+        for (nsnum, nsname) in ContentGenerator.namespaces:
+            if nsname:
+                out_fd.write('      <namespace key="%s" case="first-letter">%s</namespace>\n'
+                             % (nsnum, nsname))
+            else:
+                out_fd.write('      <namespace key="%s" case="first-letter" />\n' % nsnum)
+        out_fd.write("    </namespaces>\n  </siteinfo>\n")
+
+    def write_page(self, content_fd, stubs_fd, page):
+        """Write a page to the content file, the stubs file or both"""
+
+        lines = ["  <page>\n", "    <title>%s</title>\n" % page["title"],
+                 "    <ns>%s</ns>\n" % page["ns"], "    <id>%d</id>\n" % page["id"]]
+        content = []
+        stubs = []
+        for revision in page["revisions"]:
+            lines.extend(["    <revision>\n", "      <id>%d</id>\n" % revision["id"]])
+            if revision["parent"]:
+                lines.append("      <parentid>%d</parentid>\n" % revision["parent"])
+            lines.append("      <timestamp>%s</timestamp>\n"
+                         % self.format_timestamp(revision["timestamp"]))
+            if revision["user"] is None:
+                lines.append('      <contributor deleted="deleted" />\n')
+            elif revision["user"][0]:
+                lines.append("      <contributor>\n        <username>%s</username>\n"
+                             "        <id>%d</id>\n      </contributor>\n"
+                             % (revision["user"][1], revision["user"][0]))
+            else:
+                lines.append("      <contributor>\n        <ip>%s</ip>\n      </contributor>\n"
+                             % revision["user"][1])
+            if revision["minor"]:
+                lines.append("      <minor />\n")
+            if revision["comment"] is None:
+                lines.append('      <comment deleted="deleted" />\n')
+            elif revision["comment"]:
+                lines.append("      <comment>%s</comment>\n" % revision["comment"])
+            lines.append("      <model>wikitext</model>\n      <format>text/x-wiki</format>\n")
+            (text, size, sha1) = self.get_text(revision)
+            content.append("".join(lines))
+            stubs.append("".join(lines))
+            if text:
+                content.append('      <text xml:space="preserve" bytes="%d">%s</text>\n' % (size, text))
+            else:
+                content.append('      <text xml:space="preserve" bytes="0" />\n')
+            stubs.append('      <text id="%d" bytes="%d" />\n' % (revision["id"], size))
+            lines = ["      <sha1>%s</sha1>\n" % sha1, "    </revision>\n"]
+        lines.append("  </page>\n")
+        content.append("".join(lines))
+        stubs.append("".join(lines))
+        if content_fd:
+            content_fd.write("".join(content))
+        if stubs_fd:
+            stubs_fd.write("".join(stubs))
+
+    def write_content(self, output_paths, stubs_path=None):
+        """Write the content XML, split by page ranges into one or more files,
+        and optionally the stubs XML for all pages
+        Arguments:
+        output_paths  -- list of paths to the possibly compressed content files,
+                         or an empty list to write only the stubs
+        stubs_path    -- path to the possibly compressed stubs file, or None"""
+
+        stubs_fd = None
+        if stubs_path:
+            stubs_fd = File.open_output(stubs_path)
+            self.write_header(stubs_fd)
+        shards = max(len(output_paths), 1)
+        for shard in range(shards):
+            content_fd = None
+            if output_paths:
+                content_fd = File.open_output(output_paths[shard])
+                self.write_header(content_fd)
+            for pagenum in range(self.page_count * shard // shards,
+                                 self.page_count * (shard + 1) // shards):
+                self.write_page(content_fd, stubs_fd, self.get_page(pagenum))
+            if content_fd:
+                content_fd.write("</mediawiki>\n")
+                content_fd.close()
+        if stubs_fd:
+            stubs_fd.write("</mediawiki>\n")
+            stubs_fd.close()
+
+    def write_titles_list(self, output_path):
+        """Write the title of every page, one per line, as wikiretriever.py
+        writes them, e.g. for wikicontent2sql --titles
+        Arguments:
+        output_path  -- path to the possibly compressed output file"""
+
+        out_fd = File.open_output(output_path)
+        for pagenum in range(self.page_count):
+            (nsnum, nsname, title) = self.titles.get_title(pagenum)
+            title = self.unescape(title)
+            out_fd.write("%s\n" % ((nsname + ":" + title) if nsname else title))
+        out_fd.close()
+
+    def get_create_table(self, table):
+        if table == "page":
+            return """CREATE TABLE `page` (
+  `page_id` int(10) unsigned NOT NULL AUTO_INCREMENT,
+  `page_namespace` int(11) NOT NULL DEFAULT '0',
+  `page_title` varbinary(255) NOT NULL DEFAULT '',
+  `page_restrictions` tinyblob NOT NULL,
+  `page_is_redirect` tinyint(1) unsigned NOT NULL DEFAULT '0',
+  `page_is_new` tinyint(1) unsigned NOT NULL DEFAULT '0',
+  `page_random` double unsigned NOT NULL DEFAULT '0',
+  `page_touched` varbinary(14) NOT NULL DEFAULT '',
+  `page_links_updated` varbinary(14) DEFAULT NULL,
+  `page_latest` int(10) unsigned NOT NULL DEFAULT '0',
+  `page_len` int(10) unsigned NOT NULL DEFAULT '0',
+  `page_content_model` varbinary(32) DEFAULT NULL,
+  `page_lang` varbinary(35) DEFAULT NULL,
+  PRIMARY KEY (`page_id`),
+  UNIQUE KEY `name_title` (`page_namespace`,`page_title`),
+  KEY `page_random` (`page_random`),
+  KEY `page_len` (`page_len`),
+  KEY `page_redirect_namespace_len` (`page_is_redirect`,`page_namespace`,`page_len`)
+) ENGINE=InnoDB AUTO_INCREMENT=%d DEFAULT CHARSET=binary;
+""" % (self.page_count + 1)
+        return """CREATE TABLE `revision` (
+  `rev_id` int(8) unsigned NOT NULL AUTO_INCREMENT,
+  `rev_page` int(8) unsigned NOT NULL DEFAULT '0',
+  `rev_text_id` int(8) unsigned NOT NULL DEFAULT '0',
+  `rev_comment` varbinary(767) NOT NULL,
+  `rev_user` int(5) unsigned NOT NULL DEFAULT '0',
+  `rev_user_text` varbinary(255) NOT NULL DEFAULT '',
+  `rev_timestamp` varbinary(14) NOT NULL DEFAULT '',
+  `rev_minor_edit` tinyint(1) unsigned NOT NULL DEFAULT '0',
+  `rev_deleted` tinyint(1) unsigned NOT NULL DEFAULT '0',
+  `rev_len` int(8) unsigned DEFAULT NULL,
+  `rev_parent_id` int(8) unsigned DEFAULT NULL,
+  `rev_sha1` varbinary(32) NOT NULL DEFAULT '',
+  `rev_content_model` varbinary(32) DEFAULT NULL,
+  `rev_content_format` varbinary(64) DEFAULT NULL,
+  PRIMARY KEY (`rev_id`),
+  UNIQUE KEY `rev_page_id` (`rev_page`,`rev_id`),
+  KEY `rev_timestamp` (`rev_timestamp`),
+  KEY `page_timestamp` (`rev_page`,`rev_timestamp`),
+  KEY `user_timestamp` (`rev_user`,`rev_timestamp`),
+  KEY `usertext_timestamp` (`rev_user_text`,`rev_timestamp`),
+  KEY `page_user_timestamp` (`rev_page`,`rev_user`,`rev_timestamp`)
+) ENGINE=InnoDB AUTO_INCREMENT=%d DEFAULT CHARSET=binary;
+""" % ((self.page_count + 1) * self.revisions)
+
+    def get_rows(self, table, page):
+        """Return the sql values for the rows of the page or revision table for a page"""
+
+        if table == "page":
+            latest = page["revisions"][-1]
+            title = self.sql_escape(self.unescape(page["name"])).replace(" ", "_")
+            return ["(%d,%s,'%s','',0,%d,%.15f,'%s',NULL,%d,%d,'wikitext',NULL)" % (
+                page["id"], page["ns"], title, 1 if len(page["revisions"]) == 1 else 0,
+                random.Random(page["id"]).random(), latest["timestamp"], latest["id"],
+                self.get_text(latest)[1])]
+        rows = []
+        for revision in page["revisions"]:
+            (text, size, sha1) = self.get_text(revision)
+            user = revision["user"] or (0, "")
+            deleted = (4 if revision["user"] is None else 0) | (2 if revision["comment"] is None else 0)
+            rows.append("(%d,%d,%d,'%s',%d,'%s','%s',%d,%d,%d,%d,'%s',NULL,NULL)" % (
+                revision["id"], page["id"], revision["id"],
+                self.sql_escape(self.unescape(revision["comment"] or "")),
+                user[0], self.sql_escape(self.unescape(user[1])), revision["timestamp"],
+                1 if revision["minor"] else 0, deleted, size, revision["parent"], sha1))
+        return rows
+
+    def write_sql_table(self, output_path, table, max_bytes=1024 * 1024):
+        """Write the page or revision table as mysqldump would, with
+        INSERT statements of many rows each
+        Arguments:
+        output_path  -- path to the possibly compressed output file
+        table        -- 'page' or 'revision'
+        max_bytes    -- approximate maximum length of each INSERT statement"""
+
+        out_fd = File.open_output(output_path)
+        out_fd.write("-- MySQL dump 10.16  Distrib 10.1.22-MariaDB, for debian-linux-gnu (x86_64)\n"
+                     "--\n-- Host: 10.64.0.1    Database: enwiki\n"
+                     "-- ------------------------------------------------------\n"
+                     "-- Server version\t10.0.23-MariaDB-log\n\n"
+                     "/*!40101 SET @OLD_CHARACTER_SET_CLIENT=@@CHARACTER_SET_CLIENT */;\n"
+                     "/*!40101 SET NAMES utf8 */;\n"
+                     "/*!40014 SET @OLD_UNIQUE_CHECKS=@@UNIQUE_CHECKS, UNIQUE_CHECKS=0 */;\n\n"
+                     "--\n-- Table structure for table `%s`\n--\n\n"
+                     "DROP TABLE IF EXISTS `%s`;\n"
+                     "/*!40101 SET @saved_cs_client     = @@character_set_client */;\n"
+                     "/*!40101 SET character_set_client = utf8 */;\n" % (table, table))
+        out_fd.write(self.get_create_table(table))
+        out_fd.write("/*!40101 SET character_set_client = @saved_cs_client */;\n\n"
+                     "--\n-- Dumping data for table `%s`\n--\n\n"
+                     "/*!40000 ALTER TABLE `%s` DISABLE KEYS */;\n" % (table, table))
+        prefix = "INSERT INTO `%s` VALUES " % table
+        rows = []
+        length = 0
+        for pagenum in range(self.page_count):
+            for row in self.get_rows(table, self.get_page(pagenum)):
+                rows.append(row)
+                length = length + len(row) + 1
+                if length >= max_bytes:
+                    out_fd.write(prefix + ",".join(rows) + ";\n")
+                    rows = []
+                    length = 0
+        if rows:
+            out_fd.write(prefix + ",".join(rows) + ";\n")
+        out_fd.write("/*!40000 ALTER TABLE `%s` ENABLE KEYS */;\n"
+                     "/*!40101 SET CHARACTER_SET_CLIENT=@OLD_CHARACTER_SET_CLIENT */;\n\n"
+                     "-- Dump completed\n" % table)
+        out_fd.close()
+
+
+def usage(message=None):
+    """Show usage and help information. Arguments:
+    message   -- message to be shown (e.g. error message) before the help"""
+
+    if message:
+        sys.stderr.write(message)
+        sys.stderr.write("\n")
+    usage_message = """Usage: python gendumps.py [--logging filename] [--titles filename]
+           [--content filename] [--shards number] [--stubs filename]
+           [--titleslist filename] [--sqlfiles format]
+           [--count number] [--pages number] [--textsize bytes]
+           [--revisions number] [--seed number]
+
+This script writes synthetic dump files for testing and benchmarking
+the converters in this directory. All the files written in one run
+are for the same set of pages.
+
+Options:
+
+--logging     path to the pages-logging xml file to write
+--titles      path to a file of page ids, namespaces and titles for the pages
+              in the logging file, suitable for pageslogging2sql --sqlfile
+--content     path to the page content xml file to write, as from Special:Export;
+              with --shards, a format string in which {n} is replaced by the
+              shard number, e.g. content-{n}.xml.gz
+--shards      number of content files to split the pages across, default 1
+--stubs       path to the stubs xml file to write for the same pages
+--titleslist  path to a file of the titles of the pages, one per line, as
+              written by wikiretriever.py
+--sqlfiles    format string for the page and revision table files to write as
+              mysqldump would, in which {t} is replaced by the table name,
+              e.g. enwiki-{t}.sql.gz
+--count       number of log items to write, default 100000
+--pages       number of pages; for the logging file, the number of distinct
+              pages named in the log items, default count / 4
+--textsize    median bytes of page text, default 2000
+--revisions   number of revisions per page, default 1
+--seed        seed for the random number generator, default 1
+"""
+    sys.stderr.write(usage_message)
+    sys.exit(1)
+
+
+def do_main():
+    logging_file = None
+    titles_file = None
+    content_file = None
+    shards = 1
+    stubs_file = None
+    titles_list_file = None
+    sql_files = None
+    count = 100000
+    page_count = None
+    text_size = 2000
+    revisions = 1
+    seed = 1
+
+    try:
+        (options, remainder) = getopt.gnu_getopt(
+            sys.argv[1:], "", ["logging=", "titles=", "content=", "shards=", "stubs=",
+                               "titleslist=", "sqlfiles=", "count=", "pages=", "textsize=",
+                               "revisions=", "seed=", "help"])
+    except getopt.GetoptError as e:
+        usage(e.msg)
+
+    for (opt, val) in options:
+        if opt == "--logging":
+            logging_file = val
+        elif opt == "--titles":
+            titles_file = val
+        elif opt == "--content":
+            content_file = val
+        elif opt == "--stubs":
+            stubs_file = val
+        elif opt == "--titleslist":
+            titles_list_file = val
+        elif opt == "--sqlfiles":
+            sql_files = val
+        elif opt in ["--count", "--pages", "--seed", "--shards", "--textsize", "--revisions"]:
+            if not val.isdigit():
+                usage("%s requires a number" % opt)
+            if opt == "--count":
+                count = int(val)
+            elif opt == "--pages":
+                page_count = int(val)
+            elif opt == "--shards":
+                shards = int(val)
+            elif opt == "--textsize":
+                text_size = int(val)
+            elif opt == "--revisions":
+                revisions = int(val)
+            else:
+                seed = int(val)
+        elif opt == "--help":
+            usage()
+        else:
+            usage("Unknown option specified: %s" % opt)
+
+    if len(remainder) > 0:
+        usage("Unknown option specified: <%s>" % remainder[0])
+    if not (logging_file or titles_file or content_file or stubs_file or titles_list_file or sql_files):
+        usage("At least one file to write must be given")
+    if shards > 1 and (not content_file or "{n}" not in content_file):
+        usage("With --shards, --content must contain {n}")
+    if sql_files and "{t}" not in sql_files:
+        usage("The sqlfiles format must contain {t}")
+
+    generator = LoggingGenerator(count, seed, page_count)
+    if logging_file:
+        generator.write_logging(logging_file)
+    if titles_file:
+        generator.write_titles(titles_file)
+    content = ContentGenerator(generator.page_count, seed, text_size, revisions)
+    if content_file or stubs_file:
+        if content_file:
+            content_files = [content_file.replace("{n}", str(shard + 1)) for shard in range(shards)]
+        else:
+            content_files = []
+        content.write_content(content_files, stubs_file)
+    if titles_list_file:
+        content.write_titles_list(titles_list_file)
+    if sql_files:
+        for table in ["page", "revision"]:
+            content.write_sql_table(sql_files.replace("{t}", table), table)
+
+
+if __name__ == "__main__":
+    do_main()
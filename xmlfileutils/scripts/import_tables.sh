@@ -9,6 +9,7 @@ IMPORTDIR="imported"                             # directory relative to cwd, wh
 OUTDIR="outputs"                                 # directory relative to cwd, where output files will be generated
 VERSION="1.29"                                   # version of the generator in the stubs, page content files downloaded
 BASEDOWNLOADURL="https://dumps.wikimedia.org"    # url to base of dumps tree for downloading
+JOBS=4                                           # number of tables to load at the same time
 
 MOSTTABLES="categorylinks category change_tag externallinks geo_tags imagelinks iwlinks \
       langlinks pagelinks page_props page_restrictions protected_titles \
@@ -16,28 +17,11 @@ MOSTTABLES="categorylinks category change_tag externallinks geo_tags imagelinks
 SPECIALTABLES="page revision text"
 TABLES="${MOSTTABLES} ${SPECIALTABLES}"
 
-echo "checking if downloads are needed"
-downloadsneeded=0
-for table in $MOSTTABLES; do
-    filename="${WIKI}-${DATE}-${table}.sql.gz"
-    if [ ! -e ${IMPORTDIR}/${filename} ]; then
-	downloadsneeded=1
-	break
-    fi
-done
-
-if [ $downloadsneeded -eq 0 ]; then
-    echo "downloads not needed"
-else
-    echo "downloads proceeding"
-    for table in $MOSTTABLES; do
-        filename="${WIKI}-${DATE}-${table}.sql.gz"
-        if [ ! -e ${IMPORTDIR}/${filename} ]; then
-	    wget -O ${IMPORTDIR}/${filename} ${BASEDOWNLOADURL}/${WIKI}/${DATE}/$filename
-        fi
-    done
-    echo "downloads complete"
-fi
+# files already downloaded and with good checksums are skipped, partial ones are resumed
+echo "downloading table dumps"
+python ${CMDDIR}/download_dumps.py --wiki ${WIKI} --date ${DATE} --tables "${MOSTTABLES}" \
+       --output ${IMPORTDIR} --baseurl ${BASEDOWNLOADURL} --jobs 4 || exit 1
+echo "downloads complete"
 
 echo "checking if page, revision, text file generation needed"
 generateneeded=0
@@ -75,7 +59,9 @@ echo "tab conversion done"
 
 echo "extracting table create statements"
 for table in $MOSTTABLES; do
-    python ${CMDDIR}/extract_tablecreate.py -s "${IMPORTDIR}/${WIKI}-${DATE}-${table}.sql.gz"
+    # also writes the table with only its primary key (.create-pk) and its other indexes (.indexes)
+    python ${CMDDIR}/extract_tablecreate.py -s "${IMPORTDIR}/${WIKI}-${DATE}-${table}.sql.gz" \
+           --split --catalog "${OUTDIR}/${WIKI}-${DATE}-schema.json"
 done
 echo "table create statement extraction done"
 
@@ -94,9 +80,11 @@ for table in $SPECIALTABLES; do
 done
 echo "Truncating tables done"
 
+# secondary indexes are added after the data is loaded, so that each is built
+# once from sorted data instead of being updated for every row
 echo "Creating tables"
 for table in $MOSTTABLES; do
-    file="${WIKI}-${DATE}-${table}.sql.create"
+    file="${WIKI}-${DATE}-${table}.sql.create-pk"
     if [ -e ${IMPORTDIR}/${file} ]; then
         cat ${IMPORTDIR}/${file} | mysql -u root -pnotverysecure $DBNAME
     fi
@@ -106,16 +94,23 @@ echo "Table creation done"
 echo "beginning sql import"
 date > import-timing.txt
 CWD=`pwd`
-for table in $TABLES; do
-    echo "TABLE: $table"
-    zcat "${CWD}/${OUTDIR}/${WIKI}-${DATE}-${table}.tabs.gz" > "${CWD}/${OUTDIR}/${WIKI}-${DATE}-${table}.tabs"
-    ( \
-      echo "SET autocommit=0; SET unique_checks=0; SET foreign_key_checks=0;" ;
-      echo "LOAD DATA INFILE \"${CWD}/${OUTDIR}/${WIKI}-${DATE}-${table}.tabs\" INTO TABLE ${table} FIELDS OPTIONALLY ENCLOSED BY \"'\";" ;
-      echo "SET autocommit=1; SET unique_checks=1; SET foreign_key_checks=1;" ; 
-    ) | mysql -u root -pnotverysecure $DBNAME
-    rm "${CWD}/${OUTDIR}/${WIKI}-${DATE}-${table}.tabs"
-done
+# loads several tables at once, streaming each through a fifo without uncompressing it to disk;
+# per table throughput goes to import-throughput.txt
+python ${CMDDIR}/load_tables.py --db $DBNAME --tables "$TABLES" --jobs $JOBS \
+       --tabsfiles "${CWD}/${OUTDIR}/${WIKI}-${DATE}-{t}.tabs.gz" --fifodir "${CWD}/${OUTDIR}" \
+       --mysqlopts autocommit,unique_checks,foreign_key_checks --mysqlpasswd notverysecure \
+       > import-throughput.txt
 date >> import-timing.txt
 echo "import done"
+
+echo "Adding secondary indexes"
+for table in $MOSTTABLES; do
+    file="${WIKI}-${DATE}-${table}.sql.indexes"
+    if [ -s ${IMPORTDIR}/${file} ]; then
+        echo "TABLE: $table"
+        cat ${IMPORTDIR}/${file} | mysql -u root -pnotverysecure $DBNAME
+    fi
+done
+date >> import-timing.txt
+echo "Adding secondary indexes done"
 echo "ALL STEPS COMPLETE"
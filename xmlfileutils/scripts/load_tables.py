@@ -0,0 +1,439 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import time
+import errno
+import fcntl
+import shlex
+import getopt
+import getpass
+import threading
+import Queue
+from subprocess import Popen
+from wikifile import File
+
+
+class LoadErr(Exception):
+    pass
+
+
+class MysqlClient(object):
+    """Build the command line for the mysql client that loads one chunk
+    of a table from a fifo. The client program is given as a command
+    line, so that something other than mysql, such as a stand-in for
+    testing, can be run instead; it is invoked as
+      <command> [--defaults-extra-file=file] -u user [-h host -P port]
+                [-pPASSWORD] -D db -e 'SET ...; LOAD DATA INFILE ...'
+    and must read the fifo named in the LOAD DATA statement to its end."""
+
+    def __init__(self, command="mysql", db=None, user="root", host=None, port=None,
+                 password=None, passwdfile=None, charset="binary", mysqlopts=None):
+        """Constructor. Arguments:
+        command     -- command line of the client, e.g. 'mysql' or
+                       '/usr/local/bin/mysql --protocol=socket'
+        db          -- name of the database into which to load data
+        user        -- mysql user name
+        host        -- mysql server host name, None for the client default
+        port        -- mysql server port, None for the client default
+        password    -- mysql password, None if passwdfile is given or
+                       no password is needed
+        passwdfile  -- mysql option file with the password in its [client] section
+        charset     -- character set for LOAD DATA INFILE
+        mysqlopts   -- list of session settings to turn off before loading,
+                       e.g. ['unique_checks', 'foreign_key_checks']"""
+
+        self.command = shlex.split(command)
+        self.db = db
+        self.user = user
+        self.host = host
+        self.port = port
+        self.password = password
+        self.passwdfile = passwdfile
+        self.charset = charset
+        self.mysqlopts = mysqlopts or []
+
+    def get_sql(self, table, fifo):
+        """Return the statements loading the table from the fifo"""
+
+        statements = ["SET %s=0" % opt for opt in self.mysqlopts]
+        statements.append("LOAD DATA INFILE '%s' INTO TABLE %s CHARACTER SET %s "
+                          "FIELDS OPTIONALLY ENCLOSED BY '\\''" % (fifo, table, self.charset))
+        # otherwise the whole load is rolled back when the client exits
+        if "autocommit" in self.mysqlopts:
+            statements.append("COMMIT")
+        return "; ".join(statements) + ";"
+
+    def get_command(self, table, fifo):
+        """Return the command (as a list) which loads the table from the fifo"""
+
+        command = list(self.command)
+        # the mysql client requires this to be the first option
+        if self.passwdfile:
+            command.append("--defaults-extra-file=%s" % self.passwdfile)
+        command.extend(["-u", self.user])
+        if self.host:
+            command.extend(["-h", self.host])
+        if self.port:
+            command.extend(["-P", str(self.port)])
+        if self.password and not self.passwdfile:
+            command.append("-p%s" % self.password)
+        command.extend(["-D", self.db, "-e", self.get_sql(table, fifo)])
+        return command
+
+
+class TableLoader(object):
+    """Load one table from a possibly compressed file of tab-separated
+    rows, as written by sql2txt, by streaming it in chunks through a
+    fifo to the client; each chunk is a separate LOAD DATA INFILE and so
+    a separate transaction, which keeps the undo log for big tables from
+    growing without bound. Nothing is written to disk but the fifo."""
+
+    def __init__(self, client, table, tabs_path, fifo_dir, chunk=100000000, chunk_lines=False,
+                 open_timeout=10, verbose=False):
+        """Constructor. Arguments:
+        client        -- MysqlClient
+        table         -- name of the table to load
+        tabs_path     -- path to the possibly compressed file of rows
+        fifo_dir      -- directory in which to create the fifo; the mysql
+                         server must be able to read from it
+        chunk         -- number of bytes, or lines, per chunk
+        chunk_lines   -- True if chunk is a number of lines
+        open_timeout  -- seconds to wait for the client to open the fifo
+        verbose       -- display progress messages"""
+
+        self.client = client
+        self.table = table
+        self.tabs_path = tabs_path
+        self.fifo = os.path.join(os.path.abspath(fifo_dir), "%s-%s-%d.fifo"
+                                 % (client.db, table, os.getpid()))
+        self.chunk = chunk
+        self.chunk_lines = chunk_lines
+        self.open_timeout = open_timeout
+        self.verbose = verbose
+
+        self.rows = 0
+        self.bytes = 0
+        self.chunks = 0
+        self.seconds = 0
+        self.error = None
+
+    def open_fifo(self, process):
+        """Open the fifo for writing once the client has opened it for
+        reading, and return the file object; raises an exception if the
+        client exits or does not open it in time, rather than hanging"""
+
+        deadline = time.time() + self.open_timeout
+        while True:
+            try:
+                fd = os.open(self.fifo, os.O_WRONLY | os.O_NONBLOCK)
+                break
+            except OSError as e:
+                if e.errno != errno.ENXIO:
+                    raise
+            if process.poll() is not None:
+                raise LoadErr("client exited with code %d before opening fifo for %s\n"
+                              % (process.returncode, self.table))
+            if time.time() > deadline:
+                raise LoadErr("timeout waiting for client to open fifo for %s\n" % self.table)
+            time.sleep(0.05)
+        flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+        fcntl.fcntl(fd, fcntl.F_SETFL, flags & ~os.O_NONBLOCK)
+        return os.fdopen(fd, "wb", 1024 * 1024)
+
+    def load_chunk(self, in_fd, first_line):
+        """Send one chunk of rows to a new client, starting with first_line;
+        returns the first line of the next chunk, or the empty string at
+        the end of the input"""
+
+        # close_fds so that the client doesn't inherit the fifos of other
+        # tables, which would then never see end of file
+        process = Popen(self.client.get_command(self.table, self.fifo), close_fds=True)
+        try:
+            out_fd = self.open_fifo(process)
+        except Exception:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            raise
+        written = 0
+        line = first_line
+        try:
+            while line and written < self.chunk:
+                out_fd.write(line)
+                self.rows = self.rows + 1
+                self.bytes = self.bytes + len(line)
+                written = written + (1 if self.chunk_lines else len(line))
+                line = in_fd.readline()
+            out_fd.close()
+        except IOError as e:
+            if process.poll() is None:
+                process.kill()
+            process.wait()
+            raise LoadErr("error writing to fifo for %s: %s\n" % (self.table, str(e)))
+        if process.wait():
+            raise LoadErr("client exited with code %d loading %s\n" % (process.returncode, self.table))
+        self.chunks = self.chunks + 1
+        if self.verbose:
+            sys.stderr.write("%s: chunk %d loaded, %d rows so far\n"
+                             % (self.table, self.chunks, self.rows))
+        return line
+
+    def load(self):
+        """Load the whole file. On error raises an exception."""
+
+        start = time.time()
+        os.mkfifo(self.fifo, 0o666)
+        in_fd = File.open_input(self.tabs_path)
+        try:
+            line = in_fd.readline()
+            while line:
+                line = self.load_chunk(in_fd, line)
+        finally:
+            in_fd.close()
+            os.unlink(self.fifo)
+            self.seconds = time.time() - start
+
+    def get_report(self):
+        """Return a line with the throughput for this table"""
+
+        seconds = self.seconds or 0.000001
+        return ("%-20s %12d %14d %7d %9.1f %12.0f %9.2f %s"
+                % (self.table, self.rows, self.bytes, self.chunks, self.seconds,
+                   self.rows / seconds, self.bytes / seconds / 1024 / 1024,
+                   "FAILED" if self.error else "ok"))
+
+
+class ParallelLoader(object):
+    """Load several tables at once, each through its own fifo and client,
+    with at most a given number of tables loading at any time. Tables are
+    started largest file first, so that one big table is not left
+    loading on its own at the end."""
+
+    def __init__(self, loaders, jobs=2, verbose=False):
+        """Constructor. Arguments:
+        loaders  -- list of TableLoader, one for each table
+        jobs     -- number of tables to load at the same time
+        verbose  -- display progress messages"""
+
+        self.loaders = sorted(loaders, key=lambda loader: os.path.getsize(loader.tabs_path),
+                              reverse=True)
+        self.jobs = jobs
+        self.verbose = verbose
+        self.queue = Queue.Queue()
+        self.seconds = 0
+
+    def worker(self):
+        """Load tables from the queue until it is empty"""
+
+        while True:
+            try:
+                loader = self.queue.get_nowait()
+            except Queue.Empty:
+                return
+            if self.verbose:
+                sys.stderr.write("loading %s from %s\n" % (loader.table, loader.tabs_path))
+            try:
+                loader.load()
+            except (LoadErr, IOError, OSError) as e:
+                loader.error = str(e)
+                sys.stderr.write("failed to load %s: %s" % (loader.table, loader.error))
+            else:
+                if self.verbose:
+                    sys.stderr.write("done loading %s\n" % loader.table)
+
+    def run(self):
+        """Load all the tables; returns True if every table loaded without error"""
+
+        start = time.time()
+        for loader in self.loaders:
+            self.queue.put(loader)
+        threads = [threading.Thread(target=self.worker)
+                   for i in range(min(self.jobs, len(self.loaders)))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            # with a timeout so that an interrupt is noticed
+            while thread.is_alive():
+                thread.join(1)
+        self.seconds = time.time() - start
+        return not [loader for loader in self.loaders if loader.error]
+
+    def write_report(self, out_fd):
+        """Write the throughput for each table and the total"""
+
+        out_fd.write("%-20s %12s %14s %7s %9s %12s %9s %s\n"
+                     % ("table", "rows", "bytes", "chunks", "seconds", "rows/sec", "MB/sec", "status"))
+        for loader in self.loaders:
+            out_fd.write(loader.get_report() + "\n")
+        rows = sum([loader.rows for loader in self.loaders])
+        total_bytes = sum([loader.bytes for loader in self.loaders])
+        seconds = self.seconds or 0.000001
+        out_fd.write("%-20s %12d %14d %7d %9.1f %12.0f %9.2f\n"
+                     % ("total", rows, total_bytes, sum([loader.chunks for loader in self.loaders]),
+                        self.seconds, rows / seconds, total_bytes / seconds / 1024 / 1024))
+
+
+def usage(message=None):
+    """Show usage and help information. Arguments:
+    message   -- message to be shown (e.g. error message) before the help"""
+
+    if message:
+        sys.stderr.write(message)
+        sys.stderr.write("\n")
+    usage_message = """Usage: python load_tables.py --db dbname --tables 'table1 table2 ...'
+           --tabsfiles path-format [--jobs number] [--chunk size]
+           [--mysqlopts option1,option2,...] [--charset charset] [--fifodir dirname]
+           [--mysqluser username] [--mysqlhost hostname] [--mysqlport portnum]
+           [--mysqlpasswd password | --passwdfile filename]
+           [--mysqlcmd command] [--verbose] [--help]
+
+This script loads files of tab-separated rows, as produced by sql2txt,
+into MySQL tables. Several tables are loaded at once; each is decompressed
+on the fly and streamed in chunks through its own fifo to a mysql client
+doing LOAD DATA INFILE, so that no uncompressed copy of the data is
+written to disk. At the end the rows, bytes and rows per second loaded
+for each table are written to stdout.
+
+Options:
+
+--db           name of the database into which to load the data
+--tables       space-separated list of the tables to load
+--tabsfiles    path including a format string, to the possibly compressed
+               (gz, bz2) files of rows; the string '{t}' is replaced by
+               each table name, e.g. 'outputs/elwikivoyage-20170401-{t}.tabs.gz'
+--jobs         number of tables to load at the same time, default 2
+--chunk        number of bytes of rows after which the rest of the table is
+               sent to a new LOAD DATA INFILE; if the argument ends in 'l' it
+               is the number of lines instead; default 100000000
+--mysqlopts    comma-separated list of session settings to turn off before
+               loading each chunk, e.g. unique_checks,foreign_key_checks;
+               if autocommit is one of them, each chunk is committed
+--charset      character set for LOAD DATA INFILE, default binary
+--fifodir      directory in which to create the fifos, which must be readable
+               by the mysql server; default /tmp
+--mysqluser    user name for mysql access, default root
+--mysqlhost    hostname of the mysql server, default: the client default
+--mysqlport    port of the mysql server, default: the client default
+--mysqlpasswd  password for mysql access; it is passed to the client on
+               the command line, where other users may see it
+--passwdfile   mysql option file with the password, containing
+                 [client]
+                 password=passwordvaluehere
+               if neither this nor mysqlpasswd is given you are prompted for
+               the password; give an empty password if none is needed
+--mysqlcmd     command line of the mysql client to run for each chunk,
+               default 'mysql'; a stand-in for testing must accept the mysql
+               options above and -D dbname -e statements, and read the
+               fifo named in the LOAD DATA INFILE statement to its end
+--verbose      display progress messages
+--help         show this usage message
+"""
+    sys.stderr.write(usage_message)
+    sys.exit(1)
+
+
+def do_main():
+    db = None
+    tables = None
+    tabs_files = None
+    jobs = 2
+    chunk = "100000000"
+    mysqlopts = []
+    charset = "binary"
+    fifo_dir = "/tmp"
+    user = "root"
+    host = None
+    port = None
+    password = None
+    passwdfile = None
+    mysqlcmd = "mysql"
+    verbose = False
+
+    try:
+        (options, remainder) = getopt.gnu_getopt(
+            sys.argv[1:], "", ["db=", "tables=", "tabsfiles=", "jobs=", "chunk=", "mysqlopts=",
+                               "charset=", "fifodir=", "mysqluser=", "mysqlhost=", "mysqlport=",
+                               "mysqlpasswd=", "passwdfile=", "mysqlcmd=", "verbose", "help"])
+    except getopt.GetoptError as e:
+        usage(e.msg)
+
+    for (opt, val) in options:
+        if opt == "--db":
+            db = val
+        elif opt == "--tables":
+            tables = val.split()
+        elif opt == "--tabsfiles":
+            tabs_files = val
+        elif opt == "--jobs":
+            if not val.isdigit() or not int(val):
+                usage("jobs must be a positive number")
+            jobs = int(val)
+        elif opt == "--chunk":
+            chunk = val
+        elif opt == "--mysqlopts":
+            mysqlopts = [o for o in val.split(",") if o]
+        elif opt == "--charset":
+            charset = val
+        elif opt == "--fifodir":
+            fifo_dir = val
+        elif opt == "--mysqluser":
+            user = val
+        elif opt == "--mysqlhost":
+            host = val
+        elif opt == "--mysqlport":
+            if not val.isdigit():
+                usage("mysqlport must be a number")
+            port = int(val)
+        elif opt == "--mysqlpasswd":
+            password = val
+        elif opt == "--passwdfile":
+            passwdfile = val
+        elif opt == "--mysqlcmd":
+            mysqlcmd = val
+        elif opt == "--verbose":
+            verbose = True
+        elif opt == "--help":
+            usage()
+        else:
+            usage("Unknown option specified: %s" % opt)
+
+    if len(remainder) > 0:
+        usage("Unknown option specified: <%s>" % remainder[0])
+    for (name, value) in [("db", db), ("tables", tables), ("tabsfiles", tabs_files)]:
+        if not value:
+            usage("Missing mandatory option <%s>" % name)
+    if "{t}" not in tabs_files:
+        usage("tabsfiles must contain '{t}'")
+
+    chunk_lines = chunk.endswith("l")
+    if chunk_lines or chunk.endswith("b"):
+        chunk = chunk[:-1]
+    if not chunk.isdigit() or not int(chunk):
+        usage("chunk must be a positive number optionally followed by l or b")
+
+    for name in [db, charset, user] + tables + mysqlopts:
+        if not name.replace("_", "").replace("-", "").isalnum():
+            usage("'%s' must be alphanumeric" % name)
+
+    if password is None and passwdfile is None:
+        password = getpass.getpass("Password for mysql user: ")
+
+    client = MysqlClient(mysqlcmd, db, user, host, port, password, passwdfile, charset, mysqlopts)
+    loaders = []
+    for table in tables:
+        tabs_path = tabs_files.format(t=table)
+        if not os.path.exists(tabs_path):
+            usage("no file %s for table %s" % (tabs_path, table))
+        loaders.append(TableLoader(client, table, tabs_path, fifo_dir, int(chunk), chunk_lines,
+                                   verbose=verbose))
+
+    loader = ParallelLoader(loaders, jobs, verbose)
+    ok = loader.run()
+    loader.write_report(sys.stdout)
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    do_main()
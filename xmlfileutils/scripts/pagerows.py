@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+import re
+import random
+from xml.etree import ElementTree as ElementTree
+
+
+class PageRowsErr(Exception):
+    pass
+
+
+class PageRows(object):
+    """Turn the XML of a page, as exported or from a content or stub dump,
+    into rows for the page, revision and text tables, with the columns
+    mwxml2sql writes for MediaWiki 1.24 and later. Values left out of the
+    XML are filled in as mwxml2sql does, except that page_random is seeded
+    by the page id, so that it stays the same when the page row is written
+    over. Values are sql literals."""
+
+    page_columns = ["page_id", "page_namespace", "page_title", "page_restrictions",
+                    "page_is_redirect", "page_is_new", "page_random", "page_touched",
+                    "page_links_updated", "page_latest", "page_len", "page_content_model",
+                    "page_lang"]
+    revision_columns = ["rev_id", "rev_page", "rev_text_id", "rev_comment", "rev_user",
+                        "rev_user_text", "rev_timestamp", "rev_minor_edit", "rev_deleted",
+                        "rev_len", "rev_parent_id", "rev_sha1", "rev_content_model",
+                        "rev_content_format"]
+    text_columns = ["old_id", "old_text", "old_flags"]
+
+    def __init__(self, text_ids=False):
+        """Constructor. Arguments:
+        text_ids  -- take text ids from the id attribute of the text elements,
+                     for databases loaded with mwxml2sql -i; otherwise the
+                     revision id is the text id, as mwxml2sql has it by default"""
+
+        self.text_ids = text_ids
+
+    def get_columns(self, table):
+        return getattr(PageRows, table + "_columns")
+
+    def sql_escape(self, string):
+        """Return a string as an sql literal, enclosed in single quotes"""
+
+        string = string.replace('\\', "\\\\")  # must insert new backslashs after this step
+        string = string.replace("'", "\\'").replace('"', '\\"')
+        string = string.replace("\n", "\\n").replace("\r", "\\r").replace("\0", "\\0")
+        return "'" + string + "'"
+
+    def get_field(self, elt, path, default=""):
+        """Return the text of a child element as utf8, or the default if it
+        is missing"""
+
+        value = elt.findtext(path)
+        if value is None:
+            return default
+        if isinstance(value, unicode):
+            return value.encode("utf8")
+        return value
+
+    def get_timestamp(self, timestamp):
+        """Convert 2013-02-01T14:01:59Z to 20130201140159"""
+
+        return re.sub("[^0-9]", "", timestamp)
+
+    def parse(self, page_xml):
+        """Return the element for one page from <page> to </page>, with at
+        least one revision"""
+
+        page = ElementTree.fromstring(page_xml)
+        if page.find("revision") is None:
+            raise PageRowsErr("page without a revision: %s" % page_xml[:200])
+        return page
+
+    def get_page_id(self, page):
+        return int(self.get_field(page, "id"))
+
+    def get_text_id(self, revision):
+        """Return the text id of a revision: the revision id, as mwxml2sql
+        writes it unless given -i, or with text_ids, the id of the text
+        element, raising PageRowsErr if there is none"""
+
+        if not self.text_ids:
+            return int(self.get_field(revision, "id"))
+        text_elt = revision.find("text")
+        if text_elt is None or not text_elt.get("id"):
+            raise PageRowsErr("no text id for revision %s" % self.get_field(revision, "id"))
+        return int(text_elt.get("id"))
+
+    def get_length(self, revision):
+        text_elt = revision.find("text")
+        if text_elt is None:
+            return 0
+        return int(text_elt.get("bytes", len(self.get_field(revision, "text"))))
+
+    def get_model(self, revision):
+        """Return (content model, content format) of a revision, NULL for the
+        wikitext defaults"""
+
+        model = self.get_field(revision, "model", "wikitext")
+        text_format = self.get_field(revision, "format", "text/x-wiki")
+        return ("NULL" if model == "wikitext" else self.sql_escape(model),
+                "NULL" if text_format == "text/x-wiki" else self.sql_escape(text_format))
+
+    def get_page_row(self, page, latest):
+        """Return the page row for a page element
+        Arguments:
+        page    -- page element
+        latest  -- element of the current revision of the page"""
+
+        page_id = self.get_page_id(page)
+        title = self.get_field(page, "title")
+        ns = self.get_field(page, "ns", "0")
+        # the page table has titles without the namespace prefix, with underscores
+        name = title.split(":", 1)[1] if ns != "0" and ":" in title else title
+        parent = self.get_field(latest, "parentid")
+        return [str(page_id), ns, self.sql_escape(name.replace(" ", "_")), "''",
+                "1" if page.find("redirect") is not None else "0",
+                "0" if parent else "1",
+                "%.14f" % random.Random(page_id).random(),
+                "'%s'" % self.get_timestamp(self.get_field(latest, "timestamp")), "NULL",
+                self.get_field(latest, "id"), str(self.get_length(latest)),
+                self.get_model(latest)[0], "NULL"]
+
+    def get_revision_row(self, page_id, revision):
+        """Return the revision row for a revision element of the page with
+        the given id"""
+
+        deleted = 0
+        contributor = revision.find("contributor")
+        if contributor is None or contributor.get("deleted"):
+            (user_id, user_text) = ("0", "")
+            deleted = deleted | 4
+        elif contributor.find("ip") is not None:
+            (user_id, user_text) = ("0", self.get_field(contributor, "ip"))
+        else:
+            (user_id, user_text) = (self.get_field(contributor, "id", "0"),
+                                    self.get_field(contributor, "username"))
+        comment = revision.find("comment")
+        if comment is not None and comment.get("deleted"):
+            deleted = deleted | 2
+        text_elt = revision.find("text")
+        if text_elt is not None and text_elt.get("deleted"):
+            deleted = deleted | 1
+
+        (model, text_format) = self.get_model(revision)
+        return [self.get_field(revision, "id"), str(page_id), str(self.get_text_id(revision)),
+                self.sql_escape(self.get_field(revision, "comment")), user_id,
+                self.sql_escape(user_text),
+                "'%s'" % self.get_timestamp(self.get_field(revision, "timestamp")),
+                "1" if revision.find("minor") is not None else "0", str(deleted),
+                str(self.get_length(revision)), self.get_field(revision, "parentid") or "NULL",
+                self.sql_escape(self.get_field(revision, "sha1")), model, text_format]
+
+    def get_text_row(self, revision):
+        """Return the text row for a revision element, or None if it comes
+        from a stub, whose text element has an id and a length but no text"""
+
+        text_elt = revision.find("text")
+        if text_elt is not None and text_elt.text is None and text_elt.get("id"):
+            if text_elt.get("bytes") != "0":
+                return None
+        return [str(self.get_text_id(revision)), self.sql_escape(self.get_field(revision, "text")),
+                "'utf-8'"]
+
+    def get_rows(self, page_xml):
+        """Return (page id, revision id, title, dict of table => row values)
+        for one exported page with its current revision
+        Arguments:
+        page_xml  -- XML text of the page, from <page> to </page>"""
+
+        page = self.parse(page_xml)
+        revision = page.find("revision")
+        page_id = self.get_page_id(page)
+        rows = {"page": self.get_page_row(page, revision),
+                "revision": self.get_revision_row(page_id, revision),
+                "text": self.get_text_row(revision)}
+        return (page_id, int(self.get_field(revision, "id")), self.get_field(page, "title"), rows)
@@ -1,11 +1,21 @@
 # -*- coding: utf-8 -*-
+import os
 import re
 import sys
 import getopt
-import urllib
-import json
 import string
+import heapq
+import marshal
+import tempfile
+import multiprocessing
 from wikifile import File
+from extsort import ExternalSort
+from xmlshards import get_shards, get_shard_reader, ShardErr
+from wikinamespaces import Namespaces, NamespaceErr
+from titleindex import TitleIndex
+from sqlrows import InsertReader
+from sqlwriter import RowWriter, SqlWriterErr
+from progress import Progress
 
 
 class WikiContentErr(Exception):
@@ -14,43 +24,40 @@ class WikiContentErr(Exception):
 
 class NsDict(object):
 
-    def __init__(self, lang_code, project, verbose=False):
+    def __init__(self, lang_code, project, verbose=False, dump_path=None, cache_dir=None,
+                 offline=False):
         """Constructor. Arguments:
         lang_code   -- language code of project, like en el etc.
         project    -- type of project, like wiktionary, wikipedia, etc.
-        verbose    --  display progress messages"""
+        verbose    --  display progress messages
+        dump_path  -- XML dump file with siteinfo header from which to read namespaces
+        cache_dir  -- directory with cached namespace information
+        offline    -- never retrieve namespace information from the api"""
         self.lang_code = lang_code
         self.project = project
         self.verbose = verbose
+        self.namespaces = Namespaces(lang_code, project, cache_dir, dump_path, offline, verbose)
+        self.loaded = False
 
     def get_ns_dict(self):
-        """Retrieve namespace informtion for a wiki via the MediaWiki api
-        and store in in dict form.
+        """Retrieve namespace informtion for a wiki, from the cache, from the
+        dump file, or via the MediaWiki api, and store in in dict form.
         On error raises an exception."""
 
-        # http://en.wikipedia.org/w/api.php?action=query&meta=siteinfo&siprop=namespaces&format=json
-        api_url = ("http://" + self.lang_code + "." + self.project + "." +
-                   "org/w/api.php" + "?action=query&meta=siteinfo&siprop=namespaces&format=json")
-        ns_dict = {}
-        ufd = urllib.urlopen(api_url)
-        if str(ufd.getcode()).startswith("2"):
-            output = ufd.read()
-            ufd.close()
-            site_info = json.loads(output)
-            if 'query' not in site_info or 'namespaces' not in site_info['query']:
-                raise WikiContentErr("Error trying to get namespace information from api\n")
-            for k in site_info['query']['namespaces'].keys():
-                if '*' in site_info['query']['namespaces'][k]:
-                    ns_dict[k] = site_info['query']['namespaces'][k]['*'].encode('utf8')
-                else:
-                    raise WikiContentErr("Error trying to get parse namespace information\n")
-            return ns_dict
-        else:
-            code = ufd.getcode()
-            ufd.close()
-            raise WikiContentErr("Error trying to retrieve namespace info: %s\n" % code)
+        if not self.loaded:
+            try:
+                self.namespaces.load()
+            except NamespaceErr as e:
+                raise WikiContentErr(str(e))
+            self.loaded = True
+        return self.namespaces.get_ns_dict()
+
+    def get_ns_dict_by_string(self):
+        """Return dict of namespace name => number including
+        canonical names and aliases"""
 
-        return ns_dict
+        self.get_ns_dict()
+        return self.namespaces.get_ns_dict_by_string()
 
 
 class TitlesDict(object):
@@ -66,7 +73,7 @@ class TitlesDict(object):
         fd = File.open_input(sql_file)
         t = {}
         for line in fd:
-            (pageid, ns, title) = line.split(' ', 3)
+            (pageid, ns, title) = line.rstrip('\n').split(' ', 3)
             ns = int(ns)
             if title in t:
                 t[title][ns] = pageid
@@ -74,20 +81,159 @@ class TitlesDict(object):
                 t[title] = {ns: pageid}
         return t
 
+    @staticmethod
+    def get_page_rows(page_sql_file):
+        """Return a generator of (pageid, nsnum, pagetitle) read straight
+        from the INSERT statements of the page table, without the
+        other columns being parsed out.
+        Arguments:
+        page_sql_file   -- page table sql as written by mysqldump or mwxml2sql"""
+
+        return InsertReader(page_sql_file, ["page_id", "page_namespace", "page_title"]).get_rows()
+
+    def get_titles_dict_from_page_sql(self, page_sql_file):
+        """Arguments:
+        page_sql_file   -- page table sql as written by mysqldump or mwxml2sql"""
+
+        t = {}
+        for (pageid, ns, title) in TitlesDict.get_page_rows(page_sql_file):
+            ns = int(ns)
+            if title in t:
+                t[title][ns] = pageid
+            else:
+                t[title] = {ns: pageid}
+        return t
+
+
+class ShardFile(object):
+    """Rows converted from one shard of the logging file in a worker
+    process, each saved with marshal as (log id, table number, values)
+    so that the parent process can merge the shards in log id order and
+    drop duplicate users across shards.
+    Rows should come in log id order, as they do in logging dumps; if
+    they don't, the shard file is sorted before it is handed back."""
+
+    def __init__(self, path, tmpdir):
+        """Constructor. Arguments:
+        path    -- path of the shard file to write
+        tmpdir  -- directory for temporary sort files"""
+
+        self.path = path
+        self.tmpdir = tmpdir
+        self.fd = open(path, "wb")
+        self.key = None  # log id of the item being written
+        self.last_key = None
+        self.in_order = True
+
+    def write_row(self, table, values):
+        """Save one row for the given table (0 = logging, 1 = user)"""
+
+        if self.last_key is not None and self.key < self.last_key:
+            self.in_order = False
+        self.last_key = self.key
+        marshal.dump((self.key, table, values), self.fd)
+
+    def close(self):
+        """Finish writing, sorting the file if the rows were out of order"""
+
+        self.fd.close()
+        if self.in_order:
+            return
+        sorter = ExternalSort(tmpdir=self.tmpdir)
+        for record in ShardFile.read_records(self.path):
+            sorter.add(record)
+        self.fd = open(self.path, "wb")
+        for record in sorter.sorted():
+            marshal.dump(record, self.fd)
+        self.fd.close()
+        sorter.cleanup()
+
+    @staticmethod
+    def read_records(path):
+        """Generator returning the (log id, table number, values) records
+        in a shard file"""
+
+        in_fd = open(path, "rb")
+        while True:
+            try:
+                yield marshal.load(in_fd)
+            except EOFError:
+                break
+        in_fd.close()
+
+
+class ShardRecords(object):
+    """Used in place of a RowWriter for one table when converting a
+    shard of the logging file; rows go to the shard file"""
+
+    def __init__(self, shard_file, table):
+        """Constructor. Arguments:
+        shard_file  -- ShardFile
+        table       -- table number, 0 for logging, 1 for user"""
+
+        self.shard_file = shard_file
+        self.table = table
+
+    def write_row(self, values):
+        self.shard_file.write_row(self.table, values)
+
+
+# the converter for worker processes to use; set before the pool is
+# created, so forked workers share it and the memory-mapped title index
+# or titles dict it holds, rather than each loading its own copy
+shard_converter = None
+
+
+def convert_shard(shard):
+    """Convert one shard of the logging file in a worker process,
+    returning the path of the shard file written
+    Arguments:
+    shard  -- tuple of (start offset, end offset, tmpdir)"""
+
+    return shard_converter.convert_shard(*shard)
+
 
 class LoggingXml(object):
-    def __init__(self, ns_dict_by_string, titles_dict, xml_file, log_out_file, user_out_file):
+    logging_columns = ["log_id", "log_type", "log_action", "log_timestamp", "log_user",
+                       "log_user_text", "log_namespace", "log_title", "log_page",
+                       "log_comment", "log_params", "log_deleted"]
+    user_columns = ["user_id", "user_name", "user_real_name", "user_password",
+                    "user_newpassword", "user_newpass_time", "user_email", "user_touched",
+                    "user_token", "user_email_authenticated", "user_email_token",
+                    "user_email_token_expires", "user_registration", "user_editcount"]
+
+    def __init__(self, ns_dict_by_string, titles_dict, xml_file, log_out_file, user_out_file,
+                 line_parser=False, output_format="insert", max_rows=1000,
+                 max_bytes=1024 * 1024, jobs=1, verbose=False):
         """Constructor. Arguments:
         ns_dict_by_string  -- hash of nstitle => nsnum
-        titles_dict      -- hash of pagetitle => [pageid, nsnum]
+        titles_dict      -- hash of pagetitle => {nsnum: pageid}, or a TitleIndex
         xml_file         -- path to filename with logging.xml
-        log_out_file      -- path to logging output filename"""
+        log_out_file      -- path to logging output filename
+        user_out_file     -- path to user output filename, or None
+        line_parser      -- read the logging file a line at a time with the
+                            old parser instead of in blocks
+        output_format    -- 'insert' for one INSERT per row, 'extended' for
+                            INSERTs of many rows, 'tabs' for tab-separated
+                            rows for LOAD DATA INFILE
+        max_rows         -- maximum rows per INSERT for extended format
+        max_bytes        -- maximum bytes per INSERT for extended format
+        jobs             -- number of processes converting shards of the
+                            logging file at once
+        verbose          -- report progress on stderr now and then"""
 
         self.ns_dict_by_string = ns_dict_by_string
         self.titles_dict = titles_dict
         self.xml_file = xml_file
         self.log_out_file = log_out_file
         self.user_out_file = user_out_file
+        self.line_parser = line_parser
+        self.output_format = output_format
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.jobs = jobs
+        self.verbose = verbose
+        self.block_size = 1024 * 1024
 
         self.logitem_pattern = "^\s*<logitem>\s*\n$"
         self.compiled_logitem_pattern = re.compile(self.logitem_pattern)
@@ -115,16 +261,48 @@ class LoggingXml(object):
         self.compiled_no_params_pattern = re.compile(self.no_params_pattern)
         self.end_logitem_pattern = "^\s*</logitem>\s*\n$"
         self.compiled_end_logitem_pattern = re.compile(self.end_logitem_pattern)
+        # a whole log item in the usual layout, for get_log_item; element
+        # text is xml-escaped so it never contains <
+        self.compiled_log_item_pattern = re.compile(
+            r'\s*<id>([^<]*)</id>\s*<timestamp>([^<]*)</timestamp>\s*'
+            r'(?:<contributor deleted="deleted"\s*/>|'
+            r'<contributor>\s*<username>([^<]*)</username>\s*<id>([^<]*)</id>\s*</contributor>)\s*'
+            r'(?:<comment deleted="deleted"\s*/>\s*|<comment>([^<]*)</comment>\s*)?'
+            r'<type>([^<]*)</type>\s*<action>([^<]*)</action>\s*'
+            r'(?:<logtitle>([^<]*)</logtitle>|<text deleted="deleted"\s*/>)\s*'
+            r'(?:<params xml:space="preserve"\s*/>\s*|'
+            r'<params xml:space="preserve">([^<]*)</params>\s*)?$')
         self.all = string.maketrans('', '')
         self.nodigs = self.all.translate(self.all, string.digits)
 
+    def get_page_id(self, pagetitle, nsnum):
+        """Return the page id for a title, or the string NULL if it is not
+        in the titles dict or index.
+        Arguments:
+        pagetitle  -- sql escaped title without namespace prefix, in single quotes
+        nsnum      -- namespace number, int or string of digits"""
+
+        if isinstance(self.titles_dict, TitleIndex):
+            pageid = self.titles_dict.get_page_id(nsnum, pagetitle)
+        elif pagetitle in self.titles_dict:
+            pageid = self.titles_dict[pagetitle].get(int(nsnum))
+        else:
+            pageid = None
+        if pageid is None:
+            return "NULL"
+        return pageid
+
     def skip_header(self, fd):
         """skip over mediawiki site header etc"""
         end_header_pattern = "^\s*</siteinfo>"
         compiled_end_header_pattern = re.compile(end_header_pattern)
-        for line in fd:
+        # readline rather than iteration, since the caller goes on with
+        # readline and plain files don't allow mixing the two
+        line = fd.readline()
+        while line:
             if compiled_end_header_pattern.match(line):
                 return True
+            line = fd.readline()
         return False  # never found it
 
     def un_xml_escape(self, title):
@@ -134,6 +312,8 @@ class LoggingXml(object):
         Arguments:
         title   -- title to be desantized"""
 
+        if '&' not in title:
+            return title
         title = title.replace("&quot;", '"')
         title = title.replace("&lt;", '<')
         title = title.replace("&gt;", '>')
@@ -173,7 +353,16 @@ class LoggingXml(object):
     #    <logtitle>Βικιλεξικό:By topic</logtitle>
     #    <params xml:space="preserve" />
     #  </logitem>
-    def do_log_item(self, fd, logout_fd, userout_fd):
+    def get_log_item_by_lines(self, fd):
+        """Read one log item from the logging file a line at a time, and
+        return (logid, timestamp, username, userid, comment, type, action,
+        logtitle, params) with values still xml-escaped, or None at the
+        end of the file.
+        This is the original line by line parser, kept for comparison with
+        get_log_items; it is much slower on large files.
+        Arguments:
+        fd   -- file descriptor positioned after the siteinfo header"""
+
         # note that it's possible for a comment or the params to have an embedded newline in them
         # the rest of the fields, no
 
@@ -181,7 +370,7 @@ class LoggingXml(object):
         result = self.compiled_logitem_pattern.match(line)
         if not result:
             if "</mediawiki" in line:
-                return True  # eof
+                return None  # eof
             else:
                 raise WikiContentErr("bad line in logging file, expected <logitem>, found <%s>\n" % line)
 
@@ -289,6 +478,188 @@ class LoggingXml(object):
         if not result:
             raise WikiContentErr("bad line in logging file, expected </logitem>, found <%s>\n" % line)
 
+        return (logid, timestamp, username, userid, comment, type, action, logtitle, params)
+
+    def get_log_items_by_lines(self, fd):
+        """Generator returning the fields of each log item in the file,
+        as get_log_item_by_lines
+        Arguments:
+        fd   -- file descriptor positioned after the siteinfo header"""
+
+        while True:
+            item = self.get_log_item_by_lines(fd)
+            if item is None:
+                return
+            yield item
+
+    def get_tag_value(self, item, tag, pos):
+        """Return (value, position after the closing tag) for the first
+        <tag>value</tag> in a log item at or after the given position.
+        On error raises an exception.
+        Arguments:
+        item  -- text of the log item
+        tag   -- name of the element
+        pos   -- offset in the item from which to search"""
+
+        start = item.find("<" + tag + ">", pos)
+        if start == -1:
+            raise WikiContentErr("bad log item in logging file, expected <%s>, found <%s>\n"
+                                 % (tag, item))
+        start = start + len(tag) + 2
+        end = item.find("</" + tag + ">", start)
+        if end == -1:
+            raise WikiContentErr("bad log item in logging file, expected </%s>, found <%s>\n"
+                                 % (tag, item))
+        return (item[start:end], end + len(tag) + 3)
+
+    def get_log_item(self, item):
+        """Return (logid, timestamp, username, userid, comment, type, action,
+        logtitle, params) with values still xml-escaped, from the text of one
+        log item; deleted or missing contributor, comment, logtitle and params
+        elements are handled as in get_log_item_by_lines.
+        Arguments:
+        item  -- text between <logitem> and </logitem>"""
+
+        result = self.compiled_log_item_pattern.match(item)
+        if result:
+            (logid, timestamp, username, userid, comment, type, action,
+             logtitle, params) = result.groups()
+            if userid is None:
+                username = ''
+                userid = '0'
+            return (logid, timestamp, username, userid, comment or '', type, action,
+                    logtitle or '', params or '')
+
+        # not the usual layout, find the elements one at a time
+        (logid, pos) = self.get_tag_value(item, "id", 0)
+        (timestamp, pos) = self.get_tag_value(item, "timestamp", pos)
+
+        start = item.find("<contributor", pos)
+        if start == -1:
+            raise WikiContentErr("bad log item in logging file, expected <contributor>, " +
+                                 "found <%s>\n" % item)
+        if item.startswith("<contributor deleted", start):
+            username = ''
+            userid = '0'
+            pos = start + 12
+        else:
+            (username, pos) = self.get_tag_value(item, "username", start)
+            (userid, pos) = self.get_tag_value(item, "id", pos)
+            end = item.find("</contributor>", pos)
+            if end == -1:
+                raise WikiContentErr("bad log item in logging file, expected </contributor>, " +
+                                     "found <%s>\n" % item)
+            pos = end + 14
+
+        # comment may be missing or deleted; its text is xml-escaped so a
+        # tag found after the contributor is an element of this item
+        start = item.find("<comment", pos)
+        if start == -1 or item.startswith("<comment deleted", start):
+            comment = ''
+        else:
+            (comment, pos) = self.get_tag_value(item, "comment", start)
+
+        (type, pos) = self.get_tag_value(item, "type", pos)
+        (action, pos) = self.get_tag_value(item, "action", pos)
+
+        start = item.find("<logtitle>", pos)
+        if start == -1:
+            if "<text deleted" not in item:
+                raise WikiContentErr("bad log item in logging file, expected <logtitle>, " +
+                                     "found <%s>\n" % item)
+            logtitle = ''
+        else:
+            (logtitle, pos) = self.get_tag_value(item, "logtitle", start)
+
+        start = item.find("<params", pos)
+        if start == -1:
+            params = ''
+        else:
+            start = item.find(">", start)
+            if start == -1:
+                raise WikiContentErr("bad log item in logging file, expected " +
+                                     "<params  xml:space=\"preserve\" />, " +
+                                     "found <%s> for %s\n" % (item, logtitle))
+            if item[start - 1] == "/":
+                params = ''
+            else:
+                end = item.find("</params>", start)
+                if end == -1:
+                    raise WikiContentErr("bad log item in logging file, expected </params>, " +
+                                         "found <%s> for %s\n" % (item, logtitle))
+                params = item[start + 1:end]
+
+        return (logid, timestamp, username, userid, comment, type, action, logtitle, params)
+
+    def get_log_items(self, fd, in_header=True, shard=False):
+        """Generator returning the fields of each log item in the file,
+        as get_log_item.
+        The file is read in large blocks and each whole <logitem> element is
+        located with a plain string search, so there is no per-line
+        overhead and multi-line comments and params cost nothing extra.
+        Arguments:
+        fd         -- file descriptor positioned at the start of the file,
+                      or a shard reader from xmlshards
+        in_header  -- whether the siteinfo header must be skipped first;
+                      a shard other than the first starts wherever it
+                      starts, and anything before its first <logitem> is
+                      the tail of an item belonging to the previous shard
+        shard      -- if True, stop at the first item that starts after the
+                      end of the shard, as given by fd.get_shard_length()"""
+
+        block_size = self.block_size
+        buf = ''
+        pos = 0
+        consumed = 0  # bytes read and dropped from the front of buf
+        eof = False
+        while True:
+            if in_header:
+                end = buf.find("</siteinfo>")
+                if end != -1:
+                    in_header = False
+                    pos = end + 11
+                    continue
+            else:
+                start = buf.find("<logitem>", pos)
+                if start != -1 and shard:
+                    shard_length = fd.get_shard_length()
+                    if shard_length is not None and consumed + start >= shard_length:
+                        return  # this one belongs to the next shard
+                if start != -1:
+                    end = buf.find("</logitem>", start + 9)
+                    if end != -1:
+                        yield self.get_log_item(buf[start + 9:end])
+                        pos = end + 10
+                        continue
+                    pos = start
+                elif "</mediawiki" in buf[pos:]:
+                    return
+                else:
+                    # keep enough of the buffer for a tag split across blocks
+                    pos = max(pos, len(buf) - 10)
+            if eof:
+                if in_header:
+                    raise WikiContentErr("failed to find end of mediawiki/siteinfo header in xml file\n")
+                if buf[pos:].strip():
+                    raise WikiContentErr("truncated log item at end of logging file: <%s>\n" % buf[pos:])
+                return
+            block = fd.read(block_size)
+            if not block:
+                eof = True
+            buf = buf[pos:] + block
+            consumed = consumed + pos
+            pos = 0
+
+    def write_log_item(self, item, log_writer, user_writer):
+        """Write the row for one log item, and for its user if that
+        user has not been seen before.
+        Arguments:
+        item         -- tuple of fields as returned by get_log_item
+        log_writer   -- RowWriter for logging table rows
+        user_writer  -- RowWriter for user table rows, or None"""
+
+        (logid, timestamp, username, userid, comment, type, action, logtitle, params) = item
+
         # turn logtitle into pageid, namespace, title-with-no-namespace-prefix
         sep = logtitle.find(":")
         if sep != -1:
@@ -296,79 +667,157 @@ class LoggingXml(object):
             if prefix in self.ns_dict_by_string:
                 pagetitle = self.sql_escape(self.un_xml_escape(logtitle[sep + 1:]))
                 nsnum = self.ns_dict_by_string[prefix]
-                if pagetitle in self.titles_dict:
-                    pageid = self.titles_dict[pagetitle][nsnum]
-                else:
-                    pageid = "NULL"
             else:
                 pagetitle = self.sql_escape(self.un_xml_escape(logtitle))
                 nsnum = 0
-                if pagetitle in self.titles_dict:
-                    pageid = self.titles_dict[pagetitle][0]
-                else:
-                    pageid = "NULL"
         else:
             pagetitle = self.sql_escape(self.un_xml_escape(logtitle))
             nsnum = 0
-            if pagetitle in self.titles_dict:
-                pageid = self.titles_dict[pagetitle][0]
-            else:
-                pageid = "NULL"
+        pageid = self.get_page_id(pagetitle, nsnum)
 
         comment = self.sql_escape(self.un_xml_escape(comment), False)
         username = self.sql_escape(self.un_xml_escape(username), False)
         params = self.sql_escape(self.un_xml_escape(params), False)
 
-        line = ("INSERT INTO logging ( log_id, log_type, log_action, " +
-                "log_timestamp, log_user, log_user_text, log_namespace, " +
-                "log_title, log_page, log_comment, log_params, log_deleted ) VALUES ")
-        logout_fd.write(unicode(line).encode('utf-8'))
-        username = username.decode('utf-8')
-        pagetitle = pagetitle.decode('utf-8')
-        comment = comment.decode('utf-8')
-        params = params.decode('utf-8')
         nsnum = str(nsnum)
         # need 20130425122902, have 2005-07-23T16:43:37Z
         timestamp = timestamp.translate(self.all, self.nodigs)
 
-        line = "( %s );\n" % ", ".join(
+        # the input is utf-8 and so is the output, so the values are
+        # written as they are, without decoding and reencoding them
+        log_writer.write_row(
             [logid, "'" + type + "'", "'" + action + "'", "'" + timestamp + "'",
              userid, username, nsnum, pagetitle, pageid, comment, params, '0'])
-        logout_fd.write(unicode(line).encode('utf-8'))
-
-        if self.user_out_file and userid not in self.user_dict:
-            line = ("INSERT INTO user ( user_id, user_name, user_real_name, " +
-                    "user_password, user_newpassword, user_newpass_time, " +
-                    "user_email, user_touched, user_token, user_email_authenticated, " +
-                    "user_email_token, user_email_token_expires, user_registration, " +
-                    "user_editcount ) VALUES ")
-            userout_fd.write(unicode(line).encode('utf-8'))
-            line = "( %s );\n" % ", ".join(
+
+        if user_writer and userid not in self.user_dict:
+            user_writer.write_row(
                 [userid, username, "''", "''", "''", "NULL", "''",
                  "'20010101000000'", "'6f9b27b447a7fd49bc525e51cc82320b'",
                  "NULL", "NULL", "NULL", "NULL", "0"])
-            userout_fd.write(unicode(line).encode('utf-8'))
 
             self.user_dict[userid] = True
 
-        return False
+    def get_row_writer(self, fd, table, columns):
+        """Return a RowWriter for the table in the output format wanted"""
+
+        try:
+            return RowWriter(fd, table, columns, self.output_format, self.max_rows, self.max_bytes)
+        except SqlWriterErr as e:
+            raise WikiContentErr(str(e))
+
+    def convert_shard(self, start, end, tmpdir):
+        """Convert the log items that begin in one shard of the logging
+        file, saving the rows to a shard file, and return its path.
+        Arguments:
+        start   -- offset of the start of the shard in the logging file
+        end     -- offset of the end of the shard
+        tmpdir  -- directory for the shard file"""
+
+        self.user_dict = {1: True}
+        (fd, path) = tempfile.mkstemp(prefix="logshard-", dir=tmpdir)
+        os.close(fd)
+        shard_file = ShardFile(path, tmpdir)
+        log_records = ShardRecords(shard_file, 0)
+        if self.user_out_file:
+            user_records = ShardRecords(shard_file, 1)
+        else:
+            user_records = None
+        reader = get_shard_reader(self.xml_file, start, end)
+        progress = Progress("converting logging shard at offset %d" % start, "log items",
+                            enabled=self.verbose)
+        for item in self.get_log_items(reader, in_header=(start == 0), shard=True):
+            shard_file.key = int(item[0])
+            self.write_log_item(item, log_records, user_records)
+            progress.update()
+        reader.close()
+        shard_file.close()
+        progress.finish()
+        return path
+
+    def write_sql_sharded(self):
+        """Split the logging file into shards, convert them in a pool of
+        worker processes, and merge the results in log id order, writing
+        each user only once"""
+
+        global shard_converter
+
+        try:
+            shards = get_shards(self.xml_file, self.jobs)
+        except ShardErr as e:
+            raise WikiContentErr(str(e))
+        tmpdir = os.path.dirname(os.path.abspath(self.log_out_file))
+        shards = [(start, end, tmpdir) for (start, end) in shards]
+        if len(shards) == 1:
+            shard_paths = [self.convert_shard(*shards[0])]
+        else:
+            shard_converter = self
+            pool = multiprocessing.Pool(min(self.jobs, len(shards)))
+            try:
+                shard_paths = pool.map(convert_shard, shards)
+            finally:
+                pool.close()
+                pool.join()
+                shard_converter = None
+
+        self.user_dict = {1: True}
+        logout_fd = File.open_output(self.log_out_file)
+        log_writer = self.get_row_writer(logout_fd, "logging", LoggingXml.logging_columns)
+        if self.user_out_file:
+            userout_fd = File.open_output(self.user_out_file)
+            user_writer = self.get_row_writer(userout_fd, "user", LoggingXml.user_columns)
+        progress = Progress("merging converted shards", "rows", enabled=self.verbose)
+        try:
+            for (logid, table, values) in heapq.merge(
+                    *[ShardFile.read_records(path) for path in shard_paths]):
+                progress.update()
+                if table == 0:
+                    log_writer.write_row(values)
+                elif values[0] not in self.user_dict:
+                    user_writer.write_row(values)
+                    self.user_dict[values[0]] = True
+        finally:
+            for path in shard_paths:
+                os.unlink(path)
+        progress.finish()
+        log_writer.close()
+        logout_fd.close()
+        if self.user_out_file:
+            user_writer.close()
+            userout_fd.close()
 
     def write_sql(self):
+        if self.jobs > 1 or self.xml_file.endswith(".bz2"):
+            # the bz2 shard reader also copes with multistream files
+            self.write_sql_sharded()
+            return
         self.user_dict = {1: True}
         fd = File.open_input(self.xml_file)
         logout_fd = File.open_output(self.log_out_file)
+        log_writer = self.get_row_writer(logout_fd, "logging", LoggingXml.logging_columns)
         if self.user_out_file:
             userout_fd = File.open_output(self.user_out_file)
+            user_writer = self.get_row_writer(userout_fd, "user", LoggingXml.user_columns)
         else:
             userout_fd = None
-        if not self.skip_header(fd):
-            raise WikiContentErr("failed to find end of mediawiki/siteinfo header in xml file\n")
-        eof = False
-        while not eof:
-            eof = self.do_log_item(fd, logout_fd, userout_fd)
+            user_writer = None
+        if self.line_parser:
+            if not self.skip_header(fd):
+                raise WikiContentErr("failed to find end of mediawiki/siteinfo header in xml file\n")
+            items = self.get_log_items_by_lines(fd)
+        else:
+            items = self.get_log_items(fd)
+        progress = Progress("converting logging file", "log items", [self.xml_file],
+                            enabled=self.verbose)
+        progress.set_input(fd, self.xml_file)
+        for item in items:
+            self.write_log_item(item, log_writer, user_writer)
+            progress.update()
         fd.close()
+        progress.finish()
+        log_writer.close()
         logout_fd.close()
         if self.user_out_file:
+            user_writer.close()
             userout_fd.close()
         return
 
@@ -381,8 +830,12 @@ def usage(message=None):
         sys.stderr.write(message)
         sys.stderr.write("\n")
     usage_message = """Usage: python pageslogging2sql.py --lang langcode --project filename
-           --sqlfile filename --logfile filename --logout filename
-           [--userout filename]
+           --sqlfile filename|--pagesql filename
+           --logfile filename --logout filename
+           [--userout filename] [--titleindex filename]
+           [--nscache dirname] [--offline]
+           [--format insert|extended|tabs] [--maxrows number] [--maxbytes number]
+           [--jobs number] [--verbose]
 
 This script converts a pages-logging.xml file to an sql file suitable
 for import into the logging table of a MediaWiki installation.
@@ -402,6 +855,16 @@ Options:
                should be sql escaped as it would be if written out by
                mysqldump, and it should not contain the namespace
                prefix.
+               This may be omitted if --titleindex names an existing index.
+--pagesql      path to the sql dump of the page table, as downloaded or
+               as written by mwxml2sql; page ids, namespaces and titles are
+               read directly from it, so there is no need to extract them to
+               an sqlfile first. Use this or sqlfile but not both.
+--titleindex   path to a compact on-disk index of page titles and ids; if it
+               does not exist, it is built from the sqlfile and saved here,
+               and later runs will use it without reading the sqlfile again.
+               If this option is not given, all titles from the sqlfile
+               are loaded into memory instead.
 --loggingfile  path to the xml pages-logging file to be converted
 --logout       path to the file where the converted sql will be written
 --userout      path to file where fake user table sql will be written, if
@@ -413,6 +876,31 @@ Options:
                Make sure that there are no other users except uid 1 already
                in the table and that the username is not in the produced sql
                BEFORE using it for import
+--nscache      directory in which namespace information for the wiki is cached;
+               if the cache has no entry for the wiki, namespaces are read from
+               the siteinfo header of the logging file, and failing that from
+               the MediaWiki api, in which case they are saved to the cache
+--offline      never contact the wiki for namespace information
+--format       how rows are written to the logout and userout files:
+               insert    one INSERT statement per row (default)
+               extended  INSERT statements of many rows each, see maxrows and
+                         maxbytes; much faster to import
+               tabs      tab-separated rows in the format written by sql2txt,
+                         ready for LOAD DATA INFILE or fifo_to_mysql.pl
+                         without converting them first
+--maxrows      maximum number of rows in one INSERT for format extended,
+               default 1000
+--maxbytes     maximum number of bytes of row data in one INSERT for format
+               extended, default 1048576; keep this well under the
+               max_allowed_packet setting of the MySQL server
+--jobs         number of processes to convert the logging file with, default 1;
+               the file is split into that many shards, at any point for an
+               uncompressed file and between streams for a bz2 multistream
+               file, and the converted shards are merged in log id order.
+               gz compressed files can't be split, so decompress them first.
+--verbose      report the progress of the conversion every few seconds, with
+               log items per second, bytes of the logging file read per second
+               and an estimate of the time left
 """
     sys.stderr.write(usage_message)
     sys.exit(1)
@@ -422,13 +910,24 @@ def do_main():
     lang_code = None
     project = None
     sql_file = None
+    page_sql_file = None
     logging_file = None
     log_out_file = None
     user_out_file = None
+    title_index_file = None
+    ns_cache_dir = None
+    offline = False
+    output_format = "insert"
+    max_rows = 1000
+    max_bytes = 1024 * 1024
+    jobs = 1
+    verbose = False
 
     try:
         (options, remainder) = getopt.gnu_getopt(
-            sys.argv[1:], "", ["lang=", "project=", "sqlfile=", "loggingfile=", "logout=", "userout="])
+            sys.argv[1:], "", ["lang=", "project=", "sqlfile=", "pagesql=", "loggingfile=", "logout=",
+                               "userout=", "titleindex=", "nscache=", "offline", "format=",
+                               "maxrows=", "maxbytes=", "jobs=", "verbose"])
     except getopt.GetoptError as e:
         usage(e.msg)
 
@@ -441,12 +940,35 @@ def do_main():
             project = val
         elif opt == "--sqlfile":
             sql_file = val
+        elif opt == "--pagesql":
+            page_sql_file = val
         elif opt == "--loggingfile":
             logging_file = val
         elif opt == "--logout":
             log_out_file = val
         elif opt == "--userout":
             user_out_file = val
+        elif opt == "--titleindex":
+            title_index_file = val
+        elif opt == "--nscache":
+            ns_cache_dir = val
+        elif opt == "--offline":
+            offline = True
+        elif opt == "--verbose":
+            verbose = True
+        elif opt == "--format":
+            if val not in RowWriter.modes:
+                usage("format must be one of %s" % ", ".join(RowWriter.modes))
+            output_format = val
+        elif opt in ["--maxrows", "--maxbytes", "--jobs"]:
+            if not val.isdigit() or not int(val):
+                usage("%s requires a positive number" % opt)
+            if opt == "--maxrows":
+                max_rows = int(val)
+            elif opt == "--maxbytes":
+                max_bytes = int(val)
+            else:
+                jobs = int(val)
         else:
             usage("Unknown option specified: %s" % opt)
 
@@ -455,7 +977,10 @@ def do_main():
 
     if not lang_code:
         usage("Missing mandatory option <%s>" % "lang")
-    if not sql_file:
+    if sql_file and page_sql_file:
+        usage("Only one of the options sqlfile and pagesql may be specified")
+    have_index = title_index_file and os.path.exists(title_index_file)
+    if not sql_file and not page_sql_file and not have_index:
         usage("Missing mandatory option <%s>" % "sqlfile")
     if not project:
         usage("Missing mandatory option <%s>" % "project")
@@ -464,16 +989,29 @@ def do_main():
     if not log_out_file:
         usage("Missing mandatory option <%s>" % "logout")
 
-    ns = NsDict(lang_code, project)
-    ns_dict = ns.get_ns_dict()
-
-    ns_dict_by_string = {}
-    for nsnum in ns_dict.keys():
-        ns_dict_by_string[ns_dict[nsnum]] = nsnum
+    # the logging file has the namespaces in its siteinfo header
+    ns = NsDict(lang_code, project, dump_path=logging_file, cache_dir=ns_cache_dir,
+                offline=offline)
+    ns_dict_by_string = ns.get_ns_dict_by_string()
 
-    td = TitlesDict(ns_dict_by_string)
-    titles_dict = td.get_titles_dict(sql_file)
-    lx = LoggingXml(ns_dict_by_string, titles_dict, logging_file, log_out_file, user_out_file)
+    if title_index_file:
+        if not os.path.exists(title_index_file):
+            if page_sql_file:
+                entries = TitlesDict.get_page_rows(page_sql_file)
+            else:
+                entries = TitleIndex.read_titles_file(sql_file)
+            TitleIndex.build(entries, title_index_file,
+                             tmpdir=os.path.dirname(os.path.abspath(title_index_file)))
+        titles_dict = TitleIndex(title_index_file)
+    else:
+        td = TitlesDict(ns_dict_by_string)
+        if page_sql_file:
+            titles_dict = td.get_titles_dict_from_page_sql(page_sql_file)
+        else:
+            titles_dict = td.get_titles_dict(sql_file)
+    lx = LoggingXml(ns_dict_by_string, titles_dict, logging_file, log_out_file, user_out_file,
+                    output_format=output_format, max_rows=max_rows, max_bytes=max_bytes,
+                    jobs=jobs, verbose=verbose)
     lx.write_sql()
 
 
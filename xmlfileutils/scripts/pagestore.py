@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+import re
+import zlib
+import sqlite3
+
+
+class PageStoreErr(Exception):
+    pass
+
+
+class PageStore(object):
+    """Local store of page content as exported from a wiki, one entry per
+    page keyed by page id and holding the revision id of the text stored,
+    so that a later retrieval of the same pages need only export those whose
+    current revision (lastrevid from prop=info) is not the one stored.
+    Content files are then put together from the store.
+
+    The store is an sqlite file with the XML of each page, from <page> to
+    </page>, zlib-compressed, along with the siteinfo header of the last
+    export stored. Several processes may use the same store at once, as
+    wikicontent2sql.py does; they wait for each other's writes."""
+
+    page_pattern = re.compile("^  <page>\n.*?^  </page>\n", re.M | re.S)
+    # the page id is indented less than the revision and contributor ids
+    page_id_pattern = re.compile("^    <id>([0-9]+)</id>$", re.M)
+    rev_id_pattern = re.compile("^      <id>([0-9]+)</id>$", re.M)
+    title_pattern = re.compile("<title>([^<]*)</title>")
+
+    def __init__(self, path, timeout=600):
+        """Constructor. Opens the store, creating it if it does not exist.
+        Arguments:
+        path     -- path to the sqlite file
+        timeout  -- seconds to wait for another process writing to the store"""
+
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=timeout)
+        self.db.text_factory = str
+        self.db.execute("CREATE TABLE IF NOT EXISTS pages (page_id INTEGER PRIMARY KEY, "
+                        "rev_id INTEGER NOT NULL, title TEXT NOT NULL, xml BLOB NOT NULL)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value BLOB)")
+        self.db.commit()
+
+    def get_header(self):
+        """Return the XML header, up to and including </siteinfo>, stored
+        with the pages, or None if nothing has been stored yet"""
+
+        row = self.db.execute("SELECT value FROM meta WHERE name = 'header'").fetchone()
+        return str(row[0]) if row else None
+
+    def set_header(self, header):
+        self.db.execute("INSERT OR REPLACE INTO meta VALUES ('header', ?)", (buffer(header),))
+        self.db.commit()
+
+    def get_rev_ids(self, page_ids):
+        """Return a dict of page id => revision id stored, for those of the
+        given page ids that are in the store
+        Arguments:
+        page_ids  -- list of page ids, as ints or strings of digits"""
+
+        rev_ids = {}
+        page_ids = [int(page_id) for page_id in page_ids]
+        # sqlite allows no more than 999 parameters in a query
+        for start in range(0, len(page_ids), 500):
+            batch = page_ids[start:start + 500]
+            rows = self.db.execute("SELECT page_id, rev_id FROM pages WHERE page_id IN (%s)"
+                                   % ",".join(["?"] * len(batch)), batch)
+            rev_ids.update(dict(rows.fetchall()))
+        return rev_ids
+
+    def add_pages(self, pages):
+        """Store pages, replacing any already stored with the same page ids.
+        Returns the page ids, as ints, in the order given.
+        Arguments:
+        pages   -- XML text of one or more complete pages, as exported"""
+
+        rows = []
+        for page in PageStore.page_pattern.findall(pages):
+            page_id = PageStore.page_id_pattern.search(page)
+            rev_id = PageStore.rev_id_pattern.search(page)
+            title = PageStore.title_pattern.search(page)
+            if page_id is None or rev_id is None or title is None:
+                raise PageStoreErr("page without a title, page id or revision id in export: %s"
+                                   % page[:200])
+            rows.append((int(page_id.group(1)), int(rev_id.group(1)), title.group(1),
+                         buffer(zlib.compress(page))))
+        self.db.executemany("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?)", rows)
+        self.db.commit()
+        return [row[0] for row in rows]
+
+    def write_content(self, output_fd, page_ids):
+        """Write a content file with the stored pages for the given page ids,
+        in page id order, with the stored header and the closing tag.
+        Returns the number of pages written.
+        Arguments:
+        output_fd  -- open file to write to
+        page_ids   -- set of page ids as ints"""
+
+        header = self.get_header()
+        if header is None:
+            raise PageStoreErr("no header in page store %s, nothing was ever stored" % self.path)
+        output_fd.write(header)
+        count = 0
+        # only the wanted pages are read, batches of them in order, since
+        # the store may be shared and hold many more
+        page_ids = sorted(page_ids)
+        for start in range(0, len(page_ids), 500):
+            batch = page_ids[start:start + 500]
+            rows = self.db.execute("SELECT xml FROM pages WHERE page_id IN (%s) ORDER BY page_id"
+                                   % ",".join(["?"] * len(batch)), batch)
+            for (xml,) in rows:
+                output_fd.write(zlib.decompress(xml))
+                count = count + 1
+        output_fd.write("</mediawiki>\n")
+        return count
+
+    def get_page_count(self):
+        return self.db.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+
+    def close(self):
+        self.db.close()
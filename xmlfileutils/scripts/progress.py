@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import time
+
+
+class Progress(object):
+    """Report now and then on stderr how far a loop over a large input
+    has got: items done and per second, input bytes read and per second,
+    and an estimate of the time left, from the size of the input files
+    or from the number of items expected.
+    The clock is only looked at every check_every items, so that calling
+    update() for each item of a hot loop costs next to nothing; with
+    enabled unset it costs a decrement and a comparison."""
+
+    def __init__(self, name, unit="items", paths=None, total_items=None, enabled=True,
+                 interval=10, check_every=1000):
+        """Constructor. Arguments:
+        name         -- what is being done, shown at the start of each report
+        unit         -- what the items are called, e.g. pages
+        paths        -- list of the input files that will be read, in order, or None;
+                        their combined size is used for the estimate of time left
+        total_items  -- number of items expected, used for the estimate if
+                        there are no input paths
+        enabled      -- if not set, nothing is reported
+        interval     -- minimum seconds between reports
+        check_every  -- number of items between looks at the clock"""
+
+        self.name = name
+        self.unit = unit
+        self.paths = paths or []
+        self.total_items = total_items
+        self.enabled = enabled
+        self.interval = interval
+        self.check_every = check_every
+        self.total_bytes = sum([os.path.getsize(path) for path in self.paths])
+        self.count = 0
+        self.countdown = check_every if enabled else sys.maxint
+        self.start = time.time()
+        self.last_report = self.start
+        self.input_fd = None
+        self.input_path = None
+        self.input_fdnum = None
+        self.done_bytes = 0  # size of the input files finished with
+
+    def set_input(self, fd, path):
+        """Note that the loop has gone on to reading this input file, as
+        opened by File.open_input; the files before it count as read"""
+
+        if self.input_path is not None:
+            self.done_bytes = self.done_bytes + os.path.getsize(self.input_path)
+        self.input_fd = fd
+        self.input_path = path
+        self.input_fdnum = None
+
+    def get_fd_offset(self):
+        """Return the offset in the file of the descriptor open on the input
+        path, for file objects that don't give access to their raw file"""
+
+        if self.input_fdnum is None:
+            real_path = os.path.realpath(self.input_path)
+            for fdnum in os.listdir("/proc/self/fd"):
+                try:
+                    if os.readlink("/proc/self/fd/" + fdnum) == real_path:
+                        self.input_fdnum = fdnum
+                        break
+                except OSError:
+                    continue
+            else:
+                return None
+        fdinfo = open("/proc/self/fdinfo/" + self.input_fdnum)
+        lines = fdinfo.readlines()
+        fdinfo.close()
+        for line in lines:
+            if line.startswith("pos:"):
+                return int(line.split()[1])
+        return None
+
+    def get_offset(self):
+        """Return the number of bytes of the input files read so far,
+        counting compressed bytes for compressed files, or None if unknown"""
+
+        if self.input_fd is None:
+            return None
+        try:
+            if hasattr(self.input_fd, "fileobj"):
+                # gzip, whose own tell() counts uncompressed bytes
+                offset = self.input_fd.fileobj.tell()
+            elif isinstance(self.input_fd, file):
+                offset = self.input_fd.tell()
+            else:
+                # bz2
+                offset = self.get_fd_offset()
+        except (IOError, OSError, ValueError, AttributeError):
+            return None
+        if offset is None:
+            return None
+        return self.done_bytes + offset
+
+    def update(self, count=1):
+        """Count items done, reporting if it is time to"""
+
+        self.count = self.count + count
+        self.countdown = self.countdown - count
+        if self.countdown <= 0:
+            self.countdown = self.check_every
+            if time.time() - self.last_report >= self.interval:
+                self.report()
+
+    def format_seconds(self, seconds):
+        return "%d:%02d:%02d" % (seconds // 3600, seconds % 3600 // 60, seconds % 60)
+
+    def get_report(self):
+        """Return a line saying how far we have got"""
+
+        now = time.time()
+        elapsed = max(now - self.start, 0.001)
+        remaining = None
+        offset = self.get_offset()
+        if offset is None and self.total_items:
+            text = "%s: %d of %d %s (%.1f%%), %.1f %s/s" % (
+                self.name, self.count, self.total_items, self.unit,
+                100.0 * self.count / self.total_items, self.count / elapsed, self.unit)
+            if self.count:
+                remaining = (self.total_items - self.count) * elapsed / self.count
+        else:
+            text = "%s: %d %s, %.1f %s/s" % (
+                self.name, self.count, self.unit, self.count / elapsed, self.unit)
+        if offset is not None:
+            text = text + ", %.1f MB" % (offset / 1048576.0)
+            if self.total_bytes:
+                text = text + " of %.1f MB (%.1f%%)" % (
+                    self.total_bytes / 1048576.0, 100.0 * offset / self.total_bytes)
+                if offset:
+                    remaining = (self.total_bytes - offset) * elapsed / offset
+            text = text + " read, %.1f MB/s" % (offset / elapsed / 1048576.0)
+        if remaining is not None:
+            text = text + ", ETA %s" % self.format_seconds(max(remaining, 0))
+        return text
+
+    def report(self):
+        self.last_report = time.time()
+        sys.stderr.write(self.get_report() + "\n")
+
+    def finish(self):
+        """Report the totals once the loop is done"""
+
+        if not self.enabled:
+            return
+        sys.stderr.write("%s: done, %d %s in %s\n" % (
+            self.name, self.count, self.unit, self.format_seconds(time.time() - self.start)))
@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+import sys
+import json
+import time
+import threading
+
+
+def get_url_class(url):
+    """Return the kind of request a url makes, for grouping request
+    metrics: 'export', 'login', or the api module, e.g. 'list=embeddedin'"""
+
+    if "Special:Export" in url or re.search(r"[?&]export(&|$)", url):
+        return "export"
+    for param in ["list", "prop", "meta", "action"]:
+        result = re.search(r"[?&]%s=([^&]+)" % param, url)
+        if result and result.group(1) != "query":
+            return "%s=%s" % (param, result.group(1))
+    return "other"
+
+
+class Histogram(object):
+    """Count observed values in buckets with the given upper bounds,
+    as Prometheus histograms do"""
+
+    def __init__(self, bounds):
+        """Constructor. Arguments:
+        bounds  -- ascending list of bucket upper bounds"""
+
+        self.bounds = bounds
+        self.counts = [0] * len(bounds)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        for i in range(len(self.bounds)):
+            if value <= self.bounds[i]:
+                self.counts[i] = self.counts[i] + 1
+                break
+        self.count = self.count + 1
+        self.sum = self.sum + value
+
+    def get_cumulative(self):
+        """Return a list of (bound, count of values <= bound), ending with +Inf"""
+
+        result = []
+        total = 0
+        for (bound, count) in zip(self.bounds, self.counts):
+            total = total + count
+            result.append((bound, total))
+        result.append(("+Inf", self.count))
+        return result
+
+    def to_dict(self):
+        return {"buckets": [[str(bound), count] for (bound, count) in self.get_cumulative()],
+                "count": self.count, "sum": self.sum}
+
+
+class RequestStats(object):
+    """Totals and histograms for requests of one url class"""
+
+    seconds_bounds = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120]
+    bytes_bounds = [1024, 10240, 102400, 1048576, 10485760, 104857600]
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.lagged = 0  # responses saying the databases were lagged
+        self.reused = 0  # requests sent on an already open connection
+        self.bytes = 0
+        self.ttfb_seconds = 0  # waiting for the response to start
+        self.transfer_seconds = 0  # reading the response after that
+        self.lag_wait_seconds = 0  # sleeping before retries after lagged responses
+        self.ttfb = Histogram(RequestStats.seconds_bounds)
+        self.latency = Histogram(RequestStats.seconds_bounds)
+        self.size = Histogram(RequestStats.bytes_bounds)
+
+    def add(self, trace):
+        self.requests = self.requests + 1
+        if trace['error']:
+            self.errors = self.errors + 1
+        if trace['lagged']:
+            self.lagged = self.lagged + 1
+        if trace['reused']:
+            self.reused = self.reused + 1
+        self.bytes = self.bytes + trace['bytes']
+        self.size.observe(trace['bytes'])
+        self.latency.observe(trace['latency'])
+        if trace['ttfb'] is not None:
+            self.ttfb.observe(trace['ttfb'])
+            self.ttfb_seconds = self.ttfb_seconds + trace['ttfb']
+            self.transfer_seconds = self.transfer_seconds + trace['latency'] - trace['ttfb']
+
+    def get_limit(self):
+        """Return which of latency, bandwidth or maxlag the time for these
+        requests mostly went to"""
+
+        times = [(self.ttfb_seconds, "latency"), (self.transfer_seconds, "bandwidth"),
+                 (self.lag_wait_seconds, "maxlag")]
+        return max(times)[1] if self.requests else None
+
+    def to_dict(self):
+        return {"requests": self.requests, "errors": self.errors, "lagged": self.lagged,
+                "reused_connections": self.reused, "bytes": self.bytes,
+                "ttfb_seconds": self.ttfb_seconds, "transfer_seconds": self.transfer_seconds,
+                "lag_wait_seconds": self.lag_wait_seconds,
+                "bytes_per_transfer_second": (self.bytes / self.transfer_seconds
+                                              if self.transfer_seconds else None),
+                "limited_by": self.get_limit(),
+                "ttfb": self.ttfb.to_dict(), "latency": self.latency.to_dict(),
+                "size": self.size.to_dict()}
+
+
+class RequestMetrics(object):
+    """Collect a record for each http request made to a wiki, optionally
+    writing each one out as a line of json, and keep totals and histograms
+    per url class; these are written as json and as a Prometheus textfile
+    (for the node exporter textfile collector) every so often while the
+    run goes on and once more at the end."""
+
+    prefix = "wikiretriever"
+
+    def __init__(self, wiki, json_path=None, prom_path=None, trace_path=None, interval=60):
+        """Constructor. Arguments:
+        wiki        -- host name of the wiki, used as a label
+        json_path   -- path to the json file of totals and histograms, or None
+        prom_path   -- path to the Prometheus textfile, or None
+        trace_path  -- path to the file of per-request json records, or None
+        interval    -- seconds between writes of the totals during the run"""
+
+        self.wiki = wiki
+        self.json_path = json_path
+        self.prom_path = prom_path
+        self.interval = interval
+        self.start = time.time()
+        self.last_write = self.start
+        self.stats = {}  # url class -> RequestStats
+        self.trace_fd = open(trace_path, "a") if trace_path else None
+        # connections in several threads may share the metrics
+        self.lock = threading.Lock()
+
+    def get_stats(self, url_class):
+        if url_class not in self.stats:
+            self.stats[url_class] = RequestStats()
+        return self.stats[url_class]
+
+    def add(self, trace):
+        """Record one request.
+        Arguments:
+        trace  -- dict with url_class, method, status, bytes, ttfb (seconds to the
+                  response headers, None if there was no response), latency
+                  (seconds for the whole request), lagged, reused, error"""
+
+        with self.lock:
+            self.get_stats(trace['url_class']).add(trace)
+            if self.trace_fd:
+                record = dict(trace)
+                record['time'] = time.time()
+                self.trace_fd.write(json.dumps(record, sort_keys=True) + "\n")
+            self.write_if_due()
+
+    def add_lag_wait(self, url_class, seconds):
+        """Record time spent waiting before retrying after a lagged response"""
+
+        with self.lock:
+            stats = self.get_stats(url_class)
+            stats.lag_wait_seconds = stats.lag_wait_seconds + seconds
+
+    def write_if_due(self):
+        if time.time() - self.last_write >= self.interval:
+            self.write()
+
+    def get_summary(self):
+        return {"wiki": self.wiki, "elapsed_seconds": time.time() - self.start,
+                "url_classes": dict([(url_class, stats.to_dict())
+                                     for (url_class, stats) in self.stats.items()])}
+
+    def get_prometheus(self):
+        """Return the metrics in the Prometheus text exposition format"""
+
+        lines = []
+        counters = [("requests_total", "requests", "http requests made"),
+                    ("request_errors_total", "errors", "requests which failed"),
+                    ("lagged_responses_total", "lagged", "responses saying the databases were lagged"),
+                    ("reused_connections_total", "reused", "requests sent on an open connection"),
+                    ("response_bytes_total", "bytes", "bytes of response bodies read"),
+                    ("lag_wait_seconds_total", "lag_wait_seconds",
+                     "seconds waited before retrying lagged requests")]
+        for (name, attr, text) in counters:
+            name = "%s_%s" % (RequestMetrics.prefix, name)
+            lines.append("# HELP %s %s" % (name, text))
+            lines.append("# TYPE %s counter" % name)
+            for url_class in sorted(self.stats):
+                lines.append('%s{%s} %s' % (name, self.get_labels(url_class),
+                                            getattr(self.stats[url_class], attr)))
+        histograms = [("ttfb_seconds", "ttfb", "seconds from sending a request to its response headers"),
+                      ("request_seconds", "latency", "seconds for the whole request"),
+                      ("response_size_bytes", "size", "bytes in each response body")]
+        for (name, attr, text) in histograms:
+            name = "%s_%s" % (RequestMetrics.prefix, name)
+            lines.append("# HELP %s %s" % (name, text))
+            lines.append("# TYPE %s histogram" % name)
+            for url_class in sorted(self.stats):
+                histogram = getattr(self.stats[url_class], attr)
+                labels = self.get_labels(url_class)
+                for (bound, count) in histogram.get_cumulative():
+                    lines.append('%s_bucket{%s,le="%s"} %d' % (name, labels, bound, count))
+                lines.append('%s_sum{%s} %s' % (name, labels, histogram.sum))
+                lines.append('%s_count{%s} %d' % (name, labels, histogram.count))
+        return "\n".join(lines) + "\n"
+
+    def get_labels(self, url_class):
+        return 'wiki="%s",url_class="%s"' % (self.wiki, url_class.replace('"', '\\"'))
+
+    def write_file(self, path, contents):
+        """Write the file so that readers never see it half written"""
+
+        temp_path = path + ".tmp"
+        out_fd = open(temp_path, "w")
+        out_fd.write(contents)
+        out_fd.close()
+        os.rename(temp_path, path)
+
+    def write(self):
+        """Write the totals and histograms to the json and Prometheus files"""
+
+        self.last_write = time.time()
+        try:
+            if self.json_path:
+                self.write_file(self.json_path,
+                                json.dumps(self.get_summary(), indent=2, sort_keys=True) + "\n")
+            if self.prom_path:
+                self.write_file(self.prom_path, self.get_prometheus())
+        except IOError as e:
+            # metrics are not worth failing the retrieval over
+            sys.stderr.write("failed to write request metrics: %s\n" % str(e))
+        if self.trace_fd:
+            self.trace_fd.flush()
+
+    def close(self):
+        """Write everything out for the last time"""
+
+        self.write()
+        if self.trace_fd:
+            self.trace_fd.close()
+            self.trace_fd = None
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+import re
+from wikifile import File
+
+
+class SqlRowsErr(Exception):
+    pass
+
+
+class InsertReader(object):
+    """Read rows from the INSERT statements of an sql file, as written by
+    mysqldump (CREATE TABLE followed by INSERT INTO `table` VALUES (...),(...);
+    with many tuples per line) or by mwxml2sql (INSERT INTO table (col, col...)
+    VALUES followed by one tuple per line), returning only the wanted columns.
+    Fields after the last wanted column of each row are skipped over by a
+    single regular expression match rather than being split out one by one.
+    Values are returned as they appear in the sql: strings are still
+    sql-escaped and enclosed in single quotes, NULL is the string NULL.
+    Lines other than rows and INSERT statements (comments, CREATE TABLE, locks
+    and so on) are kept, so that the file can be written out again."""
+
+    def __init__(self, sql_path, columns):
+        """Constructor. Arguments:
+        sql_path  -- path to possibly compressed sql file
+        columns   -- list of names of the columns wanted, in the order in
+                     which they should be returned"""
+
+        self.sql_path = sql_path
+        self.columns = columns
+        self.positions = None  # column number for each wanted column
+        self.last_position = None
+        self.primary_key = None  # from CREATE TABLE, if the file has one
+        self.insert_head = None  # INSERT INTO ... VALUES of the first statement
+        self.transactions = False  # whether INSERTs are wrapped in BEGIN; COMMIT;
+        self.preamble = []  # other lines before the first INSERT
+        self.postamble = []  # other lines after the first INSERT
+
+        # format:  `page_id` int(10) unsigned NOT NULL AUTO_INCREMENT,
+        self.create_column_pattern = re.compile(r"^\s*`([^`]+)`")
+        # format:  PRIMARY KEY (`cl_from`,`cl_to`),
+        self.primary_key_pattern = re.compile(r"^\s*PRIMARY KEY\s*\(([^)]*)\)")
+        # format: INSERT INTO `page` VALUES (
+        #         INSERT  INTO page (page_id, page_namespace, page_title, ...) VALUES
+        self.insert_pattern = re.compile(r"^INSERT\s+(?:IGNORE\s+)?INTO\s+`?[^`\s(]+`?\s*"
+                                         r"(?:\((?P<c>[^)]*)\))?\s*VALUES\s*")
+        self.tuple_start_pattern = re.compile(r"[\s,]*\(")
+        # a field is a quoted string with backslash escapes, or anything up to , or )
+        self.field_pattern = re.compile(r"\s*('[^'\\]*(?:\\.[^'\\]*)*'|[^,)]*?)\s*([,)])")
+        # everything to the end of the tuple, stepping over quoted strings
+        self.rest_pattern = re.compile(r"(?:'[^'\\]*(?:\\.[^'\\]*)*'|[^')])*\)")
+
+    def set_positions(self, column_names):
+        """Work out where the wanted columns are in each row, given the
+        names of all the columns in the table, in order"""
+
+        column_names = [c.strip().strip('`') for c in column_names]
+        try:
+            self.positions = [column_names.index(c) for c in self.columns]
+        except ValueError:
+            raise SqlRowsErr("sql file %s does not have all of the columns %s\n"
+                             % (self.sql_path, ", ".join(self.columns)))
+        self.last_position = max(self.positions)
+
+    def get_rows_from_line(self, line, pos, with_text=False):
+        """Generator returning a tuple of wanted values for each row in the line
+        Arguments:
+        line       -- line of sql text
+        pos        -- offset in the line where the first tuple starts
+        with_text  -- return (values, text of the whole row) instead"""
+
+        field_match = self.field_pattern.match
+        tuple_start_match = self.tuple_start_pattern.match
+        last_position = self.last_position
+        while True:
+            result = tuple_start_match(line, pos)
+            if not result:
+                return
+            row_start = result.end() - 1
+            pos = result.end()
+            values = []
+            for i in range(last_position + 1):
+                result = field_match(line, pos)
+                if not result:
+                    raise SqlRowsErr("bad tuple in sql file %s: %s\n"
+                                     % (self.sql_path, line[pos:pos + 80]))
+                values.append(result.group(1))
+                pos = result.end()
+                if result.group(2) == ')':
+                    break
+            if len(values) <= last_position:
+                raise SqlRowsErr("short tuple in sql file %s: %s\n"
+                                 % (self.sql_path, line[max(pos - 80, 0):pos]))
+            if result.group(2) == ',':
+                result = self.rest_pattern.match(line, pos)
+                if not result:
+                    raise SqlRowsErr("unterminated tuple in sql file %s: %s\n"
+                                     % (self.sql_path, line[pos:pos + 80]))
+                pos = result.end()
+            if with_text:
+                yield (tuple([values[p] for p in self.positions]), line[row_start:pos])
+            else:
+                yield tuple([values[p] for p in self.positions])
+
+    def get_primary_key(self):
+        """Return the list of primary key columns from the CREATE TABLE
+        statement of the file, or None if there is none before the
+        first INSERT"""
+
+        fd = File.open_input(self.sql_path)
+        primary_key = None
+        for line in fd:
+            if line.startswith("INSERT"):
+                break
+            result = self.primary_key_pattern.match(line)
+            if result:
+                primary_key = [c.strip().strip('`') for c in result.group(1).split(',')]
+                break
+        fd.close()
+        return primary_key
+
+    def keep_line(self, line):
+        """Save a line that is not part of an INSERT"""
+
+        if line.rstrip() in ["BEGIN;", "COMMIT;"]:
+            self.transactions = True
+        elif self.insert_head is None:
+            self.preamble.append(line)
+        else:
+            self.postamble.append(line)
+
+    def get_rows(self, with_text=False):
+        """Generator returning a tuple of the wanted values for each row
+        in the sql file, in file order
+        Arguments:
+        with_text  -- return (values, text of the whole row) for each row,
+                      where the text is the tuple with its parentheses"""
+
+        fd = File.open_input(self.sql_path)
+        create_columns = None
+        for line in fd:
+            if line.startswith("CREATE TABLE"):
+                create_columns = []
+                self.keep_line(line)
+            elif create_columns is not None:
+                if line.startswith(")"):
+                    self.set_positions(create_columns)
+                    create_columns = None
+                else:
+                    result = self.create_column_pattern.match(line)
+                    if result:
+                        create_columns.append(result.group(1))
+                    else:
+                        result = self.primary_key_pattern.match(line)
+                        if result:
+                            self.primary_key = [c.strip().strip('`') for c in result.group(1).split(',')]
+                self.keep_line(line)
+            elif line.startswith("INSERT"):
+                result = self.insert_pattern.match(line)
+                if not result:
+                    self.keep_line(line)
+                    continue
+                if self.insert_head is None:
+                    self.insert_head = line[:result.end()].rstrip()
+                if result.group('c'):
+                    self.set_positions(result.group('c').split(','))
+                elif self.positions is None:
+                    raise SqlRowsErr("no column names found for INSERT in sql file %s\n" % self.sql_path)
+                for row in self.get_rows_from_line(line, result.end(), with_text):
+                    yield row
+            elif line.startswith("(") and self.positions is not None:
+                # tuple on a line by itself, continuing an INSERT
+                for row in self.get_rows_from_line(line, 0, with_text):
+                    yield row
+            else:
+                self.keep_line(line)
+        fd.close()
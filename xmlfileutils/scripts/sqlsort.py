@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+import sys
+import time
+from wikifile import File
+from extsort import ExternalSort
+from sqlrows import InsertReader, SqlRowsErr
+
+
+class SqlSortErr(Exception):
+    pass
+
+
+class SqlSorter(object):
+    """Rewrite the rows of a table dump, as written by mysqldump, sqlfilter
+    or mwxml2sql, in ascending primary key order.
+    InnoDB stores rows in primary key order, so rows loaded in that order
+    are appended to the end of the table, while rows loaded in random
+    order land all over it, splitting pages and making the load many
+    times slower for large tables.
+    The file is first read through once to see whether it is already in
+    order, as table dumps from mysqldump usually are, and is only
+    rewritten if it is not; the rewrite uses an external merge sort, so
+    that tables too large for memory can be sorted."""
+
+    # primary keys (or the unique index InnoDB clusters on, where older
+    # MediaWiki versions have no primary key), used when the sql file has
+    # no CREATE TABLE statement to take them from
+    primary_keys = {
+        'page': ['page_id'],
+        'revision': ['rev_id'],
+        'text': ['old_id'],
+        'category': ['cat_id'],
+        'categorylinks': ['cl_from', 'cl_to'],
+        'externallinks': ['el_id'],
+        'imagelinks': ['il_from', 'il_to'],
+        'interwiki': ['iw_prefix'],
+        'iwlinks': ['iwl_from', 'iwl_prefix', 'iwl_title'],
+        'langlinks': ['ll_from', 'll_lang'],
+        'page_props': ['pp_page', 'pp_propname'],
+        'page_restrictions': ['pr_id'],
+        'pagelinks': ['pl_from', 'pl_namespace', 'pl_title'],
+        'protected_titles': ['pt_namespace', 'pt_title'],
+        'redirect': ['rd_from'],
+        'templatelinks': ['tl_from', 'tl_namespace', 'tl_title'],
+        'logging': ['log_id'],
+        'user': ['user_id'],
+    }
+
+    unescapes = {'0': '\x00', 'n': '\n', 'r': '\r', 'Z': '\x1a', 't': '\t', 'b': '\b'}
+
+    def __init__(self, sql_path, table, tmpdir=None, max_in_memory=1000000,
+                 max_bytes=256 * 1024 * 1024, statement_bytes=1024 * 1024, verbose=False):
+        """Constructor. Arguments:
+        sql_path         -- path to possibly compressed sql file, rewritten in place
+        table            -- name of the table without any prefix, used to look
+                            up the primary key if the file has no CREATE TABLE
+        tmpdir           -- directory for temporary sort files
+        max_in_memory    -- number of rows to sort in memory at once
+        max_bytes        -- bytes of rows to sort in memory at once
+        statement_bytes  -- approximate size of each INSERT written
+        verbose          -- display progress messages"""
+
+        self.sql_path = sql_path
+        self.table = table
+        self.tmpdir = tmpdir
+        self.max_in_memory = max_in_memory
+        self.max_bytes = max_bytes
+        self.statement_bytes = statement_bytes
+        self.verbose = verbose
+        self.unescape_pattern = re.compile(r"\\(.)", re.DOTALL)
+
+        self.rows = 0
+        self.out_of_order = 0  # rows with a smaller key than the row before
+        self.sorted = False
+        self.seconds = 0
+
+    def unescape(self, text):
+        """Undo sql escaping of a string, so that keys compare in the order
+        MySQL compares them for binary columns"""
+
+        if '\\' not in text:
+            return text
+        return self.unescape_pattern.sub(
+            lambda m: SqlSorter.unescapes.get(m.group(1), m.group(1)), text)
+
+    def get_key_value(self, value):
+        """Return a sortable value for an sql literal"""
+
+        if value.startswith("'"):
+            return self.unescape(value[1:-1])
+        if value == "NULL":
+            return None
+        try:
+            return int(value)
+        except ValueError:
+            try:
+                return float(value)
+            except ValueError:
+                return value
+
+    def get_key_columns(self):
+        """Return the names of the primary key columns, from the CREATE TABLE
+        in the file if there is one, otherwise from our list of known tables"""
+
+        primary_key = InsertReader(self.sql_path, []).get_primary_key()
+        if primary_key:
+            return primary_key
+        if self.table in SqlSorter.primary_keys:
+            return SqlSorter.primary_keys[self.table]
+        raise SqlSortErr("no primary key known for table %s in %s\n" % (self.table, self.sql_path))
+
+    def get_keyed_rows(self, reader, with_text=False):
+        """Generator returning (key, row text) or key for each row in the file"""
+
+        get_key_value = self.get_key_value
+        for row in reader.get_rows(with_text):
+            if with_text:
+                yield (tuple([get_key_value(v) for v in row[0]]), row[1])
+            else:
+                yield tuple([get_key_value(v) for v in row])
+
+    def check_order(self, key_columns):
+        """Read through the file counting rows and rows out of key order"""
+
+        reader = InsertReader(self.sql_path, key_columns)
+        last_key = None
+        for key in self.get_keyed_rows(reader):
+            if last_key is not None and key < last_key:
+                self.out_of_order = self.out_of_order + 1
+            last_key = key
+            self.rows = self.rows + 1
+
+    def write_sorted(self, key_columns):
+        """Write the rows of the file out in key order to a temporary file
+        and move it into place"""
+
+        reader = InsertReader(self.sql_path, key_columns)
+        sorter = ExternalSort(self.max_in_memory, self.tmpdir, self.max_bytes)
+        for (key, text) in self.get_keyed_rows(reader, True):
+            sorter.add((key, text), len(text))
+
+        # keep the compression suffix so the output is compressed the same way
+        temp_path = os.path.join(os.path.dirname(self.sql_path),
+                                 "sorting-" + os.path.basename(self.sql_path))
+        out_fd = File.open_output(temp_path)
+        for line in reader.preamble:
+            out_fd.write(line)
+        # mwxml2sql style: BEGIN; INSERT ... VALUES, one row per line, COMMIT;
+        # mysqldump style: INSERT ... VALUES (row),(row); all on one line
+        if reader.transactions:
+            start = "BEGIN;\n" + reader.insert_head + "\n"
+            separator = ",\n"
+            end = ";\nCOMMIT;\n"
+        else:
+            start = reader.insert_head + " "
+            separator = ","
+            end = ";\n"
+        statement_size = 0
+        for (key, text) in sorter.sorted():
+            if statement_size:
+                out_fd.write(separator)
+            else:
+                out_fd.write(start)
+            out_fd.write(text)
+            statement_size = statement_size + len(text)
+            if statement_size >= self.statement_bytes:
+                out_fd.write(end)
+                statement_size = 0
+        if statement_size:
+            out_fd.write(end)
+        for line in reader.postamble:
+            out_fd.write(line)
+        out_fd.close()
+        sorter.cleanup()
+        os.rename(temp_path, self.sql_path)
+
+    def sort(self):
+        """Put the rows of the file in primary key order if they are not already.
+        On error raises an exception."""
+
+        start = time.time()
+        try:
+            key_columns = self.get_key_columns()
+            self.check_order(key_columns)
+            if self.out_of_order:
+                if self.verbose:
+                    sys.stderr.write("sorting %s by %s, %d of %d rows out of order\n"
+                                     % (self.sql_path, ", ".join(key_columns),
+                                        self.out_of_order, self.rows))
+                self.write_sorted(key_columns)
+                self.sorted = True
+        except SqlRowsErr as e:
+            raise SqlSortErr(str(e))
+        self.seconds = time.time() - start
+
+    def get_report(self):
+        """Return a line describing what was done to the file"""
+
+        if not self.rows:
+            return "%-20s no rows" % self.table
+        return ("%-20s %10d rows, %10d out of key order (%5.1f%%), %s in %.1fs"
+                % (self.table, self.rows, self.out_of_order,
+                   100.0 * self.out_of_order / self.rows,
+                   "sorted" if self.sorted else "already in order", self.seconds))
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+
+class SqlWriterErr(Exception):
+    pass
+
+
+class RowWriter(object):
+    """Write rows for one table to an open file, in one of these formats:
+      insert    -- one INSERT statement per row
+      extended  -- INSERT statements with many rows each, one row per line,
+                   as mwxml2sql writes them; a statement is ended once it
+                   has max_rows rows or max_bytes bytes of row data
+      tabs      -- tab-separated rows for LOAD DATA INFILE, in the format
+                   that sql2txt produces from INSERT statements, so the
+                   file can go straight to fifo_to_mysql.pl
+    Values are passed in as sql literals: numbers, NULL, or sql-escaped
+    strings enclosed in single quotes.
+    With replace set, statements are REPLACE rather than INSERT, so that
+    rows already in the table with the same keys are overwritten; for
+    tabs, the same goes for LOAD DATA INFILE with REPLACE."""
+
+    modes = ["insert", "extended", "tabs"]
+
+    def __init__(self, fd, table, columns, mode="insert", max_rows=1000, max_bytes=1024 * 1024,
+                 replace=False):
+        """Constructor. Arguments:
+        fd         -- file descriptor open for writing
+        table      -- name of the table
+        columns    -- list of column names, in the order the values will be given
+        mode       -- one of 'insert', 'extended', 'tabs'
+        max_rows   -- maximum number of rows in one extended INSERT
+        max_bytes  -- maximum bytes of row data in one extended INSERT
+        replace    -- write REPLACE statements instead of INSERT"""
+
+        if mode not in RowWriter.modes:
+            raise SqlWriterErr("unknown output format %s, expected one of %s\n"
+                               % (mode, ", ".join(RowWriter.modes)))
+        self.fd = fd
+        self.table = table
+        self.columns = columns
+        self.mode = mode
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.insert_start = "%s INTO %s ( %s ) VALUES " % (
+            "REPLACE" if replace else "INSERT", table, ", ".join(columns))
+        self.rows_in_statement = 0
+        self.bytes_in_statement = 0
+        self.rows_written = 0
+        self.statements_written = 0
+
+    @staticmethod
+    def get_tab_value(value):
+        """Convert one sql literal to its LOAD DATA INFILE form, as sql2txt
+        does: NULL becomes \\N, and quoted strings keep their quotes (the
+        data is loaded with FIELDS OPTIONALLY ENCLOSED BY '\\'') and their
+        backslash escapes, with tabs escaped as well. Newlines are escaped
+        too, so that every row is on one line; LOAD DATA reads \\n back as
+        a newline, so the loaded value is the same."""
+
+        if value == "NULL":
+            return "\\N"
+        if "\t" in value:
+            value = value.replace("\t", "\\t")
+        if "\n" in value:
+            value = value.replace("\n", "\\n")
+        return value
+
+    def write_row(self, values):
+        """Write one row.
+        Arguments:
+        values  -- list of sql literals, one for each column"""
+
+        if self.mode == "tabs":
+            self.fd.write("\t".join([RowWriter.get_tab_value(v) for v in values]) + "\n")
+            self.rows_written = self.rows_written + 1
+            return
+
+        row = "( %s )" % ", ".join(values)
+        if self.mode == "insert":
+            self.fd.write(self.insert_start + row + ";\n")
+            self.statements_written = self.statements_written + 1
+        else:
+            if self.rows_in_statement and (self.rows_in_statement >= self.max_rows or
+                                           self.bytes_in_statement + len(row) > self.max_bytes):
+                self.end_statement()
+            if self.rows_in_statement:
+                self.fd.write(",\n" + row)
+            else:
+                self.fd.write(self.insert_start + "\n" + row)
+            self.rows_in_statement = self.rows_in_statement + 1
+            self.bytes_in_statement = self.bytes_in_statement + len(row)
+        self.rows_written = self.rows_written + 1
+
+    def end_statement(self):
+        """Close off the extended INSERT in progress, if there is one"""
+
+        if self.rows_in_statement:
+            self.fd.write(";\n")
+            self.statements_written = self.statements_written + 1
+            self.rows_in_statement = 0
+            self.bytes_in_statement = 0
+
+    def close(self):
+        """Finish writing; the file descriptor is left open for the caller"""
+
+        self.end_statement()
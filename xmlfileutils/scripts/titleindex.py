@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import mmap
+import array
+import zlib
+import struct
+from wikifile import File
+from extsort import ExternalSort
+
+
+class TitleIndexErr(Exception):
+    pass
+
+
+class TitleIndex(object):
+    """Persistent on-disk index of (namespace, title) => page id, built once
+    from a list of page ids, namespaces and titles, and memory-mapped for
+    lookups afterwards, so that it costs almost nothing to open and takes
+    only as much memory as the pages of it that are actually used.
+
+    File layout (all integers little-endian):
+      header:   magic 'MWTIDX01', number of hash bits (uint32), record count (uint64)
+      buckets:  (2 ** hash bits) + 1 uint32 record numbers; bucket n holds the
+                records whose title hash starts with n, which are records
+                buckets[n] through buckets[n+1] - 1
+      records:  title hash (uint32), namespace (int32), page id (uint32), title
+                offset (uint64), title length (uint32), sorted by title hash and
+                then by (namespace, title)
+      titles:   the title strings, concatenated
+
+    Titles are stored sql-escaped as in the page table dump, without enclosing
+    single quotes; lookups strip those quotes too if present."""
+
+    magic = "MWTIDX01"
+    header_format = "<8sIQ"
+    bucket_format = "<I"
+    record_format = "<IiIQI"
+
+    def __init__(self, path):
+        """Constructor. Opens and memory-maps an existing index file.
+        Arguments:
+        path  -- path to the index file"""
+
+        self.path = path
+        self.fd = open(path, "rb")
+        self.map = mmap.mmap(self.fd.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.hash_bits, self.count) = struct.unpack_from(TitleIndex.header_format, self.map, 0)
+        if magic != TitleIndex.magic:
+            raise TitleIndexErr("%s is not a title index file" % path)
+        self.header_size = struct.calcsize(TitleIndex.header_format)
+        self.bucket_size = struct.calcsize(TitleIndex.bucket_format)
+        self.record_size = struct.calcsize(TitleIndex.record_format)
+        self.records_offset = self.header_size + ((1 << self.hash_bits) + 1) * self.bucket_size
+
+    @staticmethod
+    def get_hash(ns, title):
+        """Return the 32 bit hash of a namespace number and title"""
+
+        return zlib.crc32(title, ns) & 0xffffffff
+
+    @staticmethod
+    def strip_quotes(title):
+        """Remove enclosing single quotes from an sql-escaped title, if present"""
+
+        if len(title) > 1 and title[0] == "'" and title[-1] == "'":
+            return title[1:-1]
+        return title
+
+    @staticmethod
+    def get_hash_bits(count):
+        """Return the number of hash bits to use for the given number of
+        titles, aiming for a few titles per bucket"""
+
+        bits = 4
+        while (1 << bits) * 4 < count and bits < 30:
+            bits = bits + 1
+        return bits
+
+    @staticmethod
+    def get_bucket_array(length):
+        """Return a zero-filled array of uint32 of the given length; for
+        large wikis there are millions of buckets, too many for a list"""
+
+        for typecode in ['I', 'L']:
+            if array.array(typecode).itemsize == 4:
+                return array.array(typecode, [0]) * length
+        raise TitleIndexErr("no 4 byte unsigned array type on this platform")
+
+    @staticmethod
+    def read_titles_file(titles_path):
+        """Generator returning (page id, namespace, title) from a file of lines
+        pageid whitespace nsnum whitespace pagetitle, as for TitlesDict
+        Arguments:
+        titles_path -- path to the possibly compressed file"""
+
+        fd = File.open_input(titles_path)
+        for line in fd:
+            fields = line.rstrip("\n").split(' ', 2)
+            if len(fields) == 3:
+                yield (fields[0], fields[1], fields[2])
+        fd.close()
+
+    @staticmethod
+    def build(entries, path, count_hint=None, tmpdir=None, max_in_memory=1000000):
+        """Write a new index file from a list or iterator of entries.
+        Entries are sorted with an external merge sort, so building the index
+        for a very large wiki does not need the whole page table in memory.
+        Arguments:
+        entries       -- iterable of (page id, namespace number, title) where
+                         the title is sql-escaped and may have enclosing quotes
+        path          -- path of the index file to write
+        count_hint    -- estimated number of entries, used to size the hash table;
+                         if None, the entries are counted during the sort
+        tmpdir        -- directory for temporary sort files
+        max_in_memory -- number of entries sorted in memory at once"""
+
+        # records are sorted by hash first, so every hash prefix (bucket)
+        # is a contiguous run of records and the table size can be picked
+        # once we know how many there are
+        sorter = ExternalSort(max_in_memory, tmpdir)
+        for (pageid, ns, title) in entries:
+            ns = int(ns)
+            title = TitleIndex.strip_quotes(title)
+            sorter.add((TitleIndex.get_hash(ns, title), ns, title, int(pageid)))
+
+        hash_bits = TitleIndex.get_hash_bits(count_hint or sorter.count)
+
+        temp_path = path + ".tmp"
+        titles_path = path + ".titles.tmp"
+        out_fd = open(temp_path, "wb")
+        titles_fd = open(titles_path, "wb")
+        out_fd.write(struct.pack(TitleIndex.header_format, TitleIndex.magic, hash_bits, sorter.count))
+        # bucket table, rewritten once the records are in
+        buckets_offset = out_fd.tell()
+        buckets = TitleIndex.get_bucket_array((1 << hash_bits) + 1)
+        buckets.tofile(out_fd)
+
+        title_offset = 0
+        recnum = 0
+        last_bucket = -1
+        for (title_hash, ns, title, pageid) in sorter.sorted():
+            bucket = title_hash >> (32 - hash_bits)
+            while last_bucket < bucket:
+                last_bucket = last_bucket + 1
+                buckets[last_bucket] = recnum
+            out_fd.write(struct.pack(TitleIndex.record_format, title_hash, ns, pageid,
+                                     title_offset, len(title)))
+            titles_fd.write(title)
+            title_offset = title_offset + len(title)
+            recnum = recnum + 1
+        while last_bucket < (1 << hash_bits):
+            last_bucket = last_bucket + 1
+            buckets[last_bucket] = recnum
+        sorter.cleanup()
+        titles_fd.close()
+
+        # titles go after the records; their offsets are relative to the start of the titles
+        titles_fd = open(titles_path, "rb")
+        while True:
+            block = titles_fd.read(1024 * 1024)
+            if not block:
+                break
+            out_fd.write(block)
+        titles_fd.close()
+        os.unlink(titles_path)
+
+        out_fd.seek(buckets_offset)
+        if sys.byteorder != "little":
+            buckets.byteswap()
+        buckets.tofile(out_fd)
+        out_fd.close()
+        os.rename(temp_path, path)
+
+    def get_record(self, recnum):
+        """Return (title hash, namespace, page id, title) for the given record number"""
+
+        (title_hash, ns, pageid, title_offset, title_len) = struct.unpack_from(
+            TitleIndex.record_format, self.map, self.records_offset + recnum * self.record_size)
+        start = self.records_offset + self.count * self.record_size + title_offset
+        return (title_hash, ns, pageid, self.map[start:start + title_len])
+
+    def get_page_id(self, ns, title):
+        """Return the page id as a string for a title in a namespace, or None
+        if there is no such page.
+        Arguments:
+        ns     -- namespace number (int or string of digits)
+        title  -- sql-escaped title without namespace prefix, optionally
+                  enclosed in single quotes"""
+
+        ns = int(ns)
+        title = TitleIndex.strip_quotes(title)
+        title_hash = TitleIndex.get_hash(ns, title)
+        offset = self.header_size + (title_hash >> (32 - self.hash_bits)) * self.bucket_size
+        (low, high) = struct.unpack_from("<II", self.map, offset)
+        wanted = (title_hash, ns, title)
+        while low < high:
+            middle = (low + high) // 2
+            (rec_hash, rec_ns, pageid, rec_title) = self.get_record(middle)
+            if (rec_hash, rec_ns, rec_title) < wanted:
+                low = middle + 1
+            elif (rec_hash, rec_ns, rec_title) > wanted:
+                high = middle
+            else:
+                return str(pageid)
+        return None
+
+    def close(self):
+        """Release the memory map and the file"""
+
+        self.map.close()
+        self.fd.close()
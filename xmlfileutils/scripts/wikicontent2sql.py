@@ -3,13 +3,17 @@ import os
 import re
 import sys
 import getopt
-import urllib
-import json
 import time
 import select
 import shutil
+import cProfile
+import resource
 from subprocess import Popen, PIPE
 from wikifile import File
+from wikinamespaces import Namespaces, NamespaceErr
+from sqlsort import SqlSorter, SqlSortErr
+from download_dumps import DumpDownloader, DownloadErr, get_table_files
+from progress import Progress
 
 
 class WikiContentErr(Exception):
@@ -48,9 +52,81 @@ class Path(object):
         return("-".join(filter(None, [self.lang, self.project, self.date, filename])))
 
 
+class ChildProcess(object):
+    """A command started by Command, with the output collected from it
+    so far and, once it has exited, its resource usage"""
+
+    def __init__(self, command, verbose=False):
+        """Constructor, starts the command. Arguments:
+        command  -- command to run, as a list
+        verbose  -- display messages received on stderr from the command"""
+
+        self.command = command
+        if type(command).__name__ == "list":
+            self.command_string = " ".join(command)
+        else:
+            self.command_string = command
+        self.verbose = verbose
+        self.start = time.time()
+        # close_fds so that other children's pipes are not inherited and
+        # held open, which would keep us from seeing them closed
+        self.proc = Popen(command, shell=False, stdout=PIPE, stderr=PIPE, close_fds=True)
+        self.open_fds = 2
+        self.output = []  # pieces of stdout, joined when the command is done
+        self.returncode = None
+        self.wall = 0
+        self.user = 0
+        self.system = 0
+        self.maxrss = 0  # kilobytes
+
+    def add_output(self, fd, data):
+        """Keep output from stdout, and display output from stderr if verbose"""
+
+        if fd == self.proc.stderr.fileno():
+            if self.verbose:
+                sys.stderr.write(data)
+        else:
+            self.output.append(data)
+
+    def reap(self, block=False):
+        """Collect the exit status and resource usage of the process if it has
+        exited, or wait for it to exit if block is set. Returns True if it exited."""
+
+        (pid, status, rusage) = os.wait4(self.proc.pid, 0 if block else os.WNOHANG)
+        if not pid:
+            return False
+        self.wall = time.time() - self.start
+        if os.WIFSIGNALED(status):
+            self.returncode = -os.WTERMSIG(status)
+        else:
+            self.returncode = os.WEXITSTATUS(status)
+        # so that Popen doesn't try to wait for it again
+        self.proc.returncode = self.returncode
+        self.user = rusage.ru_utime
+        self.system = rusage.ru_stime
+        self.maxrss = rusage.ru_maxrss
+        self.proc.stdout.close()
+        self.proc.stderr.close()
+        return True
+
+    def get_output(self):
+        return "".join(self.output)
+
+    def get_report(self):
+        """Return a line with the resources the command used"""
+
+        command = " ".join(self.command_string.split())
+        if len(command) > 60:
+            command = command[:57] + "..."
+        return ("%-60s rc %4s wall %8.1fs user %8.1fs sys %7.1fs maxrss %7.1fMB"
+                % (command, self.returncode, self.wall, self.user, self.system,
+                   self.maxrss / 1024.0))
+
+
 class Command(object):
-    """Run a command capturing stdout and optionally displaying stderr
-    as it runs"""
+    """Run commands, one or several at once, capturing stdout and
+    optionally displaying stderr as they run, and keeping the wall
+    clock time, cpu time and peak memory use of each for reporting"""
 
     def __init__(self, verbose=False, dryrun=False):
         """Constructor.  Arguments:
@@ -60,6 +136,8 @@ class Command(object):
 
         self.dryrun = dryrun
         self.verbose = verbose
+        self.read_size = 65536
+        self.finished = []  # ChildProcess for each command run since the last report
 
     def run_command(self, command):
         """Run a command, capturing output to stdout and stderr,
@@ -69,59 +147,188 @@ class Command(object):
         the output.
         """
 
+        return self.run_commands([command])[0]
+
+    def run_commands(self, commands, max_running=None):
+        """Run several commands, at most max_running of them at once (no limit
+        if None), capturing output to stdout and stderr, optionally displaying
+        stderr output as it is received.
+        On nonzero return code from a command, displays an error on stderr.
+        Returns:  list of (return code, output to stdout) for the commands,
+        in the order given"""
+
+        results = [(None, None)] * len(commands)
+        pending = list(enumerate(commands))
+        running = {}  # ChildProcess -> index in commands
+        fd_owners = {}
+        poller = select.poll()
+        while pending or running:
+            while pending and (not max_running or len(running) < max_running):
+                (index, command) = pending.pop(0)
+                child = self.start(command)
+                if child is None:
+                    continue
+                running[child] = index
+                for fd in [child.proc.stdout.fileno(), child.proc.stderr.fileno()]:
+                    poller.register(fd, select.POLLIN | select.POLLPRI)
+                    fd_owners[fd] = child
+
+            # children which closed their output may still be running; check
+            # on them now and then, otherwise wait for output as long as it takes
+            waiting = [c for c in running if not c.open_fds]
+            if len(waiting) < len(running):
+                self.poll_once(poller, fd_owners, 100 if waiting else -1)
+            for child in running.keys():
+                if not child.open_fds and child.reap(block=not fd_owners):
+                    results[running.pop(child)] = self.finish(child)
+        return results
+
+    def start(self, command):
+        """Start a command, returning the ChildProcess, or None in dry run mode"""
+
         if type(command).__name__ == "list":
             command_string = " ".join(command)
         else:
             command_string = command
-        if (self.dryrun or self.verbose):
-            if self.dryrun:
-                sys.stderr.write("would run %s\n" % command_string)
-                return (None, None)
-            if self.verbose:
-                sys.stderr.write("about to run %s\n" % command_string)
-
-        self._proc = Popen(command, shell=False, stdout=PIPE, stderr=PIPE)
+        if self.dryrun:
+            sys.stderr.write("would run %s\n" % command_string)
+            return None
+        if self.verbose:
+            sys.stderr.write("about to run %s\n" % command_string)
+        return ChildProcess(command, self.verbose)
+
+    def poll_once(self, poller, fd_owners, timeout):
+        """Poll the children's stdout and stderr, collecting any output,
+        waiting up to timeout milliseconds (indefinitely if -1) for an event"""
+
+        for (fd, event) in poller.poll(timeout):
+            child = fd_owners[fd]
+            if event & (select.POLLIN | select.POLLPRI):
+                data = os.read(fd, self.read_size)
+                if data:
+                    child.add_output(fd, data)
+                    continue
+            # end of file, or hangup or error with nothing left to read
+            poller.unregister(fd)
+            del fd_owners[fd]
+            child.open_fds = child.open_fds - 1
 
-        self._poller = select.poll()
-        self._poller.register(self._proc.stdout, select.POLLIN | select.POLLPRI)
-        self._poller.register(self._proc.stderr, select.POLLIN | select.POLLPRI)
-        self.polledfds = 2  # keep track of active fds
-        self.poll_and_wait()
+    def finish(self, child):
+        """Note a command which has exited and return (return code, output)"""
 
-        if self._proc.returncode:
+        if child.returncode:
             sys.stderr.write("command '%s failed with return code %s\n"
-                             % (command_string, self._proc.returncode))
-
+                             % (child.command_string, child.returncode))
+        self.finished.append(child)
         # let the caller decide whether to bail or not
-        return (self._proc.returncode, self.output)
-
-    def poll_and_wait(self):
-        """Collect output to stdout from a process and optionally
-        display messages to stderr from the process, until it
-       exits or an error is encountered or its stdout and stderr are closed"""
-
-        self.output = ""
-        while self.polledfds:  # if there are active fds
-            self.poll_once()
-        self._proc.wait()
-
-    def poll_once(self):
-        """poll process, collect stdout, optionally display stderr,
-        waiting up to a second for an event"""
-
-        fds = self._poller.poll(1000)  # once a second is plenty to poll
-        if (fds):
-            for (fd, event) in fds:
-                if event & (select.POLLIN | select.POLLPRI):
-                    out = os.read(fd, 1024)
-                    if fd == self._proc.stderr.fileno():
-                        if (self.verbose):
-                            sys.stderr.write(out)
-                    else:
-                        self.output = self.output + out
-                elif (event & (select.POLLHUP | select.POLLNVAL | select.POLLERR)):
-                    self._poller.unregister(fd)
-                    self.polledfds = self.polledfds - 1  # lower number of active fds
+        return (child.returncode, child.get_output())
+
+    def write_report(self, out_fd):
+        """Write the resources used by each command run since the last report"""
+
+        for child in self.finished:
+            out_fd.write(child.get_report() + "\n")
+        self.finished = []
+
+
+class StepProfiler(object):
+    """Keep the wall clock time, cpu time and peak memory use of each step
+    of a run, both for this process and for the commands the step runs,
+    and optionally write a cProfile dump of this process for each step"""
+
+    def __init__(self, enabled=False, profile_dir=None):
+        """Constructor. Arguments:
+        enabled      -- if not set, nothing is recorded or reported
+        profile_dir  -- directory in which to write a cProfile dump per step, or None"""
+
+        self.enabled = enabled
+        self.profile_dir = profile_dir
+        self.steps = []
+        self.current = None
+        self.profiler = None
+
+    def reset_peak_rss(self):
+        """Reset the peak resident size of this process (linux 4.0 and later),
+        so that each step's peak is its own. Returns True on success."""
+
+        try:
+            clear_refs = open("/proc/self/clear_refs", "w")
+            clear_refs.write("5")
+            clear_refs.close()
+            return True
+        except IOError:
+            return False
+
+    def get_peak_rss(self):
+        """Return the peak resident size of this process in kilobytes"""
+
+        try:
+            for line in open("/proc/self/status"):
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+        except (IOError, ValueError, IndexError):
+            pass
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    def start(self, name):
+        """Start recording a step. Arguments:
+        name  -- name of the step, used in the report and for the cProfile dump"""
+
+        if not self.enabled:
+            return
+        self.current = {"name": name, "start": time.time(), "times": os.times(),
+                        "peak_reset": self.reset_peak_rss(), "children": []}
+        if self.profile_dir:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def add_children(self, children):
+        """Count the resources used by these commands (ChildProcess objects) in the current step"""
+
+        if not self.enabled:
+            return
+        self.current['children'].extend(children)
+
+    def end(self):
+        """Stop recording the current step"""
+
+        if not self.enabled:
+            return
+        if self.profiler:
+            self.profiler.disable()
+            self.profiler.dump_stats(os.path.join(self.profile_dir, "%s.prof" % self.current['name']))
+            self.profiler = None
+        step = self.current
+        times = os.times()
+        step['wall'] = time.time() - step['start']
+        step['cpu'] = times[0] - step['times'][0] + times[1] - step['times'][1]
+        step['peak_rss'] = self.get_peak_rss()
+        step['children_cpu'] = sum([c.user + c.system for c in step['children']])
+        step['children_peak_rss'] = max([c.maxrss for c in step['children']] or [0])
+        self.steps.append(step)
+        self.current = None
+
+    def write_report(self, out_fd):
+        """Write a table of the resources used by each step"""
+
+        if not self.enabled or not self.steps:
+            return
+        out_fd.write("%-16s %9s %9s %10s %5s %9s %10s\n" % (
+            "step", "wall s", "cpu s", "peak MB", "cmds", "cmd cpu s", "cmd peak MB"))
+        for step in self.steps:
+            out_fd.write("%-16s %9.1f %9.1f %9.1f%s %5d %9.1f %10.1f\n" % (
+                step['name'], step['wall'], step['cpu'], step['peak_rss'] / 1024.0,
+                " " if step['peak_reset'] else "*", len(step['children']),
+                step['children_cpu'], step['children_peak_rss'] / 1024.0))
+        out_fd.write("%-16s %9.1f %9.1f %10s %5d %9.1f\n" % (
+            "total", sum([step['wall'] for step in self.steps]),
+            sum([step['cpu'] for step in self.steps]), "",
+            sum([len(step['children']) for step in self.steps]),
+            sum([step['children_cpu'] for step in self.steps])))
+        if [step for step in self.steps if not step['peak_reset']]:
+            out_fd.write("* peak since the start of the run, it could not be reset per step\n")
+        if self.profile_dir:
+            out_fd.write("cProfile dumps for each step written to %s\n" % self.profile_dir)
 
 
 class Converter(object):
@@ -198,6 +405,9 @@ class Stubber(object):
         in_fd = File.open_input(content_path)
         out_fd = File.open_output(stubs_path)
         outpage_id_fd = File.open_output(page_ids_path)
+        progress = Progress("writing stubs and page ids", "pages", [content_path],
+                            enabled=self.verbose)
+        progress.set_input(in_fd, content_path)
         current_title = None
         current_text_id = None
         page_id = None
@@ -226,6 +436,7 @@ class Stubber(object):
                 if result:
                     expect_page_id = True
                     out_fd.write(line)
+                    progress.update()
                     continue
                 result = compiled_revision_pattern.match(line)
                 if result:
@@ -252,6 +463,7 @@ class Stubber(object):
         in_fd.close()
         out_fd.close()
         outpage_id_fd.close()
+        progress.finish()
 
 
 class Retriever(object):
@@ -269,15 +481,14 @@ class Retriever(object):
         self.verbose = verbose
         self.runner = Command(verbose=self.verbose)
 
-    def get_titles_embedded_in(self, template, output_file, escaped=False):
-        """Run command to retrieve all page titles using a given template.
-        Returns the name of the output file produced.
-        On error, raises an exception.
-        Arguments:
+    def titles_embedded_in_request(self, template, output_file, escaped=False, with_ids=False):
+        """Return (command, error message) for retrieving all page titles
+        using a given template, for retrieve_all. Arguments:
         template    -- name of the template, includes the 'Template:' string or
                        its localized equivalent on the wiki
         output_file  -- name of file (not full path) for the list of titles
-        escaped     -- whether to sqlescape these titles"""
+        escaped     -- whether to sqlescape these titles
+        with_ids    -- whether to write the page id before each title"""
 
         command = ['python', self.wcr, '-q', 'embeddedin', '-p', template, '-o',
                    self.output_dir, '-O', output_file, '-w',
@@ -285,84 +496,113 @@ class Retriever(object):
 
         if escaped:
             command.append('--sqlescaped')
+        if with_ids:
+            command.append('--pageids')
         if self.verbose:
             command.append('--verbose')
-        (result, titles_path) = self.runner.run_command(command)
-        if result:
-            raise WikiContentErr("Error trying to retrieve page titles with embedding\n")
-        else:
-            titles_path = titles_path.strip()
-            return titles_path
+        return (command, "Error trying to retrieve page titles with embedding\n")
 
-    def get_titles_in_namespace(self, ns, output_file, escaped=False):
-        """Run command to retrieve all page titles in a given namespace.
-        Returns the name of the output file produced.
-        On error, raises an exception.
-        Arguments:
+    def titles_in_namespace_request(self, ns, output_file, escaped=False, with_ids=False):
+        """Return (command, error message) for retrieving all page titles
+        in a given namespace, for retrieve_all. Arguments:
         ns          -- number of the namespace.
         output_file  -- name of file (not full path) for the list of titles
-        escaped     -- whether to sqlescape these titles"""
+        escaped     -- whether to sqlescape these titles
+        with_ids    -- whether to write the page id before each title"""
 
         command = ['python', self.wcr, '-q', 'namespace', '-p', ns, '-o', self.output_dir,
                    '-O', output_file, '-w', "%s.%s.org" % (self.lang_code, self.project)]
         if escaped:
             command.append('--sqlescaped')
+        if with_ids:
+            command.append('--pageids')
         if self.verbose:
             command.append('--verbose')
-        (result, titles_path) = self.runner.run_command(command)
-        if result:
-            raise WikiContentErr("Error trying to retrieve page titles in namespace\n")
-        else:
-            titles_path = titles_path.strip()
-            return titles_path
+        return (command, "Error trying to retrieve page titles in namespace\n")
 
-    def get_content(self, titles_path, output_file):
-        """Run command to retrieve all page content for a list of page titles.
-        Returns the name of the output file produced.
-        On error, raises an exception.
-        Arguments:
+    def content_request(self, titles_path, output_file, by_id=False, store_path=None):
+        """Return (command, error message) for retrieving all page content
+        for a list of page titles, for retrieve_all. Arguments:
         titles_path   -- full path to the list of page titles
-        output_file   -- name of file (not full path) for the page content"""
+        output_file   -- name of file (not full path) for the page content
+        by_id         -- the list has a page id at the start of each line,
+                         retrieve the content by those ids
+        store_path    -- path to a page store from which to take pages not
+                         changed since they were stored"""
 
         command = ['python', self.wcr, '-q', 'content', '-p', titles_path, '-o', self.output_dir,
                    "-O", output_file, '-w', "%s.%s.org" % (self.lang_code, self.project)]
+        if by_id:
+            command.append('--pageids')
+        if store_path:
+            command.extend(['--store', store_path])
         if self.verbose:
             command.append('--verbose')
-        (result, content_path) = self.runner.run_command(command)
-        if result:
-            raise WikiContentErr("Error trying to retrieve content\n")
-        else:
-            content_path = content_path.strip()
-            return content_path
-
-    def get_ns_dict(self):
-        """Retrieve namespace informtion for a wiki via the MediaWiki api
-        and store in in dict form.
-        On error raises an exception."""
-
-        # http://en.wikipedia.org/w/api.php?action=query&meta=siteinfo&siprop=namespaces&format=json
-        api_url = ("http://" + self.lang_code + "." + self.project + "." + "org/w/api.php" +
-                   "?action=query&meta=siteinfo&siprop=namespaces&format=json")
-        ns_dict = {}
-        ufd = urllib.urlopen(api_url)
-        if str(ufd.getcode()).startswith("2"):
-            output = ufd.read()
-            ufd.close()
-            site_info = json.loads(output)
-            if 'query' not in site_info or 'namespaces' not in site_info['query']:
-                raise WikiContentErr("Error trying to get namespace information from api\n")
-            for k in site_info['query']['namespaces'].keys():
-                if '*' in site_info['query']['namespaces'][k]:
-                    ns_dict[k] = site_info['query']['namespaces'][k]['*'].encode('utf8')
-                else:
-                    raise WikiContentErr("Error trying to get parse namespace information\n")
-            return ns_dict
-        else:
-            code = ufd.getcode()
-            ufd.close()
-            raise WikiContentErr("Error trying to retrieve namespace info: %s\n" % code)
+        return (command, "Error trying to retrieve content\n")
 
-        return ns_dict
+    def retrieve_all(self, requests, max_running=None):
+        """Run several retrieval commands at once.
+        Returns the names of the output files produced, in the order of the requests.
+        On error, raises an exception.
+        Arguments:
+        requests     -- list of (command, error message) as returned by the
+                        *_request methods
+        max_running  -- the most commands to run at the same time, None for no limit"""
+
+        results = self.runner.run_commands([command for (command, error) in requests], max_running)
+        paths = []
+        for ((command, error), (result, path)) in zip(requests, results):
+            if result:
+                raise WikiContentErr(error)
+            paths.append(path.strip())
+        return paths
+
+    def get_titles_embedded_in(self, template, output_file, escaped=False):
+        """Run command to retrieve all page titles using a given template.
+        Returns the name of the output file produced.
+        On error, raises an exception.
+        Arguments are as for titles_embedded_in_request"""
+
+        return self.retrieve_all([self.titles_embedded_in_request(template, output_file, escaped)])[0]
+
+    def get_titles_in_namespace(self, ns, output_file, escaped=False):
+        """Run command to retrieve all page titles in a given namespace.
+        Returns the name of the output file produced.
+        On error, raises an exception.
+        Arguments are as for titles_in_namespace_request"""
+
+        return self.retrieve_all([self.titles_in_namespace_request(ns, output_file, escaped)])[0]
+
+    def get_content(self, titles_path, output_file):
+        """Run command to retrieve all page content for a list of page titles.
+        Returns the name of the output file produced.
+        On error, raises an exception.
+        Arguments are as for content_request"""
+
+        return self.retrieve_all([self.content_request(titles_path, output_file)])[0]
+
+    def get_ns_dict(self, dump_path=None, cache_dir=None, offline=False):
+        """Retrieve namespace informtion for a wiki from the cache, from
+        a dump file, or via the MediaWiki api, and store in in dict form.
+        On error raises an exception.
+        Arguments:
+        dump_path  -- XML dump file with siteinfo header from which to read namespaces
+        cache_dir  -- directory with cached namespace information
+        offline    -- never retrieve namespace information from the api"""
+
+        self.namespaces = Namespaces(self.lang_code, self.project, cache_dir, dump_path,
+                                     offline, self.verbose)
+        try:
+            self.namespaces.load()
+        except NamespaceErr as e:
+            raise WikiContentErr(str(e))
+        return self.namespaces.get_ns_dict()
+
+    def get_ns_dict_by_string(self):
+        """Return dict of namespace name => number including canonical names
+        and aliases; get_ns_dict() must be called first"""
+
+        return self.namespaces.get_ns_dict_by_string()
 
 
 class Titles(object):
@@ -380,8 +620,22 @@ class Titles(object):
         self.list = []  # list of all titles but templates, with namespace prefix
         self.list_templates = []  # list of all template titles, with namespace prefix
         self.dict = {}  # dict without namespace prefix but values are {ns1: True, ns2: True} etc
+        # page id of each title in the lists that was read along with its id;
+        # titles converted from talk pages have none, as only the talk page id is known
+        self.ids = {}
+
+    def split_line(self, line, with_ids):
+        """Return (page id or None, title) for a line of a titles file
+        Arguments:
+        line      -- line of the file without the newline
+        with_ids  -- whether the line starts with a page id and a space"""
 
-    def add_related_titles_from_file(self, filename, related_ns_list, ns_list):
+        if with_ids:
+            (page_id, sep, title) = line.partition(" ")
+            return (page_id, title)
+        return (None, line)
+
+    def add_related_titles_from_file(self, filename, related_ns_list, ns_list, with_ids=False):
         """Read list of titles from file, for those in one of the
         specified namespaces, convert the title to one from its related
         namespace (i.e. if it was in Category talk, convert to Category,
@@ -390,14 +644,15 @@ class Titles(object):
         filename       -- full path to list of titles
         related_ns_list  -- list of namespaces wanted, e.g. ["4", "6", "12"]
         ns_list         -- list of namespaces to convert from, in the same order as the
-                          related NsList, e.g. ["5", "7", "13"]"""
+                          related NsList, e.g. ["5", "7", "13"]
+        with_ids        -- whether each line of the file starts with the page id"""
 
         # don't pass templates in here, we do those separately
         # because it could be a huge list and we want the user
         # to be able to save and reuse it
         fd = File.open_input(filename)
         for line in fd:
-            line = line.strip()
+            (page_id, line) = self.split_line(line.strip(), with_ids)
             sep = line.find(":")
             if sep != -1:
                 prefix = line[:sep]
@@ -421,6 +676,8 @@ class Titles(object):
                         ns = self.ns_dict_by_string[prefix]
                         no_prefix_title = line[sep + 1:]
                         self.list.append(no_prefix_title)
+                        if page_id:
+                            self.ids[no_prefix_title] = page_id
                         if no_prefix_title in self.dict:
                             self.dict[no_prefix_title][ns] = True
                         else:
@@ -428,41 +685,137 @@ class Titles(object):
             elif "0" in ns_list:
                 # main namespace, won't be caught above
                 self.list.append(line)
+                if page_id:
+                    self.ids[line] = page_id
                 if line in self.dict:
                     self.dict[line]["0"] = True
                 else:
                     self.dict[line] = {"0": True}
         fd.close()
 
-    def add_titles_from_file(self, filename, ns):
+    def add_titles_from_file(self, filename, ns, with_ids=False):
         """add titles from a file to the title list and dict.
         Note that template titles get added to a different title list
         than the rest, for separate processing
         Arguments:
         filename   -- full path to file containing page titles
         ns         -- number (string of digits) of namespace of page titles to
-                      grab from file"""
+                      grab from file
+        with_ids   -- whether each line of the file starts with the page id"""
 
         fd = File.open_input(filename)
         prefix = self.ns_dict[ns] + ":"
         prefix_len = len(prefix)
         for line in fd:
+            (page_id, line) = self.split_line(line[:-1], with_ids)  # lose newline
             if line.startswith(prefix):
                 if ns == "10":  # special case bleah
-                    self.list_templates.append(line[:-1])  # lose newline
+                    self.list_templates.append(line)
                 else:
-                    self.list.append(line[:-1])  # lose newline
-                no_prefix_title = line[prefix_len:-1]
+                    self.list.append(line)
+                if page_id:
+                    self.ids[line] = page_id
+                no_prefix_title = line[prefix_len:]
                 if no_prefix_title in self.dict:
                     self.dict[no_prefix_title][ns] = True
                 else:
                     self.dict[no_prefix_title] = {ns: True}
 
     def uniq(self):
-        """Remove duplicates from the lists of titles"""
+        """Remove duplicates from the lists of titles, leaving them sorted
+        so that the content is retrieved in a repeatable order"""
+
+        self.list = sorted(set(self.list))
+        self.list_templates = sorted(set(self.list_templates))
+
+    def write_list(self, path, titles, with_ids=False):
+        """Write titles to a file, one per line, and return the number
+        written. Arguments:
+        path      -- full path to the file
+        titles    -- list of titles
+        with_ids  -- write only the titles with a known page id, each
+                     after its id and a space, for retrieval by id"""
+
+        count = 0
+        out_fd = File.open_output(path)
+        for title in titles:
+            if not with_ids:
+                out_fd.write(title + "\n")
+            elif title in self.ids:
+                out_fd.write("%s %s\n" % (self.ids[title], title))
+            else:
+                continue
+            count = count + 1
+        out_fd.close()
+        return count
 
-        self.list = list(set(self.list))
-        self.list_templates = list(set(self.list_templates))
+
+def sort_tables(tables, output_dir, sort_mem, verbose):
+    """Put the rows of each sql file in primary key order, so that
+    InnoDB can append them as they are loaded instead of splitting
+    pages all over the table. Raises exception on error.
+    Returns the list of SqlSorter objects, with counts of rows found out of order.
+    Arguments:
+    tables      -- list of (table name, path to sql file)
+    output_dir  -- directory for temporary sort files
+    sort_mem    -- bytes of rows to sort in memory at once
+    verbose     -- display progress messages"""
+
+    sorters = []
+    for (table, sql_path) in tables:
+        if not os.path.exists(sql_path):
+            continue
+        sorter = SqlSorter(sql_path, table, tmpdir=output_dir, max_bytes=sort_mem, verbose=verbose)
+        try:
+            sorter.sort()
+        except SqlSortErr as e:
+            raise WikiContentErr("Error trying to sort sql table: %s" % str(e))
+        sorters.append(sorter)
+    return sorters
+
+
+def show_sort_report(sorters):
+    """Display what sort_tables did for each file, with a total of the rows
+    that would otherwise have been loaded out of primary key order; each of
+    those is an insert into the middle of the table, and so a likely page
+    split, on import"""
+
+    rows = 0
+    out_of_order = 0
+    for sorter in sorters:
+        sys.stderr.write(sorter.get_report() + "\n")
+        rows = rows + sorter.rows
+        out_of_order = out_of_order + sorter.out_of_order
+    sys.stderr.write("%d of %d rows put back in primary key order before import\n"
+                     % (out_of_order, rows))
+
+
+def download_sql_files(sql_files, tables, dumps_url, verbose):
+    """Download the sql table dumps named by the sqlfiles format string
+    that are missing or incomplete, checking them against the checksums
+    published with the dumps. Raises exception on error.
+    Arguments:
+    sql_files  -- path including format string, the file name part of
+                  which must be as in the dumps, e.g. enwiki-20130304-{t}.sql.gz
+    tables     -- list of tables to download
+    dumps_url  -- url of the top of the dumps tree
+    verbose    -- display progress messages"""
+
+    result = re.match(r"^([a-z0-9_]+)-([0-9]{8})-\{t\}\.sql\.gz$", os.path.basename(sql_files))
+    if not result:
+        raise WikiContentErr("can't find wiki and date in sqlfiles %s, expected something "
+                             "like enwiki-20130304-{t}.sql.gz\n" % sql_files)
+    (wiki, date) = result.groups()
+    downloader = DumpDownloader(dumps_url, wiki, date, os.path.dirname(sql_files) or ".",
+                                verbose=verbose)
+    try:
+        ok = downloader.download(get_table_files(wiki, date, tables))
+    except DownloadErr as e:
+        raise WikiContentErr("Error trying to download sql tables: %s" % str(e))
+    if verbose:
+        downloader.write_report(sys.stderr)
+    if not ok:
+        raise WikiContentErr("Error trying to download sql tables\n")
 
 
 class Filter(object):
@@ -487,15 +840,28 @@ class Filter(object):
         filter_path      -- full path to file containing filter values in form column:value
                            (starting with column 1)"""
 
-        command = [self.sql_filter, '-s', input, '-o', os.path.join(self.output_dir, output)]
-        if (filter_path):
-            command.extend(['-f', filter_path])
-        if self.verbose:
-            command.append('--verbose')
-            (result, junk) = self.runner.run_command(command)
-        if result:
-            raise WikiContentErr("Error trying to filter sql tables\n")
-        return
+        self.filter_all([(input, output)], filter_path)
+
+    def filter_all(self, files, filter_path, max_running=None):
+        """Run commands to filter several sql table dumps at once against
+        the same values. On error raises an exception.
+        Arguments:
+        files        -- list of (full path to sql file for input,
+                        filename (not full path) to write filtered sql output)
+        filter_path  -- as for filter
+        max_running  -- the most commands to run at the same time, None for no limit"""
+
+        commands = []
+        for (input, output) in files:
+            command = [self.sql_filter, '-s', input, '-o', os.path.join(self.output_dir, output)]
+            if (filter_path):
+                command.extend(['-f', filter_path])
+            if self.verbose:
+                command.append('--verbose')
+            commands.append(command)
+        for (result, junk) in self.runner.run_commands(commands, max_running):
+            if result:
+                raise WikiContentErr("Error trying to filter sql tables\n")
 
 
 def extended_usage():
@@ -526,10 +892,14 @@ Converttitles outputfiles:
 --titleswithprefix       path of file containing all titles except for templates for import
 --tmpltitleswithprefix   path of file containing all template namespace titles for this wiki
                 if already retrieved e.g. during a previous run
+--idswithprefix          with --byid, path of file containing page ids and titles of all
+                pages except for templates whose ids are known
 
 Retrievecontent outputfiles:
 --maincontent   path of file containing all content except templates for import
 --tmplcontent   path of file containing all template namespace content for import
+--idcontent     with --byid, path of file containing the content retrieved by page id
+                for --idswithprefix
 --content       path of file containing all content for import
 
 Makestub outputfles:
@@ -552,6 +922,9 @@ def usage(message=None, extended=None):
           [--lang langcode] [--project name] [--batchsize]
           [--output directory] [--auth username:password]
           [--sqlfilter path] [--mwxml2sql] [--wcr path]
+          [--nsfile path] [--nscache directory] [--offline]
+          [--dumpsurl url] [--sortmem megabytes] [--jobs number]
+          [--profile] [--profiledir directory] [--byid] [--store path]
           [--verbose] [--help] [--extendedhelp]
 """
     sys.stderr.write(usage_message)
@@ -604,6 +977,40 @@ Options:
 --mwxml2sql     path to mwxml2sql program, default: ./mwxml2sql
 --wcr           path to wikicontentretriever script, default: ./wcr
 
+--dumpsurl      url of the top of a dumps tree, e.g. https://dumps.wikimedia.org;
+                if given, sql files named by sqlfiles that are missing or
+                incomplete are downloaded from there and checked against the
+                published checksums before filtering; the file names must be
+                as in the dumps, e.g. enwiki-20130304-{t}.sql.gz
+--jobs          number of commands (title and content retrievals, sql filters)
+                to run at the same time, default: 4
+--sortmem       megabytes of rows to sort in memory at once when putting page
+                content and sql tables in primary key order; larger tables are
+                sorted on disk in the output directory, default: 256
+--profile       at the end of the run, show the wall clock time, cpu time and
+                peak memory use of each step, for this script and separately
+                for the commands it runs
+--profiledir    directory in which to write a cProfile dump of this script for
+                each step, e.g. converttitles.prof; implies --profile
+--byid          list titles along with their page ids and retrieve content by page
+                id wherever the id is known, i.e. for all pages but those found
+                by way of their talk pages; title files given to skip steps must
+                then have been written with page ids too
+--store         path to a local page store (an sqlite file) kept from run to run;
+                only pages whose current revision is not in the store are
+                downloaded, so that refreshing a subset costs requests in
+                proportion to the pages edited since the last run, not to the
+                size of the subset
+
+--nsfile        path to an XML dump file (content, stubs, logging) for the wiki,
+                from whose siteinfo header namespace information will be read
+                instead of asking the MediaWiki api for it
+--nscache       directory in which namespace information (including aliases) is
+                cached per wiki; if the wiki has an entry there it is used,
+                otherwise the entry is written after retrieval from the api
+--offline       never retrieve namespace information from the api; the cache or
+                the nsfile must have it
+
 --verbose       print progress messages to stderr
 --help          show this usage message
 --extendedhelp  show this usage message plus extended help
@@ -666,10 +1073,14 @@ def process_file_option(file_opt, value, odict):
         odict['main_titles_with_prefix_path'] = value
     elif file_opt == "tmpltitleswithprefix":
         odict['tmpl_titles_with_prefix_path'] = value
+    elif file_opt == "idswithprefix":
+        odict['main_ids_with_prefix_path'] = value
     elif file_opt == "maincontent":
         odict['main_ccontent_path'] = value
     elif file_opt == "tmplcontent":
         odict['template_content_path'] = value
+    elif file_opt == "idcontent":
+        odict['ids_content_path'] = value
     elif file_opt == "content":
         odict['content_path'] = value
     elif file_opt == "stubs":
@@ -682,12 +1093,18 @@ def do_main():
     o = {}  # stash all opt vars in here
 
     # init main opt vars
-    for opt in ['template', 'sql_files', 'mw_version', 'output_dir', 'username', 'password']:
+    for opt in ['template', 'sql_files', 'mw_version', 'output_dir', 'username', 'password',
+                'ns_file', 'ns_cache', 'dumps_url', 'profile_dir', 'store']:
         o[opt] = None
+    o['offline'] = False
+    o['profile'] = False
+    o['by_id'] = False
 
     o['project'] = "wikipedia"
     o['lang_code'] = "en"
     o['batch_size'] = 500
+    o['sort_mem'] = 256 * 1024 * 1024
+    o['jobs'] = 4
 
     cwd = Path(os.getcwd())
     o['sqlfilter'] = cwd.make_path("sqlfilter")
@@ -702,14 +1119,16 @@ def do_main():
     # init file opt vars
     for opt in ['titles_path', 'mediawiki_titles_path', 'module_titles_path', 'template_titles_path',
                 'main_titles_with_prefix_path', 'tmpl_titles_with_prefix_path', 'main_content_path',
-                'template_content_path', 'content_path', 'stubs_path', 'page_ids_path']:
+                'template_content_path', 'content_path', 'stubs_path', 'page_ids_path',
+                'main_ids_with_prefix_path', 'ids_content_path']:
         o[opt] = None
 
     verbose = False
 
     # option handling
     main_options = ["template=", "sqlfiles=", "mwversion=", "lang=",
-                    "project=", "batchsize=", "output=", "auth="]
+                    "project=", "batchsize=", "output=", "auth=", "nsfile=", "nscache=",
+                    "sortmem=", "dumpsurl=", "jobs=", "profiledir=", "store="]
     cmd_options = ["sqlfilter=", "mwxml2sql=", "wcr="]
 
     steps = ["retrievetitles", "converttitles", "retrievecontent", "makestubs",
@@ -717,14 +1136,14 @@ def do_main():
     skip_step_flags = ["no" + s for s in steps]
 
     convert_titles_options = ["titles=", "mwtitles=", "mdltitles=", "tmpltitles="]
-    retrieve_content_options = ["titleswithprefix=", "tmpltitleswithprefix="]
-    make_stubs_options = ["maincontent=", "tmplcontent=", "content="]
+    retrieve_content_options = ["titleswithprefix=", "tmpltitleswithprefix=", "idswithprefix="]
+    make_stubs_options = ["maincontent=", "tmplcontent=", "idcontent=", "content="]
     convert_xml_filter_sql_options = ["stubs=", "pageids="]
 
     files = [fopt[:-1] for fopt in convert_titles_options + retrieve_content_options +
              make_stubs_options + convert_xml_filter_sql_options]
 
-    misc_flags = ["verbose", "help", "extendedhelp"]
+    misc_flags = ["offline", "profile", "byid", "verbose", "help", "extendedhelp"]
 
     all_options = (main_options + cmd_options + skip_step_flags + convert_titles_options +
                    retrieve_content_options + make_stubs_options +
@@ -758,6 +1177,25 @@ def do_main():
                 o['username'], o['password'] = val.split(':')
             else:
                 o['username'] = val
+        elif opt == "--nsfile":
+            o['ns_file'] = val
+        elif opt == "--nscache":
+            o['ns_cache'] = val
+        elif opt == "--jobs":
+            if not val.isdigit() or not int(val):
+                usage("jobs must be a positive number")
+            o['jobs'] = int(val)
+        elif opt == "--dumpsurl":
+            o['dumps_url'] = val
+        elif opt == "--sortmem":
+            if not val.isdigit():
+                usage("sortmem must be a number")
+            o['sort_mem'] = int(val) * 1024 * 1024
+        elif opt == "--profiledir":
+            o['profile_dir'] = val
+            o['profile'] = True
+        elif opt == "--store":
+            o['store'] = val
 
         # command opts
         elif opt == "--sqlfilter":
@@ -776,6 +1214,12 @@ def do_main():
             process_file_option(opt[2:], val, o)
 
         # misc flags
+        elif opt == "--offline":
+            o['offline'] = True
+        elif opt == "--profile":
+            o['profile'] = True
+        elif opt == "--byid":
+            o['by_id'] = True
         elif opt == "--verbose":
             verbose = True
         elif opt == "--help":
@@ -792,6 +1236,10 @@ def do_main():
     date = time.strftime("%Y-%m-%d-%H%M%S", time.gmtime(time.time()))
     out = Path(o['output_dir'], o['lang_code'], o['project'], date)
 
+    if o['profile_dir'] and not os.path.isdir(o['profile_dir']):
+        os.makedirs(o['profile_dir'])
+    profiler = StepProfiler(o['profile'], o['profile_dir'])
+
     # processing begins
     if o['retrieve_titles']:
         if not o['wcr']:
@@ -806,37 +1254,46 @@ def do_main():
 
         if (verbose):
             sys.stderr.write("Retrieving page titles from wiki\n")
+        profiler.start("retrievetitles")
 
         r = Retriever(o['wcr'], o['output_dir'], o['lang_code'], o['project'], verbose)
+        # the retrievals are independent, so run them all at once
+        requests = []
         if not o['titles_path']:
             # get titles corresponding to the template
-            o['titles_path'] = r.get_titles_embedded_in(o['template'], out.make_file("main-titles.gz"))
-            if verbose:
-                sys.stderr.write("main content titles file produced: <%s>\n" % o['titles_path'])
-
+            requests.append(('titles_path', "main content titles",
+                             r.titles_embedded_in_request(o['template'],
+                                                          out.make_file("main-titles.gz"),
+                                                          with_ids=o['by_id'])))
         if not o['mediawiki_titles_path']:
             # get the mediawiki page titles
-            o['mediawiki_titles_path'] = r.get_titles_in_namespace("8", out.make_file("mw-titles.gz"))
-            if verbose:
-                sys.stderr.write("mediawiki titles file produced: <%s>\n" % o['mediawiki_titles_path'])
-
+            requests.append(('mediawiki_titles_path', "mediawiki titles",
+                             r.titles_in_namespace_request("8", out.make_file("mw-titles.gz"),
+                                                           with_ids=o['by_id'])))
         if not o['module_titles_path']:
             # get the module (lua) page titles
-            o['module_titles_path'] = r.get_titles_in_namespace("828", out.make_file("mod-titles.gz"))
-            if verbose:
-                sys.stderr.write("modules (lua) titles file produced: <%s>\n" % o['module_titles_path'])
-
+            requests.append(('module_titles_path', "modules (lua) titles",
+                             r.titles_in_namespace_request("828", out.make_file("mod-titles.gz"),
+                                                           with_ids=o['by_id'])))
         if not o['template_titles_path']:
             # get the template page titles
-            o['template_titles_path'] = r.get_titles_in_namespace("10", out.make_file("tmpl-titles.gz"))
+            requests.append(('template_titles_path', "templates titles",
+                             r.titles_in_namespace_request("10", out.make_file("tmpl-titles.gz"),
+                                                           with_ids=o['by_id'])))
+        paths = r.retrieve_all([request for (opt, name, request) in requests], o['jobs'])
+        profiler.add_children(r.runner.finished)
+        for ((opt, name, request), path) in zip(requests, paths):
+            o[opt] = path
             if verbose:
-                sys.stderr.write("templates titles file produced: <%s>\n" % o['template_titles_path'])
+                sys.stderr.write("%s file produced: <%s>\n" % (name, path))
 
         if (verbose):
+            r.runner.write_report(sys.stderr)
             sys.stderr.write("Done retrieving page titles from wiki, have " +
                              "%s, %s, %s and %s\n" % (
                                  o['titles_path'], o['mediawiki_titles_path'],
                                  o['module_titles_path'], o['template_titles_path']))
+        profiler.end()
 
     if o['convert_titles']:
         if (not o['titles_path'] or not o['mediawiki_titles_path'] or not o['module_titles_path'] or
@@ -847,15 +1304,13 @@ def do_main():
 
         if (verbose):
             sys.stderr.write("Converting retrieved titles \n")
+        profiler.start("converttitles")
 
         r = Retriever(o['wcr'], o['output_dir'], o['lang_code'], o['project'], verbose)
 
-        # get namespaces from the api
-        ns_dict = r.get_ns_dict()
-
-        ns_dict_by_string = {}
-        for nsnum in ns_dict.keys():
-            ns_dict_by_string[ns_dict[nsnum]] = nsnum
+        # get namespaces from the cache, a dump file or the api
+        ns_dict = r.get_ns_dict(o['ns_file'], o['ns_cache'], o['offline'])
+        ns_dict_by_string = r.get_ns_dict_by_string()
 
         if verbose:
             sys.stderr.write("namespace dicts assembled\n")
@@ -868,68 +1323,100 @@ def do_main():
 
         # check main, file, category, project talk namespaces and convert to
         # main, file, category, project talk namespaces
-        t.add_related_titles_from_file(o['titles_path'], ["1", "5", "7", "15"], ["0", "4", "6", "14"])
+        t.add_related_titles_from_file(o['titles_path'], ["1", "5", "7", "15"], ["0", "4", "6", "14"],
+                                       o['by_id'])
 
         if verbose:
             sys.stderr.write("page title hash assembled\n")
 
-        t.add_titles_from_file(o['mediawiki_titles_path'], "8")
+        t.add_titles_from_file(o['mediawiki_titles_path'], "8", o['by_id'])
         if verbose:
             sys.stderr.write("mediawiki titles added to page title hash\n")
 
-        t.add_titles_from_file(o['module_titles_path'], "828")
+        t.add_titles_from_file(o['module_titles_path'], "828", o['by_id'])
         if verbose:
             sys.stderr.write("module titles added to page title hash\n")
 
-        t.add_titles_from_file(o['template_titles_path'], "10")
+        t.add_titles_from_file(o['template_titles_path'], "10", o['by_id'])
         if verbose:
             sys.stderr.write("template titles added to page title hash\n")
 
         t.uniq()
 
         o['main_titles_with_prefix_path'] = out.make_path("main-titles-with-nsprefix.gz")
-        out_fd = File.open_output(o['main_titles_with_prefix_path'])
-        for line in t.list:
-            out_fd.write(line + "\n")
-        out_fd.close()
-
         o['tmpl_titles_with_prefix_path'] = out.make_path("tmpl-titles-with-nsprefix.gz")
-        out_fd = File.open_output(o['tmpl_titles_with_prefix_path'])
-        for line in t.list_templates:
-            out_fd.write(line + "\n")
-        out_fd.close()
+        if o['by_id']:
+            # titles with their page ids go by id; those converted from talk pages
+            # have none and still go by title
+            o['main_ids_with_prefix_path'] = out.make_path("main-ids-with-nsprefix.gz")
+            t.write_list(o['main_ids_with_prefix_path'], t.list, with_ids=True)
+            t.write_list(o['main_titles_with_prefix_path'],
+                         [title for title in t.list if title not in t.ids])
+            t.write_list(o['tmpl_titles_with_prefix_path'], t.list_templates, with_ids=True)
+        else:
+            t.write_list(o['main_titles_with_prefix_path'], t.list)
+            t.write_list(o['tmpl_titles_with_prefix_path'], t.list_templates)
 
         if (verbose):
             sys.stderr.write("Done converting retrieved titles, have %s and %s\n"
                              % (o['main_titles_with_prefix_path'], o['tmpl_titles_with_prefix_path']))
+            if o['by_id']:
+                sys.stderr.write("and %s, %d of %d titles with page ids\n"
+                                 % (o['main_ids_with_prefix_path'], len(t.ids),
+                                    len(t.list) + len(t.list_templates)))
+        profiler.end()
 
     if o['retrieve_content']:
         if not o['main_titles_with_prefix_path'] or not o['tmpl_titles_with_prefix_path']:
             usage("in retrieve_content: Missing mandatory option for skipping previous step.", True)
+        if o['by_id'] and not o['main_ids_with_prefix_path']:
+            usage("in retrieve_content: Missing mandatory option for skipping previous step.", True)
 
         if (verbose):
             sys.stderr.write("Retrieving page content from wiki\n")
+        profiler.start("retrievecontent")
 
+        r = Retriever(o['wcr'], o['output_dir'], o['lang_code'], o['project'], verbose)
+        requests = []
         if not o['template_content_path']:
             # filter out the template titles from the main_titles_with_prefix_path file
             # and just download the rest
-            o['template_content_path'] = r.get_content(o['tmpl_titles_with_prefix_path'],
-                                                       out.make_file("template-content.gz"))
-            if verbose:
-                sys.stderr.write("content retrieved from template page titles\n")
-
+            requests.append(('template_content_path', "template page titles",
+                             r.content_request(o['tmpl_titles_with_prefix_path'],
+                                               out.make_file("template-content.gz"),
+                                               by_id=o['by_id'], store_path=o['store'])))
         if not o['main_content_path']:
-            o['main_content_path'] = r.get_content(o['main_titles_with_prefix_path'],
-                                                   out.make_file("rest-content.gz"))
+            requests.append(('main_content_path', "page titles",
+                             r.content_request(o['main_titles_with_prefix_path'],
+                                               out.make_file("rest-content.gz"),
+                                               store_path=o['store'])))
+        if o['by_id'] and not o['ids_content_path']:
+            requests.append(('ids_content_path', "page ids",
+                             r.content_request(o['main_ids_with_prefix_path'],
+                                               out.make_file("ids-content.gz"), by_id=True,
+                                               store_path=o['store'])))
+        paths = r.retrieve_all([request for (opt, name, request) in requests], o['jobs'])
+        profiler.add_children(r.runner.finished)
+        for ((opt, name, request), path) in zip(requests, paths):
+            o[opt] = path
             if verbose:
-                sys.stderr.write("content retrieved from page titles\n")
+                sys.stderr.write("content retrieved from %s\n" % name)
+        if verbose:
+            r.runner.write_report(sys.stderr)
 
         o['content_path'] = out.make_path("content.gz")
-        File.combine_xml([o['template_content_path'], o['main_content_path']], o['content_path'])
+        # pages in page id order, so the stubs, page ids and tables made from them are too
+        content_paths = [o['template_content_path'], o['main_content_path']]
+        if o['by_id']:
+            content_paths.append(o['ids_content_path'])
+        File.combine_xml(content_paths, o['content_path'],
+                         sort_by_id=True, tmpdir=o['output_dir'], max_bytes=o['sort_mem'],
+                         verbose=verbose)
 
         if (verbose):
             sys.stderr.write("Done retrieving page content from wiki, have %s, %s and %s\n"
                              % (o['template_content_path'], o['main_content_path'], o['content_path']))
+        profiler.end()
 
     if o['make_stubs']:
         if not o['content_path']:
@@ -937,6 +1424,7 @@ def do_main():
 
         if (verbose):
             sys.stderr.write("Generating stub XML file and pageids file from downloaded content\n")
+        profiler.start("makestubs")
         s = Stubber(o['output_dir'], verbose)
         # generate stub XML file for converting sql and list of page ids for filtering sql
         o['stubs_path'] = out.make_path("stubs.gz")
@@ -946,6 +1434,7 @@ def do_main():
             sys.stderr.write("Done generating stub XML file and pageids file from " +
                              "downloaded content, have %s and %s\n" % (
                                  o['stubs_path'], o['page_ids_path']))
+        profiler.end()
 
     if o['convert_xml']:
         if not o['content_path']:
@@ -955,11 +1444,23 @@ def do_main():
 
         if (verbose):
             sys.stderr.write("Converting content to page, revision, text tables\n")
+        profiler.start("convertxml")
         c = Converter(o['mwxml2sql'], o['output_dir'], verbose)
         # convert the content file to page, revision and text tables
         c.convert_content(o['content_path'], o['stubs_path'], o['mw_version'])
+        profiler.add_children(c.runner.finished)
+        if verbose:
+            c.runner.write_report(sys.stderr)
+        # revisions and texts are written in the order of the content, which
+        # need not be id order within a page
+        sorters = sort_tables([(table, os.path.join(o['output_dir'], "filteredsql-%s.sql-%s.gz"
+                                                    % (table, o['mw_version'])))
+                               for table in ["page", "revision", "text"]],
+                              o['output_dir'], o['sort_mem'], verbose)
         if verbose:
+            show_sort_report(sorters)
             sys.stderr.write("Done converting content to page, revision, text tables\n")
+        profiler.end()
 
     if o['filter_sql']:
         if not o['page_ids_path']:
@@ -969,21 +1470,33 @@ def do_main():
         if not o['sqlfilter']:
             usage("in filter_sql: Missing mandatory option sqlfilter.")
 
+        profiler.start("filtersql")
+        tables = ["categorylinks", "externallinks", "imagelinks", "interwiki",
+                  "iwlinks", "langlinks", "page_props", "page_restrictions",
+                  "pagelinks", "protected_titles", "redirect", "templatelinks"]
+        if o['dumps_url']:
+            if verbose:
+                sys.stderr.write("Downloading sql tables\n")
+            download_sql_files(o['sql_files'], tables + ['category'], o['dumps_url'], verbose)
+
         if verbose:
             sys.stderr.write("Filtering sql tables against page ids for import\n")
 
         f = Filter(o['sqlfilter'], o['output_dir'], verbose)
         # filter all the sql tables (which should be in some nice directory)
         # against the pageids in page_ids_path file
-        for table in ["categorylinks", "externallinks", "imagelinks", "interwiki",
-                      "iwlinks", "langlinks", "page_props", "page_restrictions",
-                      "pagelinks", "protected_titles", "redirect", "templatelinks"]:
-            sql_filename = o['sql_files'].format(t=table)
-            filtered_filename = os.path.basename(sql_filename)
-            f.filter(sql_filename,
-                     filtered_filename,
-                     o['page_ids_path'])
+        files = [(o['sql_files'].format(t=table), os.path.basename(o['sql_files'].format(t=table)))
+                 for table in tables]
+        f.filter_all(files, o['page_ids_path'], o['jobs'])
+        profiler.add_children(f.runner.finished)
+        if verbose:
+            f.runner.write_report(sys.stderr)
+        filtered = [(table, os.path.join(o['output_dir'], filtered_filename))
+                    for (table, (sql_filename, filtered_filename)) in zip(tables, files)]
+        # table dumps are normally in key order already, in which case this only checks
+        sorters = sort_tables(filtered, o['output_dir'], o['sort_mem'], verbose)
         if (verbose):
+            show_sort_report(sorters)
             sys.stderr.write("Done filtering sql tables against page ids for import\n")
 
         # the one file we can't filter, it's not by pageid as categories might not have pages
@@ -993,7 +1506,9 @@ def do_main():
         if verbose:
             sys.stderr.write("about to copy %s to %s\n" % (sql_filename, new_filename))
         shutil.copyfile(sql_filename, new_filename)
+        profiler.end()
 
+    profiler.write_report(sys.stderr)
     if (verbose):
         sys.stderr.write("Done!\n")
     sys.exit(0)
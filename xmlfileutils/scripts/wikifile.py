@@ -1,6 +1,9 @@
 # -*- coding: utf-8 -*-
 import re
+import bz2
 import gzip
+from extsort import ExternalSort
+from progress import Progress
 
 
 class File(object):
@@ -13,6 +16,10 @@ class File(object):
 
         if (filename.endswith(".gz")):
             fd = gzip.open(filename, "rb")
+        elif (filename.endswith(".bz2")):
+            # note that this stops at the end of the first stream of
+            # a multistream file; see xmlshards for reading those
+            fd = bz2.BZ2File(filename, "r")
         else:
             fd = open(filename, "r")
         return fd
@@ -24,12 +31,15 @@ class File(object):
 
         if (filename.endswith(".gz")):
             fd = gzip.open(filename, "wb")
+        elif (filename.endswith(".bz2")):
+            fd = bz2.BZ2File(filename, "w")
         else:
             fd = open(filename, "w")
         return fd
 
     @staticmethod
-    def combine_xml(path_list, output_path):
+    def combine_xml(path_list, output_path, sort_by_id=False, tmpdir=None,
+                    max_bytes=256 * 1024 * 1024, verbose=False):
         """Combine multiple content or stub xml files into one,
         skipping extra headers (siteinfo etc) and footers
         There is a small risk here tht the site info is
@@ -37,20 +47,34 @@ class File(object):
         paranoid we would check that
         Arguments:
         path_list   -- list of full paths to xml content or stub files
-        output_path -- full path to combined output file"""
+        output_path -- full path to combined output file
+        sort_by_id  -- write the pages in order of page id, so that everything
+                       produced from the combined file (stubs, page ids, and
+                       the page table) is in primary key order too
+        tmpdir      -- directory for temporary files when sorting
+        max_bytes   -- bytes of page text to sort in memory at once when sorting
+        verbose     -- report progress on stderr now and then"""
+
+        if sort_by_id:
+            File.combine_xml_sorted(path_list, output_path, tmpdir, max_bytes, verbose=verbose)
+            return
 
         end_header_pattern = "^\s*</siteinfo>"
         compiled_end_header_pattern = re.compile(end_header_pattern)
         end_mediawiki_pattern = "^\s*</mediawiki>"
         compiled_end_mediawiki_pattern = re.compile(end_mediawiki_pattern)
 
+        progress = Progress("combining xml files", "pages", path_list, enabled=verbose)
         out_fd = File.open_output(output_path)
         i = 0
         list_len = len(path_list)
         for f in path_list:
             in_header = True
             in_fd = File.open_input(f)
+            progress.set_input(in_fd, f)
             for line in in_fd:
+                if "<page>" in line:
+                    progress.update()
                 if (i + 1 < list_len):  # skip footer of all files but last one
                     if compiled_end_mediawiki_pattern.match(line):
                         continue
@@ -63,3 +87,94 @@ class File(object):
             i = i + 1
 
         out_fd.close()
+        progress.finish()
+
+    @staticmethod
+    def read_pages(in_fd):
+        """Read the pages of a content or stub xml file one at a time,
+        skipping the header and footer, yielding (page id, XML text of the
+        page from <page> to </page>)
+        Arguments:
+        in_fd  -- file open for reading, as from open_input"""
+
+        page_pattern = re.compile(r"^\s*<page>")
+        end_page_pattern = re.compile(r"^\s*</page>")
+        id_pattern = re.compile(r"^\s*<id>(?P<i>[0-9]+)</id>")
+
+        page = None
+        page_id = None
+        for line in in_fd:
+            if page is not None:
+                page.append(line)
+                if page_id is None:
+                    result = id_pattern.match(line)
+                    if result:
+                        page_id = int(result.group("i"))
+                elif end_page_pattern.match(line):
+                    yield (page_id, "".join(page))
+                    page = None
+            elif page_pattern.match(line):
+                page = [line]
+                page_id = None
+
+    @staticmethod
+    def combine_xml_sorted(path_list, output_path, tmpdir=None, max_bytes=256 * 1024 * 1024,
+                           verbose=False):
+        """Combine multiple content or stub xml files into one with the
+        pages in order of page id, as combine_xml; pages are sorted with
+        an external merge sort, so the files need not fit in memory.
+        Arguments:
+        path_list   -- list of full paths to xml content or stub files
+        output_path -- full path to combined output file
+        tmpdir      -- directory for temporary sort files
+        max_bytes   -- bytes of page text to sort in memory at once
+        verbose     -- report progress on stderr now and then"""
+
+        page_pattern = re.compile(r"^\s*<page>")
+        end_page_pattern = re.compile(r"^\s*</page>")
+        id_pattern = re.compile(r"^\s*<id>(?P<i>[0-9]+)</id>")
+        end_header_pattern = re.compile(r"^\s*</siteinfo>")
+
+        sorter = ExternalSort(tmpdir=tmpdir, max_bytes=max_bytes)
+        progress = Progress("reading xml files to sort", "pages", path_list, enabled=verbose)
+        out_fd = File.open_output(output_path)
+        i = 0
+        for f in path_list:
+            in_header = True
+            page = None
+            page_id = None
+            in_fd = File.open_input(f)
+            progress.set_input(in_fd, f)
+            for line in in_fd:
+                if page is not None:
+                    page.append(line)
+                    if page_id is None:
+                        result = id_pattern.match(line)
+                        if result:
+                            page_id = int(result.group("i"))
+                    elif end_page_pattern.match(line):
+                        text = "".join(page)
+                        sorter.add((page_id, text), len(text))
+                        page = None
+                        progress.update()
+                elif page_pattern.match(line):
+                    in_header = False
+                    page = [line]
+                    page_id = None
+                elif in_header:
+                    # header of the first file only, up through siteinfo
+                    if not i:
+                        out_fd.write(line)
+                    if end_header_pattern.match(line):
+                        in_header = False
+            in_fd.close()
+            i = i + 1
+        progress.finish()
+        progress = Progress("writing sorted pages", "pages", total_items=progress.count, enabled=verbose)
+        for (page_id, text) in sorter.sorted():
+            out_fd.write(text)
+            progress.update()
+        progress.finish()
+        sorter.cleanup()
+        out_fd.write("</mediawiki>\n")
+        out_fd.close()
@@ -0,0 +1,614 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+import sys
+import time
+import shlex
+import getopt
+import getpass
+import sqlite3
+from subprocess import Popen, PIPE
+from wikifile import File
+from sqlwriter import RowWriter
+from pagerows import PageRows, PageRowsErr
+from requestmetrics import RequestMetrics
+from wikiretriever import WikiConnection, Content, RCTitles, WikiRetrieveErr, get_auth_from_file
+
+
+class MirrorErr(Exception):
+    pass
+
+
+class MirrorState(object):
+    """State of a mirror, kept in an sqlite file: the pages tracked, each
+    with its title and the revision id last applied to the mirror (0 if not
+    known, as for pages taken from a list), the recent changes cursor, the
+    timestamp of the newest change seen, and the number of polls recorded,
+    by which the changes of each poll are numbered. Pages whose export failed are
+    marked pending, to be tried again by the next poll.
+    Everything a poll changes is written in one transaction, after the
+    rows have been applied, so that a mirror restarted after a crash
+    starts again from the end of the last poll that was applied."""
+
+    def __init__(self, path):
+        """Constructor. Opens the state file, creating it if it does not exist.
+        Arguments:
+        path     -- path to the sqlite file"""
+
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.text_factory = str
+        self.db.execute("CREATE TABLE IF NOT EXISTS pages (page_id INTEGER PRIMARY KEY, "
+                        "rev_id INTEGER NOT NULL, title TEXT NOT NULL, "
+                        "pending INTEGER NOT NULL DEFAULT 0)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS pages_title ON pages (title)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+        self.db.commit()
+
+    def get_cursor(self):
+        """Return the timestamp of the newest change applied, as the api gives
+        it (2013-02-01T14:01:59Z), or None if there has been no poll yet"""
+
+        row = self.db.execute("SELECT value FROM meta WHERE name = 'cursor'").fetchone()
+        return row[0] if row else None
+
+    def get_poll_count(self):
+        """Return the number of polls recorded with checkpoint"""
+
+        row = self.db.execute("SELECT value FROM meta WHERE name = 'polls'").fetchone()
+        return int(row[0]) if row else 0
+
+    def track(self, pages):
+        """Start tracking pages, leaving alone those already tracked
+        Arguments:
+        pages  -- list of (page id, title)"""
+
+        self.db.executemany("INSERT OR IGNORE INTO pages (page_id, rev_id, title) VALUES (?, 0, ?)",
+                            [(int(page_id), title) for (page_id, title) in pages])
+        self.db.commit()
+
+    def get_rev_ids(self, page_ids):
+        """Return a dict of page id => revision id applied, for those of the
+        given page ids that are tracked
+        Arguments:
+        page_ids  -- list of page ids as ints"""
+
+        rev_ids = {}
+        page_ids = list(page_ids)
+        # sqlite allows no more than 999 parameters in a query
+        for start in range(0, len(page_ids), 500):
+            batch = page_ids[start:start + 500]
+            rows = self.db.execute("SELECT page_id, rev_id FROM pages WHERE page_id IN (%s)"
+                                   % ",".join(["?"] * len(batch)), batch)
+            rev_ids.update(dict(rows.fetchall()))
+        return rev_ids
+
+    def get_page_id(self, title):
+        """Return the id of the tracked page with this title, or None"""
+
+        row = self.db.execute("SELECT page_id FROM pages WHERE title = ?", (title,)).fetchone()
+        return row[0] if row else None
+
+    def get_pending(self):
+        return [row[0] for row in self.db.execute("SELECT page_id FROM pages WHERE pending = 1")]
+
+    def get_page_count(self):
+        return self.db.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+
+    def checkpoint(self, cursor, updated, deleted, pending):
+        """Record the results of a poll whose rows have been applied
+        Arguments:
+        cursor   -- timestamp of the newest change seen
+        updated  -- list of (page id, revision id, title) of pages applied
+        deleted  -- list of ids of pages deleted from the mirror
+        pending  -- list of ids of pages to try again next time"""
+
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, 0)", updated)
+            self.db.executemany("DELETE FROM pages WHERE page_id = ?",
+                                [(page_id,) for page_id in deleted])
+            # pages in tracked namespaces may not be in the table yet
+            self.db.executemany("INSERT OR IGNORE INTO pages VALUES (?, 0, '', 1)",
+                                [(page_id,) for page_id in pending])
+            self.db.executemany("UPDATE pages SET pending = 1 WHERE page_id = ?",
+                                [(page_id,) for page_id in pending])
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('cursor', ?)", (cursor,))
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('polls', ?)",
+                            (str(self.get_poll_count() + 1),))
+
+    def close(self):
+        self.db.close()
+
+
+class Delta(object):
+    """Changes to the page, revision and text tables found by one poll:
+    rows to be written over any with the same primary key, conditions for
+    rows to be deleted, and pages whose old text rows are to be deleted,
+    found through their revisions. Values are sql literals."""
+
+    tables = ["page", "revision", "text"]
+
+    def __init__(self):
+        self.rows = dict([(table, []) for table in Delta.tables])
+        self.deletes = dict([(table, []) for table in Delta.tables])
+        self.text_deletes = []  # (page id, revision id to keep or None)
+
+    def replace(self, table, values):
+        self.rows[table].append(values)
+
+    def delete(self, table, condition):
+        """Add rows to be deleted.
+        Arguments:
+        table      -- name of the table
+        condition  -- sql condition matching the rows, e.g. rev_id = 123"""
+
+        self.deletes[table].append(condition)
+
+    def delete_texts(self, page_id, keep_rev_id=None):
+        """Add the text rows of a page's revisions to be deleted; these are
+        found by the rev_text_id of the revisions, so they must be deleted
+        before the revisions are.
+        Arguments:
+        page_id      -- id of the page
+        keep_rev_id  -- id of a revision whose text is to be kept, if any"""
+
+        self.text_deletes.append((page_id, keep_rev_id))
+
+    def is_empty(self):
+        return (not any(self.rows.values()) and not any(self.deletes.values()) and
+                not self.text_deletes)
+
+
+class SqlFileSink(object):
+    """Write the changes of each poll to a file of sql statements in a
+    directory, named after the rc cursor and the poll number, e.g.
+    delta-20130201140159-00000042.sql.gz, to be fed to mysql in name order:
+    DELETEs, then REPLACE statements with many rows each, all in one
+    transaction. Polls that find no newer changes keep the cursor, so the
+    number is needed to keep their files apart.
+    Other places for the changes to go, such as CommandSink, subclass this
+    and override apply, which must not return until the changes are safely
+    stored, since the rc cursor is checkpointed straight after; applying the
+    same changes twice must do no harm, as it may happen after a crash."""
+
+    def __init__(self, output_dir, compress=True, verbose=False):
+        """Constructor. Arguments:
+        output_dir  -- directory in which to write the files
+        compress    -- gzip the files
+        verbose     -- display progress messages on stderr"""
+
+        self.output_dir = output_dir
+        if not os.path.isdir(self.output_dir):
+            os.makedirs(self.output_dir)
+        self.compress = compress
+        self.verbose = verbose
+        self.page_rows = PageRows()
+
+    def write_sql(self, output_fd, delta):
+        """Write the statements for the changes in a delta to an open file"""
+
+        output_fd.write("BEGIN;\n")
+        # while the old revisions are still there to say which texts are theirs
+        for (page_id, keep_rev_id) in delta.text_deletes:
+            condition = "rev_page = %d" % page_id
+            if keep_rev_id is not None:
+                condition = condition + " AND rev_id <> %d" % keep_rev_id
+            output_fd.write("DELETE text FROM text JOIN revision ON old_id = rev_text_id "
+                            "WHERE %s;\n" % condition)
+        for table in Delta.tables:
+            for condition in delta.deletes[table]:
+                output_fd.write("DELETE FROM %s WHERE %s;\n" % (table, condition))
+        for table in Delta.tables:
+            writer = RowWriter(output_fd, table, self.page_rows.get_columns(table), "extended",
+                               replace=True)
+            for values in delta.rows[table]:
+                writer.write_row(values)
+            writer.close()
+        output_fd.write("COMMIT;\n")
+
+    def apply(self, delta, cursor, poll):
+        """Apply the changes of one poll.
+        Arguments:
+        delta   -- Delta
+        cursor  -- timestamp of the newest change the poll saw
+        poll    -- number of the poll, counting from 1 over the life of the
+                   mirror; a poll that is run again after a crash has the
+                   same number, and its changes include those of the first try"""
+
+        filename = "delta-%s-%08d.sql%s" % (re.sub("[^0-9]", "", cursor), poll,
+                                            ".gz" if self.compress else "")
+        path = os.path.join(self.output_dir, filename)
+        # written aside and renamed, so a file under its own name is complete;
+        # the suffix is kept for File to pick the compression by
+        tmp_path = os.path.join(self.output_dir, "." + filename)
+        output_fd = File.open_output(tmp_path)
+        self.write_sql(output_fd, delta)
+        output_fd.close()
+        os.rename(tmp_path, path)
+        if self.verbose:
+            sys.stderr.write("changes written to %s\n" % path)
+
+    def close(self):
+        pass
+
+
+class CommandSink(SqlFileSink):
+    """Pipe the statements for the changes of each poll to a command, such
+    as the mysql client, which must exit with status 0 once they are applied"""
+
+    def __init__(self, command, verbose=False):
+        """Constructor. Arguments:
+        command  -- command line, e.g. 'mysql -u wikiuser -D wikidb'
+        verbose  -- display progress messages on stderr"""
+
+        self.command = shlex.split(command)
+        self.verbose = verbose
+        self.page_rows = PageRows()
+
+    def apply(self, delta, cursor, poll):
+        process = Popen(self.command, stdin=PIPE)
+        try:
+            self.write_sql(process.stdin, delta)
+            process.stdin.close()
+        except IOError:
+            # the command went away early; its exit code says why
+            pass
+        if process.wait():
+            raise MirrorErr("%s failed with exit code %d" % (" ".join(self.command),
+                                                             process.returncode))
+
+
+class Mirror(object):
+    """Keep a subset of a wiki's pages current in a mirror, by polling recent
+    changes from the last change seen, exporting the tracked pages with new
+    revisions since then, and passing their page, revision and text rows to
+    a SqlFileSink or CommandSink to be written over the old ones. Revisions
+    the mirror had before are deleted, so that like a rebuild from a current
+    content dump it has one revision for each page; tracked pages that have
+    been deleted from the wiki are deleted from the mirror."""
+
+    def __init__(self, wiki_conn, state, sink, namespaces=None, start_date="now",
+                 batch_size=500, max_retries=20, verbose=False):
+        """Constructor. Arguments:
+        wiki_conn    -- initialized WikiConnection object for the wiki
+        state        -- MirrorState
+        sink         -- SqlFileSink or CommandSink to apply the changes of each poll
+        namespaces   -- list of namespace numbers all of whose pages are tracked,
+                        including those created later, or None
+        start_date   -- date from which to start polling recent changes if
+                        the state has no cursor yet, in any format _date takes
+        batch_size   -- number of changes to list at once
+        max_retries  -- number of times to wait and retry if dbs are lagged, before giving up
+        verbose      -- display progress messages on stderr"""
+
+        self.wiki_conn = wiki_conn
+        self.state = state
+        self.sink = sink
+        self.namespaces = namespaces
+        self.start_date = start_date
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.verbose = verbose
+        self.workdir = os.path.dirname(os.path.abspath(state.path))
+        self.page_rows = PageRows()
+        # totals over all polls
+        self.polls = 0
+        self.pages_applied = 0
+        self.pages_deleted = 0
+
+    def get_changed_pages(self, cursor):
+        """Return (ids of tracked pages changed since the cursor, newest
+        change timestamp) from recent changes. The cursor's own second is
+        listed again, as changes may have come in during it after the last
+        poll; those already applied are weeded out by revision id later.
+        Arguments:
+        cursor  -- timestamp of the newest change already seen, or the
+                   date to start from, in any format _date takes"""
+
+        rc_titles = RCTitles(self.wiki_conn, None, "timestamp", "now", cursor, self.workdir, None,
+                             False, False, self.batch_size, self.max_retries, self.verbose,
+                             pageids=True)
+        # the namespace of each change too, to check against those tracked
+        rc_titles.attrs_to_extract.append("ns")
+        changes = 0
+        newest = None
+        changed = set()
+        candidates = []
+        for entries in rc_titles.get_entries():
+            for (page_id, title, timestamp, ns) in entries:
+                changes = changes + 1
+                newest = max(newest, timestamp)
+                candidates.append((int(page_id), title, ns))
+        if newest is None:
+            newest = rc_titles.end_date_string
+        tracked = self.state.get_rev_ids([page_id for (page_id, title, ns) in candidates if page_id])
+        for (page_id, title, ns) in candidates:
+            if not page_id:
+                # deletions and other log entries have no page id, only the title
+                page_id = self.state.get_page_id(title)
+                if page_id is not None:
+                    changed.add(page_id)
+            elif page_id in tracked or (self.namespaces and ns in self.namespaces):
+                changed.add(page_id)
+        if self.verbose:
+            sys.stderr.write("%d recent changes since %s, %d to tracked pages\n"
+                             % (changes, cursor, len(changed)))
+        return (changed, newest)
+
+    def poll(self):
+        """Find the changes to tracked pages since the last poll and apply them.
+        Returns the number of pages whose rows were written or deleted."""
+
+        (changed, newest) = self.get_changed_pages(self.state.get_cursor() or self.start_date)
+        changed.update(self.state.get_pending())
+
+        content = Content(self.wiki_conn, None, self.workdir, None, self.batch_size,
+                          self.max_retries, self.verbose, by_id=True)
+        page_ids = sorted(changed)
+        info = content.get_page_info([str(page_id) for page_id in page_ids])
+        applied = self.state.get_rev_ids(page_ids)
+        delta = Delta()
+        to_export = []
+        deleted = []
+        for (page_id, (current_id, rev_id, length)) in zip(page_ids, info):
+            if current_id is None:
+                if page_id in applied:
+                    deleted.append(page_id)
+                    delta.delete_texts(page_id)
+                    delta.delete("page", "page_id = %d" % page_id)
+                    delta.delete("revision", "rev_page = %d" % page_id)
+            elif applied.get(page_id) != int(rev_id):
+                to_export.append(str(page_id))
+
+        updated = []
+        for start in range(0, len(to_export), content.batch_size):
+            for (header, pages) in content.export_titles(to_export[start:start + content.batch_size]):
+                for page_xml in content.page_pattern.findall(pages):
+                    (page_id, rev_id, title, rows) = self.page_rows.get_rows(page_xml)
+                    for table in Delta.tables:
+                        delta.replace(table, rows[table])
+                    # the one revision the page had before, and any others, with their texts
+                    delta.delete_texts(page_id, rev_id)
+                    delta.delete("revision", "rev_page = %d AND rev_id <> %d" % (page_id, rev_id))
+                    updated.append((page_id, rev_id, title))
+        # failed exports, and pages deleted between the lookup and the export
+        done = set([str(page[0]) for page in updated])
+        pending = [int(wanted) for wanted in to_export if wanted not in done]
+
+        if not delta.is_empty():
+            self.sink.apply(delta, newest, self.state.get_poll_count() + 1)
+        self.state.checkpoint(newest, updated, deleted, pending)
+        self.polls = self.polls + 1
+        self.pages_applied = self.pages_applied + len(updated)
+        self.pages_deleted = self.pages_deleted + len(deleted)
+        if self.verbose or pending:
+            sys.stderr.write("poll to %s: %d pages changed, %d deleted, %d left for next time\n"
+                             % (newest, len(updated), len(deleted), len(pending)))
+        return len(updated) + len(deleted)
+
+    def run(self, interval, once=False):
+        """Poll every interval seconds, for ever or just once. A poll that
+        fails is reported and tried again after the interval.
+        Arguments:
+        interval  -- seconds from the start of one poll to the start of the next
+        once      -- poll once and return, e.g. when run from cron"""
+
+        while True:
+            start = time.time()
+            try:
+                self.poll()
+            except (WikiRetrieveErr, MirrorErr, PageRowsErr) as e:
+                if once:
+                    raise
+                sys.stderr.write("poll failed, will try again: %s\n" % e)
+                self.wiki_conn.close()
+            if once:
+                return
+            time.sleep(max(0, interval - (time.time() - start)))
+
+
+def read_tracked_pages(path):
+    """Return a list of (page id, title) from a file of lines each with a
+    page id and a title, as wikiretriever.py writes with --pageids"""
+
+    pages = []
+    input_fd = File.open_input(path)
+    for line in input_fd:
+        fields = line.rstrip("\n").split(" ", 1)
+        if not fields[0].isdigit():
+            continue
+        pages.append((fields[0], fields[1] if len(fields) > 1 else ""))
+    input_fd.close()
+    return pages
+
+
+def usage(message=None):
+    """Show usage and help information. Arguments:
+    message   -- message to be shown (e.g. error message) before the help"""
+
+    if message:
+        sys.stderr.write(message)
+        sys.stderr.write("\n")
+    usage_message = """Usage: python wikimirror.py --state path
+           [--track path] [--namespaces number,number...]
+           [--outputdir dirname | --command command] [--nocompress]
+           [--wiki wikiname] [--auth username:password] [--authfile filename] [--http]
+           [--startdate datestring] [--interval seconds] [--once]
+           [--batchsize number] [--retries number] [--metricsjson path] [--verbose]
+
+This script keeps a subset of a wiki's pages current in a mirror database
+built from a current content dump, in place of rebuilding the mirror from
+scratch. Every so often it lists the recent changes since the newest one it
+saw, exports the tracked pages with new revisions, and writes their rows for
+the page, revision and text tables over the old ones (REPLACE), deleting the
+revisions the mirror had before, and any tracked pages deleted on the wiki.
+Where the changes found by each poll go is up to the caller: they may be
+written to a file of sql statements in a directory, or piped to a command
+such as the mysql client. The tracked pages, the revision of each in the
+mirror and the timestamp of the newest change applied are kept in the state
+file, updated only once the changes of a poll have been applied, so that a
+mirror that is stopped and started again carries on where it left off.
+
+Options:
+
+--state (-s):      path to the state file (sqlite, created if it does not exist)
+--track (-t):      file of pages to track, each line with a page id and a title, as
+                   written by wikiretriever.py with --pageids; may be given on later
+                   runs too, to track more pages
+--namespaces (-n): track all pages in these namespaces, separated by commas,
+                   including those created later
+--outputdir (-o):  write the changes of each poll to a file
+                   delta-<timestamp>-<poll>.sql.gz in this directory, with <timestamp>
+                   that of the newest change and <poll> the number of the poll;
+                   feed the files to mysql in name order
+--command (-c):    pipe the changes of each poll to this command, e.g.
+                   'mysql -u wikiuser -D wikidb'; it must exit with status 0 once
+                   they are applied
+--nocompress:      with outputdir, do not gzip the files
+--wiki (-w):       name of the wiki, default: en.wikipedia.org
+--auth (-a):       username:password to log in with; users with the apihighlimits
+                   right (bots, sysops) may export 500 pages at once, others 50
+--authfile (-A):   file with authentication information, as for wikiretriever.py
+--http:            connect to the wiki with plain http, e.g. for fakewiki.py
+--startdate (-S):  if the state file has no cursor yet, start from changes made since
+                   this date, in any format wikiretriever.py takes, default: now
+--interval (-i):   seconds between polls, default: 60
+--once:            poll once and exit, e.g. when run from cron
+--batchsize (-b):  number of recent changes to list at once, default: 500
+--retries (-r):    number of times to retry a request if the wiki databases are
+                   lagged, default: 20
+--metricsjson:     write counts and timings of the requests made to this file as
+                   json, as wikiretriever.py does
+--verbose (-v):    display messages about what the program is doing
+--help (-h):       display this usage message
+
+Example:
+   python wikiretriever.py -q namespace -p 10 --pageids -o . -O templates.gz
+   python wikimirror.py --state templates.sqlite --track templates.gz \\
+             --startdate 2017-05-01 --command 'mysql -u root -D elwiktionary'
+"""
+    sys.stderr.write(usage_message)
+    sys.exit(1)
+
+
+def do_main():
+    state_path = None
+    track_path = None
+    namespaces = None
+    output_dir = None
+    command = None
+    compress = True
+    wikiname = "en.wikipedia.org"
+    username = None
+    password = None
+    authfile = None
+    use_http = False
+    start_date = "now"
+    interval = 60
+    once = False
+    batch_size = 500
+    max_retries = 20
+    metrics_json = None
+    verbose = False
+
+    try:
+        (options, remainder) = getopt.gnu_getopt(
+            sys.argv[1:], "s:t:n:o:c:w:a:A:S:i:b:r:vh",
+            ["state=", "track=", "namespaces=", "outputdir=", "command=", "nocompress",
+             "wiki=", "auth=", "authfile=", "http", "startdate=", "interval=", "once",
+             "batchsize=", "retries=", "metricsjson=", "verbose", "help"])
+    except getopt.GetoptError as err:
+        usage("Unknown option specified: " + str(err))
+
+    for (opt, val) in options:
+        if opt in ["-s", "--state"]:
+            state_path = val
+        elif opt in ["-t", "--track"]:
+            track_path = val
+        elif opt in ["-n", "--namespaces"]:
+            namespaces = val.split(",")
+            if not all([ns.isdigit() for ns in namespaces]):
+                usage("namespaces must be numbers separated by commas")
+        elif opt in ["-o", "--outputdir"]:
+            output_dir = val
+        elif opt in ["-c", "--command"]:
+            command = val
+        elif opt == "--nocompress":
+            compress = False
+        elif opt in ["-w", "--wiki"]:
+            wikiname = val
+        elif opt in ["-a", "--auth"]:
+            if ':' in val:
+                username, password = val.split(':')
+            else:
+                username = val
+        elif opt in ["-A", "--authfile"]:
+            authfile = val
+        elif opt == "--http":
+            use_http = True
+        elif opt in ["-S", "--startdate"]:
+            start_date = val
+        elif opt in ["-i", "--interval", "-b", "--batchsize", "-r", "--retries"]:
+            if not val.isdigit():
+                usage("%s must be a number" % opt)
+            if opt in ["-i", "--interval"]:
+                interval = int(val)
+            elif opt in ["-b", "--batchsize"]:
+                batch_size = int(val)
+            else:
+                max_retries = int(val)
+        elif opt == "--once":
+            once = True
+        elif opt == "--metricsjson":
+            metrics_json = val
+        elif opt in ["-v", "--verbose"]:
+            verbose = True
+        elif opt in ["-h", "--help"]:
+            usage("Options help:")
+        else:
+            usage("Unknown option specified: %s" % opt)
+
+    if len(remainder) > 0:
+        usage("Unknown option specified: <%s>" % remainder[0])
+    if not state_path:
+        usage("Missing mandatory option state")
+    if bool(output_dir) == bool(command):
+        usage("One of outputdir or command must be given")
+
+    if authfile:
+        (username, password) = get_auth_from_file(authfile, username, password)
+    if username and not password:
+        password = getpass.getpass("Password: ")
+
+    state = MirrorState(state_path)
+    if track_path:
+        state.track(read_tracked_pages(track_path))
+    if not state.get_page_count() and not namespaces:
+        usage("No pages to track; give track or namespaces")
+
+    if output_dir:
+        sink = SqlFileSink(output_dir, compress, verbose)
+    else:
+        sink = CommandSink(command, verbose)
+    metrics = RequestMetrics(wikiname, metrics_json) if metrics_json else None
+    wiki_conn = WikiConnection(wikiname, username, password, verbose, metrics, use_http)
+    wiki_conn.login()
+    mirror = Mirror(wiki_conn, state, sink, namespaces, start_date, batch_size, max_retries,
+                    verbose)
+    try:
+        mirror.run(interval, once)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        wiki_conn.close()
+        sink.close()
+        state.close()
+        if metrics:
+            metrics.close()
+    if verbose:
+        sys.stderr.write("%d polls, %d pages changed, %d deleted\n"
+                         % (mirror.polls, mirror.pages_applied, mirror.pages_deleted))
+
+
+if __name__ == "__main__":
+    do_main()
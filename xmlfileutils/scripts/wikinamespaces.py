@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+import sys
+import json
+import urllib
+from wikifile import File
+
+
+class NamespaceErr(Exception):
+    pass
+
+
+class Namespaces(object):
+    """Namespace information for a wiki: local names, canonical names,
+    aliases and case rules for each namespace number.
+    This may be read from the siteinfo header of an XML dump file, from
+    a cache file on disk, or from the MediaWiki api; the last is only
+    done if the other two are unavailable, and the result is written to
+    the cache for the next run.
+    Note that namespace numbers are strings of digits, not ints"""
+
+    def __init__(self, lang_code, project, cache_dir=None, dump_path=None,
+                 offline=False, verbose=False):
+        """Constructor. Arguments:
+        lang_code  -- language code of project, like en el etc.
+        project    -- type of project, like wiktionary, wikipedia, etc.
+        cache_dir  -- directory for cached namespace info, or None for no caching
+        dump_path  -- path to XML dump file (content, stubs, logging) with a
+                      siteinfo header, or None
+        offline    -- if set, never contact the wiki; fail if neither the
+                      dump nor the cache has the information
+        verbose    -- display progress messages"""
+
+        self.lang_code = lang_code
+        self.project = project
+        self.cache_dir = cache_dir
+        self.dump_path = dump_path
+        self.offline = offline
+        self.verbose = verbose
+
+        self.names = {}  # nsnum => local name
+        self.cases = {}  # nsnum => 'first-letter' or 'case-sensitive'
+        self.aliases = {}  # nsnum => list of canonical name and other aliases
+        self.lowered = None  # lowercased name or alias => nsnum, filled in on first lookup
+
+        # format: <namespace key="1" case="first-letter">Talk</namespace>
+        #         <namespace key="0" case="first-letter" />
+        self.namespace_pattern = re.compile(
+            r'<namespace\s+key="(?P<k>-?[0-9]+)"(?:\s+case="(?P<c>[^"]*)")?\s*'
+            r'(?:/>|>(?P<n>[^<]*)</namespace>)')
+
+    def get_wikiname(self):
+        """Return the hostname of the wiki"""
+
+        return "%s.%s.org" % (self.lang_code, self.project)
+
+    def get_cache_path(self):
+        """Return the path of the cache file for this wiki"""
+
+        return os.path.join(self.cache_dir, "%s-namespaces.json" % self.get_wikiname())
+
+    def un_xml_escape(self, name):
+        """Convert XML sanitized namespace name to its regular format"""
+
+        name = name.replace("&quot;", '"')
+        name = name.replace("&lt;", '<')
+        name = name.replace("&gt;", '>')
+        name = name.replace("&#039;", "'")
+        name = name.replace("&amp;", '&')  # this one must be last
+        return name
+
+    def load_from_dump(self, dump_path):
+        """Read namespace information from the <siteinfo> header of an
+        XML dump file. Returns True if namespaces were found.
+        Arguments:
+        dump_path  -- path to possibly compressed XML dump file"""
+
+        fd = File.open_input(dump_path)
+        found = self.load_from_lines(fd)
+        fd.close()
+        return found
+
+    def load_from_header(self, header):
+        """Read namespace information from the XML header of an export,
+        up through </siteinfo>. Returns True if namespaces were found.
+        Arguments:
+        header  -- XML text of the header"""
+
+        return self.load_from_lines(header.splitlines())
+
+    def load_from_lines(self, lines):
+        """Read namespace information from the lines of a <siteinfo>
+        header, stopping at the end of the namespaces. Returns True if
+        namespaces were found."""
+
+        found = False
+        for line in lines:
+            if '<namespace ' in line:
+                result = self.namespace_pattern.search(line)
+                if result:
+                    key = result.group('k')
+                    self.names[key] = self.un_xml_escape(result.group('n') or '')
+                    self.cases[key] = result.group('c') or 'first-letter'
+                    self.aliases[key] = []
+                    found = True
+            elif '</namespaces>' in line or '</siteinfo>' in line or '<page>' in line:
+                break
+        return found
+
+    def load_from_cache(self):
+        """Read namespace information from the cache file for this wiki.
+        Returns True if the cache file existed."""
+
+        if not self.cache_dir or not os.path.exists(self.get_cache_path()):
+            return False
+        fd = open(self.get_cache_path(), "r")
+        cached = json.load(fd)
+        fd.close()
+        for key in cached['names']:
+            self.names[str(key)] = cached['names'][key].encode('utf8')
+            self.cases[str(key)] = str(cached['cases'][key])
+            self.aliases[str(key)] = [a.encode('utf8') for a in cached['aliases'][key]]
+        return True
+
+    def save_to_cache(self):
+        """Write namespace information to the cache file for this wiki, if
+        we have a cache directory"""
+
+        if not self.cache_dir:
+            return
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        # write to a temp file first so that a concurrent run never sees a partial file
+        temp_path = self.get_cache_path() + ".tmp"
+        fd = open(temp_path, "w")
+        json.dump({'names': self.names, 'cases': self.cases, 'aliases': self.aliases}, fd)
+        fd.close()
+        os.rename(temp_path, self.get_cache_path())
+
+    def load_from_api(self):
+        """Retrieve namespace information and aliases for a wiki via the MediaWiki api.
+        On error raises an exception."""
+
+        # http://en.wikipedia.org/w/api.php?action=query&meta=siteinfo
+        #     &siprop=namespaces|namespacealiases&format=json
+        api_url = ("http://" + self.get_wikiname() + "/w/api.php" +
+                   "?action=query&meta=siteinfo&siprop=namespaces|namespacealiases&format=json")
+        ufd = urllib.urlopen(api_url)
+        if not str(ufd.getcode()).startswith("2"):
+            code = ufd.getcode()
+            ufd.close()
+            raise NamespaceErr("Error trying to retrieve namespace info: %s\n" % code)
+
+        output = ufd.read()
+        ufd.close()
+        site_info = json.loads(output)
+        if 'query' not in site_info or 'namespaces' not in site_info['query']:
+            raise NamespaceErr("Error trying to get namespace information from api\n")
+        namespaces = site_info['query']['namespaces']
+        for k in namespaces.keys():
+            if '*' not in namespaces[k]:
+                raise NamespaceErr("Error trying to get parse namespace information\n")
+            key = str(k)
+            self.names[key] = namespaces[k]['*'].encode('utf8')
+            self.cases[key] = str(namespaces[k].get('case', 'first-letter'))
+            self.aliases[key] = []
+            if 'canonical' in namespaces[k]:
+                canonical = namespaces[k]['canonical'].encode('utf8')
+                if canonical != self.names[key]:
+                    self.aliases[key].append(canonical)
+        for alias in site_info['query'].get('namespacealiases', []):
+            key = str(alias['id'])
+            if key in self.aliases:
+                self.aliases[key].append(alias['*'].encode('utf8'))
+
+    def load(self):
+        """Get namespace information from the cache, the dump file or the
+        api, in that order, saving anything retrieved from the api to the cache.
+        On error raises an exception."""
+
+        if self.load_from_cache():
+            source = "cache"
+        elif self.dump_path and self.load_from_dump(self.dump_path):
+            source = "dump file"
+        elif self.offline:
+            raise NamespaceErr("No namespace information available for %s without network access\n"
+                               % self.get_wikiname())
+        else:
+            self.load_from_api()
+            self.save_to_cache()
+            source = "api"
+        if self.verbose:
+            sys.stderr.write("namespace information for %s read from %s\n"
+                             % (self.get_wikiname(), source))
+
+    def get_ns_dict(self):
+        """Return dict of namespace number => local namespace name"""
+
+        return dict(self.names)
+
+    def get_ns_dict_by_string(self):
+        """Return dict of namespace name => namespace number, covering
+        local names, canonical names and aliases, each with spaces and
+        with underscores"""
+
+        by_string = {}
+        for key in self.names:
+            for name in [self.names[key]] + self.aliases[key]:
+                by_string[name] = key
+                by_string[name.replace(' ', '_')] = key
+        return by_string
+
+    def get_case(self, nsnum):
+        """Return the case rule ('first-letter' or 'case-sensitive') for
+        titles in the namespace"""
+
+        return self.cases.get(nsnum, 'first-letter')
+
+    def get_ns_num(self, prefix):
+        """Return the namespace number for a title prefix, which may be
+        a local name, canonical name or alias, with any capitalization and
+        with spaces or underscores; None if the prefix is not a namespace.
+        Arguments:
+        prefix  -- title prefix, without the trailing colon"""
+
+        if self.lowered is None:
+            self.lowered = {}
+            for name, key in self.get_ns_dict_by_string().items():
+                self.lowered[name.replace('_', ' ').decode('utf8').lower()] = key
+        # namespace names are case-insensitive
+        return self.lowered.get(prefix.replace('_', ' ').decode('utf8').lower())
+
+    def normalize_title(self, nsnum, title):
+        """Apply the case rule for the namespace to a title without prefix,
+        i.e. uppercase the first letter for first-letter namespaces
+        Arguments:
+        nsnum  -- namespace number (string of digits)
+        title  -- utf8-encoded title without namespace prefix"""
+
+        if not title or self.get_case(nsnum) != 'first-letter':
+            return title
+        utitle = title.decode('utf8')
+        return (utitle[0].upper() + utitle[1:]).encode('utf8')
+
+    def normalize_full_title(self, title):
+        """Return a title with namespace prefix as the wiki has it: with
+        spaces rather than underscores, the prefix as the local namespace
+        name, and the case rule of the namespace applied to the rest. A
+        prefix that is not a namespace is part of a main namespace title.
+        Arguments:
+        title  -- utf8-encoded title"""
+
+        title = title.replace('_', ' ').strip()
+        (prefix, sep, rest) = title.partition(':')
+        nsnum = self.get_ns_num(prefix.strip()) if sep else None
+        if nsnum is None:
+            return self.normalize_title('0', title)
+        rest = self.normalize_title(nsnum, rest.strip())
+        if nsnum == '0':
+            return rest
+        return self.names[nsnum] + ':' + rest
@@ -8,22 +8,160 @@ import urllib
 import time
 import calendar
 import getpass
+import hashlib
+import struct
+import sqlite3
+import socket
+import tempfile
+import collections
+import threading
+import Queue
 from xml.etree import ElementTree as ElementTree
 from wikifile import File
+from requestmetrics import RequestMetrics, get_url_class
+from progress import Progress
+from pagestore import PageStore
+from wikinamespaces import Namespaces
 
 
 class WikiRetrieveErr(Exception):
     pass
 
 
+class SeenEntries(object):
+    """Keep track of entries already written out, so that duplicates served
+    up across api continuations can be dropped as they arrive.
+    Entries are kept in an in-memory set until there are more than max_in_memory
+    of them; after that they are moved to an sqlite file on disk, with a bloom
+    filter in front of it so that entries never seen before (nearly all of them)
+    don't need a disk lookup at all. Memory use is thus bounded by the size of
+    the set plus the size of the bloom filter."""
+
+    def __init__(self, max_in_memory=1000000, tmpdir=None, bloom_bytes=32 * 1024 * 1024,
+                 bloom_hashes=7):
+        """Constructor. Arguments:
+        max_in_memory -- number of entries to keep in memory before switching to disk
+        tmpdir        -- directory in which to create the sqlite file, if needed
+        bloom_bytes   -- size of the bloom filter used once we are on disk
+        bloom_hashes  -- number of bit positions set in the bloom filter per entry"""
+
+        self.max_in_memory = max_in_memory
+        self.tmpdir = tmpdir
+        self.bloom_bytes = bloom_bytes
+        self.bloom_bits = bloom_bytes * 8
+        self.bloom_hashes = bloom_hashes
+        self.seen = set()
+        self.bloom = None
+        self.db = None
+        self.db_path = None
+        self.pending = 0
+        self.dups = 0
+        self.count = 0
+
+    def get_key(self, entry):
+        """Return the key for an entry (list of attributes) used for the
+        comparison; attributes are joined with a separator that can't
+        appear in an XML attribute value"""
+
+        return "\x00".join(entry)
+
+    def get_bloom_positions(self, digest):
+        """Return the bit positions in the bloom filter for an entry,
+        using double hashing on the two halves of its md5 digest"""
+
+        (first, second) = struct.unpack("<QQ", digest)
+        return [(first + i * second) % self.bloom_bits for i in range(self.bloom_hashes)]
+
+    def move_to_disk(self):
+        """Move all entries seen so far out of memory into the sqlite file
+        and the bloom filter"""
+
+        (fd, self.db_path) = tempfile.mkstemp(prefix="seen-", suffix=".sqlite", dir=self.tmpdir)
+        os.close(fd)
+        self.db = sqlite3.connect(self.db_path)
+        self.db.text_factory = str
+        self.db.execute("PRAGMA synchronous=OFF")
+        self.db.execute("PRAGMA journal_mode=OFF")
+        self.db.execute("CREATE TABLE seen (digest BLOB PRIMARY KEY)")
+        self.bloom = bytearray(self.bloom_bytes)
+        for key in self.seen:
+            self.add_to_disk(hashlib.md5(key).digest())
+        self.seen = set()
+
+    def add_to_disk(self, digest):
+        """Record the md5 digest of an entry in the bloom filter and the sqlite file"""
+
+        for pos in self.get_bloom_positions(digest):
+            self.bloom[pos >> 3] |= 1 << (pos & 7)
+        self.db.execute("INSERT INTO seen VALUES (?)", (buffer(digest),))
+        self.pending = self.pending + 1
+        if self.pending >= 10000:
+            self.db.commit()
+            self.pending = 0
+
+    def is_on_disk(self, digest):
+        """Check whether an entry was seen before, looking in the bloom filter
+        first and only going to the sqlite file if the filter says it might be there"""
+
+        for pos in self.get_bloom_positions(digest):
+            if not self.bloom[pos >> 3] & (1 << (pos & 7)):
+                return False
+        cursor = self.db.execute("SELECT 1 FROM seen WHERE digest = ?", (buffer(digest),))
+        return cursor.fetchone() is not None
+
+    def add(self, entry):
+        """Record an entry. Returns True if it had not been seen before,
+        False if it is a duplicate.
+        Arguments:
+        entry   -- list of attributes for the entry"""
+
+        key = self.get_key(entry)
+        if self.db is None:
+            if key in self.seen:
+                self.dups = self.dups + 1
+                return False
+            self.seen.add(key)
+            self.count = self.count + 1
+            if self.count > self.max_in_memory:
+                self.move_to_disk()
+            return True
+
+        digest = hashlib.md5(key).digest()
+        if self.is_on_disk(digest):
+            self.dups = self.dups + 1
+            return False
+        self.add_to_disk(digest)
+        self.count = self.count + 1
+        return True
+
+    def filter(self, entries):
+        """Return the entries from the list which have not been seen before,
+        in their original order, recording them as seen.
+        Arguments:
+        entries  -- list of entries, each of which is a list of attributes"""
+
+        return [e for e in entries if self.add(e)]
+
+    def close(self):
+        """Release memory and remove the sqlite file, if any"""
+
+        self.seen = set()
+        self.bloom = None
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+            os.unlink(self.db_path)
+
+
 class WikiConnection(object):
     """Base class for a connection to a MediaWiki wiki, holding authentication
     credentials, wiki name, type of api request, etc.
     This class is responsible for performing the actual GET request and for checking
     the response, for logging in, and for checking maxlag.
-    All connections are https but with no certificate checks."""
+    All connections are https but with no certificate checks, unless plain
+    http is asked for (e.g. for a local stand-in wiki like fakewiki.py)."""
 
-    def __init__(self, wikiname, username, password, verbose):
+    def __init__(self, wikiname, username, password, verbose, metrics=None, use_http=False):
         """Constructor. Arguments:
         wikiname        -- host name of the wiki, e.g. en.wikipedia.org
         username        -- username with which to authenticate to the wiki, if any;
@@ -31,18 +169,106 @@ class WikiConnection(object):
         password        -- password for auth to the wiki, if any; if username is
                            supplied and password is not, the user will be
                            prompted to supply one
-        verbose         -- if set, display various progress messages on stderr"""
+        verbose         -- if set, display various progress messages on stderr
+        metrics         -- RequestMetrics object to record each request in, or None
+        use_http        -- if set, connect with plain http instead of https"""
 
         self.wikiname = wikiname
         self.username = username
         self.password = password
         self.verbose = verbose
+        self.metrics = metrics
+        self.use_http = use_http
         self.logged_in = False
         self.user_agent = "wikicontentretriever.py/0.1"
         self.queryapi_url_base = "/w/api.php?action=query&format=xml&maxlag=5"
         self.error_pattern = re.compile("<error code=\"([^\"]+)\"")
         self.lagged = False
+        self.last_url_class = None
         self.cookies = []
+        # kept open across requests, saving a tcp and tls handshake for each one
+        self.http_conn = None
+        self.rights = None  # of the user we are logged in as, see has_right
+
+    def get_connection(self):
+        """Return (connection to the wiki, True if it was already open)"""
+
+        if self.http_conn is not None:
+            return (self.http_conn, True)
+        if self.use_http:
+            self.http_conn = httplib.HTTPConnection(self.wikiname)
+        else:
+            self.http_conn = httplib.HTTPSConnection(self.wikiname)
+        return (self.http_conn, False)
+
+    def copy(self):
+        """Return a new WikiConnection to the same wiki, with its own http
+        connection but sharing the login session and metrics, for use by
+        another thread"""
+
+        wiki_conn = WikiConnection(self.wikiname, self.username, self.password, self.verbose,
+                                   self.metrics, self.use_http)
+        wiki_conn.logged_in = self.logged_in
+        wiki_conn.cookies = list(self.cookies)
+        wiki_conn.rights = self.rights
+        return wiki_conn
+
+    def close(self):
+        """Close the connection to the wiki, if it is open"""
+
+        if self.http_conn is not None:
+            self.http_conn.close()
+            self.http_conn = None
+
+    def send_request(self, url, method, params):
+        """Send a request and return (response, True if the connection was reused).
+        If the server has closed a connection we kept open, the request is sent
+        once more on a new one.
+        Arguments:
+        url      -- everything that follows the hostname in a normal url
+        method   -- GET, PUT, POST etc.
+        params   -- urlencoded query string for POST requests, or None"""
+
+        while True:
+            (http_conn, reused) = self.get_connection()
+            try:
+                http_conn.putrequest(method, url, skip_accept_encoding=True)
+                http_conn.putheader("Accept", "text/html")
+                http_conn.putheader("Accept", "text/plain")
+                http_conn.putheader("Cookie", "; ".join(self.cookies))
+                http_conn.putheader("User-Agent", self.user_agent)
+                if params:
+                    http_conn.putheader("Content-Length", len(params))
+                    http_conn.putheader("Content-Type", "application/x-www-form-urlencoded")
+
+                http_conn.endheaders()
+                if params:
+                    http_conn.send(params)
+                return (http_conn.getresponse(), reused)
+            except (httplib.BadStatusLine, httplib.CannotSendRequest, socket.error):
+                self.close()
+                if not reused:
+                    raise
+
+    def record_request(self, trace, start, contents=None):
+        """Fill in the time and size of a request and pass it on to the metrics, if any"""
+
+        trace['latency'] = time.time() - start
+        if contents:
+            trace['bytes'] = len(contents)
+        trace['lagged'] = self.lagged
+        if self.metrics:
+            self.metrics.add(trace)
+
+    def wait_lagged(self, seconds):
+        """Sleep before retrying a request the server said was lagged,
+        noting the time spent in the metrics"""
+
+        if self.verbose:
+            sys.stderr.write("server lagged, sleeping %s seconds\n" % seconds)
+        time.sleep(seconds)
+        if self.metrics:
+            self.metrics.add_lag_wait(self.last_url_class, seconds)
 
     def geturl(self, url, method="GET", params=None):
         """Request a specific url and return the contents. On error
@@ -55,38 +281,37 @@ class WikiConnection(object):
         self.lagged = False
         if params:
             params = urllib.urlencode(params)
+        self.last_url_class = get_url_class(url)
+        trace = {"url_class": self.last_url_class, "method": method, "status": None,
+                 "bytes": 0, "ttfb": None, "latency": None, "lagged": False,
+                 "reused": False, "error": None}
+        start = time.time()
         try:
-            http_conn = httplib.HTTPSConnection(self.wikiname)
-            http_conn.putrequest(method, url, skip_accept_encoding=True)
-            http_conn.putheader("Accept", "text/html")
-            http_conn.putheader("Accept", "text/plain")
-            http_conn.putheader("Cookie", "; ".join(self.cookies))
-            http_conn.putheader("User-Agent", self.user_agent)
-            if params:
-                http_conn.putheader("Content-Length", len(params))
-                http_conn.putheader("Content-Type", "application/x-www-form-urlencoded")
-
-            http_conn.endheaders()
-            if params:
-                http_conn.send(params)
-            http_result = http_conn.getresponse()
+            (http_result, trace['reused']) = self.send_request(url, method, params)
+            trace['ttfb'] = time.time() - start
+            trace['status'] = http_result.status
             if http_result.status != 200:
                 if http_result.status == 503:
                     contents = http_result.read()
-                    http_conn.close()
+                    self.close()
                     if contents.find("seconds lagged"):
                         if self.verbose:
                             sys.stderr.write(contents)
                         self.lagged = True
+                        self.record_request(trace, start, contents)
                         return contents
                 sys.stderr.write("status %s, reason %s\n" % (http_result.status, http_result.reason))
-                raise httplib.HTTPException
-        except Exception:
+                raise httplib.HTTPException("status %s" % http_result.status)
+            contents = http_result.read()
+        except Exception as e:
+            self.close()
+            trace['error'] = str(e) or e.__class__.__name__
+            self.record_request(trace, start)
             sys.stderr.write("failed to retrieve output from %s\n" % url)
             return None
 
-        contents = http_result.read()
-        http_conn.close()
+        if http_result.will_close:
+            self.close()
 
         # format <error code="maxlag"
         result = self.error_pattern.search(contents)
@@ -94,10 +319,13 @@ class WikiConnection(object):
             if result.group(1) == "maxlag":
                 self.lagged = True
             else:
+                trace['error'] = result.group(1)
+                self.record_request(trace, start, contents)
                 sys.stderr.write("Error '%s' encountered\n" % result.group(1))
                 return None
         else:
             self.lagged = False
+        self.record_request(trace, start, contents)
         return contents
 
     def login(self):
@@ -166,29 +394,84 @@ class WikiConnection(object):
                             "%sUserName=%s" % (wikiprefix, lgusername),
                             "%sUserID=%s" % (wikiprefix, lguserid),
                             "%sToken=%s" % (wikiprefix, lgtoken)]
+            self.rights = None
+
+    def has_right(self, right):
+        """Return True if the user we are logged in as (or anonymous, if not
+        logged in) has the given user right, such as apihighlimits, which only
+        bots and sysops have. The rights are asked for with meta=userinfo
+        the first time; if they can't be had, no rights are assumed.
+        Arguments:
+        right   -- name of the user right"""
+
+        if self.rights is None:
+            url = self.queryapi_url_base + "&meta=userinfo&uiprop=rights"
+            contents = self.geturl(url)
+            for retry in range(5):
+                if not self.lagged:
+                    break
+                self.wait_lagged(5)
+                contents = self.geturl(url)
+            if not contents or self.lagged:
+                sys.stderr.write("failed to get user rights, assuming none\n")
+                return False
+            tree = ElementTree.fromstring(contents)
+            self.rights = [elt.text.encode("utf8") for elt in tree.iter("r") if elt.text]
+            if self.verbose:
+                sys.stderr.write("user rights: %s\n" % ", ".join(self.rights))
+        return right in self.rights
 
 
 class Content(object):
     """Download page content from a wiki, given a WikiConnection object for it.
     This class also provides methods for converting titles into various
-    formats (linked, removing sql escaping, etc.)"""
+    formats (linked, removing sql escaping, etc.)
+    Content may instead be retrieved by page id, from a list of page ids as
+    written by the title listings with pageids set; the ids go to the api's
+    export in place of titles, with no escaping or normalization to undo.
+    With history set, every revision of each page is retrieved. Special:Export
+    applies its revision limit and offset to each page of a request, so a batch
+    of pages is first asked for with a small limit; the pages that come back
+    with fewer revisions than that are complete, and the rest are gone on with
+    one at a time, from the timestamp of the last revision written, each
+    request's revisions going straight to the output file."""
 
     def __init__(self, wiki_conn, titles_file, outdir_name, outfile_name, batch_size,
-                 max_retries, verbose):
+                 max_retries, verbose, max_bytes=None, target_seconds=None, by_id=False,
+                 store_path=None, history=False, history_limit=1000):
         """Constructor.  Arguments:
         wiki_conn    -- initialized WikiConnection object for a wiki
-        titles_file  -- path to list of titles for which to retrieve page content
+        titles_file  -- path to list of titles for which to retrieve page content,
+                        or with by_id, of lines each starting with a page id
         outdir_name  -- directory in which to write any output files
         outfile_name -- filename for content output
         batch_size   -- number of pages to download at once (default 500)
         max_retries  -- number of times to wait and retry if dbs are lagged, before giving up
-        verbose     -- display progress messages on stderr"""
+        verbose     -- display progress messages on stderr
+        max_bytes    -- if set, pack batches by page length so that each response
+                        is at most about this many bytes, batch_size still being
+                        the most pages in a batch
+        target_seconds -- if set along with max_bytes, shrink or grow the byte budget
+                        (never past max_bytes) so that each export takes about this long
+        by_id        -- retrieve content by page id rather than by title; batch_size
+                        is capped at what the api allows, 50, or 500 for users with
+                        the apihighlimits right (bots and sysops)
+        store_path   -- if set, path to a PageStore; only pages whose current revision
+                        is not in the store are exported, the rest come from the store
+        history      -- retrieve all revisions of each page rather than the current one;
+                        not with by_id or store_path
+        history_limit -- with history, the most revisions to ask for in each request
+                        for one page, at most what the wiki allows ($wgExportMaxHistory)"""
 
         self.wiki_conn = wiki_conn
         self.titles_file = titles_file
         self.outdir_name = outdir_name
         if not os.path.isdir(self.outdir_name):
             os.makedirs(self.outdir_name)
+        self.by_id = by_id
+        if by_id:
+            # the most pageids the api takes at once
+            batch_size = min(batch_size, 500 if wiki_conn.has_right("apihighlimits") else 50)
         self.batch_size = batch_size
         self.timestamp = time.strftime("%Y-%m-%d-%H%M%S", time.gmtime())
         if outfile_name:
@@ -197,8 +480,43 @@ class Content(object):
             self.outfile_name = os.path.join(self.outdir_name, "content-%s-%s.gz" % (
                 self.wiki_conn.wikiname, self.timestamp))
         self.export_url = "/w/index.php?title=Special:Export&action=submit&maxlag=5"
+        self.export_by_id_url = self.wiki_conn.queryapi_url_base + "&export&exportnowrap"
         self.max_retries = max_retries
+        # times to try an export request that gets no answer (error status,
+        # timeout, dropped connection) before skipping its titles
+        self.export_tries = 3
         self.verbose = verbose
+        self.max_bytes = max_bytes
+        self.target_seconds = target_seconds
+        self.byte_budget = max_bytes
+        self.min_bytes = min(64 * 1024, max_bytes or 0)
+        # export xml for a page is about this much more than its text
+        self.page_overhead = 600
+        # titles per prop=info request; the api allows no more for non-bots
+        self.info_batch_size = 50
+        self.title_pattern = re.compile("<title>([^<]*)</title>")
+        # page ids are indented less than revision and contributor ids
+        self.id_pattern = re.compile("^    <id>([0-9]+)</id>$", re.M)
+        self.page_pattern = re.compile("^  <page>\n.*?^  </page>\n", re.M | re.S)
+        self.header_written = False
+        self.namespaces = None  # from the header of the first export, for title keys
+        self.exported = set()
+        self.skipped_titles = []
+        self.missing_titles = []
+        self.store_path = store_path
+        self.store = None
+        self.page_info = {}  # title => (page id, revision id, length), see get_page_info
+        self.wanted = set()  # ids of pages to be written out from the store
+        self.unchanged = 0
+        self.history = history
+        self.history_limit = history_limit
+        # revisions per page asked for in requests for a whole batch of pages; well
+        # under any $wgExportMaxHistory, so a page with fewer has no more
+        self.history_batch_limit = min(50, history_limit)
+        self.revision_pattern = re.compile("^    <revision>\n.*?^    </revision>\n", re.M | re.S)
+        self.rev_id_pattern = re.compile("^      <id>([0-9]+)</id>$", re.M)
+        self.timestamp_pattern = re.compile("<timestamp>([^<]*)</timestamp>")
+        self.truncated_titles = []
 
     def unsql_escape(self, title):
         """Remove sql escaping from a page title.
@@ -240,27 +558,67 @@ class Content(object):
 
         return [self.unsql_escape(self.strip_link(t)) for t in titles]
 
-    def get_batch_page_content(self, titles):
+    def get_batch_page_content(self, titles, offset=None):
         """Get content for one batchsize (for example 500) pages via the MediaWiki api.
         Returns content.  If the pages are large and the batchsize is huge, this
         could consume a lot of memory.
         If the servers are overloaded it will retry up to max_retries, waiting a few
         seconds between retries.
         Arguments:
-        titles   -- list of page titles"""
+        titles   -- list of page titles
+        offset   -- with history, get the revisions after this timestamp, up to
+                    history_limit of them, rather than the first few of each page"""
 
+        if self.by_id:
+            if self.verbose:
+                sys.stderr.write("getting batch of page content via %s\n" % self.export_by_id_url)
+            return self.post_with_retries(self.export_by_id_url, {"pageids": "|".join(titles)})
         titles_formatted = self.titles_format(titles)
-        params = {"wpDownload": "1", "curonly": "1", "pages": "\n".join(titles_formatted) + "\n"}
+        params = {"wpDownload": "1", "pages": "\n".join(titles_formatted) + "\n"}
+        if not self.history:
+            params["curonly"] = "1"
+        elif offset is None:
+            params["limit"] = str(self.history_batch_limit)
+        else:
+            params["limit"] = str(self.history_limit)
+            params["offset"] = offset
+        if self.verbose:
+            sys.stderr.write("getting batch of page content via %s\n" % self.export_url)
+        return self.post_with_retries(self.export_url, params)
+
+    def get_batch_with_retries(self, titles, offset=None):
+        """Get content as get_batch_page_content does, trying the request
+        again after a wait, up to export_tries times in all, if it fails
+        with no answer: an error status, a timeout, a dropped connection.
+        Returns the content, or None if every try failed.
+        Arguments:
+        titles   -- list of page titles
+        offset   -- as for get_batch_page_content"""
+
+        tries = 0
+        while True:
+            content = self.get_batch_page_content(titles, offset)
+            tries = tries + 1
+            if content is not None or tries >= self.export_tries:
+                return content
+            wait = 2 ** tries
+            if self.verbose:
+                sys.stderr.write("export request failed, trying again in %s seconds\n" % wait)
+            time.sleep(wait)
+
+    def post_with_retries(self, url, params):
+        """POST a request, waiting and retrying as long as the servers say
+        they are lagged, up to max_retries times. Returns the contents.
+        Arguments:
+        url     -- url to request, without the host name
+        params  -- dict of parameters for the POST body"""
+
         self.retries = 0
         while self.retries < self.max_retries:
             if self.wiki_conn.lagged:
                 self.retries = self.retries + 1
-                if self.verbose:
-                    sys.stderr.write("server lagged, sleeping 5 seconds\n")
-                time.sleep(5)
-            if self.verbose:
-                sys.stderr.write("getting batch of page content via %s\n" % self.export_url)
-            contents = self.wiki_conn.geturl(self.export_url, "POST", params)
+                self.wiki_conn.wait_lagged(5)
+            contents = self.wiki_conn.geturl(url, "POST", params)
             if not self.wiki_conn.lagged:
                 break
         if self.retries == self.max_retries:
@@ -268,80 +626,438 @@ class Content(object):
 
         return contents
 
-    def strip_site_footer(self, content):
-        """Remove </mediawiki> footer from complete XML text for page content
-        If no such tag is found, this indicates damaged input.
-        On error, raises WikiRetrieveErr exception
+    def get_page_info(self, titles):
+        """Return (page id, current revision id, length in bytes of the current
+        text) of each of the titles, in the same order, via batched prop=info
+        api requests; for pages that don't exist this is (None, None, 0).
+        The answers are kept until asked for again, so that looking up the
+        same titles twice costs only one request. A title may be in the list
+        more than once.
+        Arguments:
+        titles   -- list of page titles (or ids) as read from the titles file"""
+
+        info = dict([(title, self.page_info[title]) for title in titles if title in self.page_info])
+        for title in info:
+            del self.page_info[title]
+        wanted = []
+        for title in titles:
+            if title not in info:
+                info[title] = (None, None, 0)
+                wanted.append(title)
+        if self.by_id:
+            titles_formatted = wanted
+            (param, attr) = ("pageids", "pageid")
+        else:
+            titles_formatted = self.titles_format(wanted)
+            (param, attr) = ("titles", "title")
+        url = self.wiki_conn.queryapi_url_base + "&prop=info"
+        for start in range(0, len(titles_formatted), self.info_batch_size):
+            contents = self.post_with_retries(
+                url, {param: "|".join(titles_formatted[start:start + self.info_batch_size])})
+            if contents is None:
+                raise WikiRetrieveErr("failed to retrieve page info")
+            tree = ElementTree.fromstring(contents)
+            # the api gives back titles normalized, e.g. with underscores removed
+            normalized = dict([(entry.get("from").encode("utf8"), entry.get("to").encode("utf8"))
+                               for entry in tree.iter("n")])
+            found = {}
+            for entry in tree.iter("page"):
+                if entry.get("missing") is None:
+                    found[entry.get(attr).encode("utf8")] = (
+                        entry.get("pageid"), entry.get("lastrevid"), int(entry.get("length", "0")))
+            for (title, formatted) in zip(wanted[start:start + self.info_batch_size],
+                                          titles_formatted[start:start + self.info_batch_size]):
+                info[title] = found.get(normalized.get(formatted, formatted), (None, None, 0))
+        return [info[title] for title in titles]
+
+    def get_page_lengths(self, titles):
+        """Return the length in bytes of the current text of each of the
+        titles, in the same order, as get_page_info; the rest of the
+        info is kept for get_changed_titles
+        Arguments:
+        titles   -- list of page titles (or ids) as read from the titles file"""
+
+        info = self.get_page_info(titles)
+        if self.store is not None:
+            self.page_info.update(zip(titles, info))
+        return [length for (page_id, rev_id, length) in info]
+
+    def get_changed_titles(self, titles):
+        """Return the titles whose current revision is not the one in the page
+        store, and so need to be exported; the pages of the rest are marked
+        for writing out from the store. Titles of pages that don't exist are
+        returned too, so they are reported as missing in the usual way.
+        Arguments:
+        titles   -- list of page titles (or ids) as read from the titles file"""
+
+        info = self.get_page_info(titles)
+        stored = self.store.get_rev_ids([page_id for (page_id, rev_id, length) in info if page_id])
+        changed = []
+        for (title, (page_id, rev_id, length)) in zip(titles, info):
+            if page_id and rev_id and stored.get(int(page_id)) == int(rev_id):
+                self.wanted.add(int(page_id))
+                self.unchanged = self.unchanged + 1
+            else:
+                changed.append(title)
+        return changed
+
+    def read_titles(self, count):
+        """Return a list of up to count titles from the titles file, empty at eof;
+        with by_id, page ids, which are the first field of each line, in
+        quotes if the list was written sql escaped"""
+
+        titles = []
+        while len(titles) < count:
+            line = self.input_fd.readline()
+            if line == "":
+                break
+            line = line.strip()
+            if line and self.by_id:
+                titles.append(line.split(" ", 1)[0].strip("'"))
+            elif line:
+                titles.append(line)
+        return titles
+
+    def get_title_batches(self):
+        """Yield lists of titles for which to export content in one request:
+        batch_size titles at a time, or if there is a byte budget, as many
+        as fit it by page length, but no more than batch_size. A page too
+        big for the budget goes in a batch by itself."""
+
+        if not self.max_bytes:
+            while True:
+                titles = self.read_titles(self.batch_size)
+                if not titles:
+                    return
+                yield titles
+
+        pending = collections.deque()  # (title, length)
+        eof = False
+        while pending or not eof:
+            if not eof and len(pending) < self.batch_size:
+                titles = self.read_titles(self.batch_size)
+                if titles:
+                    pending.extend(zip(titles, self.get_page_lengths(titles)))
+                else:
+                    eof = True
+                continue
+            batch = []
+            size = 0
+            while pending and len(batch) < self.batch_size:
+                page_bytes = pending[0][1] + self.page_overhead
+                if batch and size + page_bytes > self.byte_budget:
+                    break
+                batch.append(pending.popleft()[0])
+                size = size + page_bytes
+            yield batch
+
+    def tune_byte_budget(self, size, elapsed):
+        """Move the byte budget towards the response size that would take
+        target_seconds to get, judging by the last response, but never past
+        max_bytes nor below a minimum
+        Arguments:
+        size     -- bytes in the last response
+        elapsed  -- seconds it took"""
+
+        if not self.target_seconds or not self.max_bytes or elapsed <= 0:
+            return
+        wanted = size * self.target_seconds / elapsed
+        # only go halfway, so that one odd response doesn't swing it too far
+        budget = (self.byte_budget + wanted) / 2
+        self.byte_budget = int(max(self.min_bytes, min(budget, self.max_bytes)))
+        if self.verbose:
+            sys.stderr.write("export of %d bytes took %.1fs, byte budget now %d\n"
+                             % (size, elapsed, self.byte_budget))
+
+    def get_export_parts(self, content):
+        """Return (header, pages) from the complete XML text of an export:
+        everything up to and including </siteinfo>, and the pages after it
+        without the </mediawiki> footer; or None if the text is empty or
+        damaged, i.e. the siteinfo header or the footer is missing
         Arguments:
         content   -- complete XML text for page content"""
 
-        if not content.endswith("</mediawiki>\n"):
-            raise WikiRetrieveErr("no mediawiki end tag found, uh oh.")
-        return(content[:-13])
+        if not content or not content.endswith("</mediawiki>\n"):
+            return None
+        # don't parse, just find </siteinfo>\n in the string
+        end = content.find("</siteinfo>\n")
+        if end == -1:
+            return None
+        end = end + len("</siteinfo>\n")
+        return (content[:end], content[end:-len("</mediawiki>\n")])
+
+    def export_titles(self, titles):
+        """Export content for a batch of titles. A request that fails is tried
+        again a few times (see get_batch_with_retries); if it never gets an
+        answer, the batch is skipped. If the export comes back empty or
+        damaged, split the batch in two and try each half, and so on until
+        the titles to blame are found. Skipped titles are added to
+        skipped_titles. Returns a list of (header, pages) for the parts that
+        could be exported.
+        Arguments:
+        titles   -- list of page titles"""
 
-    def strip_site_header_and_footer(self, content):
-        """Remove <mediawiki> and <siteinfo>...</siteinfo> header from
-        complete XML text for page content, also remove the footer
-        </mediawiki> from the end
-        If no such tag is found, this indicates damaged input.
-        On error, raises WikiRetrieveErr exception
+        content = self.get_batch_with_retries(titles)
+        if content is None:
+            sys.stderr.write("failed to export content for %d titles after %d tries, "
+                             "skipping them\n" % (len(titles), self.export_tries))
+            self.skipped_titles.extend(titles)
+            return []
+        parts = self.get_export_parts(content)
+        if parts is not None:
+            return [parts]
+        if len(titles) == 1:
+            sys.stderr.write("failed to export content for %s, skipping it\n" % titles[0])
+            self.skipped_titles.append(titles[0])
+            return []
+        if self.verbose:
+            sys.stderr.write("export of %d titles came back damaged, trying them in two halves\n"
+                             % len(titles))
+        middle = len(titles) // 2
+        return self.export_titles(titles[:middle]) + self.export_titles(titles[middle:])
+
+    def get_title_key(self, title):
+        """Return a key for a title that is the same whether the title comes
+        from the titles file or from the exported XML: the title as the wiki
+        normalizes it, by the namespaces and case rules in the export header,
+        so that titles differing in more than that stay distinct"""
+
+        if self.namespaces is None:
+            return title.replace("_", " ").strip()
+        return self.namespaces.normalize_full_title(title)
+
+    def get_exported_titles(self, pages):
+        """Return the titles of the pages in exported XML text"""
+
+        return [self.unescape_xml(title) for title in self.title_pattern.findall(pages)]
+
+    def get_exported_keys(self, pages):
+        """Return the keys of the pages in exported XML text, to be
+        checked off against those of the titles or ids asked for"""
+
+        if self.by_id:
+            return self.id_pattern.findall(pages)
+        return [self.get_title_key(title) for title in self.get_exported_titles(pages)]
+
+    def get_requested_keys(self, titles):
+        """Return the keys of titles or ids asked for, as get_exported_keys"""
+
+        if self.by_id:
+            return titles
+        return [self.get_title_key(title) for title in self.titles_format(titles)]
+
+    def unescape_xml(self, text):
+        return text.replace("&lt;", "<").replace("&gt;", ">").replace("&quot;", '"').replace(
+            "&#039;", "'").replace("&amp;", "&")
+
+    def write_header(self, header):
+        self.namespaces = Namespaces(None, None, offline=True)
+        if not self.namespaces.load_from_header(header):
+            self.namespaces = None
+        if self.store is not None:
+            self.store.set_header(header)
+        else:
+            self.output_fd.write(header)
+
+    def write_page_text(self, pages):
+        """Write the XML text of one or more pages to the output file, or
+        with a page store, to the store, marking them to be written out;
+        with history, the rest of the revisions of any page that may have
+        more are retrieved and written too"""
+
+        if self.store is not None:
+            self.wanted.update(self.store.add_pages(pages))
+        elif self.history:
+            for page in self.page_pattern.findall(pages):
+                revisions = self.revision_pattern.findall(page)
+                if len(revisions) < self.history_batch_limit:
+                    self.output_fd.write(page)
+                    continue
+                end = page.find("    <revision>\n")
+                self.output_fd.write(page[:end])
+                self.output_fd.write("".join(revisions))
+                self.write_rest_of_history(page[:end], revisions)
+                self.output_fd.write("  </page>\n")
+        else:
+            self.output_fd.write(pages)
+
+    def get_history_offset(self, revisions):
+        """Return (offset to ask for the revisions after the given ones, ids
+        of those of the given revisions the answer will have again).
+        The offset is a second before the timestamp of the last revision,
+        since MediaWiki gives the revisions after the offset and there may be
+        more than one revision in that second; those already written are
+        dropped from the answer by id."""
+
+        last = self.timestamp_pattern.search(revisions[-1]).group(1)
+        seconds = calendar.timegm(time.strptime(last, "%Y-%m-%dT%H:%M:%SZ")) - 1
+        again = set([self.rev_id_pattern.search(revision).group(1) for revision in revisions
+                     if self.timestamp_pattern.search(revision).group(1) == last])
+        return (time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(seconds)), again)
+
+    def write_rest_of_history(self, page_head, revisions):
+        """Retrieve the revisions of a page after those already written, one
+        request of up to history_limit revisions at a time, writing each lot
+        to the output file as it comes, until a request brings no revisions
+        not already written. The wiki may give fewer revisions than asked for,
+        as it caps the limit at $wgExportMaxHistory, so a short answer is not
+        taken to be the end. If a request fails, or more revisions have one
+        timestamp than the wiki gives at once, the page is left with the
+        revisions written so far and its title is added to truncated_titles.
         Arguments:
-        content   -- complete XML text for page content"""
+        page_head  -- XML text of the page up to its first revision
+        revisions  -- list of XML text of the last revisions written"""
 
-        # don't parse, just find </siteinfo>\n in the string and toss everything before that
-        start = content.find("</siteinfo>\n")
-        if not start:
-            raise WikiRetrieveErr("no siteinfo header found, uh oh.")
-        if not content.endswith("</mediawiki>\n"):
-            raise WikiRetrieveErr("no mediawiki end tag found, uh oh.")
-        return(content[start + 12: -13])
+        title = self.unescape_xml(self.title_pattern.search(page_head).group(1))
+        count = len(revisions)
+        # the most revisions the wiki has given at once; no answer with fewer was cut short
+        largest = len(revisions)
+        while True:
+            (offset, again) = self.get_history_offset(revisions)
+            if self.verbose:
+                sys.stderr.write("getting revisions of %s after %s\n" % (title, offset))
+            parts = self.get_export_parts(self.get_batch_with_retries([title], offset))
+            pages = self.page_pattern.findall(parts[1]) if parts is not None else None
+            if not pages:
+                sys.stderr.write("failed to export history of %s after %d revisions\n"
+                                 % (title, count))
+                self.truncated_titles.append(title)
+                return
+            revisions = self.revision_pattern.findall(pages[0])
+            new_revisions = [revision for revision in revisions
+                             if self.rev_id_pattern.search(revision).group(1) not in again]
+            self.output_fd.write("".join(new_revisions))
+            count = count + len(new_revisions)
+            if not new_revisions:
+                if len(revisions) < largest:
+                    return
+                # a full answer, all in the one second: more revisions have that
+                # timestamp than the wiki will give at once
+                sys.stderr.write("can't get history of %s past %s, more than %d revisions "
+                                 "have the next timestamp\n" % (title, offset, len(revisions)))
+                self.truncated_titles.append(title)
+                return
+            largest = max(largest, len(revisions))
+
+    def write_pages(self, parts, titles, only_new=False):
+        """Write the exported pages to the output file (or the page store),
+        the XML header first if it has not yet been written, and return the
+        titles asked for which were not exported.
+        Arguments:
+        parts    -- list of (header, pages) as returned by export_titles
+        titles   -- titles asked for
+        only_new -- if set, write only pages not already written"""
+
+        for (header, pages) in parts:
+            if not self.header_written:
+                self.write_header(header)
+                self.header_written = True
+            if only_new:
+                # one page at a time, dropping those we already have
+                for page in self.page_pattern.findall(pages):
+                    exported = self.get_exported_keys(page)
+                    if exported and exported[0] not in self.exported:
+                        self.write_page_text(page)
+                        self.exported.add(exported[0])
+            else:
+                self.write_page_text(pages)
+                self.exported.update(self.get_exported_keys(pages))
+        skipped = set(self.skipped_titles)
+        return [title for (title, key) in zip(titles, self.get_requested_keys(titles))
+                if title not in skipped and key not in self.exported]
+
+    def reconcile(self, missing):
+        """Ask once more for content for titles that were asked for but not
+        exported, writing any that come back; Special:Export quietly drops
+        titles that don't exist, so those still missing are most likely
+        deleted or renamed. Returns the titles still missing.
+        Arguments:
+        missing  -- list of titles"""
+
+        if self.verbose:
+            sys.stderr.write("asking again for %d titles that were not exported\n" % len(missing))
+        still_missing = []
+        for start in range(0, len(missing), self.batch_size):
+            titles = missing[start:start + self.batch_size]
+            still_missing.extend(self.write_pages(self.export_titles(titles), titles, only_new=True))
+        return still_missing
+
+    def write_title_list(self, titles, suffix, message):
+        """Write titles to a file named after the output file with
+        the given suffix, saying so on stderr"""
+
+        path = self.outfile_name + suffix
+        output_fd = open(path, "w")
+        for title in titles:
+            output_fd.write(title + "\n")
+        output_fd.close()
+        sys.stderr.write("%d titles %s, list in %s\n" % (len(titles), message, path))
 
     def get_all_entries(self):
         """Retrieve page content for all titles in accordance with arguments
         given to constructor, in batches, writing it out to a file.
-        On error (failure to retrieve some content), raises WikiRetrieveErr exception"""
-
+        Batches that come back damaged are split up until the titles to blame
+        are found and skipped, as are batches that keep failing; titles that
+        were not exported are asked for again at the end. Both kinds are
+        listed in files next to the output file.
+        With a page store, pages whose current revision is already stored
+        are not exported, and the output file is written from the store.
+        If titles were given but no content at all could be retrieved,
+        raises WikiRetrieveErr exception"""
+
+        if self.store_path:
+            self.store = PageStore(self.store_path)
         self.output_fd = File.open_output(self.outfile_name)
         self.input_fd = File.open_input(self.titles_file)
-        first = True
-        count = 0
-
-        eof = False
-        while not eof:
-            linecount = 0
-            titles = []
-            while not eof:
-                line = self.input_fd.readline()
-                if line == "":
-                    eof = True
-                line = line.strip()
-                if line:
-                    titles.append(line)
-                    linecount = linecount + 1
-                if linecount >= self.batch_size:
-                    break
-
-            if (not titles):
-                break
-
-            count = count + self.batch_size
-            content = self.get_batch_page_content(titles)
-
-            if not len(content):
-                raise WikiRetrieveErr("content of zero length returned, uh oh.")
-
-            if first:
-                first = False
-                content = self.strip_site_footer(content)
-            else:
-                content = self.strip_site_header_and_footer(content)
-
-            self.output_fd.write(content)
+        # batches are slow, so look at the clock after each one
+        progress = Progress("retrieving page content", "titles", [self.titles_file],
+                            enabled=self.verbose, check_every=1)
+        progress.set_input(self.input_fd, self.titles_file)
+        self.header_written = False
+        self.exported = set()  # keys of the pages written, see get_exported_keys
+        self.skipped_titles = []
+        missing = []
+        asked = 0
+
+        for batch in self.get_title_batches():
+            asked = asked + len(batch)
+            titles = self.get_changed_titles(batch) if self.store is not None else batch
+            if titles:
+                start = time.time()
+                parts = self.export_titles(titles)
+                self.tune_byte_budget(sum([len(header) + len(pages) for (header, pages) in parts]),
+                                      time.time() - start)
+                missing.extend(self.write_pages(parts, titles))
+            progress.update(len(batch))
+        self.input_fd.close()
+        progress.finish()
 
-        # cheap hack
-        self.output_fd.write("</mediawiki>\n")
+        if missing:
+            self.missing_titles = self.reconcile(missing)
+        else:
+            self.missing_titles = []
+        if asked and not self.header_written and not self.wanted:
+            self.output_fd.close()
+            raise WikiRetrieveErr("no content could be retrieved for any title")
+
+        if self.store is not None and self.wanted:
+            self.store.write_content(self.output_fd, self.wanted)
+            sys.stderr.write("%d pages unchanged since stored, %d exported\n"
+                             % (self.unchanged, len(self.wanted) - self.unchanged))
+        else:
+            # cheap hack
+            self.output_fd.write("</mediawiki>\n")
         self.output_fd.close()
-        self.input_fd.close()
+        if self.store is not None:
+            self.store.close()
+        if self.skipped_titles:
+            self.write_title_list(self.skipped_titles, ".skipped", "skipped as their export failed")
+        if self.missing_titles:
+            self.write_title_list(self.missing_titles, ".missing",
+                                  "not exported, probably deleted or renamed")
+        if self.truncated_titles:
+            self.write_title_list(self.truncated_titles, ".truncated",
+                                  "exported with only part of their history")
 
 
 class Entries(object):
@@ -350,7 +1066,7 @@ class Entries(object):
     converting titles into various formats (linked, sql escaped, etc.)."""
 
     def __init__(self, wiki_conn, props, outdir_name, outfile_name, linked, sql_escaped,
-                 batch_size, max_retries, verbose):
+                 batch_size, max_retries, verbose, pageids=False):
         """Constructor. Arguments:
         props       -- comma-separated list of additional properties to request
         wiki_conn    -- initialized WikiConnection object for a wiki
@@ -363,7 +1079,8 @@ class Entries(object):
                        characters quoted with backslash
         batch_size   -- number of pages to download at once (default 500)
         max_retries  -- number of times to wait and retry if dbs are lagged, before giving up
-        verbose     -- display progress messages on stderr"""
+        verbose     -- display progress messages on stderr
+        pageids     -- write the page id of each entry before it"""
 
         self.wiki_conn = wiki_conn
         if props:
@@ -391,6 +1108,15 @@ class Entries(object):
         self.continue_from = None
         self.more = None
         self.verbose = verbose
+        self.pageids = pageids
+        # attribute of each XML entry with its page id, subclasses may override
+        self.pageid_attr = "pageid"
+
+        # continuations may serve up the same entries more than once, see
+        # get_batch_entries(); this many are remembered in memory before
+        # going to disk to weed those out
+        self.max_seen_in_memory = 1000000
+        self.dups_dropped = 0
 
         self.date_formatter = None
         self.start_date_string = None
@@ -426,6 +1152,9 @@ class Entries(object):
         xml_attrs      -- attributes present in the xml though not specifically requested"""
         self.props_to_request = self.combinelists_nodups([default_props, extra_props])
         self.attrs_to_extract = self.combinelists_nodups([xml_attrs, default_props, extra_props])
+        if self.pageids and self.props_to_request and "ids" not in self.props_to_request:
+            # queries that take a property list only give page ids when asked
+            self.props_to_request.append("ids")
         if not self.param_prefix:
             self.param_prefix = self.entrytag_name
         if len(self.props_to_request):
@@ -487,17 +1216,19 @@ class Entries(object):
                      along with possibly other attributes"""
 
         for e in entries:
-            # escape all fields but link only the first, if requested
+            # escape all fields but link only the first after any page id, if requested
             if linked:
-                e[0] = "[[" + e[0] + "]]"
+                first = 1 if self.pageids else 0
+                e[first] = "[[" + e[first] + "]]"
             if sql_escaped:
                 self.output_fd.write(" ".join([self.sql_escape(attr) for attr in e]) + "\n")
             else:
                 self.output_fd.write(" ".join(e) + "\n")
 
-    def get_all_entries(self):
-        """Retrieve entries such as page titles from wiki in accordance with arguments
-        given to constructor, in batches, writing them out to a file.
+    def get_entries(self):
+        """Generator returning the entries such as page titles from the wiki in
+        accordance with arguments given to constructor, a batch at a time, with
+        any served up again by continuations dropped.
         On error (failure to rerieve some titles), raises WikiRetrieveErr exception."""
 
         self.more = True
@@ -509,25 +1240,42 @@ class Entries(object):
             self.start_date_secs = self.date_formatter.get_secs(self.start_date_string)
             self.end_date_secs = self.date_formatter.get_secs(self.end_date_string)
 
-        self.output_fd = File.open_output(self.outfile_name)
+        seen = SeenEntries(self.max_seen_in_memory, self.outdir_name)
+        try:
+            while True:
+                entries = self.get_batch_entries()
+                if not len(entries):
+                    # not always an error
+                    break
+                # continuations can serve us some of the same entries again
+                yield seen.filter(entries)
+                if not self.more:
+                    break
+        finally:
+            self.dups_dropped = seen.dups
+            seen.close()
 
-        count = 0
-        while True:
-            count = count + self.batch_size
-            entries = self.get_batch_entries()
+    def get_all_entries(self):
+        """Retrieve entries such as page titles from wiki in accordance with arguments
+        given to constructor, in batches, writing them out to a file.
+        On error (failure to rerieve some titles), raises WikiRetrieveErr exception."""
+
+        self.output_fd = File.open_output(self.outfile_name)
+        for entries in self.get_entries():
             self.write_entry_info(entries)
-            if not len(entries):
-                # not always an error
-                break
-            # FIXME is there a possibility that there will be a continue elt and
-            # we'll be served the same titles again?
-            if not self.more:
-                break
         self.output_fd.close()
+        if self.dups_dropped:
+            sys.stderr.write("%d duplicate entries dropped\n" % self.dups_dropped)
 
     def extract_items_from_xml(self, tree):
-        return [[self.desanitize(entry.get(a).encode("utf8")) for a in self.attrs_to_extract]
-                for entry in tree.iter(self.entrytag_name)]
+        items = [[self.desanitize(entry.get(a).encode("utf8")) for a in self.attrs_to_extract]
+                 for entry in tree.iter(self.entrytag_name)]
+        if self.pageids:
+            # entries for pages since deleted may have no page id
+            ids = [entry.get(self.pageid_attr, "0").encode("utf8")
+                   for entry in tree.iter(self.entrytag_name)]
+            items = [[page_id] + item for (page_id, item) in zip(ids, items)]
+        return items
 
     def get_batch_entries(self):
         """Retrieve one batch of entries such as page titles via the MediaWiki api
@@ -540,7 +1288,8 @@ class Entries(object):
         and it's possible that there are multiple entries for that timestamp, and
         it's possible that the previous batch ended in the middle of that timestamp,
         we can't rule out the possibility of dups.
-        The caller should therefore deal with potential dup titless from this method.
+        The caller should therefore deal with potential dup titless from this method;
+        get_all_entries() does so via SeenEntries.
         At least the defaut batchsize of 500 is large enough that we should never wind
         up in a loop getting the same batch every time.
         See bugs https://phabricator.wikimedia.org/T37786 and
@@ -571,9 +1320,7 @@ class Entries(object):
         while self.retries < self.max_retries:
             if self.wiki_conn.lagged:
                 self.retries = self.retries + 1
-                if self.verbose:
-                    sys.stderr.write("server lagged, sleeping 5 seconds\n")
-                    time.sleep(5)
+                self.wiki_conn.wait_lagged(5)
 
             if self.verbose:
                 sys.stderr.write("getting batch of titles via %s\n" % url)
@@ -614,10 +1361,10 @@ class Entries(object):
 
 class CatTitles(Entries):
     """Retrieves titles of pages in a given category.  Does not include
-    subcategories but that might be nice for the future."""
+    the pages of subcategories; see CatTreeTitles for those."""
 
     def __init__(self, wiki_conn, cat_name, props, outdir_name, outfile_name, linked,
-                 sql_escaped, batch_size, retries, verbose):
+                 sql_escaped, batch_size, retries, verbose, pageids=False):
         """Constructor. Arguments:
         wiki_conn    -- initialized WikiConnection object for a wiki
         cat_name     -- name of category from which to retrieve page titles
@@ -630,10 +1377,11 @@ class CatTitles(Entries):
                        characters quoted with backslash
         batch_size   -- number of pages to download at once (default 500)
         retries     -- number of times to wait and retry if dbs are lagged, before giving up
-        verbose     -- display progress messages on stderr"""
+        verbose     -- display progress messages on stderr
+        pageids     -- write the page id of each entry before it"""
 
         super(CatTitles, self).__init__(wiki_conn, props, outdir_name, outfile_name, linked,
-                                        sql_escaped, batch_size, retries, verbose)
+                                        sql_escaped, batch_size, retries, verbose, pageids)
         self.cat_name = cat_name
         # format <cm ns="10" title="Πρότυπο:-ακρ-" />
         self.entrytag_name = "cm"
@@ -642,12 +1390,166 @@ class CatTitles(Entries):
             self.wiki_conn.queryapi_url_base, self.cat_name, self.batch_size, self.prop_param)
 
 
+class CatTreeTitles(Entries):
+    """Retrieves titles of pages in a given category and in all its
+    subcategories, expanding the category tree breadth first.
+    Several categories are listed at once, each by a worker thread with
+    its own connection to the wiki, so that their requests overlap; as a
+    worker finishes one category it takes the next one waiting. Each
+    category is listed once however many parents it has, so loops in the
+    tree do no harm, and each page is written once however many of the
+    categories it is in."""
+
+    def __init__(self, wiki_conn, cat_name, props, outdir_name, outfile_name, linked,
+                 sql_escaped, batch_size, retries, verbose, pageids=False, max_depth=None,
+                 max_titles=None, chains=4):
+        """Constructor. Arguments:
+        wiki_conn    -- initialized WikiConnection object for a wiki
+        cat_name     -- name of category from which to retrieve page titles,
+                        without namespace prefix, url-quoted
+        outdir_name  -- directory in which to write any output files
+        outfile_name -- filename for content output
+        linked      -- whether or not to write the page titles as links
+                       in wikimarup (i.e. with [[ ]] around them)
+        sql_escaped  -- whether or not to write the page titles in sql-escaped
+                       format, enclosed in single quotes and with various
+                       characters quoted with backslash
+        batch_size   -- number of pages to download at once (default 500)
+        retries     -- number of times to wait and retry if dbs are lagged, before giving up
+        verbose     -- display progress messages on stderr
+        pageids     -- write the page id of each entry before it
+        max_depth   -- how many levels of subcategories to go down, None for no limit;
+                       0 lists the given category only
+        max_titles  -- stop once this many titles have been retrieved, None for no limit
+        chains      -- number of categories to list at once, each on its own connection"""
+
+        super(CatTreeTitles, self).__init__(wiki_conn, props, outdir_name, outfile_name, linked,
+                                            sql_escaped, batch_size, retries, verbose, pageids)
+        self.cat_name = cat_name
+        self.max_depth = max_depth
+        self.max_titles = max_titles
+        self.chains = chains
+        self.categories_listed = 0
+
+    def get_category_key(self, name):
+        """Return the name of a category as the visited set keeps it
+        Arguments:
+        name  -- category name without namespace prefix, not url-quoted"""
+
+        return name.replace("_", " ")
+
+    def list_categories(self, wiki_conn, work, results, stop):
+        """Worker: list the categories taken from the work queue until it
+        gives None, putting (kind, depth, value) on the results queue:
+        ("entries", depth, batch of entries, each with its namespace added
+        at the end so that subcategories can be picked out) as they come,
+        ("done", depth, duplicates dropped) at the end of each category, and
+        ("error", depth, exception) if listing one fails. Once stop is set,
+        categories still in the queue are passed over.
+        Arguments:
+        wiki_conn  -- WikiConnection for this worker alone
+        work       -- Queue of (url-quoted category name, depth) or None
+        results    -- Queue for the results
+        stop       -- threading.Event set when no more titles are wanted"""
+
+        try:
+            while True:
+                item = work.get()
+                if item is None:
+                    return
+                if stop.is_set():
+                    continue
+                (cat_name, depth) = item
+                try:
+                    retriever = CatTitles(wiki_conn, cat_name, ",".join(self.props), self.outdir_name,
+                                          self.outfile_name, False, False, self.batch_size,
+                                          self.max_retries, self.verbose, self.pageids)
+                    retriever.max_seen_in_memory = self.max_seen_in_memory
+                    retriever.attrs_to_extract.append("ns")
+                    for entries in retriever.get_entries():
+                        results.put(("entries", depth, entries))
+                        if stop.is_set():
+                            break
+                    results.put(("done", depth, retriever.dups_dropped))
+                except Exception as e:
+                    # anything at all, or get_entries would wait for this category for ever
+                    results.put(("error", depth, e))
+        finally:
+            wiki_conn.close()
+
+    def get_entries(self):
+        """Generator returning the titles of the pages in the category and
+        its subcategories, a batch at a time, with each page only once.
+        On error (failure to rerieve some titles), raises WikiRetrieveErr exception."""
+
+        seen = SeenEntries(self.max_seen_in_memory, self.outdir_name)
+        visited = set([self.get_category_key(urllib.url2pathname(self.cat_name))])
+        work = Queue.Queue()
+        results = Queue.Queue()
+        stop = threading.Event()
+        threads = [threading.Thread(target=self.list_categories,
+                                    args=(self.wiki_conn.copy(), work, results, stop))
+                   for i in range(self.chains)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        work.put((self.cat_name, 0))
+        unfinished = 1  # categories queued but not yet listed to the end
+        count = 0
+        title_field = 1 if self.pageids else 0
+        try:
+            while unfinished:
+                try:
+                    # with a timeout so that an interrupt is noticed
+                    (kind, depth, value) = results.get(True, 1)
+                except Queue.Empty:
+                    continue
+                if kind == "error":
+                    raise value
+                if kind == "done":
+                    unfinished = unfinished - 1
+                    self.categories_listed = self.categories_listed + 1
+                    self.dups_dropped = self.dups_dropped + value
+                    continue
+                new_entries = []
+                for entry in value:
+                    (entry, ns) = (entry[:-1], entry[-1])
+                    title = entry[title_field]
+                    if ns == "14" and (self.max_depth is None or depth < self.max_depth):
+                        name = title.split(":", 1)[-1]
+                        if self.get_category_key(name) not in visited:
+                            visited.add(self.get_category_key(name))
+                            work.put((urllib.pathname2url(name), depth + 1))
+                            unfinished = unfinished + 1
+                    if seen.add([title]):
+                        new_entries.append(entry)
+                if self.max_titles is not None:
+                    new_entries = new_entries[:self.max_titles - count]
+                count = count + len(new_entries)
+                if new_entries:
+                    yield new_entries
+                if self.max_titles is not None and count >= self.max_titles:
+                    return
+        finally:
+            stop.set()
+            for thread in threads:
+                work.put(None)
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(1)
+            self.dups_dropped = self.dups_dropped + seen.dups
+            seen.close()
+            if self.verbose:
+                sys.stderr.write("%d categories listed, %d left unlisted\n"
+                                 % (self.categories_listed, unfinished))
+
+
 class EmbeddedTitles(Entries):
     """Retrieves titles of pages that have a specific page embedded in them
     (link, used as template, etc.)"""
 
     def __init__(self, wiki_conn, page_title, props, outdir_name, outfile_name, linked,
-                 sql_escaped, batch_size, retries, verbose):
+                 sql_escaped, batch_size, retries, verbose, pageids=False):
         """Constructor. Arguments:
         wiki_conn    -- initialized WikiConnection object for a wiki
         page_title   -- title of page for which to find all pages with it embedded
@@ -660,10 +1562,11 @@ class EmbeddedTitles(Entries):
                        characters quoted with backslash
         batch_size   -- number of pages to download at once (default 500)
         retries     -- number of times to wait and retry if dbs are lagged, before giving up
-        verbose     -- display progress messages on stderr"""
+        verbose     -- display progress messages on stderr
+        pageids     -- write the page id of each entry before it"""
 
         super(EmbeddedTitles, self).__init__(wiki_conn, props, outdir_name, outfile_name,
-                                             linked, sql_escaped, batch_size, retries, verbose)
+                                             linked, sql_escaped, batch_size, retries, verbose, pageids)
         self.page_title = page_title
         # format <ei pageid="230229" ns="0" title="μερικοί" />
         self.entrytag_name = "ei"
@@ -676,7 +1579,7 @@ class NamespaceTitles(Entries):
     """Retrieves titles of pages in a given namespace."""
 
     def __init__(self, wiki_conn, namespace, props, outdir_name, outfile_name, linked,
-                 sql_escaped, batch_size, retries, verbose):
+                 sql_escaped, batch_size, retries, verbose, pageids=False):
         """Constructor. Arguments:
         wiki_conn    -- initialized WikiConnection object for a wiki
         namespace   -- number of namespace for which to get page titles
@@ -689,10 +1592,11 @@ class NamespaceTitles(Entries):
                        characters quoted with backslash
         batch_size   -- number of pages to download at once (default 500)
         retries     -- number of times to wait and retry if dbs are lagged, before giving up
-        verbose     -- display progress messages on stderr"""
+        verbose     -- display progress messages on stderr
+        pageids     -- write the page id of each entry before it"""
 
         super(NamespaceTitles, self).__init__(wiki_conn, props, outdir_name, outfile_name,
-                                              linked, sql_escaped, batch_size, retries, verbose)
+                                              linked, sql_escaped, batch_size, retries, verbose, pageids)
         if not namespace.isdigit():
             raise WikiRetrieveErr("namespace should be a number but was %s" % namespace)
 
@@ -708,7 +1612,7 @@ class Users(Entries):
     """Retrieves all user names, ids, editcounts and registration info."""
 
     def __init__(self, wiki_conn, props, outdir_name, outfile_name, linked, sql_escaped,
-                 batch_size, retries, verbose):
+                 batch_size, retries, verbose, pageids=False):
         """Constructor. Arguments:
         wiki_conn    -- initialized WikiConnection object for a wiki
         outdir_name  -- directory in which to write any output files
@@ -720,10 +1624,13 @@ class Users(Entries):
                        characters quoted with backslash
         batch_size   -- number of users to request info for at once (default 500)
         retries     -- number of times to wait and retry if dbs are lagged, before giving up
-        verbose     -- display progress messages on stderr"""
+        verbose     -- display progress messages on stderr
+        pageids     -- must not be set, users have no page ids"""
 
         super(Users, self).__init__(wiki_conn, props, outdir_name, outfile_name,
-                                    linked, sql_escaped, batch_size, retries, verbose)
+                                    linked, sql_escaped, batch_size, retries, verbose, pageids)
+        if pageids:
+            raise WikiRetrieveErr("users have no page ids")
         # format <u userid="146308" name="!" editcount="93" registration="2004-12-04T19:39:42Z" />
         self.entrytag_name = "u"
         self.param_prefix = "au"
@@ -737,7 +1644,7 @@ class RCTitles(Entries):
     """Retrieves page titles in recent changes, within a specified date range"""
 
     def __init__(self, wiki_conn, namespace, props, start_date, end_date, outdir_name,
-                 outfile_name, linked, sql_escaped, batch_size, retries, verbose):
+                 outfile_name, linked, sql_escaped, batch_size, retries, verbose, pageids=False):
         """Constructor. Arguments:
         wiki_conn    -- initialized WikiConnection object for a wiki
         namespace   -- number of namespace for which to get page titles
@@ -756,10 +1663,11 @@ class RCTitles(Entries):
                        characters quoted with backslash
         batch_size   -- number of pages to download at once (default 500)
         retries     -- number of times to wait and retry if dbs are lagged, before giving up
-        verbose     -- display progress messages on stderr"""
+        verbose     -- display progress messages on stderr
+        pageids     -- write the page id of each entry before it"""
 
         super(RCTitles, self).__init__(wiki_conn, props, outdir_name, outfile_name, linked,
-                                       sql_escaped, batch_size, retries, verbose)
+                                       sql_escaped, batch_size, retries, verbose, pageids)
         self.namespace = namespace
         # format: <rc type="edit" ns="0" title="The Blind Assassin" />
         self.entrytag_name = "rc"
@@ -788,7 +1696,7 @@ class UserContribsTitles(Entries):
     """Retrieves pages edited by a given user, within a specified date range"""
 
     def __init__(self, wiki_conn, username, props, start_date, end_date, outdir_name,
-                 outfile_name, linked, sql_escaped, batch_size, retries, verbose):
+                 outfile_name, linked, sql_escaped, batch_size, retries, verbose, pageids=False):
         """Constructor. Arguments:
         wiki_conn    -- initialized WikiConnection object for a wiki
         start_date   -- starting timestamp for edits,
@@ -806,10 +1714,12 @@ class UserContribsTitles(Entries):
                        characters quoted with backslash
         batch_size   -- number of pages to download at once (default 500)
         retries     -- number of times to wait and retry if dbs are lagged, before giving up
-        verbose     -- display progress messages on stderr"""
+        verbose     -- display progress messages on stderr
+        pageids     -- write the page id of each entry before it"""
 
         super(UserContribsTitles, self).__init__(wiki_conn, props, outdir_name, outfile_name,
-                                                 linked, sql_escaped, batch_size, retries, verbose)
+                                                 linked, sql_escaped, batch_size, retries, verbose,
+                                                 pageids)
         self.username = username
         # format: <item userid="271058" user="YurikBot" ns="0" title="Achmet II" />
         self.entrytag_name = "item"
@@ -827,7 +1737,7 @@ class LogEventsTitles(Entries):
     """Retrieves titles frm log entries for a given log type and action, within a specified date range"""
 
     def __init__(self, wiki_conn, log_event_action, props, start_date, end_date, outdir_name,
-                 outfile_name, linked, sql_escaped, batch_size, retries, verbose):
+                 outfile_name, linked, sql_escaped, batch_size, retries, verbose, pageids=False):
         """Constructor. Arguments:
         wiki_conn       -- initialized WikiConnection object for a wiki
         log_event_action -- log type and action, separated by '/'  e.g. 'upload/overwrite'
@@ -846,13 +1756,16 @@ class LogEventsTitles(Entries):
                           characters quoted with backslash
         batch_size      -- number of pages to download at once (default 500)
         retries        -- number of times to wait and retry if dbs are lagged, before giving up
-        verbose        -- display progress messages on stderr"""
+        verbose        -- display progress messages on stderr
+        pageids        -- write the page id of each entry before it"""
 
         super(LogEventsTitles, self).__init__(wiki_conn, props, outdir_name, outfile_name,
-                                              linked, sql_escaped, batch_size, retries, verbose)
+                                              linked, sql_escaped, batch_size, retries, verbose, pageids)
         self.log_event_action = log_event_action
         # format: <item ns="6" title="File:Glenmmont Fire Station.jpg" />
+        # or with ids: <item logid="9" ns="6" title="File:Glenmmont Fire Station.jpg" logpage="12" />
         self.entrytag_name = "item"
+        self.pageid_attr = "logpage"
         self.setup_props_attrs(["title"], self.props, [])
 
         self.url = "%s&list=logevents&leaction=%s&lelimit=%d%s" % (
@@ -873,9 +1786,10 @@ class _date(object):
     def __init__(self):
         """Constructor. Duh."""
 
-        self.time_pattern = re.compile("\s+([0-9]+):([0-9])+(:[0-9]+)?$")
+        self.time_pattern = re.compile("\s+([0-9]+):([0-9]+)(?::([0-9]+))?$")
         self.date_pattern = re.compile("^([0-9]{4})-([0-9][0-9]?)-([0-9][0-9]?)$")
         self.incr_pattern = re.compile("^(now|today)\s*-\s*([0-9]+)([dhms]?)$")
+        self.canonical_pattern = re.compile("^[0-9]{4}-[0-9]{2}-[0-9]{2}T[0-9]{2}:[0-9]{2}:[0-9]{2}Z$")
 
     def get_date_format_string(self):
         """Return format string we use with strftime for converting all
@@ -921,7 +1835,7 @@ class _date(object):
         if result:
             date = date_string[:result.start()]
             hours, mins = int(result.group(1)), int(result.group(2))
-            if len(result.group(3)):
+            if result.group(3):
                 secs = int(result.group(3))
 
         result = self.date_pattern.search(date)
@@ -939,10 +1853,13 @@ class _date(object):
         Allowable input formats:
           now/today [- Xh/m/d/s (default seconds)]
           yyyy-mm-dd [hh:mm:ss]
+          YYYY-MM-DDThh:mm:ssZ, as the api gives timestamps
         Arguments:
         date_string --  string to convert"""
 
         date_string = date_string.strip()
+        if self.canonical_pattern.match(date_string):
+            return date_string
         if date_string.startswith("now") or date_string.startswith("today"):
             return(self.get_now_minus_incr(date_string))
         return(self.get_ymdhms(date_string))
@@ -1002,7 +1919,12 @@ Usage: python %s --query querytype [--param value] [--wiki wikiname]
                  [--outputdir dirname] [--outputfile filename]
                  [--startdate datestring] [--enddate datestring]
                  [--linked] [--sql_escaped] [--batchsize batchsize]
-                 [--auth username:password] [--authfile filename] [--verbose]
+                 [--auth username:password] [--authfile filename]
+                 [--dedupmem count] [--metricsjson path] [--metricsprom path]
+                 [--trace path] [--metricsinterval seconds] [--http]
+                 [--batchbytes bytes] [--targetseconds seconds] [--pageids]
+                 [--store path] [--maxdepth number] [--maxtitles number]
+                 [--chains number] [--history] [--historylimit number] [--verbose]
 """ % sys.argv[0]
     usage_message = usage_message + """
 This script uses the MediaWiki api to download titles of pages in a
@@ -1017,8 +1939,9 @@ Warning: if there happens to be a schema change or namespace change while this
 script is running, the results will be inconsistent and maybe broken. These changes
 are rare but do happen.
 
---query (-q):      one of 'category', 'embeddedin', 'log', 'namespace',
-                   'usercontribs', 'users' or 'content'
+--query (-q):      one of 'category', 'categorytree', 'embeddedin', 'log', 'namespace',
+                   'usercontribs', 'users' or 'content'; 'categorytree' gets the titles
+                   in a category and in all its subcategories, each title once
 --param (-p):      mandatory for all queries but 'users' and 'rc'
                    for titles: name of the category for which to get titles or name of the
                    article for which to get links, or the number of the namespace from which
@@ -1058,6 +1981,44 @@ are rare but do happen.
 --sqlescaped (-s): write titles with character escaping as for sql INSERT statements
 --batchsize (-b):  number of titles to get at once (for bots and sysadmins this
                    can be 5000, but for other users 500, which is the default)
+--batchbytes:      for content: instead of batchsize titles at a time, ask for as many
+                   pages as will come to about this many bytes of page text, by the
+                   page lengths, which are looked up first; batchsize is still the
+                   most pages per request. Useful when page sizes vary a lot.
+--targetseconds:   for content with batchbytes: adjust the number of bytes asked for
+                   in each request, up to batchbytes, so that each takes about this
+                   many seconds
+--pageids:         for title listings: write the page id of each entry before it,
+                   separated by a space; for content: the file given as param has a
+                   page id at the start of each line (e.g. a title listing written
+                   with pageids), and content is retrieved by page id via the api's
+                   export, at most 50 pages per request or 500 if logged in as a
+                   user with the apihighlimits right (bots, sysops); not for the
+                   'users' query
+--store:           for content: path to a local page store (an sqlite file, created
+                   if it does not exist) holding the page content retrieved by earlier
+                   runs; the current revision id of each page is looked up first and
+                   only pages changed since they were stored are exported, the output
+                   file being written from the store
+--history:         for content: retrieve every revision of each page rather than
+                   only the current one; pages are asked for in batches with their
+                   first few revisions, and those with more are gone on with one at
+                   a time, historylimit revisions per request; titles of pages whose
+                   history could not all be retrieved are written to a file named
+                   after the output file, ending in .truncated. Not with pageids
+                   (the api export has current revisions only) or store
+--historylimit:    for content with history: the most revisions to ask for in each
+                   request for one page; the wiki gives at most $wgExportMaxHistory,
+                   whatever is asked for
+                   default: 1000
+--maxdepth:        for categorytree: how many levels of subcategories to go down,
+                   0 for the category itself only
+                   default: no limit
+--maxtitles:       for categorytree: stop after this many titles
+                   default: no limit
+--chains:          for categorytree: number of categories to list at once, each
+                   with its own connection to the wiki
+                   default: 4
 --retries (-r):    number of times a given http request will be retried if the
                    wiki databases are lagged, before giving up
                    default: 20
@@ -1069,6 +2030,22 @@ are rare but do happen.
                    file format: each line contains keyword<spaces>value
                    lines with blanks or starting with # will be skipped,
                    keywords are username and password
+--dedupmem (-D):   number of titles or other entries to remember in memory when
+                   dropping duplicates returned by the api across batches; past
+                   this number they are remembered in a temporary file in the
+                   output directory instead
+                   default: 1000000
+--metricsjson:     write counts of requests, bytes, lag retries and reused connections,
+                   with histograms of time to first byte, latency and response size,
+                   for each kind of request (export, list=categorymembers, etc.) to
+                   this file as json, every so often during the run and at the end
+--metricsprom:     write the same metrics to this file in the Prometheus text format,
+                   for the node exporter textfile collector
+--trace:           append a line of json for each http request made to this file
+--metricsinterval: seconds between writes of the metrics files during the run
+                   default: 60
+--http:            connect to the wiki with plain http rather than https, for
+                   a local stand-in wiki such as fakewiki.py
 --verbose (-v):    display messages about what the program is doing
 --help:            display this usage message
 
@@ -1086,6 +2063,8 @@ Examples:
 Example usage:
    python %s --query category --param 'Πρότυπα για τα μέρη του λόγου' \\
              --wiki el.wiktionary.org
+   python %s --query categorytree --param 'Physics' --maxdepth 3 \\
+             --wiki en.wikipedia.org -o junk
    python %s --query usercontribs --param ArielGlenn --startdate now \\
              --enddate 2012-05-01 --outputdir junk
    python %s --query embeddedin --param 'Template:WikiProject Cats' -o junk -v
@@ -1097,7 +2076,7 @@ Example usage:
    python %s -q rc --param 3 -w en.wikipedia.org -o junk -v --startdate now \\
              --enddate 2013-09-25 --props user,comment,sizes -s
 """ % (sys.argv[0], sys.argv[0], sys.argv[0], sys.argv[0], sys.argv[0],
-       sys.argv[0], sys.argv[0], sys.argv[0])
+       sys.argv[0], sys.argv[0], sys.argv[0], sys.argv[0])
     sys.stderr.write(usage_message)
     sys.exit(1)
 
@@ -1119,13 +2098,31 @@ def do_main():
     authfile = None
     start_date = None
     end_date = None
+    dedup_mem = None
+    metrics_json = None
+    metrics_prom = None
+    trace_path = None
+    metrics_interval = 60
+    use_http = False
+    max_bytes = None
+    target_seconds = None
+    pageids = False
+    store_path = None
+    max_depth = None
+    max_titles = None
+    chains = None
+    history = False
+    history_limit = None
 
     try:
         (options, remainder) = getopt.gnu_getopt(
-            sys.argv[1:], "q:p:P:S:E:w:o:O:lsb:r:a:A:vh",
+            sys.argv[1:], "q:p:P:S:E:w:o:O:lsb:r:a:A:D:vh",
             ["query=", "param=", "props=", "startdate=", "enddate=", "wiki=", "outputdir=",
              "outputfile=", "linked", "sqlescaped", "batchsize=", "retries=", "auth=",
-             "authfile=", "verbose", "help"])
+             "authfile=", "dedupmem=", "metricsjson=", "metricsprom=", "trace=",
+             "metricsinterval=", "http", "batchbytes=", "targetseconds=", "pageids", "store=",
+             "maxdepth=", "maxtitles=", "chains=", "history", "historylimit=", "verbose",
+             "help"])
     except getopt.GetoptError as err:
         usage("Unknown option specified: " + str(err))
 
@@ -1153,6 +2150,50 @@ def do_main():
             if not val.isdigit():
                 usage("retries must be a number")
             retries = int(val)
+        elif opt in ["-D", "--dedupmem"]:
+            if not val.isdigit():
+                usage("dedupmem must be a number")
+            dedup_mem = int(val)
+        elif opt == "--metricsjson":
+            metrics_json = val
+        elif opt == "--metricsprom":
+            metrics_prom = val
+        elif opt == "--trace":
+            trace_path = val
+        elif opt == "--metricsinterval":
+            if not val.isdigit():
+                usage("metricsinterval must be a number")
+            metrics_interval = int(val)
+        elif opt == "--http":
+            use_http = True
+        elif opt == "--pageids":
+            pageids = True
+        elif opt == "--store":
+            store_path = val
+        elif opt == "--history":
+            history = True
+        elif opt == "--historylimit":
+            if not val.isdigit():
+                usage("historylimit must be a number")
+            history_limit = int(val)
+        elif opt in ["--maxdepth", "--maxtitles", "--chains"]:
+            if not val.isdigit():
+                usage("%s must be a number" % opt[2:])
+            if opt == "--maxdepth":
+                max_depth = int(val)
+            elif opt == "--maxtitles":
+                max_titles = int(val)
+            else:
+                chains = int(val)
+        elif opt == "--batchbytes":
+            if not val.isdigit():
+                usage("batchbytes must be a number")
+            max_bytes = int(val)
+        elif opt == "--targetseconds":
+            try:
+                target_seconds = float(val)
+            except ValueError:
+                usage("targetseconds must be a number")
         elif opt in ["-q", "--query"]:
             query = val
         elif opt in ["-w", "--wiki"]:
@@ -1187,10 +2228,37 @@ def do_main():
     if not (query == "usercontribs" or query == "log" or query == "rc") and (start_date or end_date):
         usage("startdate or enddate specified for wrong query type")
 
+    if (max_bytes or target_seconds or store_path) and query != "content":
+        usage("batchbytes, targetseconds or store specified for wrong query type")
+    if target_seconds and not max_bytes:
+        usage("targetseconds requires batchbytes")
+
+    if history and query != "content":
+        usage("history specified for wrong query type")
+    if history_limit is not None and not history:
+        usage("historylimit requires history")
+    if history_limit == 0:
+        usage("historylimit must be at least 1")
+    if history and (pageids or store_path):
+        usage("history can't be used with pageids or store")
+
+    if (max_depth is not None or max_titles is not None or chains is not None) and \
+            query != "categorytree":
+        usage("maxdepth, maxtitles or chains specified for wrong query type")
+    if chains == 0:
+        usage("chains must be at least 1")
+
+    if pageids and query == "users":
+        usage("pageids specified for wrong query type")
+
     if props and (query == "embeddedin" or query == "namespace"):
         usage("props specified for wrong query type")
 
-    wiki_conn = WikiConnection(wikiname, username, password, verbose)
+    if metrics_json or metrics_prom or trace_path:
+        metrics = RequestMetrics(wikiname, metrics_json, metrics_prom, trace_path, metrics_interval)
+    else:
+        metrics = None
+    wiki_conn = WikiConnection(wikiname, username, password, verbose, metrics, use_http)
     wiki_conn.login()
 
     if query != "content":
@@ -1198,34 +2266,48 @@ def do_main():
             param = urllib.pathname2url(param)
     if query == "category":
         retriever = CatTitles(wiki_conn, param, props, outdir_name, outfile_name, linked,
-                              sql_escaped, batch_size, max_retries, verbose)
+                              sql_escaped, batch_size, max_retries, verbose, pageids)
+    elif query == "categorytree":
+        retriever = CatTreeTitles(wiki_conn, param, props, outdir_name, outfile_name, linked,
+                                  sql_escaped, batch_size, max_retries, verbose, pageids,
+                                  max_depth, max_titles, chains or 4)
     elif query == "embeddedin":
         retriever = EmbeddedTitles(wiki_conn, param, props, outdir_name, outfile_name,
-                                   linked, sql_escaped, batch_size, max_retries, verbose)
+                                   linked, sql_escaped, batch_size, max_retries, verbose, pageids)
     elif query == "namespace":
         retriever = NamespaceTitles(wiki_conn, param, props, outdir_name, outfile_name,
-                                    linked, sql_escaped, batch_size, max_retries, verbose)
+                                    linked, sql_escaped, batch_size, max_retries, verbose, pageids)
     elif query == "usercontribs":
         retriever = UserContribsTitles(wiki_conn, param, props, start_date, end_date,
                                        outdir_name, outfile_name, linked, sql_escaped,
-                                       batch_size, max_retries, verbose)
+                                       batch_size, max_retries, verbose, pageids)
     elif query == "log":
         retriever = LogEventsTitles(wiki_conn, param, props, start_date, end_date,
                                     outdir_name, outfile_name, linked, sql_escaped,
-                                    batch_size, max_retries, verbose)
+                                    batch_size, max_retries, verbose, pageids)
     elif query == 'rc':
         retriever = RCTitles(wiki_conn, param, props, start_date, end_date, outdir_name,
-                             outfile_name, linked, sql_escaped, batch_size, max_retries, verbose)
+                             outfile_name, linked, sql_escaped, batch_size, max_retries, verbose,
+                             pageids)
     elif query == "content":
         retriever = Content(wiki_conn, param, outdir_name, outfile_name,
-                            batch_size, max_retries, verbose)
+                            batch_size, max_retries, verbose, max_bytes, target_seconds, pageids,
+                            store_path, history, history_limit or 1000)
     elif query == 'users':
         retriever = Users(wiki_conn, props, outdir_name, outfile_name, linked, sql_escaped,
                           batch_size, max_retries, verbose)
     else:
         usage("Unknown query type specified")
 
-    retriever.get_all_entries()
+    if dedup_mem is not None and query != "content":
+        retriever.max_seen_in_memory = dedup_mem
+
+    try:
+        retriever.get_all_entries()
+    finally:
+        wiki_conn.close()
+        if metrics:
+            metrics.close()
 
     # this is the only thing we display to the user, unless verbose is set.
     # wrapper scripts that call this program can grab this in order to do
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+import os
+import bz2
+
+
+class ShardErr(Exception):
+    pass
+
+
+class PlainShardReader(object):
+    """Read an uncompressed file from a given byte offset onwards.
+    The shard is the bytes from start to end; reading does not stop at
+    the end of the shard, so that the caller can finish off the last
+    record that begins in it."""
+
+    def __init__(self, path, start, end):
+        """Constructor. Arguments:
+        path   -- path to the uncompressed file
+        start  -- offset of the first byte of the shard
+        end    -- offset just past the last byte of the shard"""
+
+        self.fd = open(path, "rb")
+        self.fd.seek(start)
+        self.shard_length = end - start
+
+    def read(self, size):
+        return self.fd.read(size)
+
+    def get_shard_length(self):
+        """Return the number of bytes read from the file that belong to this shard"""
+
+        return self.shard_length
+
+    def close(self):
+        self.fd.close()
+
+
+class Bz2ShardReader(object):
+    """Read and decompress a bz2 multistream file from the start of a
+    given stream onwards. The shard is the streams that begin between
+    start and end; reading does not stop at the end of the shard, so
+    that the caller can finish off the last record that begins in it."""
+
+    def __init__(self, path, start, end):
+        """Constructor. Arguments:
+        path   -- path to the bz2 file
+        start  -- offset of the first stream of the shard
+        end    -- offset of the first stream after the shard, or the file size"""
+
+        self.fd = open(path, "rb")
+        self.fd.seek(start)
+        self.position = start  # offset in the compressed file of the next read
+        self.end = end
+        self.decompressor = bz2.BZ2Decompressor()
+        self.stream_start = start
+        self.decompressed = 0  # bytes returned so far
+        self.shard_length = None  # decompressed length, known once the shard is read
+        self.eof = False
+
+    def start_stream(self, offset):
+        """Note the end of a stream and the start of the next one at the given offset"""
+
+        if self.shard_length is None and offset >= self.end:
+            self.shard_length = self.decompressed
+        self.decompressor = bz2.BZ2Decompressor()
+        self.stream_start = offset
+
+    def read(self, size):
+        """Return some decompressed data, at most around size bytes,
+        or the empty string at the end of the file"""
+
+        while not self.eof:
+            data = self.fd.read(size)
+            if not data:
+                self.eof = True
+                self.start_stream(self.position)
+                break
+            data_start = self.position
+            self.position = self.position + len(data)
+            output = []
+            while data:
+                try:
+                    text = self.decompressor.decompress(data)
+                except EOFError:
+                    # the last stream ended exactly where this data starts
+                    self.start_stream(data_start)
+                    continue
+                # counted as we go, since a stream may end partway through the data
+                self.decompressed = self.decompressed + len(text)
+                output.append(text)
+                data = self.decompressor.unused_data
+                if data:
+                    data_start = self.position - len(data)
+                    self.start_stream(data_start)
+            output = "".join(output)
+            if output:
+                return output
+        return ""
+
+    def get_shard_length(self):
+        """Return the number of decompressed bytes that belong to this
+        shard, or None if not all of them have been read yet"""
+
+        return self.shard_length
+
+    def close(self):
+        self.fd.close()
+
+
+def is_bz2_stream(fd, offset):
+    """Return True if a bz2 stream really starts at this offset,
+    and not just something that looks like one inside compressed data"""
+
+    fd.seek(offset)
+    decompressor = bz2.BZ2Decompressor()
+    while True:
+        data = fd.read(256 * 1024)
+        if not data:
+            return False
+        try:
+            if decompressor.decompress(data) or decompressor.unused_data:
+                return True
+        except (IOError, EOFError):
+            return False
+
+
+def find_bz2_stream(fd, offset, limit):
+    """Return the offset of the first bz2 stream that starts at or after
+    the given offset and before the limit, or None if there is none"""
+
+    # stream header: 'BZh', block size digit, then the first block magic
+    # or, for an empty stream, the end of stream magic
+    magics = ["\x31\x41\x59\x26\x53\x59", "\x17\x72\x45\x38\x50\x90"]
+    block_size = 1024 * 1024
+    while offset < limit:
+        fd.seek(offset)
+        data = fd.read(block_size + 9)
+        pos = data.find("BZh")
+        while pos != -1 and offset + pos < limit:
+            if (pos + 10 <= len(data) and data[pos + 3] in "123456789" and
+                    data[pos + 4:pos + 10] in magics and is_bz2_stream(fd, offset + pos)):
+                return offset + pos
+            pos = data.find("BZh", pos + 1)
+        if len(data) <= block_size:
+            break
+        offset = offset + block_size
+    return None
+
+
+def get_shards(path, count):
+    """Return a list of (start, end) offsets splitting the file into at
+    most count shards of roughly equal size. Uncompressed files are split
+    at any byte; bz2 files are split at stream boundaries, so a bz2 file
+    with only one stream is one shard. Other compressed files can't be split.
+    Arguments:
+    path   -- path to uncompressed or bz2 file
+    count  -- number of shards wanted"""
+
+    size = os.path.getsize(path)
+    if path.endswith(".gz"):
+        raise ShardErr("gz compressed files can't be split, use an uncompressed or bz2 file\n")
+    if not path.endswith(".bz2"):
+        offsets = [size * i // count for i in range(count)]
+    else:
+        fd = open(path, "rb")
+        offsets = [0]
+        for i in range(1, count):
+            offset = find_bz2_stream(fd, max(size * i // count, offsets[-1] + 1), size)
+            if offset is None:
+                break
+            if offset != offsets[-1]:
+                offsets.append(offset)
+        fd.close()
+    offsets = sorted(set(offsets))
+    return [(offsets[i], offsets[i + 1] if i + 1 < len(offsets) else size)
+            for i in range(len(offsets))]
+
+
+def get_shard_reader(path, start, end):
+    """Return a reader for the shard of the file from start to end"""
+
+    if path.endswith(".bz2"):
+        return Bz2ShardReader(path, start, end)
+    return PlainShardReader(path, start, end)